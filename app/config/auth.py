@@ -8,6 +8,7 @@ from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 import app.config.database as database
+from app.utils import contexto_evento
 from app.models.admin import Admin, AdminCreate, AdminUpdate
 from bson import ObjectId
 
@@ -304,7 +305,8 @@ async def verify_token_bilheteria(
     Middleware para verificar token de bilheteria
     """
     db = database.get_database()
-    evento = await db.eventos.find_one({"token_bilheteria": x_token_bilheteria})
+    # também popula o cache por _id, reaproveitado pelos handlers
+    evento = await contexto_evento.evento_por_token(db, "token_bilheteria", x_token_bilheteria)
     
     if not evento:
         raise HTTPException(
@@ -322,7 +324,8 @@ async def verify_token_portaria(
     Middleware para verificar token de portaria
     """
     db = database.get_database()
-    evento = await db.eventos.find_one({"token_portaria": x_token_portaria})
+    # também popula o cache por _id, reaproveitado pelos handlers
+    evento = await contexto_evento.evento_por_token(db, "token_portaria", x_token_portaria)
     
     if not evento:
         raise HTTPException(
@@ -1,4 +1,10 @@
+import logging
+
 import app.config.database as database
+from app.utils.idempotencia import TTL as IDEMPOTENCIA_TTL
+from app.utils.validations import cpfs_duplicados, preencher_cpf_ingressos
+
+logger = logging.getLogger(__name__)
 
 
 async def create_indexes():
@@ -32,6 +38,38 @@ async def create_indexes():
         await db.participantes.create_index([("ingressos.evento_id", 1)])
     except Exception:
         pass
+    # Um ingresso por CPF no evento entre participantes distintos: a emissão da
+    # bilheteria confia neste índice em vez de ler antes de gravar (dentro do
+    # mesmo participante o $push condicional faz a checagem). Sem ele a emissão
+    # aceitaria CPFs duplicados, então a falha impede a inicialização; os
+    # duplicados existentes são listados e corrigidos por
+    # scripts/verificar_cpf_ingressos.py. O filtro parcial vale para o documento
+    # inteiro, então antes o `participante_cpf` dos ingressos é alinhado ao CPF
+    # do participante (nenhum documento mistura CPF nulo e string)
+    corrigidos = await preencher_cpf_ingressos(db)
+    if corrigidos:
+        logger.warning("participante_cpf regravado em %d ingressos embutidos", corrigidos)
+    try:
+        await db.participantes.create_index(
+            [("ingressos.evento_id", 1), ("ingressos.participante_cpf", 1)],
+            unique=True,
+            partialFilterExpression={"ingressos.participante_cpf": {"$type": "string"}},
+        )
+    except Exception as exc:
+        duplicados = await cpfs_duplicados(db)
+        for dup in duplicados[:20]:
+            logger.error("CPF %s com ingresso em mais de um participante no evento %s: %s",
+                         dup["cpf"], dup["evento_id"], ", ".join(dup["participantes"]))
+        logger.error("Índice único de CPF por evento não criado (%d duplicados): %s", len(duplicados), exc)
+        raise RuntimeError(
+            "Índice único (ingressos.evento_id, ingressos.participante_cpf) não criado; "
+            "execute scripts/verificar_cpf_ingressos.py"
+        ) from exc
+    # Caixa de saída do espelho para ingressos_emitidos (app/utils/espelho_ingressos.py)
+    try:
+        await db.participantes.create_index("ingressos.espelho_pendente", sparse=True)
+    except Exception:
+        pass
 
     # Mantém índices antigos em ingressos_emitidos para compatibilidade (se coleção existir)
     try:
@@ -44,6 +82,14 @@ async def create_indexes():
     # Participantes: email único e busca por nome
     await db.participantes.create_index("email", unique=True)
     await db.participantes.create_index("nome")
+    # Busca por prefixo sem acentos (app/utils/busca_participantes.py) e paginação por
+    # cursor em (nome_busca, _id) (app/utils/paginacao.py); `nome_termos` é multikey e
+    # não pode ser composto com `ingressos.evento_id` (também array)
+    try:
+        await db.participantes.create_index([("ingressos.evento_id", 1), ("nome_busca", 1), ("_id", 1)])
+        await db.participantes.create_index("nome_termos")
+    except Exception:
+        pass
 
     # Mantém índice composto para tipos por descrição (não-único)
     await db.tipos_ingresso.create_index([("evento_id", 1), ("descricao", 1)])
@@ -51,6 +97,54 @@ async def create_indexes():
     # Ilhas e interações
     await db.ilhas.create_index("evento_id")
 
+    # Histórico de alterações de ingressos (snapshot offline da portaria)
+    try:
+        await db.ingressos_alteracoes.create_index([("evento_id", 1), ("versao", 1)], unique=True)
+    except Exception:
+        pass
+
+    # Livro-razão de capacidade: um contador por (evento, ilha)
+    try:
+        await db.ilha_capacidade.create_index([("evento_id", 1), ("ilha_id", 1)], unique=True)
+    except Exception:
+        pass
+
+    # Métricas de ingressos: um documento por evento
+    try:
+        await db.evento_metricas.create_index("evento_id", unique=True)
+    except Exception:
+        pass
+
+    # Assets endereçados por conteúdo (logos): pedaços ordenados por asset
+    try:
+        await db.assets_chunks.create_index([("asset_id", 1), ("n", 1)], unique=True)
+    except Exception:
+        pass
+
+    # Validações públicas de planilha com falha expiram se o resultado não for consultado
+    try:
+        await db.planilha_importacoes.create_index("expira_em", expireAfterSeconds=0)
+    except Exception:
+        pass
+
+    # Erros por linha das importações de planilha, lidos na retomada em ordem de linha
+    try:
+        await db.planilha_importacoes_erros.create_index([("import_id", 1), ("line", 1)])
+    except Exception:
+        pass
+
+    # Versões de layout de ingresso por evento
+    try:
+        await db.layouts_ingresso.create_index("evento_id")
+    except Exception:
+        pass
+
+    # Respostas guardadas por Idempotency-Key (app/utils/idempotencia.py), expiram pelo TTL
+    try:
+        await db.idempotencia.create_index("criado_em", expireAfterSeconds=IDEMPOTENCIA_TTL)
+    except Exception:
+        pass
+
     # Administradores
     await db.administradores.create_index("username", unique=True)
     await db.administradores.create_index("email", unique=True)
@@ -9,6 +9,10 @@ import app.config.database as database
 from app.config.database import connect_to_mongo, close_mongo_connection
 from app.config.indexes import create_indexes
 from app.config.auth import create_initial_admin
+from app.utils.buffer_acessos import encerrar_buffer_acessos
+from app.utils.render_pool import encerrar_render_pool
+from app.utils.importacoes import retomar_importacoes, encerrar_importacoes
+from app.utils.espelho_ingressos import iniciar_espelho, encerrar_espelho
 from app.routers import admin, bilheteria, portaria, admin_web, operational_web, admin_management
 from app.routers import inscricao, evento_web
 from bson import ObjectId
@@ -42,9 +46,23 @@ async def startup_db_client():
     await connect_to_mongo()
     await create_indexes()
     await create_initial_admin()
+    # importações de planilha interrompidas continuam do último lote gravado
+    try:
+        await retomar_importacoes(database.get_database())
+    except Exception:
+        pass
+    # ingressos emitidos pela bilheteria são espelhados em ingressos_emitidos em segundo plano
+    iniciar_espelho(database.get_database())
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    # grava o log de acessos pendente antes de fechar a conexão
+    await encerrar_buffer_acessos()
+    # importações em andamento voltam para a fila e são retomadas no próximo startup
+    await encerrar_importacoes()
+    # espelha os ingressos ainda pendentes
+    await encerrar_espelho()
+    encerrar_render_pool()
     await close_mongo_connection()
 
 # Include routers
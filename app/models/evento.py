@@ -40,6 +40,13 @@ class EventoBase(BaseModel):
     campos_obrigatorios_planilha: List[str] = Field(default_factory=list)
     token_inscricao: Optional[str] = None
     aceita_inscricoes: bool = Field(default=False)
+    # Durabilidade do log de acessos da portaria: "sync" grava antes de responder,
+    # "buffer" grava em segundo plano com perda máxima de `log_acessos_janela_segundos`
+    log_acessos_modo: str = Field(default="buffer", pattern="^(sync|buffer)$")
+    log_acessos_janela_segundos: float = Field(default=2.0, gt=0, le=60)
+    # QR codes assinados com HMAC (verificáveis sem consulta ao banco); o segredo
+    # (`qr_segredo`) é gerado pelo servidor e nunca exposto pela API
+    qr_assinado: bool = Field(default=False)
 
     class PlanilhaEmbedded(BaseModel):
         id: Optional[str] = Field(None, alias="_id")
@@ -69,6 +76,9 @@ class EventoUpdate(BaseModel):
     layout_ingresso: Optional[Dict[str, Any]] = None
     campos_obrigatorios_planilha: Optional[List[str]] = None
     token_inscricao: Optional[str] = None
+    log_acessos_modo: Optional[str] = Field(None, pattern="^(sync|buffer)$")
+    log_acessos_janela_segundos: Optional[float] = Field(None, gt=0, le=60)
+    qr_assinado: Optional[bool] = None
 
 
 class Evento(EventoBase):
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict
-from typing import Optional
+from typing import Dict, Optional
 from datetime import datetime
 from enum import Enum
 
@@ -35,8 +35,11 @@ class IngressoEmitido(IngressoEmitidoBase):
     id: str = Field(..., alias="_id")
     qrcode_hash: str
     data_emissao: datetime
-    # Embedded layout specific for this issued ticket
+    # Embedded layout specific for this issued ticket (legacy)
     layout_ingresso: Optional[dict] = None
+    # Placeholder values and, when pinned, the layout version (see app.utils.layout_versoes)
+    campos_layout: Optional[Dict[str, Optional[str]]] = None
+    layout_versao: Optional[str] = None
 
 
 class IngressoEmitidoEmbedded(BaseModel):
@@ -51,6 +54,8 @@ class IngressoEmitidoEmbedded(BaseModel):
     qrcode_hash: str
     data_emissao: datetime
     layout_ingresso: Optional[dict] = None
+    campos_layout: Optional[Dict[str, Optional[str]]] = None
+    layout_versao: Optional[str] = None
     
     model_config = ConfigDict(
         populate_by_name=True,
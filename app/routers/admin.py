@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query
 from typing import List
 from datetime import datetime, timezone
 from bson import ObjectId
@@ -15,6 +15,12 @@ import os
 from app.models.admin import AdminCreate
 from app.utils.validations import normalize_event_name
 from app.utils.planilha import generate_template_for_evento
+from app.utils.capacidade import registrar_emissao
+from app.utils import indice_validacao, contexto_evento, render_cache, exportacao_leads, metricas_evento, roster_evento
+from app.utils.snapshot_portaria import registrar_alteracoes
+from app.utils.qr_assinado import gerar_segredo, codigo_para_evento
+from app.utils.assets import PROJECAO_SEM_LOGO
+from app.utils.layout_versoes import campos_layout
 from io import BytesIO
 from openpyxl import Workbook
 from openpyxl.utils import get_column_letter
@@ -28,6 +34,14 @@ RESET_ADMIN_UUID = os.getenv("RESET_ADMIN_UUID", "01b3807d-9e62-4ec4-961d-f42980
 RESET_ALL_USERS_UUID = os.getenv("RESET_ALL_USERS_UUID", "c1244f86-82ed-4ecc-a288-88fa329b21a2")
 
 
+def _evento_alterado(evento_id) -> None:
+    """Descarta os caches derivados do evento (índice da portaria e contexto por token)."""
+    if evento_id is None:
+        return
+    indice_validacao.invalidar_evento(str(evento_id))
+    contexto_evento.invalidar_evento(str(evento_id))
+
+
 def _stringify_objectids(obj):
     """Recursively convert any bson.ObjectId values in dict/list to str for Pydantic compatibility."""
     from bson import ObjectId
@@ -55,7 +69,7 @@ async def list_eventos(skip: int = 0, limit: int = 10):
     # Handle both real DB cursors and in-memory FakeCursor used in tests
     try:
         # Prefer using to_list when available (FakeCursor supports to_list)
-        all_docs = await db.eventos.find().to_list(length=None)
+        all_docs = await db.eventos.find({}, PROJECAO_SEM_LOGO).to_list(length=None)
         sliced = all_docs[skip: skip + limit]
         for document in sliced:
             document = _stringify_objectids(document)
@@ -64,7 +78,7 @@ async def list_eventos(skip: int = 0, limit: int = 10):
         return eventos
     except Exception:
         # Fallback to iterating over cursor (real DB)
-        cursor = db.eventos.find().skip(skip).limit(limit)
+        cursor = db.eventos.find({}, PROJECAO_SEM_LOGO).skip(skip).limit(limit)
         async for document in cursor:
             document["_id"] = str(document["_id"])
             eventos.append(Evento(**document))
@@ -77,7 +91,7 @@ async def get_evento(evento_id: str):
     db = get_database()
     
     try:
-        document = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+        document = await db.eventos.find_one({"_id": ObjectId(evento_id)}, PROJECAO_SEM_LOGO)
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -107,6 +121,8 @@ async def create_evento(evento: EventoCreate):
     # Normaliza e armazena nome_normalizado para uso na URL pública
     if evento_dict.get("nome"):
         evento_dict["nome_normalizado"] = normalize_event_name(evento_dict["nome"])
+    if evento_dict.get("qr_assinado"):
+        evento_dict["qr_segredo"] = gerar_segredo()
 
     result = await db.eventos.insert_one(evento_dict)
     
@@ -149,10 +165,18 @@ async def update_evento(evento_id: str, evento_update: EventoUpdate):
         if not all(r in normalized for r in required):
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Para ativar inscrições, confirme que Nome, Email e CPF são campos obrigatórios")
 
+    # QR assinado: o segredo do evento é criado na primeira ativação e nunca trocado,
+    # para que ingressos já emitidos continuem válidos
+    if update_data.get('qr_assinado'):
+        atual = await db.eventos.find_one({"_id": object_id}, {"qr_segredo": 1})
+        if atual and not atual.get('qr_segredo'):
+            update_data['qr_segredo'] = gerar_segredo()
+
     result = await db.eventos.update_one(
         {"_id": object_id},
         {"$set": update_data}
     )
+    _evento_alterado(evento_id)
 
     # Se aceitação ativada, gerar planilha modelo estilizada
     if update_data.get('aceita_inscricoes'):
@@ -189,6 +213,8 @@ async def delete_evento(evento_id: str):
         )
     
     result = await db.eventos.delete_one({"_id": object_id})
+    _evento_alterado(evento_id)
+    render_cache.invalidar_evento(evento_id)
     
     if result.deleted_count == 0:
         raise HTTPException(
@@ -230,6 +256,23 @@ async def list_ilhas(evento_id: str):
     return result
 
 
+@router.post("/eventos/{evento_id}/ilhas/reconciliar-capacidade", dependencies=[Depends(verify_admin_access)])
+async def reconciliar_capacidade_ilhas(evento_id: str):
+    """Reconstrói os contadores de ocupação (`ilha_capacidade`) do evento a partir dos ingressos emitidos"""
+    db = get_database()
+    from app.utils.capacidade import reconciliar_capacidade
+    contagem = await reconciliar_capacidade(db, evento_id)
+    return {"evento_id": evento_id, "ocupacao": contagem}
+
+
+@router.post("/eventos/{evento_id}/metricas/reconstruir", dependencies=[Depends(verify_admin_access)])
+async def reconstruir_metricas_evento(evento_id: str):
+    """Recalcula as métricas de ingressos do evento (`evento_metricas`) a partir dos ingressos emitidos"""
+    db = get_database()
+    metricas = await metricas_evento.reconstruir_metricas(db, evento_id)
+    return {"evento_id": evento_id, "metricas": metricas}
+
+
 @router.post("/ilhas", response_model=Ilha, status_code=status.HTTP_201_CREATED, dependencies=[Depends(verify_admin_access)])
 async def create_ilha(ilha: IlhaCreate):
     """Cria uma nova ilha"""
@@ -259,6 +302,7 @@ async def create_ilha(ilha: IlhaCreate):
         ilha_dict["_id"] = ObjectId()
     # push into evento.ilhas
     await db.eventos.update_one({"_id": ObjectId(ilha.evento_id)}, {"$push": {"ilhas": ilha_dict}})
+    _evento_alterado(ilha.evento_id)
     # dual-write to legacy collection for compatibility
     try:
         await db.ilhas.insert_one({**ilha_dict, "evento_id": ilha.evento_id})
@@ -300,6 +344,7 @@ async def update_ilha(ilha_id: str, ilha_update: IlhaUpdate):
         evento = await db.eventos.find_one({"ilhas._id": object_id}, {"ilhas.$": 1})
         if not evento or not evento.get("ilhas"):
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ilha não encontrada")
+        _evento_alterado(evento.get("_id"))
         updated_ilha = evento["ilhas"][0]
         updated_ilha["_id"] = str(updated_ilha["_id"]) if updated_ilha.get("_id") else None
         return Ilha(**updated_ilha)
@@ -322,7 +367,10 @@ async def delete_ilha(ilha_id: str):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de ilha inválido")
 
     # pull from evento.ilhas
+    owner = await db.eventos.find_one({"ilhas._id": object_id}, {"_id": 1})
     res = await db.eventos.update_one({"ilhas._id": object_id}, {"$pull": {"ilhas": {"_id": object_id}}})
+    if owner:
+        _evento_alterado(owner.get("_id"))
     # delete from legacy collection for compatibility
     legacy_deleted = False
     try:
@@ -504,6 +552,7 @@ async def create_tipo_ingresso(tipo_ingresso: TipoIngressoCreate):
                 # direct mutation for in-memory docs
                 evt["tipos_ingresso"] = tipos_list
 
+    _evento_alterado(tipo_dict.get("evento_id"))
     created = dict(tipo_dict)
     created["_id"] = str(created["_id"])
     return TipoIngresso(**created)
@@ -534,6 +583,7 @@ async def update_tipo_ingresso(tipo_id: str, tipo_update: TipoIngressoUpdate):
         if not update_data:
             raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Nenhum campo para atualizar")
         await db.tipos_ingresso.update_one({"_id": object_id}, {"$set": update_data})
+        _evento_alterado(existing_tipo.get("evento_id"))
         updated_tipo = await db.tipos_ingresso.find_one({"_id": object_id})
         updated_tipo["_id"] = str(updated_tipo["_id"])
         return TipoIngresso(**updated_tipo)
@@ -571,6 +621,7 @@ async def update_tipo_ingresso(tipo_id: str, tipo_update: TipoIngressoUpdate):
         await db.tipos_ingresso.update_one({"_id": object_id}, {"$set": update_data})
     except Exception:
         pass
+    _evento_alterado(str(evento.get("_id")))
 
     updated = await db.eventos.find_one({"tipos_ingresso._id": object_id}, {"tipos_ingresso.$": 1})
     updated_tipo = updated.get("tipos_ingresso", [])[0]
@@ -591,7 +642,10 @@ async def delete_tipo_ingresso(tipo_id: str):
             detail="ID de tipo de ingresso inválido"
         )
     # pull from evento.tipos_ingresso
+    owner = await db.eventos.find_one({"tipos_ingresso._id": object_id}, {"_id": 1})
     res = await db.eventos.update_one({"tipos_ingresso._id": object_id}, {"$pull": {"tipos_ingresso": {"_id": object_id}}})
+    if owner:
+        _evento_alterado(str(owner.get("_id")))
     # delete from legacy collection for compatibility
     legacy_deleted = False
     try:
@@ -626,90 +680,22 @@ async def relatorio_vendas(evento_id: str):
             detail="ID de evento inválido"
         )
     
-    # Preferir agregação sobre ingressos embutidos em participantes
-    pipeline = [
-        {"$unwind": "$ingressos"},
-        {"$match": {"ingressos.evento_id": evento_id}},
-        {"$group": {
-            "_id": "$ingressos.tipo_ingresso_id",
-            "quantidade": {"$sum": 1},
-            "ativos": {"$sum": {"$cond": [{"$eq": ["$ingressos.status", "Ativo"]}, 1, 0]}},
-            "cancelados": {"$sum": {"$cond": [{"$eq": ["$ingressos.status", "Cancelado"]}, 1, 0]}}
-        }}
-    ]
+    # Contadores mantidos incrementalmente em `evento_metricas`
+    metricas = await metricas_evento.obter_metricas(db, evento_id)
+    tipos = await metricas_evento.tipos_por_id(db, evento, metricas.get("tipos", {}).keys())
 
     vendas_por_tipo = []
-    # Prefer aggregation over participantes.ingressos when available, otherwise compute manually
-    try:
-        if hasattr(db.participantes, 'aggregate'):
-            async for doc in db.participantes.aggregate(pipeline):
-                tipo_obj = None
-                tipo_id = doc.get("_id")
-                # try to find in tipos_ingresso collection
-                try:
-                    tipo_obj = await db.tipos_ingresso.find_one({"_id": ObjectId(tipo_id)})
-                except Exception:
-                    tipo_obj = await db.tipos_ingresso.find_one({"_id": tipo_id})
-                # fallback: search in evento.tipos_ingresso embedded
-                if not tipo_obj:
-                    for t in evento.get("tipos_ingresso", []) or []:
-                        if str(t.get("_id")) == str(tipo_id) or t.get("numero") == tipo_id:
-                            tipo_obj = t
-                            break
-                vendas_por_tipo.append({
-                    "tipo_ingresso": tipo_obj.get("descricao") if tipo_obj else "Desconhecido",
-                    "valor": tipo_obj.get("valor") if tipo_obj else 0,
-                    "quantidade_total": doc.get("quantidade", 0),
-                    "ativos": doc.get("ativos", 0),
-                    "cancelados": doc.get("cancelados", 0),
-                    "receita_total": (tipo_obj.get("valor") if tipo_obj else 0) * doc.get("ativos", 0)
-                })
-        else:
-            # manual aggregation over participantes -> ingressos
-            counts = {}
-            async for part in db.participantes.find():
-                for ing in part.get('ingressos', []):
-                    if ing.get('evento_id') != evento_id:
-                        continue
-                    tipo_id = ing.get('tipo_ingresso_id')
-                    status_ing = ing.get('status')
-                    if tipo_id not in counts:
-                        counts[tipo_id] = {"quantidade": 0, "ativos": 0, "cancelados": 0}
-                    counts[tipo_id]["quantidade"] += 1
-                    if status_ing == "Ativo":
-                        counts[tipo_id]["ativos"] += 1
-                    if status_ing == "Cancelado":
-                        counts[tipo_id]["cancelados"] += 1
-            for tipo_id, doc in counts.items():
-                tipo_obj = None
-                try:
-                    tipo_obj = await db.tipos_ingresso.find_one({"_id": ObjectId(tipo_id)})
-                except Exception:
-                    tipo_obj = await db.tipos_ingresso.find_one({"_id": tipo_id})
-                if not tipo_obj:
-                    for t in evento.get("tipos_ingresso", []) or []:
-                        if str(t.get("_id")) == str(tipo_id) or t.get("numero") == tipo_id:
-                            tipo_obj = t
-                            break
-                vendas_por_tipo.append({
-                    "tipo_ingresso": tipo_obj.get("descricao") if tipo_obj else "Desconhecido",
-                    "valor": tipo_obj.get("valor") if tipo_obj else 0,
-                    "quantidade_total": doc.get("quantidade", 0),
-                    "ativos": doc.get("ativos", 0),
-                    "cancelados": doc.get("cancelados", 0),
-                    "receita_total": (tipo_obj.get("valor") if tipo_obj else 0) * doc.get("ativos", 0)
-                })
-    except Exception:
-        # Se aggregation falhar, retorna vazio
-        pass
-    
-    # debug
-    try:
-        print(f"relatorio_vendas: ingressos_docs={getattr(db.ingressos_emitidos, 'docs', None)}")
-        print(f"relatorio_vendas: tipos_docs={getattr(db.tipos_ingresso, 'docs', None)}")
-        print(f"relatorio_vendas: vendas_por_tipo={vendas_por_tipo}")
-    except Exception:
-        pass
+    for tipo_id, contadores in metricas.get("tipos", {}).items():
+        tipo_obj = tipos.get(tipo_id)
+        valor = (tipo_obj.get("valor") or 0) if tipo_obj else 0
+        vendas_por_tipo.append({
+            "tipo_ingresso": tipo_obj.get("descricao") if tipo_obj else "Desconhecido",
+            "valor": valor,
+            "quantidade_total": contadores.get("total", 0),
+            "ativos": contadores.get("ativos", 0),
+            "cancelados": contadores.get("cancelados", 0),
+            "receita_total": valor * contadores.get("ativos", 0)
+        })
 
     total_vendas = sum(v["quantidade_total"] for v in vendas_por_tipo)
     receita_total = sum(v["receita_total"] for v in vendas_por_tipo)
@@ -734,59 +720,35 @@ async def relatorio_vendas(evento_id: str):
 
 
 @router.get("/eventos/{evento_id}/exportar-leads", dependencies=[Depends(verify_admin_access)])
-async def exportar_leads(evento_id: str):
-    """Exporta leads do evento em formato XLSX"""
+async def exportar_leads(evento_id: str, formato: str = Query("xlsx")):
+    """Exporta leads do evento em XLSX, CSV ou CSV gzip (`formato`), em streaming"""
     db = get_database()
-    
+
+    if formato not in exportacao_leads.FORMATOS_LEADS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Formato inválido; use um de: {', '.join(exportacao_leads.FORMATOS_LEADS)}"
+        )
+
     # Verifica se o evento existe
     try:
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-        if not evento:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Evento não encontrado"
-            )
+        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, {"nome": 1})
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="ID de evento inválido"
         )
-    
-    # Busca todos os participantes do evento (ingressos embutidos)
-    participantes_ids = set()
-    p_cursor = db.participantes.find({"ingressos": {"$elemMatch": {"evento_id": evento_id}}})
-    async for participante in p_cursor:
-        participantes_ids.add(participante.get("_id"))
-    
-    # Cria o workbook
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Leads"
-    
-    # Cabeçalhos
-    ws.append(["Nome", "Email", "Telefone", "Empresa", "Cargo"])
-    
-    # Dados
-    for participante_id in participantes_ids:
-        participante = await db.participantes.find_one({"_id": ObjectId(participante_id)})
-        if participante:
-            ws.append([
-                participante.get("nome", ""),
-                participante.get("email", ""),
-                participante.get("telefone", ""),
-                participante.get("empresa", ""),
-                participante.get("cargo", "")
-            ])
-    
-    # Salva em memória
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
+    if not evento:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Evento não encontrado"
+        )
+
+    config = exportacao_leads.FORMATOS_LEADS[formato]
     return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename=leads_{evento['nome']}.xlsx"}
+        exportacao_leads.exportar_leads(db, evento_id, formato),
+        media_type=config["media_type"],
+        headers={"Content-Disposition": f"attachment; filename=leads_{evento['nome']}.{config['extensao']}"}
     )
 
 
@@ -967,8 +929,10 @@ async def admin_emitir(req: EmissaoAdminRequest):
 
     # create ingresso
     from app.config.auth import generate_qrcode_hash
-    qrcode_hash = generate_qrcode_hash()
+    ingresso_oid = ObjectId()
+    qrcode_hash = codigo_para_evento(evento, str(ingresso_oid), tipo.get('numero')) or generate_qrcode_hash()
     ingresso_doc = {
+        '_id': ingresso_oid,
         'evento_id': req.evento_id,
         'tipo_ingresso_id': req.tipo_ingresso_id,
         'participante_id': req.participante_id,
@@ -978,35 +942,29 @@ async def admin_emitir(req: EmissaoAdminRequest):
         'data_emissao': datetime.now(timezone.utc),
         'impresso': False
     }
-    # embed layout
-    try:
-        from app.utils.layouts import embed_layout
-        # Always use the event layout when embedding into the ingresso
-        embedded = embed_layout(evento.get('layout_ingresso'), participante, tipo, evento, ingresso_doc)
-        ingresso_doc['layout_ingresso'] = embedded
-    except Exception:
-        pass
+    # the ingresso keeps only its own values; the layout comes from the event's current version
+    ingresso_doc['campos_layout'] = campos_layout(participante, tipo, evento, ingresso_doc)
     # ensure ingresso has an _id for embedding
     try:
         ingresso_doc['_id'] = ObjectId(ingresso_doc.get('_id')) if ingresso_doc.get('_id') else ObjectId()
     except Exception:
         ingresso_doc['_id'] = ObjectId()
 
-    # dual-write: insert into legacy collection and embed into participante
+    # conditional push into participante.ingressos (409 on a concurrent duplicate CPF);
+    # the legacy copy and the counters only follow a successful write
+    from app.utils.validations import gravar_ingresso_embutido
+    await gravar_ingresso_embutido(db, participante['_id'], req.evento_id, ingresso_doc)
     try:
         await db.ingressos_emitidos.insert_one(dict(ingresso_doc))
     except Exception:
         pass
-
-    # push into participante.ingressos
-    try:
-        pid = ObjectId(req.participante_id)
-    except Exception:
-        pid = req.participante_id
-    try:
-        await db.participantes.update_one({'_id': pid}, {'$push': {'ingressos': ingresso_doc}})
-    except Exception:
-        pass
+    await registrar_emissao(db, req.evento_id, ingresso_doc)
+    await metricas_evento.registrar_emissoes(db, req.evento_id, [ingresso_doc])
+    indice_validacao.registrar_ingresso(req.evento_id, ingresso_doc, participante.get('nome'))
+    roster_evento.registrar_ingresso(
+        req.evento_id, ingresso_doc, participante.get('nome'), participante.get('cpf'), req.participante_id
+    )
+    await registrar_alteracoes(db, req.evento_id, [ingresso_doc])
 
     created = dict(ingresso_doc)
     created['_id'] = str(created['_id'])
@@ -1015,64 +973,15 @@ async def admin_emitir(req: EmissaoAdminRequest):
 
 @router.post('/eventos/{evento_id}/ingressos/backfill-layouts', dependencies=[Depends(verify_admin_access)])
 async def backfill_ingresso_layouts(evento_id: str):
-    """Backfill ingressos_emitidos: embed layout_ingresso into existing ingressos that lack it for an event."""
-    db = get_database()
-    updated = 0
-    updated_ids = []
-    cursor = db.ingressos_emitidos.find({"evento_id": evento_id, "layout_ingresso": {"$exists": False}})
-    from app.utils.layouts import embed_layout
-    async for ingresso in cursor:
-        try:
-            participante = None
-            tipo = None
-            try:
-                participante = await db.participantes.find_one({"_id": ObjectId(ingresso.get('participante_id'))})
-            except Exception:
-                participante = await db.participantes.find_one({"_id": ingresso.get('participante_id')})
-            try:
-                tipo = await db.tipos_ingresso.find_one({"_id": ObjectId(ingresso.get('tipo_ingresso_id'))})
-            except Exception:
-                tipo = await db.tipos_ingresso.find_one({"_id": ingresso.get('tipo_ingresso_id')})
-            evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-            base_layout = evento.get('layout_ingresso')
-            embedded = embed_layout(base_layout, participante or {}, tipo or {}, evento or {}, ingresso)
-            oid = ingresso.get('_id')
-            await db.ingressos_emitidos.update_one({"_id": oid}, {"$set": {"layout_ingresso": embedded}})
-            updated += 1
-            updated_ids.append(str(oid))
-        except Exception:
-            continue
-    # Now backfill embedded ingressos inside participantes
-    try:
-        p_cursor = db.participantes.find({"ingressos": {"$elemMatch": {"evento_id": evento_id, "layout_ingresso": {"$exists": False}}}})
-        async for participante in p_cursor:
-            for ing in participante.get('ingressos', []):
-                try:
-                    if ing.get('evento_id') != evento_id:
-                        continue
-                    if ing.get('layout_ingresso'):
-                        continue
-                    tipo = None
-                    try:
-                        tipo = await db.tipos_ingresso.find_one({"_id": ObjectId(ing.get('tipo_ingresso_id'))})
-                    except Exception:
-                        tipo = await db.tipos_ingresso.find_one({"_id": ing.get('tipo_ingresso_id')})
-                    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-                    base_layout = evento.get('layout_ingresso')
-                    embedded = embed_layout(base_layout, participante or {}, tipo or {}, evento or {}, ing)
-                    try:
-                        ing_oid = ing.get('_id')
-                        await db.participantes.update_one({"_id": participante.get('_id'), "ingressos._id": ing_oid}, {"$set": {"ingressos.$.layout_ingresso": embedded}})
-                        updated += 1
-                        updated_ids.append(str(ing_oid))
-                    except Exception:
-                        continue
-                except Exception:
-                    continue
-    except Exception:
-        pass
+    """Converte os layouts embutidos dos ingressos do evento em referências de versão.
 
-    return {"updated": updated, "ids": updated_ids}
+    Ingressos sem layout embutido já seguem a versão vigente do evento e não
+    precisam de backfill (ver `app.utils.layout_versoes`).
+    """
+    db = get_database()
+    from app.utils.layout_versoes import migrar_layouts_evento
+    resultado = await migrar_layouts_evento(db, evento_id)
+    return {"updated": resultado["seguem_atual"] + resultado["congelados"], **resultado}
 
 
 @router.post("/limpar-layouts-cache/{evento_id}", dependencies=[Depends(verify_admin_access)])
@@ -1107,7 +1016,8 @@ async def limpar_layouts_cache(evento_id: str):
         {"$unset": {"layout_ingresso": ""}}
     )
     
-    # Limpar imagens renderizadas em disco
+    # Limpar imagens renderizadas (cache de renderização e arquivos antigos em disco)
+    render_cache.invalidar_evento(evento_id)
     from pathlib import Path
     import shutil
     ingressos_dir = Path('app') / 'static' / 'ingressos'
@@ -1128,6 +1038,20 @@ async def limpar_layouts_cache(evento_id: str):
     }
 
 
+@router.get("/metricas/log-acessos", dependencies=[Depends(verify_admin_access)])
+async def metricas_log_acessos():
+    """Métricas do buffer de escrita do log de acessos da portaria (pendentes, descartados, backpressure)"""
+    from app.utils.buffer_acessos import metricas_buffer_acessos
+    return metricas_buffer_acessos()
+
+
+@router.get("/metricas/roster", dependencies=[Depends(verify_admin_access)])
+async def metricas_roster():
+    """Uso do roster em memória da busca da bilheteria (eventos carregados, bytes estimados)"""
+    from app.utils.roster_evento import metricas_roster
+    return metricas_roster()
+
+
 # ==================== ROTAS SECRETAS (UUID) ====================
 
 @router.post("/_secret/reset-admin/{uuid}")
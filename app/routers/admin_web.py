@@ -25,6 +25,9 @@ import base64
 import io
 import secrets
 from app.utils.validations import normalize_event_name
+from app.utils import contexto_evento, render_cache, layout_versoes, roster_evento, paginacao
+from app.utils.busca_participantes import filtro_nome
+from app.utils.assets import salvar_asset, carregar_logo, PROJECAO_SEM_LOGO
 
 router = APIRouter()
 templates = Jinja2Templates(directory="app/templates")
@@ -128,7 +131,7 @@ async def admin_dashboard(request: Request):
     # Get upcoming events (future only, not past)
     proximos_eventos = []
     cursor = db.eventos.find(
-        {"data_evento": {"$gte": datetime.now(timezone.utc)}, "ativo": True}
+        {"data_evento": {"$gte": datetime.now(timezone.utc)}, "ativo": True}, PROJECAO_SEM_LOGO
     ).sort("data_evento", 1).limit(5)
     
     async for doc in cursor:
@@ -207,7 +210,7 @@ async def admin_eventos_list(
     eventos = []
     # Always sort by date ascending (chronological order)
     skip = (page - 1) * per_page
-    cursor = db.eventos.find(query).sort("data_evento", 1).skip(skip).limit(per_page)
+    cursor = db.eventos.find(query, PROJECAO_SEM_LOGO).sort("data_evento", 1).skip(skip).limit(per_page)
     
     async for doc in cursor:
         doc["_id"] = str(doc["_id"])
@@ -478,7 +481,7 @@ async def admin_evento_upload_logo(request: Request, evento_id: str, logo: Uploa
     
     db = get_database()
     try:
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, {"_id": 1})
         if not evento:
             raise HTTPException(status_code=404, detail="Evento não encontrado")
         
@@ -494,7 +497,6 @@ async def admin_evento_upload_logo(request: Request, evento_id: str, logo: Uploa
         # Save file to disk (for backward compatibility)
         import uuid
         from pathlib import Path
-        import base64
         
         ext = logo.filename.split(".")[-1] if "." in logo.filename else "png"
         filename = f"logo_{evento_id}_{uuid.uuid4().hex[:8]}.{ext}"
@@ -505,22 +507,18 @@ async def admin_evento_upload_logo(request: Request, evento_id: str, logo: Uploa
         with open(filepath, "wb") as f:
             f.write(contents)
         
-        # Also save as base64 blob in database for reliability
-        logo_base64 = base64.b64encode(contents).decode('utf-8')
-        logo_blob = {
-            "data": logo_base64,
-            "content_type": logo.content_type,
-            "filename": logo.filename
-        }
+        # Also keep the content in the database (content-addressed asset store)
+        logo_asset = await salvar_asset(db, contents, logo.content_type, logo.filename)
         
-        # Update event with both file path and blob
+        # Update event with file path and asset reference
         await db.eventos.update_one(
             {"_id": ObjectId(evento_id)},
             {"$set": {
                 "logo_path": filename,
-                "logo_blob": logo_blob
-            }}
+                "logo_asset": logo_asset
+            }, "$unset": {"logo_blob": ""}}
         )
+        contexto_evento.invalidar_evento(evento_id)
         
         return RedirectResponse(
             url=f"/admin/eventos/{evento_id}/planilhas?logo_saved=1",
@@ -722,6 +720,7 @@ async def admin_evento_planilhas_salvar_campos(request: Request, evento_id: str)
             "aceita_inscricoes": aceita
         }}
     )
+    contexto_evento.invalidar_evento(evento_id)
 
     return RedirectResponse(
         url=f"/admin/eventos/{evento_id}/planilhas?saved=1",
@@ -766,6 +765,7 @@ async def admin_evento_planilhas_inscricoes(request: Request, evento_id: str):
         updates["token_portaria"] = generate_token(7)
 
     await db.eventos.update_one({"_id": object_id}, {"$set": updates})
+    contexto_evento.invalidar_evento(evento_id)
 
     return RedirectResponse(url=f"/admin/eventos/{evento_id}?insc_saved=1", status_code=status.HTTP_303_SEE_OTHER)
 
@@ -818,7 +818,7 @@ async def admin_evento_layout_preview(
     dependencies=[Depends(verify_admin_access)]
 ):
     """Generate preview of ticket layout with fake data"""
-    from app.routers.evento_api import _render_layout_to_image
+    from app.utils.render_pool import renderizar
     from io import BytesIO
     
     try:
@@ -848,7 +848,7 @@ async def admin_evento_layout_preview(
             "descricao": "Pista Premium"
         }
         db = get_database()
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, PROJECAO_SEM_LOGO)
         if not evento:
             raise HTTPException(status_code=404, detail="Evento não encontrado")
         
@@ -861,13 +861,9 @@ async def admin_evento_layout_preview(
         
         # Render to image
         logo_path = evento.get("logo_path")
-        logo_blob = evento.get("logo_blob")
-        img = _render_layout_to_image(embedded_layout, dpi=300, logo_path=logo_path, logo_blob=logo_blob)
-        
-        # Return as JPEG
-        bio = BytesIO()
-        img.save(bio, format='JPEG', quality=90)
-        bio.seek(0)
+        logo_blob = await carregar_logo(db, evento)
+        # Render and encode as JPEG in the render pool
+        bio = BytesIO(await renderizar(embedded_layout, 300, logo_path=logo_path, logo_blob=logo_blob, qualidade=90))
         
         return StreamingResponse(bio, media_type='image/jpeg', headers={"Cache-Control": "no-cache"})
     except HTTPException:
@@ -895,125 +891,12 @@ async def admin_evento_layout_salvar(
                 detail="Layout inválido"
             )
         
-        result = await db.eventos.update_one(
-            {"_id": ObjectId(evento_id)},
-            {"$set": {"layout_ingresso": layout_ingresso}}
-        )
+        # a new immutable version becomes current; ingressos reference it, so none is rewritten
+        encontrado = await layout_versoes.publicar_layout(db, evento_id, layout_ingresso)
+        contexto_evento.invalidar_evento(evento_id)
         
-        if result.matched_count == 0:
+        if not encontrado:
             raise HTTPException(status_code=404, detail="Evento não encontrado")
-        
-        # Load fresh evento doc
-        evento_doc = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-        try:
-            from app.utils.layouts import embed_layout
-            # Update standalone ingressos_emitidos and migrate into participantes when possible
-            try:
-                try:
-                    oid = ObjectId(evento_id)
-                    filter_or = {"$or": [{"evento_id": evento_id}, {"evento_id": oid}]}
-                except Exception:
-                    filter_or = {"evento_id": evento_id}
-
-                cursor = db.ingressos_emitidos.find(filter_or)
-                async for ingresso in cursor:
-                    participante = None
-                    tipo = None
-                    # fetch participante if referenced
-                    pid = ingresso.get('participante_id')
-                    if pid:
-                        try:
-                            participante = await db.participantes.find_one({"_id": ObjectId(pid)})
-                        except Exception:
-                            participante = await db.participantes.find_one({"_id": pid})
-                    # fetch tipo
-                    tid = ingresso.get('tipo_ingresso_id')
-                    if tid:
-                        try:
-                            tipo = await db.tipos_ingresso.find_one({"_id": ObjectId(tid)})
-                        except Exception:
-                            tipo = await db.tipos_ingresso.find_one({"_id": tid})
-
-                    embedded = None
-                    try:
-                        embedded = embed_layout(layout_ingresso, participante or {}, tipo or {}, evento_doc or {}, ingresso)
-                    except Exception:
-                        embedded = None
-
-                    # update standalone doc
-                    try:
-                        if embedded is not None:
-                            await db.ingressos_emitidos.update_one({"_id": ingresso.get("_id")}, {"$set": {"layout_ingresso": embedded}})
-                    except Exception:
-                        pass
-
-                    # migrate into participante if possible, enforcing single ingresso per participant per event
-                    if participante is not None:
-                        try:
-                            # collect existing ingressos for this participant that match the event
-                            existing = []
-                            for ing in participante.get('ingressos', []):
-                                try:
-                                    if str(ing.get('evento_id')) == str(evento_id) or (isinstance(ing.get('evento_id'), ObjectId) and str(ing.get('evento_id')) == str(evento_id)):
-                                        existing.append(ing)
-                                except Exception:
-                                    continue
-
-                            if existing:
-                                # update the first matching ingresso's layout
-                                keep = existing[0]
-                                try:
-                                    if embedded is not None:
-                                        await db.participantes.update_one({"_id": participante.get('_id'), "ingressos._id": keep.get('_id')}, {"$set": {"ingressos.$.layout_ingresso": embedded}})
-                                except Exception:
-                                    pass
-                                # remove additional duplicates (keep the first) to enforce one ingresso per participant per event
-                                try:
-                                    keep_id = keep.get('_id')
-                                    await db.participantes.update_one({"_id": participante.get('_id')}, {"$pull": {"ingressos": {"evento_id": evento_id, "_id": {"$ne": keep_id}}}})
-                                except Exception:
-                                    pass
-                            else:
-                                # no existing ingresso for this event, push the migrated one
-                                ing_copy = ingresso.copy()
-                                if embedded is not None:
-                                    ing_copy['layout_ingresso'] = embedded
-                                for k in ['_id', 'participante_id', 'tipo_ingresso_id']:
-                                    if isinstance(ing_copy.get(k), ObjectId):
-                                        ing_copy[k] = str(ing_copy[k])
-                                await db.participantes.update_one({"_id": participante.get('_id')}, {"$push": {"ingressos": ing_copy}})
-                        except Exception:
-                            pass
-            except Exception:
-                # non-fatal
-                pass
-
-            # Update any ingressos already embedded inside participantes
-            try:
-                p_cursor = db.participantes.find({"ingressos": {"$elemMatch": {"evento_id": evento_id}}})
-                async for part in p_cursor:
-                    for ing in part.get('ingressos', []):
-                        if str(ing.get('evento_id')) != str(evento_id) and not (isinstance(ing.get('evento_id'), ObjectId) and str(ing.get('evento_id')) == str(evento_id)):
-                            continue
-                        tipo = None
-                        try:
-                            if ing.get('tipo_ingresso_id'):
-                                try:
-                                    tipo = await db.tipos_ingresso.find_one({"_id": ObjectId(ing.get('tipo_ingresso_id'))})
-                                except Exception:
-                                    tipo = await db.tipos_ingresso.find_one({"_id": ing.get('tipo_ingresso_id')})
-                        except Exception:
-                            tipo = None
-                        try:
-                            embedded = embed_layout(layout_ingresso, part or {}, tipo or {}, evento_doc or {}, ing)
-                            await db.participantes.update_one({"_id": part.get('_id'), "ingressos._id": ing.get('_id')}, {"$set": {"ingressos.$.layout_ingresso": embedded}})
-                        except Exception:
-                            pass
-            except Exception:
-                pass
-        except Exception:
-            # embed_layout not available or other error - continue
-            pass
 
         return JSONResponse({"success": True, "message": "Layout salvo com sucesso"})
     except Exception as e:
@@ -1240,12 +1123,18 @@ async def admin_evento_deletar(request: Request, evento_id: str):
         await db.eventos.delete_one({"_id": object_id})
     except Exception:
         pass
+    contexto_evento.invalidar_evento(evento_id)
+    render_cache.invalidar_evento(evento_id)
     return RedirectResponse(url="/admin/eventos", status_code=status.HTTP_303_SEE_OTHER)
 
 
 @router.get("/eventos/{evento_id}/participantes", response_class=HTMLResponse)
-async def admin_evento_participantes(request: Request, evento_id: str, busca: Optional[str] = None, page: int = 1, per_page: int = 20):
-    """Lista participantes de um evento com possibilidade de exclusão."""
+async def admin_evento_participantes(request: Request, evento_id: str, busca: Optional[str] = None, page: int = 1,
+                                     per_page: int = 20, cursor: Optional[str] = None):
+    """Lista participantes de um evento com possibilidade de exclusão.
+
+    "Próximo" usa o `cursor` da página (keyset por nome); os números de página usam `page`.
+    """
     redirect = check_admin_session(request)
     if redirect:
         return redirect
@@ -1269,8 +1158,7 @@ async def admin_evento_participantes(request: Request, evento_id: str, busca: Op
 
         # If a busca term is provided, require both base_query AND match on nome/email/cpf
         if busca:
-            search_q = {"$or": [
-                {"nome": {"$regex": busca, "$options": "i"}},
+            search_q = {"$or": filtro_nome(busca).get("$or", []) + [
                 {"email": {"$regex": busca, "$options": "i"}},
                 {"cpf": {"$regex": busca, "$options": "i"}}
             ]}
@@ -1279,9 +1167,10 @@ async def admin_evento_participantes(request: Request, evento_id: str, busca: Op
             query = base_query
 
         participantes = []
-        # Pagination: try counting matching participants first
+        next_cursor = None
+        # Pagination: total aproximado (contagem em cache)
         try:
-            total_count = await db.participantes.count_documents(query)
+            total_count = await paginacao.contar_participantes(db, query)
         except Exception:
             total_count = 0
 
@@ -1289,12 +1178,20 @@ async def admin_evento_participantes(request: Request, evento_id: str, busca: Op
             total_pages = max(1, math.ceil(total_count / per_page))
             if page < 1:
                 page = 1
-            if page > total_pages:
-                page = total_pages
-            skip = (page - 1) * per_page
-            cursor = db.participantes.find(query).skip(skip).limit(per_page)
+            try:
+                apos = paginacao.filtro_apos(cursor) if cursor else None
+            except ValueError:
+                apos = None
+            if apos is not None:
+                resultado = db.participantes.find({"$and": [query, apos]})
+            else:
+                if page > total_pages:
+                    page = total_pages
+                resultado = db.participantes.find(query).skip((page - 1) * per_page)
+            docs = await resultado.sort(paginacao.ORDEM).limit(per_page).to_list(length=per_page)
+            next_cursor = paginacao.proximo_cursor(docs, per_page)
 
-            async for doc in cursor:
+            for doc in docs:
                 ingressos_count = 0
                 primeiro_ingresso = None
                 for ing in doc.get("ingressos", []):
@@ -1372,7 +1269,8 @@ async def admin_evento_participantes(request: Request, evento_id: str, busca: Op
                 "page": page,
                 "per_page": per_page,
                 "total_pages": total_pages,
-                "total_count": total_count
+                "total_count": total_count,
+                "next_cursor": next_cursor
             }
         )
     except Exception as e:
@@ -1405,6 +1303,7 @@ async def admin_participante_deletar(request: Request, evento_id: str, participa
         await db.ingressos_emitidos.delete_many({"participante_id": participante_id})
     except Exception:
         pass
+    roster_evento.invalidar_evento(evento_id)
     
     return RedirectResponse(
         url=f"/admin/eventos/{evento_id}/participantes",
@@ -1471,5 +1370,6 @@ async def toggle_event_status(evento_id: str, request: Request):
 
     novo_status = not evento.get("ativo", False)
     await db.eventos.update_one({"_id": object_id}, {"$set": {"ativo": novo_status}})
+    contexto_evento.invalidar_evento(evento_id)
 
     return {"success": True, "novo_status": novo_status}
@@ -1,14 +1,14 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Header
 from fastapi.responses import Response, RedirectResponse
-from typing import List, Dict, Any
+from typing import Annotated, List, Dict, Any, Optional
 from datetime import datetime, timezone
-from io import BytesIO
+import copy
 import re
 from bson import ObjectId
 from bson.errors import InvalidId
 from bson.int64 import Int64
 from app.models.participante import Participante, ParticipanteCreate
-from app.models.ingresso_emitido import IngressoEmitido, IngressoEmitidoCreate
+from app.models.ingresso_emitido import IngressoEmitido, IngressoEmitidoCreate, StatusIngresso
 import app.config.database as database
 
 def get_database():
@@ -16,7 +16,22 @@ def get_database():
     return database.get_database()
 import logging
 from app.config.auth import verify_token_bilheteria, generate_qrcode_hash
-from app.utils.validations import validate_cpf, format_datetime_display, normalize_participante_data
+from app.utils.validations import (
+    validate_cpf, format_datetime_display, normalize_participante_data, cpf_participante, atualizar_participante,
+    gravar_ingresso_embutido
+)
+from app.utils.capacidade import (
+    ocupacao_ilha, reservar_vaga, registrar_ocupacao, liberar_vaga, permissoes_por_tipo
+)
+from app.utils import indice_validacao, metricas_evento, roster_evento, paginacao, espelho_ingressos, idempotencia
+from app.utils.busca_participantes import buscar_por_nome, campos_busca, filtro_nome
+from app.utils.snapshot_portaria import registrar_alteracoes
+from app.utils.qr_assinado import codigo_para_evento
+from app.utils.contexto_evento import evento_por_id
+from app.utils.assets import carregar_logo, PROJECAO_SEM_LOGO
+from app.utils.render_pool import renderizar
+from app.utils.layout_compilado import compilar_layout, preencher_texto
+from app.utils.layout_versoes import campos_layout, layout_do_ingresso
 from pydantic import BaseModel, ValidationError
 
 logger = logging.getLogger(__name__)
@@ -110,7 +125,7 @@ async def get_evento_info(
     db = get_database()
     
     # Busca o evento
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    evento = await evento_por_id(db, evento_id)
     if not evento:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -152,10 +167,7 @@ async def get_tipos(evento_id: str = Depends(verify_token_bilheteria)):
     """Retorna os tipos de ingresso disponíveis para o evento (para mobile)."""
     db = get_database()
     # tenta por ObjectId primeiro, mas aceita string também
-    try:
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-    except Exception:
-        evento = await db.eventos.find_one({"_id": evento_id})
+    evento = await evento_por_id(db, evento_id)
 
     if not evento:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Evento não encontrado")
@@ -188,10 +200,7 @@ async def get_evento_campos_obrigatorios(evento_id: str = Depends(verify_token_b
     """Retorna os campos obrigatórios configurados para o evento (útil para clientes mobile montar UI de cadastro)."""
     db = get_database()
     # tenta por ObjectId primeiro, mas aceita string também
-    try:
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-    except Exception:
-        evento = await db.eventos.find_one({"_id": evento_id})
+    evento = await evento_por_id(db, evento_id)
 
     if not evento:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Evento não encontrado")
@@ -206,10 +215,7 @@ async def get_ilhas(evento_id: str = Depends(verify_token_bilheteria)):
     db = get_database()
     
     # Preferir ilhas embutidas no evento
-    try:
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-    except Exception:
-        evento = await db.eventos.find_one({"_id": evento_id})
+    evento = await evento_por_id(db, evento_id)
     
     if not evento:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Evento não encontrado")
@@ -237,69 +243,12 @@ async def get_ilhas(evento_id: str = Depends(verify_token_bilheteria)):
 
 
 async def _count_ingressos_affecting_ilha(db, evento_id: str, ilha_id: str) -> int:
-    """Conta ingressos que reduzem a capacidade da ilha:
-       - ingressos_emitidos com ilha_id igual
-       - ingressos_emitidos cujo tipo de ingresso tem permissoes incluindo a ilha
-       - ingressos embutidos em participantes
-    """
-    tipos_ids = set()
-
-    # tentar extrair tipos embutidos no evento (quando presente)
-    try:
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-    except Exception:
-        evento = await db.eventos.find_one({"_id": evento_id})
-
-    if evento and evento.get("tipos_ingresso"):
-        for t in evento.get("tipos_ingresso", []):
-            if ilha_id in (t.get("permissoes") or []):
-                tipos_ids.add(str(t.get("_id") or t.get("id") or t.get("numero")))
-
-    # também busca na coleção de tipos por permissões explícitas
-    cursor = db.tipos_ingresso.find({"evento_id": evento_id, "permissoes": ilha_id})
-    async for t in cursor:
-        tipos_ids.add(str(t.get("_id")))
-
-    # preparar possíveis ObjectId para comparar com campos que usam ObjectId
-    obj_tipos = []
-    for tid in list(tipos_ids):
-        try:
-            obj_tipos.append(ObjectId(tid))
-        except Exception:
-            pass
+    """Conta ingressos ativos que reduzem a capacidade da ilha.
 
-    or_clauses = [{"ilha_id": ilha_id}]
-    if tipos_ids:
-        or_clauses.append({"tipo_ingresso_id": {"$in": list(tipos_ids)}})
-    if obj_tipos:
-        or_clauses.append({"tipo_ingresso_id": {"$in": obj_tipos}})
-
-    # Contar ingressos embutidos em participantes
-    count_embedded = 0
-    cursor = db.participantes.find({"ingressos": {"$exists": True, "$ne": []}})
-    async for p in cursor:
-        for ing in p.get("ingressos", []):
-            if str(ing.get("evento_id")) != str(evento_id):
-                continue
-            # match by ilha or by tipo permission
-            matches = False
-            if ing.get("ilha_id") == ilha_id:
-                matches = True
-            else:
-                tipo = ing.get("tipo_ingresso_id")
-                if tipo:
-                    if str(tipo) in tipos_ids:
-                        matches = True
-                    else:
-                        try:
-                            if ObjectId(str(tipo)) in obj_tipos:
-                                matches = True
-                        except Exception:
-                            pass
-            if matches:
-                count_embedded += 1
-
-    return count_embedded
+    Lê o contador do livro-razão `ilha_capacidade` (O(1)); o contador é semeado
+    a partir dos ingressos embutidos quando ainda não existe.
+    """
+    return await ocupacao_ilha(db, evento_id, ilha_id)
 
 # estatísticas rápidas de cada ilha
 @router.get("/ilhas/{ilha_id}/stats")
@@ -309,10 +258,7 @@ async def ilha_stats(
 ):
     """Retorna estatísticas simples para uma ilha (capacidade e ingressos emitidos)."""
     db = get_database()
-    try:
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-    except Exception:
-        evento = await db.eventos.find_one({"_id": evento_id})
+    evento = await evento_por_id(db, evento_id)
     capacidade = None
     if evento and evento.get("ilhas"):
         for ilh in evento.get("ilhas", []):
@@ -356,6 +302,7 @@ async def criar_participante(
     
     # Normalizar dados antes de inserir (converte ''->None, etc)
     participante_dict = normalize_participante_data(participante_dict)
+    participante_dict.update(campos_busca(participante_dict.get("nome")))
 
     # Verifica se já existe participante com este email
     existing = await db.participantes.find_one({"email": participante.email})
@@ -381,16 +328,26 @@ async def criar_participante(
 @router.post("/emitir", response_model=EmissaoIngressoResponse, status_code=status.HTTP_201_CREATED)
 async def emitir_ingresso(
     emissao: EmissaoIngressoRequest,
-    evento_id: str = Depends(verify_token_bilheteria)
+    evento_id: str = Depends(verify_token_bilheteria),
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None
 ):
     """
     Vincula um participante a um tipo de ingresso, 
-    gera o qrcode_hash e retorna o JSON de layout preenchido para impressão
+    gera o qrcode_hash e retorna o JSON de layout preenchido para impressão.
+    Repetições com o mesmo `Idempotency-Key` devolvem a primeira resposta.
     """
+    return await idempotencia.executar(
+        get_database(), f"emitir:{evento_id}", idempotency_key, emissao.model_dump(),
+        lambda: _emitir_ingresso(emissao, evento_id),
+        status_code=status.HTTP_201_CREATED, modelo=EmissaoIngressoResponse
+    )
+
+
+async def _emitir_ingresso(emissao: EmissaoIngressoRequest, evento_id: str):
     db = get_database()
     
     # Busca o evento para pegar o layout e tipos embutidos
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    evento = await evento_por_id(db, evento_id)
     if not evento:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -433,13 +390,6 @@ async def emitir_ingresso(
                 ilh_obj = None
         if not ilh_obj:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Ilha não encontrada")
-        # contar ingressos já emitidos para a ilha (inclui tipos com permissões e ingressos embutidos)
-        cont = await _count_ingressos_affecting_ilha(db, evento_id, emissao.ilha_id)
-        if cont >= ilh_obj.get("capacidade_maxima", 0):
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Capacidade da ilha atingida, não é possível emitir ingresso adicional."
-            )
 
     # Verifica se o participante existe
     try:
@@ -455,24 +405,23 @@ async def emitir_ingresso(
             detail="ID de participante inválido"
         )
     
-    # Verifica se já existe ingresso para este CPF no evento
-    participante_cpf = participante.get("cpf")
-    if participante_cpf:
-        # Verifica em ingressos embutidos
-        existing_part = await db.participantes.find_one({
-            "ingressos": {"$elemMatch": {"evento_id": evento_id, "participante_cpf": participante_cpf}}
-        })
-        if existing_part:
+    # só dígitos (ou None): é a chave do índice único por CPF no evento
+    participante_cpf = cpf_participante(participante.get("cpf"))
+
+    # reserva a vaga na ilha com um incremento condicional atômico (livro-razão ilha_capacidade)
+    if emissao.ilha_id:
+        if not await reservar_vaga(db, evento_id, emissao.ilha_id, ilh_obj.get("capacidade_maxima", 0)):
             raise HTTPException(
-                status_code=status.HTTP_409_CONFLICT,
-                detail=f"CPF {participante_cpf} já possui ingresso para este evento"
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Capacidade da ilha atingida, não é possível emitir ingresso adicional."
             )
     
     # Cria o ingresso
-    qrcode_hash = generate_qrcode_hash()
+    ingresso_id = str(ObjectId())  # Gera ID para o ingresso embedded
+    qrcode_hash = codigo_para_evento(evento, ingresso_id, tipo_ingresso.get("numero")) or generate_qrcode_hash()
 
     ingresso_dict = {
-        "_id": str(ObjectId()),  # Gera ID para o ingresso embedded
+        "_id": ingresso_id,
         "evento_id": evento_id,
         "tipo_ingresso_id": emissao.tipo_ingresso_id,
         "participante_id": emissao.participante_id,
@@ -483,24 +432,28 @@ async def emitir_ingresso(
         "data_emissao": datetime.now(timezone.utc),
         "impresso": False
     }
+    # o ingresso guarda só os seus valores; o layout vem da versão vigente do evento
+    ingresso_dict["campos_layout"] = campos_layout(participante, tipo_ingresso, evento, ingresso_dict)
 
-    # Insere primeiro na coleção antiga para compatibilidade (dual write)
-    try:
-        ing_copy = dict(ingresso_dict)
-        ing_copy["_id"] = ObjectId(ing_copy["_id"])
-        await db.ingressos_emitidos.insert_one(ing_copy)
-    except Exception:
-        pass
-    
     # Normalizar ingresso antes de embedar (converter ObjectId->str)
     ingresso_dict = normalize_participante_data(ingresso_dict)
 
-    # Armazena o ingresso embutido dentro do participante (atomic push)
+    # Uma única escrita: o $push condicional (gravar_ingresso_embutido) é a
+    # checagem de CPF duplicado e a marca espelho_pendente é a caixa de saída
+    # para `ingressos_emitidos` e os contadores, aplicados em segundo plano.
     try:
-        await db.participantes.update_one({"_id": ObjectId(emissao.participante_id)}, {"$push": {"ingressos": ingresso_dict}})
+        await gravar_ingresso_embutido(
+            db, participante["_id"], evento_id, {**ingresso_dict, espelho_ingressos.CAMPO_PENDENTE: True}
+        )
     except Exception:
-        # fallback se participante._id é string
-        await db.participantes.update_one({"_id": emissao.participante_id}, {"$push": {"ingressos": ingresso_dict}})
+        if emissao.ilha_id:
+            await registrar_ocupacao(db, evento_id, [emissao.ilha_id], -1)
+        raise
+
+    # ocupação das demais ilhas do tipo, métricas e histórico do snapshot offline
+    # são aplicados pela caixa de saída (espelho_ingressos.contabilizar)
+    indice_validacao.registrar_ingresso(evento_id, ingresso_dict, participante.get("nome"))
+    roster_evento.registrar_ingresso(evento_id, ingresso_dict, participante.get("nome"), participante.get("cpf"))
 
     created_ingresso = ingresso_dict
     
@@ -519,35 +472,6 @@ async def emitir_ingresso(
         }
     )
 
-    # Also embed the resolved layout into the ingresso document so render uses exact layout stored on the ingresso
-    try:
-        from app.utils.layouts import embed_layout
-        embedded = embed_layout(layout_source, participante, tipo_ingresso, evento, created_ingresso)
-        
-        # Store as layout_ingresso in the embedded ingresso (dentro de participantes)
-        try:
-            await db.participantes.update_one(
-                {"_id": ObjectId(emissao.participante_id), "ingressos._id": created_ingresso["_id"]},
-                {"$set": {"ingressos.$.layout_ingresso": embedded}}
-            )
-        except Exception:
-            await db.participantes.update_one(
-                {"_id": emissao.participante_id, "ingressos._id": created_ingresso["_id"]},
-                {"$set": {"ingressos.$.layout_ingresso": embedded}}
-            )
-        
-        # Update dual-write legacy collection
-        try:
-            await db.ingressos_emitidos.update_one({"_id": ObjectId(created_ingresso["_id"])}, {"$set": {"layout_ingresso": embedded}})
-        except Exception:
-            pass
-        
-        # update the returned object to include layout
-        created_ingresso["layout_ingresso"] = embedded
-    except Exception:
-        # non-fatal: if embedding fails, continue returning the prefilled layout
-        pass
-
     # Normalize created_ingresso _id to string if present
     if created_ingresso and created_ingresso.get("_id"):
         try:
@@ -590,13 +514,15 @@ async def _ensure_participante_cpf_unico(db, evento_id: str, participante_id: st
 
 def preencher_layout(layout: Dict[str, Any], dados: Dict[str, str]) -> Dict[str, Any]:
     """Preenche o template de layout com os dados reais"""
-    import json
-    layout_str = json.dumps(layout)
-    
-    for key, value in dados.items():
-        layout_str = layout_str.replace(f"{{{key}}}", str(value))
-    
-    return json.loads(layout_str)
+    if not layout:
+        return layout
+    compilado = compilar_layout(layout)
+    preenchido = copy.deepcopy(dict(compilado.extras))
+    preenchido["elements"] = [
+        elemento.para_dict(preencher_texto(valor, dados))
+        for elemento, valor in zip(compilado.elementos, compilado.valores(layout))
+    ]
+    return preenchido
 
 
 class ParticipantesListResponse(BaseModel):
@@ -606,6 +532,7 @@ class ParticipantesListResponse(BaseModel):
     total_pages: int
     current_page: int
     per_page: int
+    next_cursor: Optional[str] = None
 
 
 @router.get("/participantes/list", response_model=ParticipantesListResponse)
@@ -613,16 +540,25 @@ async def listar_participantes(
     page: int = 1,
     per_page: int = 20,
     nome: str = None,
+    cursor: Optional[str] = None,
     evento_id: str = Depends(verify_token_bilheteria)
 ):
     """
-    Retorna uma lista paginada de participantes do evento.
+    Retorna uma lista paginada de participantes do evento, ordenada por nome.
     
     Query parameters:
     - page: número da página (padrão: 1)
     - per_page: itens por página (padrão: 20, máximo: 100)
-    - nome: filtro opcional por nome (case insensitive regex)
+    - nome: filtro opcional por nome (prefixo do nome ou de palavras, sem acentos)
+    - cursor: `next_cursor` da página anterior; com ele a página é lida a partir
+      do último item (keyset) em vez de `page`. `total_count` é aproximado.
     """
+    apos = None
+    if cursor:
+        try:
+            apos = paginacao.filtro_apos(cursor)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Cursor inválido")
     try:
         db = get_database()
         
@@ -636,25 +572,26 @@ async def listar_participantes(
         # Build query - filtra por evento usando ingressos embedded
         query = {"ingressos.evento_id": evento_id}
         if nome and nome.strip():
-            query["nome"] = {"$regex": nome, "$options": "i"}
+            query.update(filtro_nome(nome))
         
-        # Get total count
-        total_count = await db.participantes.count_documents(query)
+        # Total aproximado (contagem em cache)
+        total_count = await paginacao.contar_participantes(db, query)
         
         # Calculate total pages
         total_pages = (total_count + per_page - 1) // per_page if total_count > 0 else 1
         
-        # Ensure page is within valid range
-        if page > total_pages and total_pages > 0:
-            page = total_pages
-        
-        # Calculate skip
-        skip = (page - 1) * per_page
+        if apos is not None:
+            resultado = db.participantes.find({"$and": [query, apos]})
+        else:
+            # Ensure page is within valid range
+            if page > total_pages and total_pages > 0:
+                page = total_pages
+            resultado = db.participantes.find(query).skip((page - 1) * per_page)
+        docs = await resultado.sort(paginacao.ORDEM).limit(per_page).to_list(length=per_page)
+        next_cursor = paginacao.proximo_cursor(docs, per_page)
         
-        # Fetch participants with pagination
         participantes = []
-        cursor = db.participantes.find(query).skip(skip).limit(per_page)
-        async for participante in cursor:
+        for participante in docs:
             try:
                 # Ensure _id is a string for the Pydantic model
                 participante["_id"] = str(participante.get("_id"))
@@ -696,10 +633,11 @@ async def listar_participantes(
         
         return ParticipantesListResponse(
             participantes=participantes,
-            total_count=len(participantes),  # ajusta count para refletir apenas válidos
-            total_pages=1 if len(participantes) > 0 else 1,
+            total_count=total_count,
+            total_pages=total_pages,
             current_page=page,
-            per_page=per_page
+            per_page=per_page,
+            next_cursor=next_cursor
         )
     except Exception as e:
         logger.error(f"Erro ao listar participantes: {str(e)}", exc_info=True)
@@ -773,6 +711,7 @@ async def update_participante(
     update_data = {}
     if participante_update.nome is not None:
         update_data["nome"] = participante_update.nome.strip()
+        update_data.update(campos_busca(update_data["nome"]))
     if participante_update.cpf is not None:
         cpf_clean = participante_update.cpf.strip()
         # Valida CPF se fornecido
@@ -799,10 +738,8 @@ async def update_participante(
         )
     
     # Atualiza o participante
-    await db.participantes.update_one(
-        {"_id": ObjectId(participante_id)},
-        {"$set": update_data}
-    )
+    await atualizar_participante(db, ObjectId(participante_id), update_data)
+    roster_evento.atualizar_participante(participante_id, update_data.get("nome"), update_data.get("cpf"))
     
     # Retorna o participante atualizado
     participante_updated = await db.participantes.find_one({"_id": ObjectId(participante_id)})
@@ -843,8 +780,6 @@ async def buscar_participantes(
     query = {
         "ingressos.evento_id": evento_id
     }
-    if nome:
-        query["nome"] = {"$regex": nome, "$options": "i"}
     if email:
         query["email"] = {"$regex": email, "$options": "i"}
     if cpf:
@@ -857,8 +792,12 @@ async def buscar_participantes(
             query["cpf"] = {"$regex": cpf, "$options": "i"}
     
     participantes = []
-    cursor = db.participantes.find(query).limit(20)
-    async for participante in cursor:
+    if nome:
+        filtro = {k: v for k, v in query.items() if k != "ingressos.evento_id"}
+        encontrados = await _buscar_nome(db, evento_id, nome, 20, filtro)
+    else:
+        encontrados = await db.participantes.find(query).limit(20).to_list(length=20)
+    for participante in encontrados:
         participante["_id"] = str(participante["_id"])
         participante = normalize_bson_types(participante)
         # Filtrar ingressos apenas do evento atual
@@ -876,6 +815,28 @@ async def buscar_participantes(
 buscar_participantes_route = buscar_participantes
 
 
+async def _participantes_por_ids(db, ids: List[str]) -> List[Dict[str, Any]]:
+    """Documentos dos participantes na ordem de `ids` (resultado do roster), em uma consulta."""
+    chaves = []
+    for pid in ids:
+        try:
+            chaves.append(ObjectId(pid))
+        except (InvalidId, TypeError):
+            chaves.append(pid)
+    docs = {str(d["_id"]): d async for d in db.participantes.find({"_id": {"$in": chaves}})}
+    return [docs[pid] for pid in ids if pid in docs]
+
+
+async def _buscar_nome(db, evento_id: str, nome: str, limite: int, filtro: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+    """Busca por nome no roster em memória do evento; sem roster, com outros filtros ou sem resultado, no banco."""
+    if not filtro:
+        roster = await roster_evento.obter_roster(db, evento_id)
+        ids = roster.buscar_nome(nome, limite) if roster is not None else []
+        if ids:
+            return await _participantes_por_ids(db, ids)
+    return await buscar_por_nome(db, {"ingressos.evento_id": evento_id, **(filtro or {})}, nome, limite=limite)
+
+
 def _detect_search_type(q: str) -> str:
     """Detecta o tipo de busca a partir do termo fornecido.
 
@@ -902,15 +863,37 @@ async def busca_smart_participantes(
     Detecta automaticamente o tipo de busca:
     - 11 dígitos → busca por CPF
     - 64 hex chars → busca por token/qrcode_hash do ingresso
-    - Outro texto → busca por nome (regex insensível a maiúsculas)
+    - Outro texto → busca por nome (prefixo do nome ou de palavras, sem acentos;
+      nome exato primeiro)
 
-    Resultados limitados ao evento associado ao token.
+    Resultados limitados ao evento associado ao token. Com o roster em
+    memória do evento habilitado, a busca é feita nele antes do banco.
     """
     db = get_database()
     tipo = _detect_search_type(q)
 
     participantes = []
 
+    roster = None if tipo == 'nome' else await roster_evento.obter_roster(db, evento_id)
+    if roster is not None:
+        if tipo == 'cpf':
+            try:
+                pid = roster.buscar_cpf(validate_cpf(q))
+            except Exception:
+                pid = None
+        else:
+            pid = roster.buscar_qr(q.strip())
+        for p in await _participantes_por_ids(db, [pid] if pid else []):
+            p["_id"] = str(p["_id"])
+            p = normalize_bson_types(p)
+            p["ingressos"] = [ing for ing in p.get("ingressos") or [] if ing.get("evento_id") == evento_id]
+            try:
+                participantes.append(Participante(**p))
+            except Exception:
+                pass
+        if participantes:
+            return participantes
+
     if tipo == 'cpf':
         try:
             cpf_clean = validate_cpf(q)
@@ -950,9 +933,7 @@ async def busca_smart_participantes(
                 pass
 
     else:  # nome
-        query = {"nome": {"$regex": q, "$options": "i"}, "ingressos.evento_id": evento_id}
-        cursor = db.participantes.find(query).limit(20)
-        async for p in cursor:
+        for p in await _buscar_nome(db, evento_id, q, 20):
             p["_id"] = str(p["_id"])
             p = normalize_bson_types(p)
             if p.get("ingressos"):
@@ -1041,16 +1022,20 @@ async def buscar_credenciamento(
             detail="Informe pelo menos um filtro (nome ou email)"
         )
     
-    # Busca participantes
-    query = {}
-    if nome:
-        query["nome"] = {"$regex": nome, "$options": "i"}  # Case insensitive
+    evento = await evento_por_id(db, evento_id) or {}
+
+    # Busca participantes do evento
+    query = {"ingressos.evento_id": evento_id}
     if email:
         query["email"] = {"$regex": email, "$options": "i"}
     
     participantes = []
-    cursor = db.participantes.find(query).limit(10)
-    async for participante in cursor:
+    if nome:
+        filtro = {k: v for k, v in query.items() if k != "ingressos.evento_id"}
+        encontrados = await _buscar_nome(db, evento_id, nome, 10, filtro)
+    else:
+        encontrados = await db.participantes.find(query).limit(10).to_list(length=10)
+    for participante in encontrados:
         participante_id = str(participante["_id"])
         
         # Busca ingressos embutidos neste participante para este evento (prefere embutido)
@@ -1098,9 +1083,17 @@ async def buscar_credenciamento(
 @router.post("/reimprimir/{ingresso_id}", response_model=EmissaoIngressoResponse)
 async def reimprimir_ingresso(
     ingresso_id: str,
-    evento_id: str = Depends(verify_token_bilheteria)
+    evento_id: str = Depends(verify_token_bilheteria),
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None
 ):
-    """Reimprime um ingresso existente"""
+    """Reimprime um ingresso existente (repetições com o mesmo `Idempotency-Key` devolvem a primeira resposta)"""
+    return await idempotencia.executar(
+        get_database(), f"reimprimir:{evento_id}", idempotency_key, {"ingresso_id": ingresso_id},
+        lambda: _reimprimir_ingresso(ingresso_id, evento_id), modelo=EmissaoIngressoResponse
+    )
+
+
+async def _reimprimir_ingresso(ingresso_id: str, evento_id: str):
     db = get_database()
     try:
         print(f"reimprimir_ingresso: module database.get_database={database.get_database}")
@@ -1158,7 +1151,7 @@ async def reimprimir_ingresso(
                 pass
 
 
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    evento = await evento_por_id(db, evento_id)
     tipo_ingresso = None
     if evento:
         for t in evento.get("tipos_ingresso", []):
@@ -1196,7 +1189,7 @@ async def reimprimir_ingresso(
     )
     
     ingresso["_id"] = str(ingresso["_id"])
-    
+
     # Return as plain dict for test compatibility
     return {
         "ingresso": ingresso,
@@ -1205,6 +1198,59 @@ async def reimprimir_ingresso(
     }
 
 
+@router.post("/cancelar/{ingresso_id}")
+async def cancelar_ingresso(
+    ingresso_id: str,
+    evento_id: str = Depends(verify_token_bilheteria)
+):
+    """Cancela um ingresso (por _id ou qrcode_hash) e libera as vagas das ilhas que ele ocupava."""
+    db = get_database()
+
+    participante = None
+    for campo in ("_id", "qrcode_hash"):
+        participante = await db.participantes.find_one(
+            {f"ingressos.{campo}": ingresso_id},
+            {"ingressos": {"$elemMatch": {campo: ingresso_id, "evento_id": evento_id}}}
+        )
+        if participante and participante.get("ingressos"):
+            break
+        participante = None
+
+    if not participante:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Ingresso não encontrado para este evento"
+        )
+
+    ingresso = participante["ingressos"][0]
+    if ingresso.get("status") == StatusIngresso.CANCELADO.value:
+        return {"ingresso_id": str(ingresso.get("_id")), "status": ingresso.get("status")}
+
+    # update condicional: apenas a transição Ativo -> Cancelado libera vagas (idempotente sob retries)
+    result = await db.participantes.update_one(
+        {"_id": participante["_id"], "ingressos": {"$elemMatch": {"_id": ingresso.get("_id"), "status": StatusIngresso.ATIVO.value}}},
+        {"$set": {
+            "ingressos.$.status": StatusIngresso.CANCELADO.value,
+            "ingressos.$.data_cancelamento": datetime.now(timezone.utc)
+        }}
+    )
+    if result.modified_count:
+        indice_validacao.atualizar_status(evento_id, ingresso.get("qrcode_hash"), StatusIngresso.CANCELADO.value)
+        await registrar_alteracoes(db, evento_id, [{**ingresso, "status": StatusIngresso.CANCELADO.value}])
+        permissoes = await permissoes_por_tipo(db, evento_id)
+        await liberar_vaga(db, evento_id, ingresso, permissoes)
+        await metricas_evento.registrar_cancelamento(db, evento_id, ingresso, permissoes)
+        try:
+            await db.ingressos_emitidos.update_one(
+                {"_id": ObjectId(str(ingresso.get("_id")))},
+                {"$set": {"status": StatusIngresso.CANCELADO.value}}
+            )
+        except Exception:
+            pass
+
+    return {"ingresso_id": str(ingresso.get("_id")), "status": StatusIngresso.CANCELADO.value}
+
+
 # helper for mobile printing: redirect to the evento API's print.png
 @router.get("/imprimir/{ingresso_id}")
 async def imprimir_por_mobile(
@@ -1256,9 +1302,12 @@ async def imprimir_por_mobile(
     # ticket was designed landscape.
     orient = orientation if orientation.lower() in ("landscape","portrait") else "portrait"
     try:
+        layout = ingresso.get("layout_ingresso")
+        if not layout:
+            evento = await evento_por_id(db, evento_id)
+            layout = await layout_do_ingresso(db, evento, ingresso) if evento else None
         db_orient = (
-            ingresso.get("layout_ingresso", {})
-                   .get("canvas", {})
+            (layout or {}).get("canvas", {})
                    .get("orientation", "")
                    .lower()
         )
@@ -1331,27 +1380,19 @@ async def render_ingresso_by_qrcode(
             detail="Ingresso não encontrado"
         )
     
-    # Busca evento para logo_path/logo_blob
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    # Busca evento para logo_path/logo_asset
+    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, PROJECAO_SEM_LOGO)
     logo_path = evento.get("logo_path") if evento else None
-    logo_blob = evento.get("logo_blob") if evento else None
+    logo_blob = await carregar_logo(db, evento)
     
     # Importa funções de renderização
-    from app.routers.evento_api import _get_or_create_embedded_layout, _render_layout_to_image
-    
-    # Get or create layout
-    from_participante = participante is not None
-    layout = await _get_or_create_embedded_layout(
-        db, ingresso, evento_id, from_participante, participante
-    )
+    from app.routers.evento_api import _resolve_ingresso_layout
     
-    # Render to image
-    img = _render_layout_to_image(layout, dpi, logo_path=logo_path, logo_blob=logo_blob)
+    # Resolve the ingresso's layout (embedded copy or versioned reference)
+    layout = await _resolve_ingresso_layout(db, ingresso, evento_id, evento, participante)
     
-    # Serialize to JPEG
-    bio = BytesIO()
-    img.save(bio, format='JPEG', quality=85)
-    bio.seek(0)
+    # Render to JPEG in the render pool
+    conteudo = await renderizar(layout, dpi, logo_path=logo_path, logo_blob=logo_blob)
     
-    return Response(content=bio.read(), media_type="image/jpeg")
+    return Response(content=conteudo, media_type="image/jpeg")
     return await buscar_credenciamento(nome=query, email=None, evento_id=evento_id)
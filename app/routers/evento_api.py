@@ -15,9 +15,15 @@ from PIL import Image, ImageDraw, ImageFont
 import logging
 
 logger = logging.getLogger(__name__)
-import qrcode
-import hashlib
 from typing import Dict, Any, Tuple, Optional
+from app.utils.assets import carregar_logo, PROJECAO_SEM_LOGO
+from app.utils.contexto_evento import evento_por_id
+from app.utils.render_pool import renderizar
+from app.utils.render_cache import obter_cache, chave_render, referencia_logo
+from app.utils import render_assets, metricas_evento, roster_evento
+from app.utils.layout_compilado import LayoutCompilado, compilar_layout, mm_para_px
+from app.utils.layout_versoes import layout_do_ingresso
+from app.utils.layouts import embed_layout
 
 router = APIRouter()
 
@@ -40,8 +46,7 @@ def _get_font(size: int = 14) -> ImageFont.ImageFont:
 
 def _mm_to_px(val_mm: float, dpi: int) -> int:
     """Convert millimeters to pixels at given DPI."""
-    px_per_mm = dpi / 25.4
-    return int(round(float(val_mm) * px_per_mm))
+    return mm_para_px(val_mm, dpi)
 
 
 def _wrap_text(text: str, font: ImageFont.ImageFont, max_width_px: int, draw: ImageDraw.ImageDraw) -> list:
@@ -104,6 +109,27 @@ def _wrap_text(text: str, font: ImageFont.ImageFont, max_width_px: int, draw: Im
     return lines if lines else [text]
 
 
+def _camada_base(compilado: LayoutCompilado, indices: list, valores: list, dpi: int,
+                 logo_path: Optional[str], logo_blob: Optional[Dict[str, Any]]) -> Image.Image:
+    """Render (or fetch from cache) the static layer: canvas border plus the given non-variable elements."""
+    static_values = tuple(str(valores[i]) for i in indices)
+    key = (compilado.chave, tuple(indices), static_values, dpi, render_assets.chave_logo(logo_blob, logo_path))
+
+    def render_base():
+        base_layout = {
+            "canvas": dict(compilado.canvas),
+            "section": compilado.section,
+            "elements": [],
+        }
+        for i in indices:
+            el = compilado.elementos[i].para_dict(valores[i])
+            el.pop("variavel", None)
+            base_layout["elements"].append(el)
+        return _render_layout_to_image(base_layout, dpi, logo_path=logo_path, logo_blob=logo_blob)
+
+    return render_assets.camada_base(key, render_base)
+
+
 def _render_layout_to_image(layout: Dict[str, Any], dpi: int = 300, logo_path: Optional[str] = None, logo_blob: Optional[Dict[str, Any]] = None) -> Image.Image:
     """Render a layout (with already-embedded data) to an image.
     
@@ -111,209 +137,62 @@ def _render_layout_to_image(layout: Dict[str, Any], dpi: int = 300, logo_path: O
         layout: Layout dict with embedded data (no placeholders)
         dpi: Dots per inch for rendering
         logo_path: Optional path to logo image file (relative to app/static/uploads/)
-        logo_blob: Optional logo blob dict with 'data' (base64), 'content_type', 'filename'
+        logo_blob: Optional logo blob dict with 'bytes' (raw) or 'data' (base64), 'content_type', 'filename'
         
     Returns:
         PIL Image object
     """
-    canvas = layout.get("canvas", {})
-    width_mm = float(canvas.get("width", 80))
-    height_mm = float(canvas.get("height", 120))
-
-    # compute pixel dimensions at requested DPI
-    width_px = max(1, _mm_to_px(width_mm, dpi))
-    height_px = max(1, _mm_to_px(height_mm, dpi))
-
-    # For print-accurate output do not auto-downscale: use requested DPI so mm->px mapping is exact
-    dpi_effective = dpi
-
-    img_width_px = width_px
-    img_height_px = height_px
-
-    img = Image.new('RGB', (img_width_px, img_height_px), color='white')
+    # groups, absolute coordinates, font paths and pixel geometry come from the
+    # compiled layout, shared by every ticket embedded from the same template
+    compiled = compilar_layout(layout)
+    values = compiled.valores(layout)
+    geometry = compiled.geometria(dpi)
+    indices = list(range(len(compiled.elementos)))
+
+    # Elements tagged by embed_layout as not depending on the ticket are drawn
+    # once into a cached base layer. Only the static run before the first
+    # variable element goes there: a later static element may overlap a
+    # variable one and has to stay on top of it, so it is drawn per ticket,
+    # in element order (its font/logo still come from the asset caches)
+    base = None
+    if indices and all(el.variavel is not None for el in compiled.elementos):
+        primeira_variavel = next((i for i in indices if compiled.elementos[i].variavel), len(indices))
+        static = indices[:primeira_variavel]
+        if static:
+            base = _camada_base(compiled, static, values, dpi, logo_path, logo_blob)
+            indices = indices[primeira_variavel:]
+
+    if base is not None:
+        img = base.copy()
+    else:
+        img = Image.new('RGB', (geometry.largura_px, geometry.altura_px), color='white')
     draw = ImageDraw.Draw(img)
 
-    elements = layout.get("elements", [])
-    # Support frontend `groups` model: convert elements that reference `groupId` into absolute coords
-    try:
-        groups = layout.get("groups") or []
-        groups_map = {g.get("id"): g for g in groups if g.get("id")}
-        # If groups define nested elements, compile them too
-        for g in groups:
-            nested = g.get("elements") or []
-            for el in nested:
-                # copy nested element and offset by group origin
-                try:
-                    el_copy = el.copy()
-                except Exception:
-                    import copy as _copy
-                    el_copy = _copy.deepcopy(el)
-                try:
-                    gx = float(g.get("x", 0) or 0)
-                except Exception:
-                    gx = 0
-                try:
-                    gy = float(g.get("y", 0) or 0)
-                except Exception:
-                    gy = 0
-                try:
-                    rel_x = float(el_copy.get("x", 0) or 0)
-                except Exception:
-                    rel_x = 0
-                try:
-                    rel_y = float(el_copy.get("y", 0) or 0)
-                except Exception:
-                    rel_y = 0
-                el_copy["x"] = gx + rel_x
-                el_copy["y"] = gy + rel_y
-                elements.append(el_copy)
-
-        # Convert elements that reference groupId
-        if groups_map:
-            for el in elements:
-                gid = el.get("groupId")
-                if gid and gid in groups_map:
-                    g = groups_map[gid]
-                    try:
-                        gx = float(g.get("x", 0) or 0)
-                    except Exception:
-                        gx = 0
-                    try:
-                        gy = float(g.get("y", 0) or 0)
-                    except Exception:
-                        gy = 0
-                    try:
-                        rel_x = float(el.get("x", 0) or 0)
-                    except Exception:
-                        rel_x = 0
-                    try:
-                        rel_y = float(el.get("y", 0) or 0)
-                    except Exception:
-                        rel_y = 0
-                    el["x"] = gx + rel_x
-                    el["y"] = gy + rel_y
-    except Exception:
-        # non-fatal; proceed with original elements
-        pass
     # honor optional canvas padding and border
-    canvas_padding_mm = float(canvas.get('padding_mm', 0))
-    canvas_border = bool(canvas.get('border', False))
-    if canvas_border and canvas_padding_mm >= 0:
+    if base is None and geometry.borda_px is not None:
+        pad_px = geometry.borda_px
         try:
-            pad_px = _mm_to_px(canvas_padding_mm, dpi_effective)
-            draw.rectangle([pad_px, pad_px, img_width_px - pad_px - 1, img_height_px - pad_px - 1], outline='black', width=2)
+            draw.rectangle([pad_px, pad_px, geometry.largura_px - pad_px - 1, geometry.altura_px - pad_px - 1], outline='black', width=2)
         except Exception:
             pass
 
-    # Section info (vertical or horizontal split, from editor)
-    section = layout.get("section")  # None | {type: 'vertical'|'horizontal', pos_mm: float}
-
-    def _element_area(el):
-        """Return (area_start_px, area_width_px, anchor_px, h_pos) for element.
-
-        Uses the new model fields (horizontal_position, margin_left, margin_right, sector)
-        with fallback to legacy fields (x, align, margin_mm).
-        """
-        # -- horizontal position / alignment
-        h_pos = el.get("horizontal_position") or el.get("align") or "center"
-
-        # -- margins
-        margin_left_mm  = float(el.get("margin_left",  el.get("margin_mm", 0)) or 0)
-        margin_right_mm = float(el.get("margin_right", el.get("margin_mm", 0)) or 0)
-        margin_left_px  = _mm_to_px(margin_left_mm,  dpi_effective)
-        margin_right_px = _mm_to_px(margin_right_mm, dpi_effective)
-
-        # -- sector-aware area boundaries
-        sector = el.get("sector")
-        if section and section.get("type") == "vertical" and sector in ("A", "B"):
-            sec_pos_mm = float(section.get("pos_mm", width_mm / 2) or width_mm / 2)
-            if sector == "A":
-                area_start_mm, area_width_mm = 0.0, sec_pos_mm
-            else:
-                area_start_mm, area_width_mm = sec_pos_mm, width_mm - sec_pos_mm
-        else:
-            # Legacy: if element has explicit x, honour it; otherwise use full canvas width
-            x_mm = float(el.get("x", 0) or 0)
-            area_start_mm = x_mm if h_pos in ("left",) else 0.0
-            area_width_mm = width_mm
-
-        area_start_px = _mm_to_px(area_start_mm, dpi_effective)
-        area_width_px = _mm_to_px(area_width_mm, dpi_effective)
-        usable_width_px = max(10, area_width_px - margin_left_px - margin_right_px)
-
-        # -- anchor pixel (matches Canvas hPos logic)
-        if h_pos == "left":
-            anchor_px = area_start_px + margin_left_px
-        elif h_pos == "right":
-            anchor_px = area_start_px + area_width_px - margin_right_px
-        else:  # center
-            anchor_px = area_start_px + area_width_px // 2 + margin_left_px - margin_right_px
-
-        return area_start_px, area_width_px, usable_width_px, anchor_px, h_pos
-
-    for el in elements:
-        etype = el.get("type")
-        y_mm = float(el.get('y', 0))
-
-        area_start_px, area_width_px, usable_width_px, anchor_px, h_pos = _element_area(el)
+    for i in indices:
+        element = compiled.elementos[i]
+        el = element.atributos
+        value = values[i]
+        geo = geometry.elementos[i]
+        etype = element.tipo
+        area_start_px, area_width_px, anchor_px, h_pos = geo.area_inicio_px, geo.area_largura_px, geo.ancora_px, geo.h_pos
 
         if etype == "text":
-            text = str(el.get("value", ""))
-            # interpret size as points (pt) and convert to pixel size using DPI so font scales physically
-            size_pt = float(el.get("size", 12))
-            font_px = max(1, int(round(size_pt * dpi_effective / 72.0)))
-            
-            # Get font attributes from element
-            font_family = el.get("font", "Arial")
-            is_bold = el.get("bold", False)
-            is_italic = el.get("italic", False)
-            
-            # Map font family to available DejaVu fonts
-            font_path = None
-            try:
-                # Build font path based on attributes
-                if font_family in ["Times", "Times New Roman", "Serif"]:
-                    if is_bold and is_italic:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSerif-BoldItalic.ttf"
-                    elif is_bold:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSerif-Bold.ttf"
-                    elif is_italic:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSerif-Italic.ttf"
-                    else:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSerif.ttf"
-                elif font_family in ["Courier", "Courier New", "Mono", "Monospace"]:
-                    if is_bold and is_italic:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSansMono-BoldOblique.ttf"
-                    elif is_bold:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSansMono-Bold.ttf"
-                    elif is_italic:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSansMono-Oblique.ttf"
-                    else:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSansMono.ttf"
-                else:  # Default to Arial/Sans
-                    if is_bold and is_italic:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans-BoldOblique.ttf"
-                    elif is_bold:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf"
-                    elif is_italic:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans-Oblique.ttf"
-                    else:
-                        font_path = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
-                
-                font = ImageFont.truetype(font_path, font_px)
-            except Exception as e:
-                # Fallback to default font
-                try:
-                    font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", font_px)
-                except Exception:
-                    font = ImageFont.load_default()
-
-            y_start = _mm_to_px(y_mm, dpi_effective)
+            text = "" if value is None else str(value)
+            font_px = geo.fonte_px
+            font = render_assets.fonte(element.fonte, font_px)
 
             # Wrap text only when wrapText flag is set (default True for backward compat)
             wrap = el.get("wrapText", True)
             if wrap:
-                lines = _wrap_text(text, font, usable_width_px, draw)
+                lines = _wrap_text(text, font, geo.largura_util_px, draw)
             else:
                 lines = [text]
 
@@ -325,7 +204,7 @@ def _render_layout_to_image(layout: Dict[str, Any], dpi: int = 300, logo_path: O
                 line_height = int(font_px * 1.2)
 
             # Draw each line respecting alignment within the sector area
-            current_y = y_start
+            current_y = geo.y_px
             for line in lines:
                 try:
                     bbox = draw.textbbox((0, 0), line, font=font)
@@ -346,16 +225,8 @@ def _render_layout_to_image(layout: Dict[str, Any], dpi: int = 300, logo_path: O
                 draw.text((x, int(current_y)), line, fill='black', font=font)
                 current_y += line_height
 
-        elif etype == "qrcode":
-
-            qr_text = str(el.get("value", ""))
-            size_mm = float(el.get("size_mm", 30))
-            size_px = _mm_to_px(size_mm, dpi_effective)
-
-            qr = qrcode.make(qr_text)
-            qr = qr.resize((size_px, size_px))
-
-            y = _mm_to_px(y_mm, dpi_effective)
+        elif etype in ("qrcode", "logo"):
+            size_px = geo.tamanho_px
 
             if h_pos == "left":
                 x = anchor_px
@@ -367,95 +238,15 @@ def _render_layout_to_image(layout: Dict[str, Any], dpi: int = 300, logo_path: O
             # Clamp within area
             x = max(area_start_px, min(x, area_start_px + area_width_px - size_px))
 
-            img.paste(qr, (x, int(y)))
-            
-        elif etype == "logo":
-            # Render logo image or placeholder
-            logger.info(f"[RENDER] Renderizando elemento tipo 'logo': y={el.get('y')}mm, size={el.get('size_mm', 30)}mm")
-            logger.info(f"[RENDER] logo_blob disponível: {logo_blob is not None}, logo_path: {logo_path}")
-            
-            size_mm = float(el.get("size_mm", 30))
-            size_px = _mm_to_px(size_mm, dpi_effective)
-
-            y = _mm_to_px(y_mm, dpi_effective)
+            if etype == "qrcode":
+                img.paste(render_assets.qrcode_imagem("" if value is None else str(value), size_px), (x, geo.y_px))
+                continue
 
-            if h_pos == "left":
-                x = anchor_px
-            elif h_pos == "right":
-                x = anchor_px - size_px
-            else:  # center
-                x = anchor_px - size_px // 2
+            # Decoded and fitted once per (logo, size); shared between renders
+            logo_img = render_assets.logo_ajustado(logo_blob, logo_path, size_px)
+            if logo_img is None and (logo_blob or logo_path):
+                logger.warning(f"Failed to load logo (blob: {logo_blob is not None}, path: {logo_path})")
 
-            # Clamp within area
-            x = max(area_start_px, min(x, area_start_px + area_width_px - size_px))
-            
-            # Try to load real logo image first
-            logo_img = None
-            
-            # Priority 1: Try to load from blob (most reliable)
-            if logo_blob and isinstance(logo_blob, dict):
-                try:
-                    import base64
-                    from io import BytesIO
-                    logger.info("Attempting to load logo from blob (base64)")
-                    
-                    logo_data = base64.b64decode(logo_blob.get("data", ""))
-                    logger.info(f"Decoded logo blob, size: {len(logo_data)} bytes")
-                    
-                    logo_img = Image.open(BytesIO(logo_data)).convert('RGBA')
-                    logger.info(f"Logo image loaded from blob: {logo_img.size}, mode: {logo_img.mode}")
-                    
-                    # Resize maintaining aspect ratio
-                    logo_img.thumbnail((size_px, size_px), Image.Resampling.LANCZOS)
-                    # Create a white background image and paste logo centered
-                    bg = Image.new('RGB', (size_px, size_px), color='white')
-                    offset_x = (size_px - logo_img.width) // 2
-                    offset_y = (size_px - logo_img.height) // 2
-                    # Handle transparency by pasting RGBA onto RGB background
-                    if logo_img.mode == 'RGBA':
-                        bg.paste(logo_img, (offset_x, offset_y), logo_img)
-                    else:
-                        bg.paste(logo_img, (offset_x, offset_y))
-                    logo_img = bg
-                    logger.info("Logo loaded successfully from blob")
-                except Exception as e:
-                    logger.error(f"Failed to load logo from blob: {e}", exc_info=True)
-                    logo_img = None
-            
-            # Priority 2: Try to load from file path (fallback)
-            if logo_img is None and logo_path:
-                try:
-                    from pathlib import Path
-                    logo_file = Path("app/static/uploads") / logo_path
-                    logger.info(f"Attempting to load logo from file: {logo_file}")
-                    logger.info(f"Logo file exists: {logo_file.exists()}")
-                    logger.info(f"Absolute path: {logo_file.absolute()}")
-                    
-                    if logo_file.exists():
-                        logger.info(f"Loading logo image from {logo_file}")
-                        logo_img = Image.open(logo_file).convert('RGBA')
-                        # Resize maintaining aspect ratio
-                        logo_img.thumbnail((size_px, size_px), Image.Resampling.LANCZOS)
-                        # Create a white background image and paste logo centered
-                        bg = Image.new('RGB', (size_px, size_px), color='white')
-                        offset_x = (size_px - logo_img.width) // 2
-                        offset_y = (size_px - logo_img.height) // 2
-                        # Handle transparency by pasting RGBA onto RGB background
-                        if logo_img.mode == 'RGBA':
-                            bg.paste(logo_img, (offset_x, offset_y), logo_img)
-                        else:
-                            bg.paste(logo_img, (offset_x, offset_y))
-                        logo_img = bg
-                        logger.info("Logo loaded successfully from file")
-                    else:
-                        logger.warning(f"Logo file not found at: {logo_file}")
-                except Exception as e:
-                    logger.error(f"Failed to load logo from {logo_path}: {e}", exc_info=True)
-                    logo_img = None
-            
-            if logo_img is None and not logo_blob and not logo_path:
-                logger.info("No logo_path or logo_blob provided for rendering")
-            
             # Fallback to placeholder if no logo available
             if logo_img is None:
                 logo_img = Image.new('RGB', (size_px, size_px), color='#e2e8f0')
@@ -465,15 +256,9 @@ def _render_layout_to_image(layout: Dict[str, Any], dpi: int = 300, logo_path: O
                 logo_draw.rectangle([0, 0, size_px-1, size_px-1], outline='#94a3b8', width=2)
                 
                 # Draw "LOGO" text in center
-                logo_text = str(el.get("value", "LOGO"))
+                logo_text = "LOGO" if value is None else str(value)
                 font_size = max(8, int(size_px * 0.15))
-                try:
-                    logo_font = ImageFont.truetype("DejaVuSans.ttf", font_size)
-                except Exception:
-                    try:
-                        logo_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
-                    except Exception:
-                        logo_font = ImageFont.load_default()
+                logo_font = render_assets.fonte(render_assets.FONTE_PADRAO, font_size)
                 
                 try:
                     bbox = logo_draw.textbbox((0, 0), logo_text, font=logo_font)
@@ -486,7 +271,7 @@ def _render_layout_to_image(layout: Dict[str, Any], dpi: int = 300, logo_path: O
                 text_y = (size_px - text_height) // 2
                 logo_draw.text((text_x, text_y), logo_text, fill='#64748b', font=logo_font)
             
-            img.paste(logo_img, (x, int(y)))
+            img.paste(logo_img, (x, geo.y_px))
     
     return img
 
@@ -651,22 +436,17 @@ async def print_ingresso_png(evento_id: str, ingresso_id: str, dpi: int = 300, o
                 {"$set": {"ingressos.$.impresso": True}}
             )
             print(f"[PRINT.PNG] Marked embedded ingresso as impresso: matched={result.matched_count}, modified={result.modified_count}")
+            if result.modified_count:
+                await metricas_evento.registrar_impressao(db, evento_id, ingresso, True)
+                roster_evento.marcar_impresso(evento_id, ingresso.get("_id"), True)
         except Exception as e:
             print(f"[PRINT.PNG] Failed to mark embedded ingresso as impresso: {e}")
     
-    # Get evento for logo
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-    logo_path = evento.get("logo_path") if evento else None
-    logo_blob = evento.get("logo_blob") if evento else None
-    
-    # Get or create embedded layout
-    from_participante = participante is not None
-    layout = await _get_or_create_embedded_layout(
-        db, ingresso, evento_id, from_participante, participante
-    )
+    # Get evento for logo reference
+    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, PROJECAO_SEM_LOGO)
     
-    # Render layout to image
-    img = _render_layout_to_image(layout, dpi, logo_path=logo_path, logo_blob=logo_blob)
+    # Resolve the ingresso's layout (embedded copy or versioned reference)
+    layout = await _resolve_ingresso_layout(db, ingresso, evento_id, evento, participante)
     
     # Prioritise the orientation stored in the layout itself if present
     try:
@@ -676,18 +456,11 @@ async def print_ingresso_png(evento_id: str, ingresso_id: str, dpi: int = 300, o
     except Exception:
         pass
 
-    # Apply rotation for landscape printing
+    # Render (rotated for landscape printing) as PNG, served from the render cache when possible
     rotate_ccw = orientation.lower() in ("landscape", "l")
-    if rotate_ccw:
-        img = img.rotate(90, expand=True)
-    
-    # Serialize to PNG
-    bio = BytesIO()
-    try:
-        img.save(bio, format='PNG', dpi=(dpi, dpi))
-    except Exception:
-        img.save(bio, format='PNG')
-    bio.seek(0)
+    bio = BytesIO(await _renderizar_com_cache(
+        db, evento_id, evento, layout, dpi, formato="PNG", rotacionar=rotate_ccw
+    ))
     
     headers = {
         "Cache-Control": "no-cache, no-store, must-revalidate",
@@ -696,6 +469,20 @@ async def print_ingresso_png(evento_id: str, ingresso_id: str, dpi: int = 300, o
     return StreamingResponse(bio, media_type='image/png', headers=headers)
 
 
+async def _contabilizar_impressao(db, evento_id: str, query: dict, ingresso_id, impresso: bool) -> None:
+    """Atualiza roster e métricas do evento após a mudança do flag `impresso` (métricas precisam do tipo do ingresso)."""
+    roster_evento.marcar_impresso(evento_id, ingresso_id, impresso)
+    try:
+        participante = await db.participantes.find_one(
+            query, {"ingressos": {"$elemMatch": {"_id": ingresso_id, "evento_id": evento_id}}}
+        )
+        ingressos = (participante or {}).get("ingressos") or []
+        ingresso = next((i for i in ingressos if i.get("_id") == ingresso_id), ingressos[0] if ingressos else {})
+        await metricas_evento.registrar_impressao(db, evento_id, ingresso, impresso)
+    except Exception as e:
+        logger.warning(f"Falha ao atualizar métricas de impressão do ingresso {ingresso_id}: {e}")
+
+
 @router.put("/{evento_id}/ingresso/{ingresso_id}/impresso")
 async def set_ingresso_impresso(evento_id: str, ingresso_id: str, data: ImpressoUpdate):
     """Marca ou desmarca um ingresso como impresso (boolean) APENAS na coleção embedded."""
@@ -720,6 +507,8 @@ async def set_ingresso_impresso(evento_id: str, ingresso_id: str, data: Impresso
         
         if result.matched_count:
             logger.info(f"Ingresso {ingresso_id} atualizado em participantes (ObjectId) (matched: {result.matched_count}, modified: {result.modified_count})")
+            if result.modified_count:
+                await _contabilizar_impressao(db, evento_id, query, oid, impresso)
             print("[IMPRESSO] ✓ Sucesso com ObjectId")
             return {"success": True}
     except Exception as e:
@@ -737,6 +526,8 @@ async def set_ingresso_impresso(evento_id: str, ingresso_id: str, data: Impresso
     
     if result.matched_count:
         logger.info(f"Ingresso {ingresso_id} atualizado em participantes (string) (matched: {result.matched_count}, modified: {result.modified_count})")
+        if result.modified_count:
+            await _contabilizar_impressao(db, evento_id, query, ingresso_id, impresso)
         print("[IMPRESSO] ✓ Sucesso com string")
     else:
         logger.warning(f"Nenhum ingresso encontrado com _id={ingresso_id} para evento {evento_id}")
@@ -744,6 +535,37 @@ async def set_ingresso_impresso(evento_id: str, ingresso_id: str, data: Impresso
     
     return {"success": True}
 
+def _chave_render_evento(evento: Optional[Dict[str, Any]], layout: Dict[str, Any], dpi: int,
+                         formato: str = "JPEG", qualidade: int = 85, rotacionar: bool = False) -> str:
+    """Chave do cache de renderização para o layout com o logo do evento."""
+    return chave_render(layout, referencia_logo(evento), dpi, formato, qualidade, rotacionar)
+
+
+def _etag_render(chave: str) -> str:
+    """ETag da imagem renderizada: a própria chave do cache de renderização."""
+    return f'"{chave}"'
+
+
+async def _renderizar_com_cache(db, evento_id: str, evento: Optional[Dict[str, Any]], layout: Dict[str, Any],
+                                dpi: int, formato: str = "JPEG", qualidade: int = 85,
+                                rotacionar: bool = False, chave: Optional[str] = None) -> bytes:
+    """Bytes da imagem do cache de renderização; renderiza (e guarda) em caso de falta."""
+    cache = obter_cache()
+    if chave is None:
+        chave = _chave_render_evento(evento, layout, dpi, formato, qualidade, rotacionar)
+    conteudo = cache.obter(evento_id, chave, formato)
+    if conteudo is not None:
+        return conteudo
+    logo_path = evento.get("logo_path") if evento else None
+    logo_blob = await carregar_logo(db, evento)
+    conteudo = await renderizar(
+        layout, dpi, logo_path=logo_path, logo_blob=logo_blob,
+        formato=formato, qualidade=qualidade, rotacionar=rotacionar,
+    )
+    cache.guardar(evento_id, chave, conteudo, formato)
+    return conteudo
+
+
 async def _fetch_ingresso_data(db, evento_id: str, ingresso_id: str) -> Tuple[Optional[Dict], Optional[Dict]]:
     """Fetch ingresso from database (ONLY embedded in participante).
     
@@ -794,66 +616,44 @@ async def _fetch_ingresso_data(db, evento_id: str, ingresso_id: str) -> Tuple[Op
     return None, None
 
 
-async def _get_or_create_embedded_layout(db, ingresso: Dict, evento_id: str, from_participante: bool, participante: Optional[Dict]) -> Dict:
-    """Get embedded layout from ingresso or create and persist it.
+async def _resolve_ingresso_layout(db, ingresso: Dict, evento_id: str, evento: Optional[Dict],
+                                         participante: Optional[Dict]) -> Dict:
+    """Resolve the ingresso's layout with all placeholders replaced.
+
+    Legacy ingressos carry an embedded copy; current ones reference a layout
+    version and keep only their own values (see `app.utils.layout_versoes`).
     
     Args:
         db: MongoDB database instance (AsyncIOMotorDatabase)
         ingresso: Ingresso document dict
         evento_id: ID of the event
-        from_participante: Whether ingresso was found embedded in participante
+        evento: Evento document (without logo) or None
         participante: Participante document dict or None
         
     Returns:
-        Embedded layout dict with all placeholders replaced
+        Layout dict ready for rendering
     """
-    layout = ingresso.get("layout_ingresso")
-    
-    if layout:
-        return layout
-    
-    # Need to create embedded layout
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    if ingresso.get("layout_ingresso"):
+        return await layout_do_ingresso(db, evento or {}, ingresso)
+
     if not evento:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Evento não encontrado")
-    
-    # Load related data for embedding
-    if not participante and ingresso.get("participante_id"):
-        try:
-            participante = await db.participantes.find_one({"_id": ObjectId(ingresso.get("participante_id"))})
-        except Exception:
-            participante = await db.participantes.find_one({"_id": ingresso.get("participante_id")})
-    
+
+    # Ingressos issued before field values were stored resolve them from participante/tipo
     tipo = None
-    if ingresso.get("tipo_ingresso_id"):
-        try:
-            tipo = await db.tipos_ingresso.find_one({"_id": ObjectId(ingresso.get("tipo_ingresso_id"))})
-        except Exception:
-            tipo = await db.tipos_ingresso.find_one({"_id": ingresso.get("tipo_ingresso_id")})
-    
-    # Create embedded layout
-    from app.utils.layouts import embed_layout
-    base_layout = evento.get("layout_ingresso")
-    embedded = embed_layout(base_layout, participante or {}, tipo or {}, evento or {}, ingresso)
-    
-    # Persist embedded layout (ONLY in participante embedded collection)
-    try:
-        if from_participante and participante:
-            pid = participante.get("_id")
+    if ingresso.get("campos_layout") is None:
+        if not participante and ingresso.get("participante_id"):
             try:
-                ing_oid = ObjectId(ingresso.get("_id"))
+                participante = await db.participantes.find_one({"_id": ObjectId(ingresso.get("participante_id"))})
             except Exception:
-                ing_oid = ingresso.get("_id")
-            await db.participantes.update_one(
-                {"_id": pid, "ingressos._id": ing_oid}, 
-                {"$set": {"ingressos.$.layout_ingresso": embedded}}
-            )
-        else:
-            logger.warning(f"Ingresso not embedded in participante - cannot persist layout")
-    except Exception as e:
-        logger.warning(f"Failed to persist embedded layout: {e}")
-    
-    return embedded
+                participante = await db.participantes.find_one({"_id": ingresso.get("participante_id")})
+        if ingresso.get("tipo_ingresso_id"):
+            try:
+                tipo = await db.tipos_ingresso.find_one({"_id": ObjectId(ingresso.get("tipo_ingresso_id"))})
+            except Exception:
+                tipo = await db.tipos_ingresso.find_one({"_id": ingresso.get("tipo_ingresso_id")})
+
+    return await layout_do_ingresso(db, evento, ingresso, participante, tipo) or embed_layout(None, {}, {}, {}, {})
 
 
 @router.get("/{evento_id}/ingresso/{ingresso_id}/render.jpg")
@@ -870,64 +670,31 @@ async def render_ingresso_jpg(evento_id: str, ingresso_id: str, dpi: int = 300,
             detail="Ingresso não encontrado para este evento"
         )
     
-    # Get evento for logo_path
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-    logo_path = evento.get("logo_path") if evento else None
-    logo_blob = evento.get("logo_blob") if evento else None
-    
-    # Debug logging for logo
-    if evento:
-        logger.info(f"[RENDER] Evento {evento_id}: logo_path={logo_path}, logo_blob presente={logo_blob is not None}")
-        if logo_blob:
-            if isinstance(logo_blob, dict):
-                data_len = len(logo_blob.get('data', ''))
-                logger.info(f"[RENDER] logo_blob: content_type={logo_blob.get('content_type')}, data_len={data_len}")
-            else:
-                logger.warning(f"[RENDER] logo_blob existe mas não é dict: {type(logo_blob)}")
-    else:
+    # Get evento (cached context, without logo) and resolve the ingresso's layout
+    # (embedded copy or versioned reference): both feed the ETag
+    evento = await evento_por_id(db, evento_id)
+    if not evento:
         logger.warning(f"[RENDER] Evento {evento_id} não encontrado!")
-    
-    # Get or create embedded layout
-    from_participante = participante is not None
-    layout = await _get_or_create_embedded_layout(
-        db, ingresso, evento_id, from_participante, participante
-    )
-    
-    # Render layout to image
-    img = _render_layout_to_image(layout, dpi, logo_path=logo_path, logo_blob=logo_blob)
-    
-    # Serialize to JPEG
-    bio = BytesIO()
-    img.save(bio, format='JPEG', quality=85)
-    bio.seek(0)
-    
-    # Persist rendered image to disk for caching
-    try:
-        out_dir = Path('app') / 'static' / 'ingressos'
-        out_dir.mkdir(parents=True, exist_ok=True)
-        file_path = out_dir / f"{ingresso_id}.jpg"
-        with open(file_path, 'wb') as f:
-            f.write(bio.getvalue())
-        logger.info(f"Saved rendered ingresso image to {file_path}")
-    except Exception as e:
-        logger.warning(f"Failed to save rendered image: {e}")
-    
-    # Generate cache headers
+    layout = await _resolve_ingresso_layout(db, ingresso, evento_id, evento, participante)
+
+    # Generate cache headers: the ETag is the render cache key, so a layout or
+    # logo change yields a new ETag
     from email.utils import format_datetime, parsedate_to_datetime
-    etag_src = (ingresso.get('qrcode_hash', '') or '') + str(ingresso.get('data_emissao', ''))
-    etag = hashlib.sha1(etag_src.encode()).hexdigest()
+    chave = _chave_render_evento(evento, layout, dpi)
+    etag = _etag_render(chave)
     
-    # Check conditional request headers
+    # Check conditional request headers before rendering
     if request and hasattr(request, 'headers') and request.headers:
         req_headers = {k.lower(): v for k, v in request.headers.items()}
         
-        # If-None-Match
-        if req_headers.get('if-none-match') == etag:
-            return Response(status_code=304, headers={"ETag": etag})
+        # If-None-Match (takes precedence over If-Modified-Since)
+        if 'if-none-match' in req_headers:
+            if req_headers['if-none-match'] == etag:
+                return Response(status_code=304, headers={"ETag": etag})
         
         # If-Modified-Since
         ims = req_headers.get('if-modified-since')
-        if ims and ingresso.get('data_emissao'):
+        if ims and 'if-none-match' not in req_headers and ingresso.get('data_emissao'):
             try:
                 ims_dt = parsedate_to_datetime(ims)
                 if ims_dt.tzinfo is None:
@@ -947,6 +714,9 @@ async def render_ingresso_jpg(evento_id: str, ingresso_id: str, dpi: int = 300,
             except Exception:
                 pass
     
+    # Serve from the render cache or render to JPEG in the render pool
+    bio = BytesIO(await _renderizar_com_cache(db, evento_id, evento, layout, dpi, chave=chave))
+    
     # Build response headers
     headers = {"Cache-Control": "public, max-age=0, must-revalidate", "ETag": etag}
     if ingresso.get('data_emissao'):
@@ -955,7 +725,6 @@ async def render_ingresso_jpg(evento_id: str, ingresso_id: str, dpi: int = 300,
         except Exception:
             pass
     
-    bio.seek(0)
     return StreamingResponse(bio, media_type='image/jpeg', headers=headers)
 
 
@@ -982,9 +751,11 @@ async def render_ingresso_from_payload(evento_id: str, ingresso_id: str, payload
         elif "ingresso" in payload and isinstance(payload.get("ingresso"), dict):
             layout = payload.get("ingresso").get("layout_ingresso")
     
-    # Fallback to ingresso's embedded layout
-    if not layout:
-        layout = ingresso.get("layout_ingresso")
+    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, PROJECAO_SEM_LOGO)
+
+    # Fallback to the ingresso's own layout (embedded copy or versioned reference)
+    if not layout and evento:
+        layout = await layout_do_ingresso(db, evento, ingresso)
     
     # Final fallback: load from tipo or evento
     if not layout:
@@ -995,7 +766,6 @@ async def render_ingresso_from_payload(evento_id: str, ingresso_id: str, payload
             except Exception:
                 tipo = await db.tipos_ingresso.find_one({"_id": ingresso.get("tipo_ingresso_id")})
         
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
         if not evento:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Evento não encontrado")
         
@@ -1006,32 +776,10 @@ async def render_ingresso_from_payload(evento_id: str, ingresso_id: str, payload
                 "canvas": {"width": 80, "height": 120, "unit": "mm"}, 
                 "elements": []
             }
-    else:
-        # Get evento for logo_path
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
     
-    logo_path = evento.get("logo_path") if evento else None
-    logo_blob = evento.get("logo_blob") if evento else None
+    # Serve from the render cache or render to JPEG in the render pool
+    bio = BytesIO(await _renderizar_com_cache(db, evento_id, evento, layout, dpi))
     
-    # Render layout to image
-    img = _render_layout_to_image(layout, dpi, logo_path=logo_path, logo_blob=logo_blob)
-    
-    # Serialize to JPEG
-    bio = BytesIO()
-    img.save(bio, format='JPEG', quality=85)
-    bio.seek(0)
-    
-    # Persist file
-    try:
-        out_dir = Path('app') / 'static' / 'ingressos'
-        out_dir.mkdir(parents=True, exist_ok=True)
-        file_path = out_dir / f"{ingresso_id}.jpg"
-        with open(file_path, 'wb') as f:
-            f.write(bio.getvalue())
-    except Exception:
-        pass
-    
-    bio.seek(0)
     headers = {"Cache-Control": "no-cache, no-store, must-revalidate"}
     return StreamingResponse(bio, media_type='image/jpeg', headers=headers)
 
@@ -1066,41 +814,18 @@ async def render_ingresso_by_cpf(evento_id: str, payload: dict = None, dpi: int
 
     ingresso = participante["ingressos"][0]
 
-    # Get evento for logo_path
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
-    logo_path = evento.get("logo_path") if evento else None
-    logo_blob = evento.get("logo_blob") if evento else None
+    # Get evento for logo reference
+    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, PROJECAO_SEM_LOGO)
 
     # Gera ou obtém layout embutido
-    layout = await _get_or_create_embedded_layout(db, ingresso, evento_id, True, participante)
+    layout = await _resolve_ingresso_layout(db, ingresso, evento_id, evento, participante)
 
-    # Renderiza imagem
-    img = _render_layout_to_image(layout, dpi, logo_path=logo_path, logo_blob=logo_blob)
-    bio2 = BytesIO()
-    img.save(bio2, format='JPEG', quality=85)
-    bio2.seek(0)
-
-    # Persiste cópia em disco para cache (não crítico)
-    try:
-        out_dir = Path('app') / 'static' / 'ingressos'
-        out_dir.mkdir(parents=True, exist_ok=True)
-        file_path = out_dir / f"{ingresso.get('_id')}.jpg"
-        with open(file_path, 'wb') as f:
-            f.write(bio2.getvalue())
-    except Exception:
-        pass
-
-    # Gera ETag/Last-Modified semelhantes ao endpoint existente
-    try:
-        from email.utils import format_datetime
-        etag_src = (ingresso.get('qrcode_hash', '') or '') + str(ingresso.get('data_emissao', ''))
-        etag = hashlib.sha1(etag_src.encode()).hexdigest()
-    except Exception:
-        etag = None
+    # Renderiza imagem (cache de renderização ou pool de renderização)
+    chave = _chave_render_evento(evento, layout, dpi)
+    bio2 = BytesIO(await _renderizar_com_cache(db, evento_id, evento, layout, dpi, chave=chave))
 
-    headers = {"Cache-Control": "public, max-age=0, must-revalidate"}
-    if etag:
-        headers["ETag"] = etag
+    # ETag/Last-Modified semelhantes ao endpoint existente
+    headers = {"Cache-Control": "public, max-age=0, must-revalidate", "ETag": _etag_render(chave)}
     if ingresso.get('data_emissao'):
         try:
             from email.utils import format_datetime
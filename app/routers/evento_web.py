@@ -6,7 +6,7 @@ As rotas server-side consultam o banco diretamente, independente do tipo de toke
 """
 import re
 import logging
-from fastapi import APIRouter, Request, Form, status
+from fastapi import APIRouter, Request, Form, HTTPException, status
 from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
 from fastapi.templating import Jinja2Templates
 from bson import ObjectId
@@ -14,7 +14,15 @@ from typing import Optional, Tuple
 from datetime import datetime, timezone
 
 import app.config.database as database
-from app.utils.validations import validate_cpf, normalize_participante_data, format_datetime_display
+from app.utils.validations import (
+    validate_cpf, normalize_participante_data, format_datetime_display, cpf_participante, atualizar_participante,
+    gravar_ingresso_embutido
+)
+from app.utils.capacidade import registrar_emissao
+from app.utils import indice_validacao, contexto_evento, metricas_evento, roster_evento, paginacao
+from app.utils.busca_participantes import buscar_por_nome, campos_busca
+from app.utils.snapshot_portaria import registrar_alteracoes
+from app.utils.qr_assinado import codigo_para_evento
 from app.routers.bilheteria import normalize_bson_types, _detect_search_type
 
 router = APIRouter()
@@ -29,11 +37,7 @@ COOKIE_TOKEN = "evento_token"
 async def _resolve_token(token: str) -> Optional[dict]:
     """Verifica se o token é de bilheteria ou portaria e retorna o documento do evento."""
     db = database.get_database()
-    evento = await db.eventos.find_one({"token_bilheteria": token})
-    if evento:
-        return evento
-    evento = await db.eventos.find_one({"token_portaria": token})
-    return evento
+    return await contexto_evento.evento_por_qualquer_token(db, token)
 
 
 async def _get_evento_from_cookie(request: Request) -> Optional[Tuple[dict, str]]:
@@ -195,32 +199,9 @@ async def evento_api_ingressos_stats(request: Request):
     evento_id = _evento_id_str(evento)
     db = database.get_database()
 
-    try:
-        evento_oid = ObjectId(evento_id)
-    except Exception:
-        evento_oid = None
-
-    # Build match clauses covering evento_id stored as str or ObjectId
-    id_or = [{"ingressos.evento_id": evento_id}]
-    if evento_oid:
-        id_or.append({"ingressos.evento_id": evento_oid})
-
-    pipeline = [
-        {"$match": {"$or": id_or}},
-        {"$unwind": "$ingressos"},
-        {"$match": {"$or": id_or}},
-        {"$group": {
-            "_id": None,
-            "total": {"$sum": 1},
-            "impressos": {"$sum": {"$cond": [{"$eq": ["$ingressos.impresso", True]}, 1, 0]}},
-        }},
-    ]
-    result = await db.participantes.aggregate(pipeline).to_list(length=1)
-    total = 0
-    impressos = 0
-    if result:
-        total = result[0].get("total", 0)
-        impressos = result[0].get("impressos", 0)
+    metricas = await metricas_evento.obter_metricas(db, evento_id)
+    total = metricas.get("total", 0)
+    impressos = metricas.get("impressos", 0)
 
     return JSONResponse({"total": total, "impressos": impressos})
 
@@ -235,36 +216,21 @@ async def evento_api_ingresso_metrics(request: Request):
     evento_id = _evento_id_str(evento)
     db = database.get_database()
 
-    # ── Tipo metrics ─────────────────────────────────────────────
-    pipeline_tipo = [
-        {"$match": {"evento_id": evento_id}},
-        {"$group": {
-            "_id": "$tipo_ingresso_id",
-            "total": {"$sum": 1},
-            "printed": {"$sum": {"$cond": [{"$eq": ["$impresso", True]}, 1, 0]}},
-        }},
-    ]
-    tipo_groups = await db.ingressos_emitidos.aggregate(pipeline_tipo).to_list(length=None)
+    metricas = await metricas_evento.obter_metricas(db, evento_id)
 
+    # ── Tipo metrics ─────────────────────────────────────────────
+    tipos = await metricas_evento.tipos_por_id(db, evento, metricas.get("tipos", {}).keys())
     tipo_metrics = []
-    for g in tipo_groups:
-        tipo_id = g.get("_id")
-        tipo_nome = "Desconhecido"
-        if tipo_id:
-            tipo = None
-            try:
-                tipo = await db.tipos_ingresso.find_one({"_id": ObjectId(str(tipo_id))})
-            except Exception:
-                pass
-            if not tipo:
-                tipo = await db.tipos_ingresso.find_one({"_id": tipo_id})
-            if tipo:
-                tipo_nome = tipo.get("nome") or tipo.get("descricao") or "Desconhecido"
+    for tipo_id, contadores in metricas.get("tipos", {}).items():
+        tipo = tipos.get(tipo_id)
+        tipo_nome = (tipo.get("nome") or tipo.get("descricao")) if tipo else None
         tipo_metrics.append({
-            "tipo_id": str(tipo_id) if tipo_id else None,
-            "tipo_nome": tipo_nome,
-            "total": g.get("total", 0),
-            "printed": g.get("printed", 0),
+            "tipo_id": None if tipo_id == metricas_evento.SEM_TIPO else tipo_id,
+            "tipo_nome": tipo_nome or "Desconhecido",
+            "total": contadores.get("total", 0),
+            "printed": contadores.get("impressos", 0),
+            "ativos": contadores.get("ativos", 0),
+            "cancelados": contadores.get("cancelados", 0),
         })
 
     # ── Ilha metrics ─────────────────────────────────────────────
@@ -277,42 +243,29 @@ async def evento_api_ingresso_metrics(request: Request):
         async for ilha in cursor:
             ilhas.append(ilha)
 
-    # Build a map: tipo_id_str → set of ilha_id_str (from permissoes)
-    tipos_map = {}
-    cursor_tipos = db.tipos_ingresso.find({"evento_id": evento_id})
-    async for tipo in cursor_tipos:
-        t_id = str(tipo.get("_id"))
-        tipos_map[t_id] = set(str(p) for p in tipo.get("permissoes", []))
-
-    # Fetch all ingressos for the event
-    ingressos = []
-    cursor_ing = db.ingressos_emitidos.find({"evento_id": evento_id})
-    async for ing in cursor_ing:
-        ingressos.append(ing)
-
-    # For each ilha, count ingressos whose tipo grants access to it
     ilha_metrics = []
     for ilh in ilhas:
         ilha_id_str = str(ilh.get("_id") or ilh.get("id"))
-        capacidade = ilh.get("capacidade_maxima", 0)
-        count = 0
-        for ing in ingressos:
-            tipo_id_str = str(ing.get("tipo_ingresso_id") or "")
-            if ilha_id_str in tipos_map.get(tipo_id_str, set()):
-                count += 1
+        contadores = metricas.get("ilhas", {}).get(ilha_id_str, {})
         ilha_metrics.append({
             "ilha_id": ilha_id_str,
             "nome_setor": ilh.get("nome_setor", ""),
-            "capacidade": capacidade,
-            "vendidos": count,
+            "capacidade": ilh.get("capacidade_maxima", 0),
+            "vendidos": contadores.get("total", 0),
+            "ativos": contadores.get("ativos", 0),
+            "validacoes": contadores.get("validacoes", 0),
         })
 
     return JSONResponse({"tipo_metrics": tipo_metrics, "ilha_metrics": ilha_metrics})
 
 
 @router.get("/evento/api/participantes")
-async def evento_api_participantes(request: Request, page: int = 1, per_page: int = 20):
-    """Lista paginada de participantes do evento (autenticado por cookie), ordenada por nome."""
+async def evento_api_participantes(request: Request, page: int = 1, per_page: int = 20, cursor: Optional[str] = None):
+    """Lista paginada de participantes do evento (autenticado por cookie), ordenada por nome.
+
+    Com `cursor` (o `next_cursor` da resposta anterior) a página é lida a partir
+    do último item, sem `skip`; `total_count` é aproximado (contagem em cache).
+    """
     session = await _get_evento_from_cookie(request)
     if not session:
         return JSONResponse({"detail": "Não autenticado"}, status_code=401)
@@ -323,30 +276,27 @@ async def evento_api_participantes(request: Request, page: int = 1, per_page: in
     per_page = max(1, min(per_page, 100))
     if page < 1:
         page = 1
+    apos = None
+    if cursor:
+        try:
+            apos = paginacao.filtro_apos(cursor)
+        except ValueError:
+            return JSONResponse({"detail": "Cursor inválido"}, status_code=400)
 
     # Filtra participantes que possuem ingressos neste evento
-    pipeline = [
-        {"$match": {"ingressos.evento_id": evento_id}},
-        {"$sort": {"nome": 1}},
-        {"$facet": {
-            "total": [{"$count": "count"}],
-            "data": [{"$skip": (page - 1) * per_page}, {"$limit": per_page}],
-        }},
-    ]
-    result = await db.participantes.aggregate(pipeline).to_list(length=1)
-    total_count = 0
-    docs = []
-    if result:
-        total_count = (result[0].get("total") or [{}])[0].get("count", 0)
-        docs = result[0].get("data", [])
-
+    query = {"ingressos.evento_id": evento_id}
+    total_count = await paginacao.contar_participantes(db, query)
     # Fallback: se não há ingressos embutidos, lista todos ordenados por nome
     if total_count == 0:
-        total_count = await db.participantes.count_documents({})
-        total_pages = max(1, (total_count + per_page - 1) // per_page)
-        skip = (page - 1) * per_page
-        cursor = db.participantes.find({}).sort("nome", 1).skip(skip).limit(per_page)
-        docs = await cursor.to_list(length=per_page)
+        query = {}
+        total_count = await paginacao.contar_participantes(db, query)
+
+    if apos is not None:
+        resultado = db.participantes.find({"$and": [query, apos]})
+    else:
+        resultado = db.participantes.find(query).skip((page - 1) * per_page)
+    docs = await resultado.sort(paginacao.ORDEM).limit(per_page).to_list(length=per_page)
+    next_cursor = paginacao.proximo_cursor(docs, per_page)
 
     total_pages = max(1, (total_count + per_page - 1) // per_page)
 
@@ -364,6 +314,7 @@ async def evento_api_participantes(request: Request, page: int = 1, per_page: in
         "total_pages": total_pages,
         "current_page": page,
         "per_page": per_page,
+        "next_cursor": next_cursor,
     })
 
 
@@ -419,9 +370,7 @@ async def evento_api_busca_smart(request: Request, q: str = ""):
             participantes.append(p_doc)
 
     else:  # nome
-        query = {"nome": {"$regex": q, "$options": "i"}}
-        cursor = db.participantes.find(query).sort("nome", 1).limit(20)
-        async for p in cursor:
+        for p in await buscar_por_nome(db, {"ingressos.evento_id": evento_id}, q, limite=20):
             p["_id"] = str(p["_id"])
             p = normalize_bson_types(p)
             if p.get("ingressos"):
@@ -508,11 +457,12 @@ async def evento_participante_editar_save(
         }
         # Remove None values
         update_data = {k: v for k, v in update_data.items() if v is not None}
+        update_data.update(campos_busca(update_data["nome"]))
         try:
-            await db.participantes.update_one(
-                {"_id": ObjectId(participante_id)},
-                {"$set": update_data},
-            )
+            await atualizar_participante(db, ObjectId(participante_id), update_data)
+            roster_evento.atualizar_participante(participante_id, update_data.get("nome"), update_data.get("cpf"))
+        except HTTPException as exc:
+            error = exc.detail
         except Exception as exc:
             error = f"Erro ao salvar: {exc}"
 
@@ -632,6 +582,7 @@ async def evento_participante_novo_save(
     db = database.get_database()
 
     error = None
+    status_erro = status.HTTP_200_OK
     cpf_clean = None
     try:
         cpf_clean = validate_cpf(cpf)
@@ -647,18 +598,28 @@ async def evento_participante_novo_save(
             "telefone": telefone.strip() or None,
             "empresa": empresa.strip() or None,
             "nacionalidade": nacionalidade.strip() or None,
+            **campos_busca(nome),
         }
         existing = await db.participantes.find_one({"email": participante_dict["email"]})
         if existing:
             participante_id = str(existing["_id"])
+            # o ingresso é do participante já cadastrado: usa o CPF dele
+            cpf_clean = cpf_participante(existing.get("cpf")) or cpf_clean
         else:
             result = await db.participantes.insert_one(participante_dict)
             participante_id = str(result.inserted_id)
 
     if not error and tipo_ingresso_id.strip() and participante_id:
         from app.config.auth import generate_qrcode_hash
-        qrcode_hash = generate_qrcode_hash()
+        ingresso_oid = ObjectId()
+        tipo_numero = next(
+            (t.get("numero") for t in evento.get("tipos_ingresso", []) or []
+             if tipo_ingresso_id.strip() in (str(t.get("_id") or t.get("id")), str(t.get("numero")))),
+            None
+        )
+        qrcode_hash = codigo_para_evento(evento, str(ingresso_oid), tipo_numero) or generate_qrcode_hash()
         ingresso_dict = {
+            "_id": str(ingresso_oid),
             "evento_id": evento_id,
             "tipo_ingresso_id": tipo_ingresso_id.strip(),
             "participante_id": participante_id,
@@ -667,19 +628,23 @@ async def evento_participante_novo_save(
             "qrcode_hash": qrcode_hash,
             "data_emissao": datetime.now(timezone.utc).isoformat(),
         }
+        # $push condicional: um CPF já emitido no evento (mesmo em concorrência) é
+        # recusado e nada mais é gravado ou contabilizado
         try:
-            await db.ingressos_emitidos.insert_one(dict(ingresso_dict))
-        except Exception as exc:
-            logger.error("Erro ao inserir ingresso em ingressos_emitidos: %s", exc)
-            error = "Erro ao emitir ingresso. Participante cadastrado, mas ingresso não emitido."
+            await gravar_ingresso_embutido(db, ObjectId(participante_id), evento_id, ingresso_dict)
+        except HTTPException as exc:
+            error = exc.detail
+            status_erro = exc.status_code
         if not error:
             try:
-                await db.participantes.update_one(
-                    {"_id": ObjectId(participante_id)},
-                    {"$push": {"ingressos": ingresso_dict}},
-                )
+                await db.ingressos_emitidos.insert_one({**ingresso_dict, "_id": ingresso_oid})
             except Exception as exc:
-                logger.error("Erro ao embedar ingresso no participante: %s", exc)
+                logger.error("Erro ao inserir ingresso em ingressos_emitidos: %s", exc)
+            await registrar_emissao(db, evento_id, ingresso_dict)
+            await metricas_evento.registrar_emissoes(db, evento_id, [ingresso_dict])
+            indice_validacao.registrar_ingresso(evento_id, ingresso_dict, nome.strip())
+            roster_evento.registrar_ingresso(evento_id, ingresso_dict, nome.strip(), cpf_clean)
+            await registrar_alteracoes(db, evento_id, [ingresso_dict])
 
     tipos = await _get_tipos_ingresso(db, evento)
 
@@ -693,6 +658,7 @@ async def evento_participante_novo_save(
                 "active_page": "dashboard",
                 "error": error,
             },
+            status_code=status_erro,
         )
 
     if participante_id:
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, HTTPException, status, Request
+from fastapi import APIRouter, HTTPException, status, Request, Header
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import JSONResponse, RedirectResponse
 
@@ -11,8 +11,15 @@ from app.models.participante import ParticipanteCreate, Participante
 from app.models.ingresso_emitido import IngressoEmitido
 from app.config.auth import generate_qrcode_hash
 from app.utils.validations import validate_cpf
+from app.utils.capacidade import registrar_emissao
+from app.utils import indice_validacao, metricas_evento, roster_evento, idempotencia
+from app.utils.busca_participantes import campos_busca
+from app.utils.snapshot_portaria import registrar_alteracoes
+from app.utils.qr_assinado import codigo_para_evento
+from app.utils.layout_versoes import campos_layout
 from bson import ObjectId
 from datetime import datetime, timezone
+from typing import Annotated, Optional
 
 router = APIRouter()
 templates = Jinja2Templates(directory='app/templates')
@@ -113,8 +120,19 @@ async def buscar_ingresso_api(evento_slug: str, payload: dict):
 
 
 @router.post("/{evento_slug}", status_code=status.HTTP_201_CREATED)
-async def post_inscricao(evento_slug: str, participante: ParticipanteCreate):
-    """Processa inscrição pública pelo nome normalizado do evento"""
+async def post_inscricao(
+    evento_slug: str,
+    participante: ParticipanteCreate,
+    idempotency_key: Annotated[Optional[str], Header(alias="Idempotency-Key")] = None
+):
+    """Processa inscrição pública pelo nome normalizado do evento (idempotente por `Idempotency-Key`)"""
+    return await idempotencia.executar(
+        get_database(), f"inscricao:{evento_slug}", idempotency_key, participante.model_dump(),
+        lambda: _post_inscricao(evento_slug, participante), status_code=status.HTTP_201_CREATED
+    )
+
+
+async def _post_inscricao(evento_slug: str, participante: ParticipanteCreate):
     evento = await _find_evento_by_slug(evento_slug)
     if not evento:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Evento não encontrado")
@@ -144,6 +162,7 @@ async def post_inscricao(evento_slug: str, participante: ParticipanteCreate):
     else:
         part_dict = participante.model_dump()
         part_dict["cpf"] = cpf_digits
+        part_dict.update(campos_busca(part_dict.get("nome")))
         result = await db.participantes.insert_one(part_dict)
         participante_id = str(result.inserted_id)
 
@@ -152,9 +171,9 @@ async def post_inscricao(evento_slug: str, participante: ParticipanteCreate):
     if not tipo:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Nenhum tipo de ingresso padrão definido para este evento")
 
-    qrcode_hash = generate_qrcode_hash()
     # Gera _id antecipadamente para embedded document
     ingresso_id = str(ObjectId())
+    qrcode_hash = codigo_para_evento(evento, ingresso_id, tipo.get("numero")) or generate_qrcode_hash()
     ingresso_dict = {
         "_id": ingresso_id,
         "evento_id": str(evento["_id"]),
@@ -167,14 +186,10 @@ async def post_inscricao(evento_slug: str, participante: ParticipanteCreate):
         "impresso": False
     }
 
-    # Always use the event layout; embed it into the ingresso before saving
-    layout_source = evento.get("layout_ingresso")
-    try:
-        from app.utils.layouts import embed_layout
-        embedded = embed_layout(layout_source, {"nome": participante.nome, "cpf": participante.cpf, "email": participante.email}, tipo, evento, ingresso_dict)
-        ingresso_dict["layout_ingresso"] = embedded
-    except Exception:
-        pass
+    # o ingresso guarda só os seus valores; o layout vem da versão vigente do evento
+    ingresso_dict["campos_layout"] = campos_layout(
+        {"nome": participante.nome, "cpf": participante.cpf, "email": participante.email}, tipo, evento, ingresso_dict
+    )
 
     # Insere como embedded no participante (fonte primária)
     await db.participantes.update_one(
@@ -186,5 +201,10 @@ async def post_inscricao(evento_slug: str, participante: ParticipanteCreate):
     ingresso_legacy = ingresso_dict.copy()
     ingresso_legacy["_id"] = ObjectId(ingresso_id)
     await db.ingressos_emitidos.insert_one(ingresso_legacy)
+    await registrar_emissao(db, str(evento["_id"]), ingresso_dict)
+    await metricas_evento.registrar_emissoes(db, str(evento["_id"]), [ingresso_dict])
+    indice_validacao.registrar_ingresso(str(evento["_id"]), ingresso_dict, participante.nome)
+    roster_evento.registrar_ingresso(str(evento["_id"]), ingresso_dict, participante.nome, cpf_digits)
+    await registrar_alteracoes(db, str(evento["_id"]), [ingresso_dict])
 
     return {"message": "Inscrição realizada com sucesso", "ingresso_id": ingresso_id, "ingresso": IngressoEmitido(**ingresso_dict)}
\ No newline at end of file
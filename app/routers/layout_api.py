@@ -9,6 +9,8 @@ from bson import ObjectId
 from app.config.database import get_database
 from app.config.auth import verify_admin_access
 from app.models.layout import LayoutUpdate
+from app.utils import contexto_evento, layout_versoes
+from app.utils.assets import PROJECAO_SEM_LOGO
 
 
 router = APIRouter(prefix="/api/eventos", tags=["Layout API"])
@@ -28,7 +30,7 @@ async def get_evento_layout(
     db = get_db()
     
     try:
-        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, PROJECAO_SEM_LOGO)
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -77,7 +79,7 @@ async def update_evento_layout(
             detail="ID inválido"
         )
     
-    evento = await db.eventos.find_one({"_id": obj_id})
+    evento = await db.eventos.find_one({"_id": obj_id}, {"_id": 1})
     if not evento:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -87,11 +89,9 @@ async def update_evento_layout(
     # Prepara atualização do layout_ingresso
     layout_dict = data.model_dump(exclude_unset=True)
     
-    # Atualiza o subdocumento layout_ingresso
-    await db.eventos.update_one(
-        {"_id": obj_id},
-        {"$set": {"layout_ingresso": layout_dict}}
-    )
+    # Atualiza o subdocumento layout_ingresso e publica a nova versão
+    await layout_versoes.publicar_layout(db, evento_id, layout_dict)
+    contexto_evento.invalidar_evento(str(obj_id))
     
     return {
         "success": True,
@@ -2,14 +2,12 @@ from fastapi import APIRouter, HTTPException, status, Depends, UploadFile, File,
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse
 import app.config.database as database
-import os
 
 def get_database():
     """Runtime indirection to allow tests to monkeypatch `get_database` on this module."""
     return database.get_database()
 from app.config.auth import verify_admin_access
-from app.utils.planilha import process_planilha
-from datetime import datetime, timezone
+from app.utils import importacoes
 from bson import ObjectId
 
 router = APIRouter()
@@ -18,56 +16,32 @@ templates = Jinja2Templates(directory='app/templates')
 
 @router.post("/eventos/{evento_id}/planilha-upload", dependencies=[Depends(verify_admin_access)])
 async def upload_planilha(evento_id: str, file: UploadFile = File(...)):
+    """Enfileira a importação e responde imediatamente; acompanhe em `GET /importacoes/{import_id}`."""
     db = get_database()
     try:
         evento_object_id = ObjectId(evento_id)
     except Exception:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="ID de evento inválido")
 
-    evento = await db.eventos.find_one({"_id": evento_object_id})
+    evento = await db.eventos.find_one({"_id": evento_object_id}, {"_id": 1})
     if not evento:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Evento não encontrado")
 
-    evento_id_str = str(evento_object_id)
-    content = await file.read()
-
-    # registrar importacao como em processamento antes de começar para permitir updates de progresso
-    import_doc = {
-        'evento_id': evento_id_str,
-        'filename': file.filename,
-        'status': 'processing',
-        'relatorio': {},
-        'progress': {'processed': 0},
-        'created_at': datetime.now(timezone.utc)
-    }
-    res = await db.planilha_importacoes.insert_one(import_doc)
-    import_id = str(res.inserted_id)
+    import_id = await importacoes.criar_importacao(db, str(evento_object_id), file.filename, file)
+    return {'message': 'Upload enfileirado', 'import_id': import_id, 'status': importacoes.STATUS_FILA}
 
-    try:
-        report = await process_planilha(content, file.filename, evento_id_str, db, import_id=import_id)
-    except ValueError as exc:
-        # update import_doc as failed
-        try:
-            await db.planilha_importacoes.update_one({'_id': ObjectId(import_id)}, {'$set': {'status': 'failed', 'relatorio': {'errors': [str(exc)]}}})
-        except Exception:
-            pass
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
-
-    # registrar importacao final
-    if report.get('errors'):
-        if report.get('created_ingressos', 0) > 0 or report.get('created_participants', 0) > 0:
-            status_val = 'partial'
-        else:
-            status_val = 'failed'
-    else:
-        status_val = 'completed'
 
+@router.get('/importacoes/{import_id}', dependencies=[Depends(verify_admin_access)])
+async def get_situacao_importacao(import_id: str):
+    """Andamento da importação: linhas processadas/total, linhas por segundo e estimativa de término."""
+    db = get_database()
     try:
-        await db.planilha_importacoes.update_one({'_id': ObjectId(import_id)}, {'$set': {'status': status_val, 'relatorio': report, 'progress': {'processed': report.get('total', 0), 'total': report.get('total', 0)}}})
+        doc = await db.planilha_importacoes.find_one({'_id': ObjectId(import_id)})
     except Exception:
-        pass
-
-    return { 'message': 'Upload processed', 'report': report, 'import_id': import_id }
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Importacao não encontrada')
+    if not doc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Importacao não encontrada')
+    return importacoes.situacao_importacao(doc)
 
 
 # Public upload via token
@@ -169,62 +143,34 @@ async def download_template_xlsx(token: str):
 
 @router.post('/upload/{token}', response_class=HTMLResponse)
 async def public_upload(request: Request, token: str, file: UploadFile = File(...)):
+    """Enfileira a validação da planilha; sem erros, ela aguarda o aceite do admin."""
     db = get_database()
     link = await db.planilha_upload_links.find_one({'token': token})
     if not link:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Link de upload inválido')
     evento_id = link.get('evento_id')
-    content = await file.read()
-    # registrar importacao como em processamento antes de começar
-    import_doc = {
-        'evento_id': evento_id,
-        'filename': file.filename,
-        'status': 'processing',
-        'relatorio': {},
-        'progress': {'processed': 0},
-        'created_at': datetime.now(timezone.utc)
-    }
-    res = await db.planilha_importacoes.insert_one(import_doc)
-    import_id = str(res.inserted_id)
+    import_id = await importacoes.criar_importacao(db, evento_id, file.filename, file, modo=importacoes.MODO_VALIDAR)
+    return templates.TemplateResponse('upload_result.html', {
+        'request': request, 'status': importacoes.STATUS_FILA, 'report': {}, 'token': token, 'import_id': import_id,
+    })
 
-    try:
-        # validate only first: do not persist data yet
-        report = await process_planilha(content, file.filename, evento_id, db, import_id=import_id, validate_only=True)
-    except ValueError as exc:
-        try:
-            await db.planilha_importacoes.update_one({'_id': ObjectId(import_id)}, {'$set': {'status': 'failed', 'relatorio': {'errors': [str(exc)]}}})
-        except Exception:
-            pass
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
-
-    # If validation failed, delete the import record and do not keep the file
-    if report.get('errors'):
-        try:
-            await db.planilha_importacoes.delete_one({'_id': ObjectId(import_id)})
-        except Exception:
-            pass
-        return templates.TemplateResponse('upload_result.html', {'request': request, 'status': 'failed', 'report': report})
-
-    # Validation passed: store the uploaded file for admin review and mark as uploaded
-    uploads_dir = os.path.join('app', 'static', 'uploads')
-    os.makedirs(uploads_dir, exist_ok=True)
-    safe_name = file.filename.replace(' ', '_')
-    file_path = os.path.join(uploads_dir, f"{import_id}_" + safe_name)
-    try:
-        with open(file_path, 'wb') as fh:
-            fh.write(content)
-    except Exception:
-        # failed to save file, mark import as failed
-        await db.planilha_importacoes.update_one({'_id': ObjectId(import_id)}, {'$set': {'status': 'failed', 'relatorio': {'errors': ['Erro ao salvar arquivo no servidor']}}})
-        return templates.TemplateResponse('upload_result.html', {'request': request, 'status': 'failed', 'report': {'errors': ['Erro ao salvar arquivo no servidor']}})
 
-    status_val = 'uploaded'
+@router.get('/upload/{token}/importacao/{import_id}')
+async def public_upload_situacao(token: str, import_id: str):
+    """Andamento da validação de um upload público (apenas do evento do link)."""
+    db = get_database()
+    link = await db.planilha_upload_links.find_one({'token': token})
+    if not link:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Link de upload inválido')
     try:
-        await db.planilha_importacoes.update_one({'_id': ObjectId(import_id)}, {'$set': {'status': status_val, 'relatorio': report, 'file_path': file_path, 'progress': {'processed': report.get('total', 0), 'total': report.get('total', 0)}}})
+        doc = await db.planilha_importacoes.find_one({'_id': ObjectId(import_id), 'evento_id': link.get('evento_id')})
     except Exception:
-        pass
-
-    return templates.TemplateResponse('upload_result.html', {'request': request, 'status': status_val, 'report': report})
+        doc = None
+    if not doc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Importacao não encontrada')
+    situacao = importacoes.situacao_importacao(doc)
+    await importacoes.entregar_validacao(db, doc)
+    return {k: situacao[k] for k in ('status', 'processed', 'total', 'eta_segundos', 'relatorio')}
 
 
 @router.get('/eventos/{evento_id}/planilha-importacao/{import_id}')
@@ -252,28 +198,9 @@ async def accept_importacao(evento_id: str, import_id: str):
     if not doc:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail='Importacao não encontrada')
     # require that file_path exists
-    file_path = doc.get('file_path')
-    if not file_path:
+    if not doc.get('file_path'):
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Nenhum arquivo associado a esta importacao')
-    try:
-        with open(file_path, 'rb') as fh:
-            content = fh.read()
-    except Exception:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail='Falha ao ler arquivo no servidor')
-
-    # process and persist
-    try:
-        report = await process_planilha(content, doc.get('filename'), evento_id, db, import_id=import_id, validate_only=False)
-    except ValueError as exc:
-        await db.planilha_importacoes.update_one({'_id': ObjectId(import_id)}, {'$set': {'status': 'failed', 'relatorio': {'errors': [str(exc)]}}})
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(exc))
-
-    # update import status based on report
-    if report.get('errors'):
-        status_val = 'partial' if (report.get('created_ingressos', 0) > 0 or report.get('created_participants', 0) > 0) else 'failed'
-    else:
-        status_val = 'completed'
-
-    await db.planilha_importacoes.update_one({'_id': ObjectId(import_id)}, {'$set': {'status': status_val, 'relatorio': report, 'progress': {'processed': report.get('total', 0), 'total': report.get('total', 0)}}})
+    if not await importacoes.aceitar_importacao(db, import_id):
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Importacao com status '{doc.get('status')}' não pode ser aceita")
 
-    return {'status': status_val, 'report': report}
\ No newline at end of file
+    return {'status': importacoes.STATUS_FILA, 'import_id': import_id}
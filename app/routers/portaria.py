@@ -1,4 +1,5 @@
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, status, Depends, Query, Request
+from fastapi.responses import Response
 from bson import ObjectId
 from bson.errors import InvalidId
 import app.config.database as database
@@ -8,9 +9,13 @@ def get_database():
     return database.get_database()
 from app.config.auth import verify_token_portaria
 from app.utils.validations import format_datetime_display
-from pydantic import BaseModel
+from app.utils.indice_validacao import obter_indice, carregar_evento, confirmar_status, IndiceEvento
+from app.utils.snapshot_portaria import montar_snapshot, montar_delta, empacotar
+from app.utils.buffer_acessos import registrar_acessos, descarregar_acessos, MODO_BUFFER, JANELA_PADRAO
+from app.utils.contexto_evento import evento_por_id
+from pydantic import BaseModel, Field
 from datetime import datetime, timezone
-from typing import Optional
+from typing import Optional, List
 
 router = APIRouter()
 
@@ -25,6 +30,12 @@ class _LocalColl:
         self.docs.append(new_doc)
         return SimpleNamespace(inserted_id=new_doc.get("_id"))
 
+    async def insert_many(self, docs, ordered=True):
+        from types import SimpleNamespace
+        new_docs = [dict(d) for d in docs]
+        self.docs.extend(new_docs)
+        return SimpleNamespace(inserted_ids=[d.get("_id") for d in new_docs])
+
     async def count_documents(self, query=None):
         query = query or {}
         count = 0
@@ -97,6 +108,13 @@ def _ensure_validacoes(db):
         db.validacoes_acesso = _LocalColl()
 
 
+def _durabilidade(indice) -> tuple:
+    """(modo, janela) do log de acessos configurados no evento."""
+    if indice is None:
+        return MODO_BUFFER, JANELA_PADRAO
+    return indice.log_modo, indice.log_janela
+
+
 
 class ValidacaoRequest(BaseModel):
     """Request para validação de QR code"""
@@ -104,6 +122,28 @@ class ValidacaoRequest(BaseModel):
     ilha_id: str
 
 
+class ValidacaoLoteItem(BaseModel):
+    """Leitura individual enviada pelo coletor"""
+    qrcode_hash: str
+    ilha_id: str
+    scanned_at: Optional[datetime] = None
+
+
+class ValidacaoLoteRequest(BaseModel):
+    """Leituras acumuladas pelo coletor, na ordem em que foram feitas"""
+    leituras: List[ValidacaoLoteItem] = Field(..., max_length=500)
+
+
+class ValidacaoLoteResultado(BaseModel):
+    """Resultado de uma leitura do lote"""
+    qrcode_hash: str
+    ilha_id: str
+    status: str  # "OK" ou "NEGADO"
+    mensagem: str
+    participante_nome: Optional[str] = None
+    tipo_ingresso: Optional[str] = None
+
+
 class ValidacaoResponse(BaseModel):
     """Response da validação"""
     status: str  # "OK" ou "NEGADO"
@@ -152,7 +192,7 @@ async def get_evento_info(
     db = get_database()
     
     # Busca o evento
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    evento = await evento_por_id(db, evento_id)
     if not evento:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -185,7 +225,7 @@ async def get_ingresso_by_qrcode(
     )
 
     ingresso = None
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    evento = await evento_por_id(db, evento_id)
 
     if participante and participante.get("ingressos"):
         ingresso = participante["ingressos"][0]
@@ -275,7 +315,7 @@ async def get_ingresso_completo_by_qrcode(
         )
 
     # Busca evento
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    evento = await evento_por_id(db, evento_id)
     if not evento:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -373,7 +413,7 @@ async def get_ingresso_completo_por_cpf(
         )
     
     # Busca evento
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    evento = await evento_por_id(db, evento_id)
     if not evento:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -473,7 +513,7 @@ async def get_ingresso_por_participante(
         )
 
     # Busca evento
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    evento = await evento_por_id(db, evento_id)
     if not evento:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -539,7 +579,27 @@ async def validar_acesso(
     - 403 (Vermelho/Negado): Acesso negado
     """
     db = get_database()
-    
+
+    # Caminho rápido: índice em memória do evento (nenhuma leitura no banco)
+    indice = await obter_indice(db, evento_id)
+    if indice is not None:
+        motivo = indice.verificar_qr(validacao.qrcode_hash)
+        if motivo:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=motivo)
+    registro = indice.ingressos.get(validacao.qrcode_hash) if indice is not None else None
+    motivo, descricao = indice.decidir(registro, validacao.ilha_id) if registro is not None else (None, None)
+    if descricao is not None:
+        # aprovado pelo índice: confirma o status (cancelamento em outro worker)
+        await confirmar_status(db, indice, [validacao.qrcode_hash])
+        motivo, descricao = indice.decidir(registro, validacao.ilha_id)
+    if motivo:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail=motivo)
+    if descricao is not None:
+        return await _registrar_acesso(
+            db, evento_id, validacao.ilha_id, registro.ingresso_id, registro.participante_id,
+            registro.participante_nome or "Desconhecido", descricao, indice
+        )
+
     # Primeiro tenta localizar ingresso embutido dentro de participantes
     participante = await db.participantes.find_one(
         {"ingressos.qrcode_hash": validacao.qrcode_hash},
@@ -563,6 +623,10 @@ async def validar_acesso(
             detail="Ingresso não pertence a este evento"
         )
 
+    # ingresso ainda não indexado (ex.: emitido por outro worker): inclui no índice
+    if indice is not None:
+        indice.registrar(ingresso, participante.get("nome"), participante.get("_id"))
+
     # Verifica se o ingresso está ativo
     if ingresso.get("status") != "Ativo":
         raise HTTPException(
@@ -571,7 +635,7 @@ async def validar_acesso(
         )
 
     # Busca tipo de ingresso no evento (embutido) ou fallback para coleção
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    evento = await evento_por_id(db, evento_id)
     tipo_ingresso = None
     if evento:
         for t in evento.get("tipos_ingresso", []):
@@ -620,28 +684,206 @@ async def validar_acesso(
     except:
         participante_nome = "Desconhecido"
 
+    return await _registrar_acesso(
+        db, evento_id, validacao.ilha_id,
+        str(ingresso.get("_id") or ingresso.get("qrcode_hash")),
+        ingresso.get("participante_id") or (str(participante.get("_id")) if participante else None),
+        participante_nome, tipo_ingresso["descricao"], indice
+    )
+
+
+async def _registrar_acesso(db, evento_id: str, ilha_id: str, ingresso_id: str, participante_id,
+                            participante_nome: str, tipo_descricao: str,
+                            indice: Optional[IndiceEvento] = None) -> ValidacaoResponse:
+    """Registra o log de acesso de uma validação aprovada e monta a resposta.
+
+    No modo "buffer" (padrão) o registro é gravado em segundo plano e a resposta
+    não espera o banco; no modo "sync" a gravação acontece antes da resposta.
+    """
     # Ensure the validacoes_acesso collection exists (for tests using FakeDB)
     _ensure_validacoes(db)
 
     # Registra a validação (log de acesso)
-    await db.validacoes_acesso.insert_one({
-        "ingresso_id": str(ingresso.get("_id") or ingresso.get("qrcode_hash")),
+    await registrar_acessos(db, [{
+        "ingresso_id": ingresso_id,
         "evento_id": evento_id,
-        "ilha_id": validacao.ilha_id,
-        "participante_id": ingresso.get("participante_id") or (str(participante.get("_id")) if participante else None),
+        "ilha_id": ilha_id,
+        "participante_id": participante_id,
         "data_validacao": datetime.now(timezone.utc),
         "status": "OK"
-    })
+    }], *_durabilidade(indice))
 
     # Tudo OK, acesso permitido
     return ValidacaoResponse(
         status="OK",
         mensagem="Acesso permitido",
         participante_nome=participante_nome,
-        tipo_ingresso=tipo_ingresso["descricao"]
+        tipo_ingresso=tipo_descricao
+    )
+
+
+@router.post("/validar/lote")
+async def validar_acesso_lote(
+    lote: ValidacaoLoteRequest,
+    evento_id: str = Depends(verify_token_portaria)
+):
+    """
+    Valida um lote de leituras acumuladas pelo coletor (ex.: após queda de Wi-Fi)
+
+    Os ingressos fora do índice em memória são resolvidos com uma única consulta
+    `$in`, as permissões vêm de uma única leitura do evento e os acessos aprovados
+    são gravados com um único `insert_many`. Os resultados seguem a ordem das
+    leituras; a repetição de um mesmo QR code para a mesma ilha dentro do lote é
+    negada como leitura duplicada.
+    """
+    db = get_database()
+
+    indice = await obter_indice(db, evento_id)
+    if indice is None:
+        indice = IndiceEvento(evento_id)
+        await carregar_evento(db, evento_id, indice)
+
+    # QR assinados forjados ou de outro evento são recusados sem consultar o banco
+    recusados = {}
+    for leitura in lote.leituras:
+        motivo = indice.verificar_qr(leitura.qrcode_hash)
+        if motivo:
+            recusados[leitura.qrcode_hash] = motivo
+
+    # hashes desconhecidos do índice: uma única consulta ao banco
+    outro_evento = set()
+    ausentes = list({
+        l.qrcode_hash for l in lote.leituras
+        if l.qrcode_hash not in indice.ingressos and l.qrcode_hash not in recusados
+    })
+    if ausentes:
+        pendentes = set(ausentes)
+        cursor = db.participantes.find({"ingressos.qrcode_hash": {"$in": ausentes}}, {"nome": 1, "ingressos": 1})
+        async for participante in cursor:
+            for ing in participante.get("ingressos", []) or []:
+                if ing.get("qrcode_hash") not in pendentes:
+                    continue
+                if ing.get("evento_id") != evento_id:
+                    outro_evento.add(ing.get("qrcode_hash"))
+                    continue
+                indice.registrar(ing, participante.get("nome"), participante.get("_id"))
+
+    # status dos ingressos indexados: uma leitura por `_id` (cancelamentos de outros workers)
+    lidos_agora = set(ausentes)
+    await confirmar_status(db, indice, {
+        l.qrcode_hash for l in lote.leituras if l.qrcode_hash not in recusados and l.qrcode_hash not in lidos_agora
+    })
+
+    agora = datetime.now(timezone.utc)
+    resultados = []
+    logs = []
+    aprovados = set()
+    for leitura in lote.leituras:
+        registro = indice.ingressos.get(leitura.qrcode_hash)
+        descricao = None
+        if leitura.qrcode_hash in recusados:
+            motivo = recusados[leitura.qrcode_hash]
+        elif (leitura.qrcode_hash, leitura.ilha_id) in aprovados:
+            motivo = "Leitura duplicada no lote"
+        elif registro is None:
+            motivo = "Ingresso não pertence a este evento" if leitura.qrcode_hash in outro_evento else "QR Code inválido"
+        else:
+            motivo, descricao = indice.decidir(registro, leitura.ilha_id)
+            if motivo is None and descricao is None:
+                motivo = "Tipo de ingresso não encontrado"
+
+        if motivo:
+            resultados.append(ValidacaoLoteResultado(
+                qrcode_hash=leitura.qrcode_hash, ilha_id=leitura.ilha_id, status="NEGADO", mensagem=motivo
+            ))
+            continue
+
+        aprovados.add((leitura.qrcode_hash, leitura.ilha_id))
+        logs.append({
+            "ingresso_id": registro.ingresso_id,
+            "evento_id": evento_id,
+            "ilha_id": leitura.ilha_id,
+            "participante_id": registro.participante_id,
+            "data_validacao": leitura.scanned_at or agora,
+            "data_recebimento": agora,
+            "status": "OK"
+        })
+        resultados.append(ValidacaoLoteResultado(
+            qrcode_hash=leitura.qrcode_hash, ilha_id=leitura.ilha_id, status="OK", mensagem="Acesso permitido",
+            participante_nome=registro.participante_nome or "Desconhecido", tipo_ingresso=descricao
+        ))
+
+    if logs:
+        _ensure_validacoes(db)
+        await registrar_acessos(db, logs, *_durabilidade(indice))
+
+    return {
+        "total": len(resultados),
+        "aprovados": len(logs),
+        "negados": len(resultados) - len(logs),
+        "resultados": resultados
+    }
+
+
+async def _evento_snapshot(db, evento_id: str):
+    projecao = {"tipos_ingresso": 1, "ilhas": 1, "versao_ingressos": 1, "token_portaria": 1}
+    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, projecao)
+    if not evento:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Evento não encontrado")
+    return evento
+
+
+def _resposta_pacote(payload: dict, evento: dict, etag: str) -> Response:
+    pacote = empacotar(payload, evento.get("token_portaria", ""))
+    return Response(
+        content=pacote["conteudo"],
+        media_type="application/json",
+        headers={
+            "Content-Encoding": "gzip",
+            "ETag": etag,
+            "X-Snapshot-Versao": str(payload["versao"]),
+            "X-Snapshot-Assinatura": pacote["assinatura"],
+        }
     )
 
 
+@router.get("/snapshot")
+async def snapshot_offline(
+    request: Request,
+    evento_id: str = Depends(verify_token_portaria)
+):
+    """
+    Pacote para validação offline no coletor: ingressos ativos (hash truncado + tipo)
+    e matriz de permissões tipo→ilhas, comprimido (gzip) e assinado com HMAC-SHA256
+    (chave: token de portaria) no header `X-Snapshot-Assinatura`.
+    """
+    db = get_database()
+    evento = await _evento_snapshot(db, evento_id)
+    etag = f'"snapshot-{evento_id}-{int(evento.get("versao_ingressos", 0))}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+
+    payload = await montar_snapshot(db, evento)
+    return _resposta_pacote(payload, evento, etag)
+
+
+@router.get("/snapshot/delta")
+async def snapshot_offline_delta(
+    since: int = Query(..., ge=0, description="Versão do snapshot que o coletor já possui"),
+    evento_id: str = Depends(verify_token_portaria)
+):
+    """Ingressos emitidos ou cancelados depois da versão `since` (mesmo formato/assinatura do snapshot)."""
+    db = get_database()
+    evento = await _evento_snapshot(db, evento_id)
+    payload = await montar_delta(db, evento, since)
+    if payload is None:
+        raise HTTPException(
+            status_code=status.HTTP_410_GONE,
+            detail="Histórico de alterações indisponível; baixe o snapshot completo"
+        )
+    return _resposta_pacote(payload, evento, f'"delta-{evento_id}-{since}-{payload["versao"]}"')
+
+
 @router.get("/ilhas")
 async def get_ilhas(
     evento_id: str = Depends(verify_token_portaria)
@@ -650,7 +892,7 @@ async def get_ilhas(
     db = get_database()
     
     # Preferir ilhas embutidas no evento
-    evento = await db.eventos.find_one({"_id": ObjectId(evento_id)})
+    evento = await evento_por_id(db, evento_id)
     ilhas = []
     if evento and evento.get("ilhas"):
         for ilha in evento.get("ilhas", []):
@@ -680,8 +922,9 @@ async def estatisticas_portaria(
     """Retorna estatísticas de validações para o evento"""
     db = get_database()
     
-    # Total de validações
+    # Total de validações (inclui registros ainda no buffer de escrita)
     _ensure_validacoes(db)
+    await descarregar_acessos()
     total_validacoes = await db.validacoes_acesso.count_documents({
         "evento_id": evento_id
     })
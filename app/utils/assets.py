@@ -0,0 +1,157 @@
+"""Armazenamento de arquivos binários (logos) endereçado por conteúdo.
+
+O logo do evento ficava embutido em `eventos.logo_blob` como base64 (até
+~6.7 MB), e toda leitura do evento sem projeção arrastava esse conteúdo pela
+rede. Agora o arquivo fica em duas coleções:
+
+- `assets`: metadados, com `_id` igual ao SHA-256 do conteúdo;
+- `assets_chunks`: pedaços binários de até `TAMANHO_CHUNK` bytes
+  (`{"asset_id", "n", "data"}`).
+
+O evento guarda apenas a referência em `logo_asset`
+(`{"sha256", "content_type", "filename", "tamanho"}`). Conteúdo repetido é
+gravado uma única vez. Leituras de evento que não precisam do logo devem usar
+`PROJECAO_SEM_LOGO`, que também cobre eventos ainda não migrados.
+"""
+import base64
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+from bson import Binary, ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.utils.render_assets import LRUContado
+
+TAMANHO_CHUNK = 255 * 1024
+
+# eventos já consultados sem `logo_blob` legado; nada volta a gravar o campo,
+# então a ausência não expira (só sai do cache pelo limite da LRU)
+_sem_logo_legado = LRUContado(4096)
+
+# projeção para leituras de evento que não usam o logo legado embutido
+PROJECAO_SEM_LOGO = {"logo_blob": 0}
+
+
+def _colecoes(db):
+    return getattr(db, "assets", None), getattr(db, "assets_chunks", None)
+
+
+def _filtro_evento(evento_id) -> Dict[str, Any]:
+    try:
+        return {"_id": ObjectId(evento_id)}
+    except Exception:
+        return {"_id": evento_id}
+
+
+async def salvar_asset(db, conteudo: bytes, content_type: Optional[str] = None,
+                       filename: Optional[str] = None) -> Dict[str, Any]:
+    """Grava o conteúdo (se ainda não existir) e retorna a referência."""
+    sha256 = hashlib.sha256(conteudo).hexdigest()
+    referencia = {
+        "sha256": sha256,
+        "content_type": content_type,
+        "filename": filename,
+        "tamanho": len(conteudo),
+    }
+    assets, chunks = _colecoes(db)
+    if await assets.find_one({"_id": sha256}) is not None:
+        return referencia
+
+    # chunks primeiro: um documento em `assets` implica conteúdo completo
+    pedacos = [
+        {"asset_id": sha256, "n": n, "data": Binary(conteudo[i:i + TAMANHO_CHUNK])}
+        for n, i in enumerate(range(0, len(conteudo), TAMANHO_CHUNK))
+    ]
+    if pedacos:
+        try:
+            await chunks.insert_many(pedacos, ordered=False)
+        except BulkWriteError as exc:
+            # (asset_id, n) já gravado por uma gravação concorrente ou interrompida:
+            # mesmo sha256, mesmo pedaço
+            if any(e.get("code") != 11000 for e in exc.details.get("writeErrors", [])):
+                raise
+    try:
+        await assets.insert_one({
+            "_id": sha256,
+            "content_type": content_type,
+            "tamanho": len(conteudo),
+            "chunks": len(pedacos),
+            "data_criacao": datetime.now(timezone.utc),
+        })
+    except Exception:
+        # gravação concorrente do mesmo conteúdo: o documento já existe
+        pass
+    return referencia
+
+
+async def carregar_asset(db, sha256: str) -> Optional[bytes]:
+    """Conteúdo do asset, ou None se ausente/incompleto."""
+    assets, chunks = _colecoes(db)
+    if assets is None or chunks is None:
+        return None
+    meta = await assets.find_one({"_id": sha256})
+    if meta is None:
+        return None
+    partes = await chunks.find({"asset_id": sha256}).sort("n", 1).to_list(length=None)
+    if len(partes) != meta.get("chunks", len(partes)):
+        return None
+    conteudo = b"".join(bytes(p["data"]) for p in partes)
+    if hashlib.sha256(conteudo).hexdigest() != sha256:
+        return None
+    return conteudo
+
+
+async def carregar_logo(db, evento: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Logo do evento no formato aceito por `_render_layout_to_image`.
+
+    Usa `logo_asset` quando presente; para eventos ainda não migrados busca
+    apenas o campo `logo_blob` legado, uma vez por evento quando ele não existe.
+    """
+    if not evento:
+        return None
+    referencia = evento.get("logo_asset")
+    if referencia:
+        conteudo = await carregar_asset(db, referencia.get("sha256"))
+        if conteudo is None:
+            return None
+        return {
+            "bytes": conteudo,
+            "sha256": referencia.get("sha256"),
+            "content_type": referencia.get("content_type"),
+            "filename": referencia.get("filename"),
+        }
+    if "logo_blob" in evento:
+        return evento.get("logo_blob")
+    chave = str(evento.get("_id"))
+    if chave in _sem_logo_legado:
+        return None
+    legado = await db.eventos.find_one(_filtro_evento(evento.get("_id")), {"logo_blob": 1})
+    logo_blob = (legado or {}).get("logo_blob")
+    if logo_blob is None:
+        _sem_logo_legado.obter(chave, lambda: True)
+    return logo_blob
+
+
+async def migrar_logo_evento(db, evento: Dict[str, Any]) -> bool:
+    """Move `logo_blob` do evento para o armazenamento de assets."""
+    logo_blob = evento.get("logo_blob")
+    if not isinstance(logo_blob, dict) or not logo_blob.get("data"):
+        return False
+    conteudo = base64.b64decode(logo_blob["data"])
+    referencia = await salvar_asset(db, conteudo, logo_blob.get("content_type"), logo_blob.get("filename"))
+    await db.eventos.update_one(
+        {"_id": evento["_id"]},
+        {"$set": {"logo_asset": referencia}, "$unset": {"logo_blob": ""}}
+    )
+    return True
+
+
+async def migrar_logos(db) -> int:
+    """Migra todos os eventos que ainda guardam `logo_blob`; retorna quantos migrou."""
+    migrados = 0
+    cursor = db.eventos.find({"logo_blob": {"$exists": True}}, {"logo_blob": 1})
+    async for evento in cursor:
+        if await migrar_logo_evento(db, evento):
+            migrados += 1
+    return migrados
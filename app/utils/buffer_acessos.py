@@ -0,0 +1,198 @@
+"""Buffer de escrita (write-behind) para o log de acessos `validacoes_acesso`.
+
+A portaria responde à catraca assim que decide o acesso; o registro do acesso
+entra em um buffer em memória, limitado, que é gravado com `insert_many` quando
+atinge `ACESSOS_BUFFER_LOTE` registros ou quando vence a janela máxima de perda
+do evento mais exigente entre os pendentes. No desligamento da aplicação o
+buffer é descarregado (`shutdown_db_client`).
+
+Com o buffer cheio o chamador aguarda uma descarga (backpressure); se mesmo
+assim não houver espaço (ex.: banco indisponível) o registro é descartado e
+contabilizado em `descartados`.
+
+A durabilidade é configurável por evento (`log_acessos_modo`):
+- "sync": grava antes de responder (comportamento anterior);
+- "buffer": grava em segundo plano, com perda máxima de
+  `log_acessos_janela_segundos` em caso de queda do processo.
+"""
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from typing import Dict, Any, List, Optional
+
+from pymongo.errors import BulkWriteError
+
+from app.utils.metricas_evento import registrar_validacoes
+
+logger = logging.getLogger(__name__)
+
+MODO_SYNC = "sync"
+MODO_BUFFER = "buffer"
+
+TAMANHO_MAXIMO = int(os.getenv("ACESSOS_BUFFER_MAX", "10000"))
+TAMANHO_LOTE = int(os.getenv("ACESSOS_BUFFER_LOTE", "200"))
+JANELA_PADRAO = float(os.getenv("ACESSOS_BUFFER_JANELA_SEGUNDOS", "2"))
+# intervalo entre novas tentativas após falha de gravação
+ESPERA_FALHA = 1.0
+
+
+class BufferAcessos:
+    """Fila limitada de registros de acesso com descarga por tamanho ou prazo."""
+
+    def __init__(self, tamanho_maximo: int = TAMANHO_MAXIMO, tamanho_lote: int = TAMANHO_LOTE):
+        self.tamanho_maximo = tamanho_maximo
+        self.tamanho_lote = tamanho_lote
+        self._pendentes: deque = deque()
+        self._prazo: Optional[float] = None
+        self._loop = None
+        self._acordar: Optional[asyncio.Event] = None
+        self._descarga: Optional[asyncio.Lock] = None
+        self._tarefa: Optional[asyncio.Task] = None
+        self.metricas: Dict[str, int] = {
+            "enfileirados": 0,
+            "gravados": 0,
+            "descartados": 0,
+            "descargas": 0,
+            "falhas": 0,
+            "backpressure": 0,
+        }
+
+    def _garantir_tarefa(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # primeiro uso (ou novo event loop, como nos testes): recria primitivas
+            self._loop = loop
+            self._acordar = asyncio.Event()
+            self._descarga = asyncio.Lock()
+            self._tarefa = None
+        if self._tarefa is None or self._tarefa.done():
+            self._tarefa = loop.create_task(self._executar())
+
+    async def registrar(self, db, docs: List[Dict[str, Any]], janela: float = JANELA_PADRAO) -> int:
+        """Enfileira registros de acesso; retorna quantos foram aceitos."""
+        self._garantir_tarefa()
+        aceitos = 0
+        for doc in docs:
+            if len(self._pendentes) >= self.tamanho_maximo:
+                self.metricas["backpressure"] += 1
+                await self.descarregar()
+                if len(self._pendentes) >= self.tamanho_maximo:
+                    self.metricas["descartados"] += 1
+                    logger.warning("Buffer de acessos cheio: registro descartado (evento %s)", doc.get("evento_id"))
+                    continue
+            self._pendentes.append((db, doc))
+            aceitos += 1
+        self.metricas["enfileirados"] += aceitos
+
+        prazo = time.monotonic() + janela
+        if self._prazo is None or prazo < self._prazo:
+            self._prazo = prazo
+            self._acordar.set()
+        if len(self._pendentes) >= self.tamanho_lote:
+            self._acordar.set()
+        return aceitos
+
+    async def _executar(self) -> None:
+        while True:
+            espera = None if self._prazo is None else max(0.0, self._prazo - time.monotonic())
+            try:
+                await asyncio.wait_for(self._acordar.wait(), espera)
+            except asyncio.TimeoutError:
+                pass
+            self._acordar.clear()
+            vencido = self._prazo is not None and self._prazo <= time.monotonic()
+            if vencido or len(self._pendentes) >= self.tamanho_lote:
+                await self.descarregar()
+
+    async def descarregar(self) -> None:
+        """Grava todos os registros pendentes com `insert_many` (agrupados por banco)."""
+        if self._descarga is None:
+            return
+        async with self._descarga:
+            while self._pendentes:
+                lote = [self._pendentes.popleft() for _ in range(min(self.tamanho_lote, len(self._pendentes)))]
+                por_db: Dict[int, Any] = {}
+                for db, doc in lote:
+                    por_db.setdefault(id(db), (db, []))[1].append(doc)
+                falhou = []
+                for db, docs in por_db.values():
+                    try:
+                        await db.validacoes_acesso.insert_many(docs, ordered=False)
+                        gravados = docs
+                    except BulkWriteError as exc:
+                        # 11000: o registro já está gravado (tentativa anterior aplicada
+                        # pelo servidor); só os demais erros voltam para a fila
+                        erros = {
+                            e["index"] for e in exc.details.get("writeErrors", []) if e.get("code") != 11000
+                        }
+                        gravados = [d for i, d in enumerate(docs) if i not in erros]
+                        if erros:
+                            self.metricas["falhas"] += 1
+                            logger.warning("Falha ao gravar %d registros de acesso: %s", len(erros), exc)
+                            falhou.extend((db, docs[i]) for i in sorted(erros))
+                    except Exception as exc:
+                        self.metricas["falhas"] += 1
+                        logger.warning("Falha ao gravar %d registros de acesso: %s", len(docs), exc)
+                        falhou.extend((db, d) for d in docs)
+                        continue
+                    self.metricas["gravados"] += len(gravados)
+                    try:
+                        await registrar_validacoes(db, gravados)
+                    except Exception as exc:
+                        # os registros já estão gravados: não voltam para a fila
+                        logger.warning("Falha ao contabilizar %d validações: %s", len(gravados), exc)
+                self.metricas["descargas"] += 1
+                if falhou:
+                    # devolve ao início da fila, respeitando o limite, e tenta de novo depois
+                    espaco = self.tamanho_maximo - len(self._pendentes)
+                    self.metricas["descartados"] += max(0, len(falhou) - espaco)
+                    for item in reversed(falhou[:max(0, espaco)]):
+                        self._pendentes.appendleft(item)
+                    self._prazo = time.monotonic() + ESPERA_FALHA
+                    return
+            self._prazo = None
+
+    async def encerrar(self) -> None:
+        """Para a tarefa de descarga e grava o que estiver pendente."""
+        if self._tarefa is not None and not self._tarefa.done():
+            self._tarefa.cancel()
+            try:
+                await self._tarefa
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._tarefa = None
+        await self.descarregar()
+
+    def estado(self) -> Dict[str, Any]:
+        return {**self.metricas, "pendentes": len(self._pendentes), "capacidade": self.tamanho_maximo}
+
+
+buffer_acessos = BufferAcessos()
+
+
+async def registrar_acessos(db, docs: List[Dict[str, Any]], modo: str = MODO_BUFFER, janela: float = JANELA_PADRAO) -> None:
+    """Registra acessos conforme a durabilidade configurada para o evento."""
+    if not docs:
+        return
+    if modo == MODO_SYNC:
+        if len(docs) == 1:
+            await db.validacoes_acesso.insert_one(docs[0])
+        else:
+            await db.validacoes_acesso.insert_many(docs)
+        await registrar_validacoes(db, docs)
+        return
+    await buffer_acessos.registrar(db, docs, janela)
+
+
+async def descarregar_acessos() -> None:
+    await buffer_acessos.descarregar()
+
+
+async def encerrar_buffer_acessos() -> None:
+    await buffer_acessos.encerrar()
+
+
+def metricas_buffer_acessos() -> Dict[str, Any]:
+    return buffer_acessos.estado()
@@ -0,0 +1,136 @@
+"""Busca de participantes por nome, sem acentos e por prefixo (digitação na bilheteria).
+
+Cada participante guarda, além do `nome`:
+
+- `nome_busca`: o nome sem acentos, em minúsculas e com espaços simples
+  ("João  da Silva" -> "joao da silva");
+- `nome_termos`: as palavras de `nome_busca` (["joao", "da", "silva"]).
+
+As consultas usam só regex ancoradas e sem opções (`^joao`), que o MongoDB
+resolve como intervalo no índice `(ingressos.evento_id, nome_busca)` e no
+índice de `nome_termos`; não há varredura da coleção a cada tecla. A busca
+"Joao" encontra "João" e vice-versa, e "silva" encontra "João da Silva".
+
+Participantes gravados antes desses campos (`nome_busca` ausente) ainda são
+encontrados pela regex antiga, restrita a eles pelo mesmo índice, até
+`scripts/indexar_busca_participantes.py` preenchê-los.
+"""
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+# letras que aparecem acentuadas em nomes: usadas na regex dos participantes ainda não indexados
+_VARIANTES = {
+    "a": "aàáâãäå", "e": "eèéêë", "i": "iìíîï", "o": "oòóôõö", "u": "uùúûü",
+    "c": "cç", "n": "nñ", "y": "yýÿ",
+}
+_NAO_ALFANUMERICO = re.compile(r"[^0-9a-z]+")
+
+# relevância: nome igual, nome começando pelo termo, alguma palavra começando por ele, demais
+EXATO, PREFIXO, PREFIXO_TERMO, OUTROS = range(4)
+
+
+def normalizar_nome(nome: Any) -> str:
+    """Nome sem acentos, em minúsculas, só com letras/dígitos separados por um espaço."""
+    if not nome:
+        return ""
+    decomposto = unicodedata.normalize("NFKD", str(nome))
+    sem_acento = "".join(c for c in decomposto if not unicodedata.combining(c))
+    return _NAO_ALFANUMERICO.sub(" ", sem_acento.lower()).strip()
+
+
+def campos_busca(nome: Any) -> Dict[str, Any]:
+    """Campos de busca a gravar junto com o `nome` do participante."""
+    nome_busca = normalizar_nome(nome)
+    return {"nome_busca": nome_busca, "nome_termos": list(dict.fromkeys(nome_busca.split()))}
+
+
+def _regex_legado(termo: str) -> str:
+    """Regex sem âncora e tolerante a acentos para o campo `nome` original."""
+    partes = []
+    for c in normalizar_nome(termo):
+        if c == " ":
+            partes.append(r"\W+")
+        elif c in _VARIANTES:
+            partes.append(f"[{_VARIANTES[c]}]")
+        else:
+            partes.append(re.escape(c))
+    return "".join(partes)
+
+
+def filtro_nome(termo: str) -> Dict[str, Any]:
+    """Condição de nome para combinar com outros filtros (ex.: listagens paginadas)."""
+    normalizado = normalizar_nome(termo)
+    if not normalizado:
+        return {}
+    termos = normalizado.split()
+    return {"$or": [
+        {"nome_busca": {"$regex": "^" + re.escape(normalizado)}},
+        {"$and": [{"nome_termos": {"$regex": "^" + re.escape(t)}} for t in termos]},
+        {"nome_busca": None, "nome": {"$regex": _regex_legado(termo), "$options": "i"}},
+    ]}
+
+
+def relevancia(nome: Any, termo: str) -> int:
+    normalizado = normalizar_nome(termo)
+    nome_busca = normalizar_nome(nome)
+    if nome_busca == normalizado:
+        return EXATO
+    if nome_busca.startswith(normalizado):
+        return PREFIXO
+    palavras = nome_busca.split()
+    if all(any(p.startswith(t) for p in palavras) for t in normalizado.split()):
+        return PREFIXO_TERMO
+    return OUTROS
+
+
+def ordenar_por_relevancia(docs: List[Dict[str, Any]], termo: str) -> List[Dict[str, Any]]:
+    """Nome exato primeiro, depois prefixo do nome, prefixo de palavra e o resto; então por nome."""
+    return sorted(docs, key=lambda d: (relevancia(d.get("nome"), termo), normalizar_nome(d.get("nome"))))
+
+
+async def buscar_por_nome(db, filtro: Dict[str, Any], termo: str, limite: int = 20,
+                          projecao: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """Participantes que atendem `filtro` (ex.: `{"ingressos.evento_id": ...}`) cujo nome casa com `termo`.
+
+    Consulta em etapas, cada uma por índice, até completar `limite`:
+    prefixo do nome inteiro, prefixo de cada palavra e, por fim, os
+    participantes ainda sem `nome_busca`. O resultado vem ordenado por relevância.
+    """
+    normalizado = normalizar_nome(termo)
+    if not normalizado:
+        return []
+    termos = normalizado.split()
+    etapas = [
+        {"nome_busca": {"$regex": "^" + re.escape(normalizado)}},
+        {"$and": [{"nome_termos": {"$regex": "^" + re.escape(t)}} for t in termos]},
+        {"nome_busca": None, "nome": {"$regex": _regex_legado(termo), "$options": "i"}},
+    ]
+    encontrados: Dict[Any, Dict[str, Any]] = {}
+    for condicao in etapas:
+        if len(encontrados) >= limite:
+            break
+        query = {**filtro, **condicao} if "$and" not in filtro else {"$and": [filtro, condicao]}
+        cursor = db.participantes.find(query, projecao) if projecao else db.participantes.find(query)
+        async for doc in cursor.sort("nome_busca", 1).limit(limite):
+            encontrados.setdefault(doc.get("_id"), doc)
+    return ordenar_por_relevancia(list(encontrados.values()), termo)[:limite]
+
+
+async def indexar_participantes(db, tamanho_lote: int = 500) -> int:
+    """Preenche `nome_busca`/`nome_termos` dos participantes que ainda não os têm; retorna quantos."""
+    total = 0
+    operacoes = []
+    cursor = db.participantes.find({"nome_busca": None}, {"nome": 1})
+    async for doc in cursor:
+        operacoes.append(UpdateOne({"_id": doc["_id"]}, {"$set": campos_busca(doc.get("nome"))}))
+        if len(operacoes) >= tamanho_lote:
+            await db.participantes.bulk_write(operacoes, ordered=False)
+            total += len(operacoes)
+            operacoes = []
+    if operacoes:
+        await db.participantes.bulk_write(operacoes, ordered=False)
+        total += len(operacoes)
+    return total
@@ -0,0 +1,177 @@
+"""Livro-razão de capacidade por ilha (coleção `ilha_capacidade`).
+
+Cada documento é identificado por `(evento_id, ilha_id)` e guarda em `ocupados`
+quantos ingressos ativos consomem a capacidade daquela ilha. A emissão reserva
+uma vaga com um único incremento condicional (`ocupados < capacidade`) e o
+cancelamento libera a vaga com um decremento, de modo que a verificação de
+capacidade é O(1) e não sofre corrida entre bilheterias concorrentes.
+
+Quando o documento de uma ilha ainda não existe ele é semeado a partir dos
+ingressos embutidos em `participantes`; `reconciliar_capacidade` reconstrói
+todos os contadores de um evento a partir da mesma fonte.
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Dict, Any, Iterable, Optional, Set
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+STATUS_CANCELADO = "Cancelado"
+
+
+async def _fetch_evento(db, evento_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        return await db.eventos.find_one({"_id": ObjectId(evento_id)}, {"tipos_ingresso": 1})
+    except Exception:
+        return await db.eventos.find_one({"_id": evento_id}, {"tipos_ingresso": 1})
+
+
+async def permissoes_por_tipo(db, evento_id: str, evento: Optional[Dict[str, Any]] = None) -> Dict[str, Set[str]]:
+    """Mapa `tipo_ingresso_id -> {ilha_id}` com as permissões de cada tipo do evento.
+
+    Considera os tipos embutidos no evento (por `_id`/`id` e por `numero`) e a
+    coleção legada `tipos_ingresso`.
+    """
+    if evento is None:
+        evento = await _fetch_evento(db, evento_id)
+    mapa: Dict[str, Set[str]] = {}
+    for t in (evento or {}).get("tipos_ingresso", []) or []:
+        perms = set(str(p) for p in (t.get("permissoes") or []))
+        for chave in (t.get("_id") or t.get("id"), t.get("numero")):
+            if chave is not None:
+                mapa.setdefault(str(chave), set()).update(perms)
+    try:
+        async for t in db.tipos_ingresso.find({"evento_id": evento_id}):
+            mapa.setdefault(str(t.get("_id")), set()).update(str(p) for p in (t.get("permissoes") or []))
+    except Exception:
+        pass
+    return mapa
+
+
+def ilhas_afetadas(ingresso: Dict[str, Any], permissoes: Dict[str, Set[str]]) -> Set[str]:
+    """Ilhas cuja capacidade é consumida pelo ingresso: a ilha explícita e as permitidas pelo tipo."""
+    ilhas = set(permissoes.get(str(ingresso.get("tipo_ingresso_id")), set()))
+    if ingresso.get("ilha_id"):
+        ilhas.add(str(ingresso.get("ilha_id")))
+    return ilhas
+
+
+async def contar_ocupacao(db, evento_id: str, permissoes: Optional[Dict[str, Set[str]]] = None) -> Dict[str, int]:
+    """Conta, a partir dos ingressos embutidos, quantos ingressos ativos afetam cada ilha do evento."""
+    if permissoes is None:
+        permissoes = await permissoes_por_tipo(db, evento_id)
+    contagem: Dict[str, int] = {}
+    cursor = db.participantes.find({"ingressos.evento_id": evento_id}, {"ingressos": 1})
+    async for p in cursor:
+        for ing in p.get("ingressos", []) or []:
+            if str(ing.get("evento_id")) != str(evento_id):
+                continue
+            if ing.get("status") == STATUS_CANCELADO:
+                continue
+            for ilha_id in ilhas_afetadas(ing, permissoes):
+                contagem[ilha_id] = contagem.get(ilha_id, 0) + 1
+    return contagem
+
+
+async def _semear(db, col, evento_id: str, ilha_id: str) -> None:
+    """Cria o contador de uma ilha a partir dos ingressos existentes (idempotente)."""
+    contagem = await contar_ocupacao(db, evento_id)
+    now = datetime.now(timezone.utc)
+    try:
+        await col.update_one(
+            {"evento_id": evento_id, "ilha_id": ilha_id},
+            {"$setOnInsert": {"ocupados": contagem.get(ilha_id, 0), "atualizado_em": now}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # outra bilheteria semeou o mesmo contador ao mesmo tempo
+        pass
+
+
+async def ocupacao_ilha(db, evento_id: str, ilha_id: str) -> int:
+    """Retorna quantos ingressos ativos consomem a capacidade da ilha."""
+    col = db.ilha_capacidade
+    doc = await col.find_one({"evento_id": evento_id, "ilha_id": ilha_id})
+    if not doc:
+        await _semear(db, col, evento_id, ilha_id)
+        doc = await col.find_one({"evento_id": evento_id, "ilha_id": ilha_id})
+    return int((doc or {}).get("ocupados", 0))
+
+
+async def reservar_vaga(db, evento_id: str, ilha_id: str, capacidade_maxima: int) -> bool:
+    """Reserva uma vaga na ilha com um incremento condicional atômico.
+
+    Retorna False quando a ilha já atingiu `capacidade_maxima`.
+    """
+    col = db.ilha_capacidade
+    filtro = {"evento_id": evento_id, "ilha_id": ilha_id}
+    update = {"$inc": {"ocupados": 1}, "$set": {"atualizado_em": datetime.now(timezone.utc)}}
+    result = await col.update_one({**filtro, "ocupados": {"$lt": capacidade_maxima}}, update)
+    if result.matched_count:
+        return True
+    if await col.find_one(filtro, {"_id": 1}):
+        return False
+    # primeiro uso da ilha: semeia o contador e tenta novamente
+    await _semear(db, col, evento_id, ilha_id)
+    result = await col.update_one({**filtro, "ocupados": {"$lt": capacidade_maxima}}, update)
+    return bool(result.matched_count)
+
+
+async def registrar_ocupacao(db, evento_id: str, ilhas: Iterable[str], delta: int) -> None:
+    """Aplica `delta` aos contadores já existentes das ilhas informadas.
+
+    Ilhas sem contador são ignoradas: serão semeadas a partir dos ingressos
+    embutidos (que já refletem a alteração) no primeiro acesso.
+    """
+    col = db.ilha_capacidade
+    ilhas = [i for i in ilhas if i]
+    if not ilhas:
+        return
+    await col.update_many(
+        {"evento_id": evento_id, "ilha_id": {"$in": ilhas}},
+        {"$inc": {"ocupados": delta}, "$set": {"atualizado_em": datetime.now(timezone.utc)}},
+    )
+
+
+async def registrar_emissao(db, evento_id: str, ingresso: Dict[str, Any], permissoes: Optional[Dict[str, Set[str]]] = None) -> None:
+    """Contabiliza um ingresso emitido fora da bilheteria (inscrição, planilha, admin).
+
+    Esses caminhos não aplicam limite de capacidade, então o incremento é
+    incondicional; falhas apenas deixam o contador para a reconciliação.
+    """
+    try:
+        if permissoes is None:
+            permissoes = await permissoes_por_tipo(db, evento_id)
+        await registrar_ocupacao(db, evento_id, ilhas_afetadas(ingresso, permissoes), 1)
+    except Exception as exc:
+        # o contador fica para `reconciliar_capacidade`
+        logger.warning("Falha ao contabilizar ingresso do evento %s na capacidade: %s", evento_id, exc)
+
+
+async def liberar_vaga(db, evento_id: str, ingresso: Dict[str, Any], permissoes: Optional[Dict[str, Set[str]]] = None) -> None:
+    """Libera as vagas consumidas por um ingresso cancelado."""
+    if permissoes is None:
+        permissoes = await permissoes_por_tipo(db, evento_id)
+    await registrar_ocupacao(db, evento_id, ilhas_afetadas(ingresso, permissoes), -1)
+
+
+async def reconciliar_capacidade(db, evento_id: str) -> Dict[str, int]:
+    """Reconstrói todos os contadores do evento a partir dos ingressos embutidos."""
+    col = db.ilha_capacidade
+    contagem = await contar_ocupacao(db, evento_id)
+    now = datetime.now(timezone.utc)
+    # zera ilhas que não possuem mais ingressos ativos
+    await col.update_many(
+        {"evento_id": evento_id, "ilha_id": {"$nin": list(contagem.keys())}},
+        {"$set": {"ocupados": 0, "atualizado_em": now}},
+    )
+    for ilha_id, ocupados in contagem.items():
+        await col.update_one(
+            {"evento_id": evento_id, "ilha_id": ilha_id},
+            {"$set": {"ocupados": ocupados, "atualizado_em": now}},
+            upsert=True,
+        )
+    return contagem
@@ -0,0 +1,158 @@
+"""Cache do contexto de evento usado pelas rotas de bilheteria e portaria.
+
+Cada requisição autenticada por token resolvia o evento com
+`eventos.find_one({"token_...": token})` e, em seguida, o handler buscava o
+mesmo evento de novo pelo `_id`. Este módulo mantém um LRU limitado, com TTL,
+de snapshots do evento (sem `logo_blob`) indexados tanto pelo token quanto pelo
+`_id`: a resolução do token popula o cache e o handler reaproveita o snapshot.
+
+Cada leitura devolve uma cópia do snapshot, de modo que alterações feitas pelo
+handler não vazam para outras requisições. As rotas administrativas chamam
+`invalidar_evento` após alterar o evento; em implantações com vários workers
+as demais réplicas convergem em até `EVENTO_CACHE_TTL_SEGUNDOS`.
+"""
+import copy
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set, Tuple
+
+from bson import ObjectId
+
+from app.utils.assets import PROJECAO_SEM_LOGO
+
+EVENTO_CACHE_MAX = int(os.getenv("EVENTO_CACHE_MAX", "1024"))
+EVENTO_CACHE_TTL_SEGUNDOS = float(os.getenv("EVENTO_CACHE_TTL_SEGUNDOS", "30"))
+
+# campos pesados que nunca entram no snapshot
+PROJECAO = PROJECAO_SEM_LOGO
+
+CAMPOS_TOKEN = ("token_bilheteria", "token_portaria")
+
+Chave = Tuple[str, str]
+
+
+class CacheContextoEvento:
+    """LRU com TTL de snapshots de evento, indexado por token e por `_id`."""
+
+    def __init__(self, maximo: int = EVENTO_CACHE_MAX, ttl: float = EVENTO_CACHE_TTL_SEGUNDOS):
+        self.maximo = maximo
+        self.ttl = ttl
+        self._entradas: "OrderedDict[Chave, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._chaves_evento: Dict[str, Set[Chave]] = {}
+        self.acertos = 0
+        self.falhas = 0
+
+    def obter(self, chave: Chave) -> Optional[Dict[str, Any]]:
+        entrada = self._entradas.get(chave)
+        if entrada is None:
+            self.falhas += 1
+            return None
+        expira_em, evento = entrada
+        if expira_em <= time.monotonic():
+            self._remover(chave)
+            self.falhas += 1
+            return None
+        self._entradas.move_to_end(chave)
+        self.acertos += 1
+        return copy.deepcopy(evento)
+
+    def guardar(self, evento: Dict[str, Any]) -> None:
+        """Guarda o snapshot sob o `_id` e os tokens do evento."""
+        evento_id = str(evento["_id"])
+        snapshot = _snapshot(evento)
+        expira_em = time.monotonic() + self.ttl
+        chaves = [("_id", evento_id)] + [(c, evento[c]) for c in CAMPOS_TOKEN if evento.get(c)]
+        for chave in chaves:
+            self._entradas[chave] = (expira_em, snapshot)
+            self._entradas.move_to_end(chave)
+            self._chaves_evento.setdefault(evento_id, set()).add(chave)
+        while len(self._entradas) > self.maximo:
+            self._remover(next(iter(self._entradas)))
+
+    def invalidar_evento(self, evento_id: str) -> None:
+        for chave in self._chaves_evento.pop(str(evento_id), set()):
+            self._entradas.pop(chave, None)
+
+    def limpar(self) -> None:
+        self._entradas.clear()
+        self._chaves_evento.clear()
+
+    def _remover(self, chave: Chave) -> None:
+        entrada = self._entradas.pop(chave, None)
+        if entrada is None:
+            return
+        evento_id = str(entrada[1].get("_id"))
+        chaves = self._chaves_evento.get(evento_id)
+        if chaves is not None:
+            chaves.discard(chave)
+            if not chaves:
+                self._chaves_evento.pop(evento_id, None)
+
+    def __len__(self) -> int:
+        return len(self._entradas)
+
+
+def _snapshot(evento: Dict[str, Any]) -> Dict[str, Any]:
+    return copy.deepcopy({k: v for k, v in evento.items() if k not in PROJECAO})
+
+
+_cache = CacheContextoEvento()
+
+
+async def evento_por_token(db, campo: str, token: str) -> Optional[Dict[str, Any]]:
+    """Resolve um token de bilheteria/portaria para o snapshot do evento."""
+    if campo not in CAMPOS_TOKEN or not token:
+        return None
+    evento = _cache.obter((campo, token))
+    if evento is not None:
+        return evento
+    evento = await db.eventos.find_one({campo: token}, PROJECAO)
+    if not evento:
+        return None
+    _cache.guardar(evento)
+    return _snapshot(evento)
+
+
+async def evento_por_qualquer_token(db, token: str) -> Optional[Dict[str, Any]]:
+    """Resolve um token que pode ser de bilheteria ou de portaria (uma única consulta)."""
+    if not token:
+        return None
+    for campo in CAMPOS_TOKEN:
+        evento = _cache.obter((campo, token))
+        if evento is not None:
+            return evento
+    evento = await db.eventos.find_one({"$or": [{campo: token} for campo in CAMPOS_TOKEN]}, PROJECAO)
+    if not evento:
+        return None
+    _cache.guardar(evento)
+    return _snapshot(evento)
+
+
+async def evento_por_id(db, evento_id: str) -> Optional[Dict[str, Any]]:
+    """Snapshot do evento pelo `_id` (aceita ObjectId em string ou `_id` textual)."""
+    evento = _cache.obter(("_id", str(evento_id)))
+    if evento is not None:
+        return evento
+    try:
+        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, PROJECAO)
+    except Exception:
+        evento = await db.eventos.find_one({"_id": evento_id}, PROJECAO)
+    if not evento:
+        return None
+    _cache.guardar(evento)
+    return _snapshot(evento)
+
+
+def invalidar_evento(evento_id: str) -> None:
+    """Descarta o snapshot do evento (chamar após qualquer alteração no evento)."""
+    if evento_id is not None:
+        _cache.invalidar_evento(str(evento_id))
+
+
+def limpar_cache() -> None:
+    _cache.limpar()
+
+
+def metricas_cache() -> Dict[str, int]:
+    return {"entradas": len(_cache), "acertos": _cache.acertos, "falhas": _cache.falhas}
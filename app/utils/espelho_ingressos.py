@@ -0,0 +1,156 @@
+"""Caixa de saída da emissão da bilheteria: espelho em `ingressos_emitidos` e contadores.
+
+A emissão da bilheteria grava o ingresso em `participantes.ingressos` já com
+`espelho_pendente: True`, no mesmo `update_one` que o insere. A marca é a caixa
+de saída (outbox): durável e atômica com o próprio ingresso, sem outras
+escritas no caminho da mesa além da reserva de vaga da ilha pedida.
+
+Uma tarefa em segundo plano (`iniciar_espelho`, no startup) procura os
+ingressos marcados (índice esparso em `ingressos.espelho_pendente`) e, para
+cada um:
+
+1. grava o ingresso em `ingressos_emitidos` com upsert pelo `_id` (repetir
+   após uma queda não duplica); uma falha mantém a marca para a próxima passada;
+2. remove a marca com um `$unset` condicionado a ela: só um processo vence,
+   e só o vencedor contabiliza o ingresso;
+3. ao fim da passada, por evento, aplica os efeitos que antes eram gravados na
+   emissão: ocupação das demais ilhas liberadas pelo tipo (`ilha_capacidade`),
+   métricas (`evento_metricas`) e o histórico do snapshot offline
+   (`ingressos_alteracoes`), cada um com uma escrita para todos os ingressos
+   do evento na passada.
+
+Os efeitos ficam para depois da marca removida: uma queda entre os dois passos
+deixa os contadores para a reconciliação (`reconciliar_capacidade`,
+`reconstruir_metricas`), como as falhas de contabilização na emissão já
+deixavam, em vez de contar o ingresso duas vezes. No desligamento é feita uma
+última passada.
+"""
+import asyncio
+import logging
+import os
+from collections import Counter, defaultdict
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo.errors import DuplicateKeyError
+
+from app.utils import metricas_evento
+from app.utils.capacidade import ilhas_afetadas, permissoes_por_tipo, registrar_ocupacao
+from app.utils.contexto_evento import evento_por_id
+from app.utils.snapshot_portaria import registrar_alteracoes
+
+logger = logging.getLogger(__name__)
+
+CAMPO_PENDENTE = "espelho_pendente"
+LOTE = int(os.getenv("ESPELHO_LOTE", "100"))
+INTERVALO = float(os.getenv("ESPELHO_INTERVALO_SEGUNDOS", "1"))
+
+_tarefa: Optional[asyncio.Task] = None
+_db = None
+
+
+def documento_legado(ingresso: Dict[str, Any]) -> Dict[str, Any]:
+    """Documento de `ingressos_emitidos` para um ingresso embutido (`_id` como ObjectId)."""
+    doc = {k: v for k, v in ingresso.items() if k != CAMPO_PENDENTE}
+    try:
+        doc["_id"] = ObjectId(doc["_id"])
+    except (InvalidId, TypeError, KeyError):
+        pass
+    return doc
+
+
+async def espelhar(db, participante_id, ingresso: Dict[str, Any]) -> bool:
+    """Grava um ingresso pendente na coleção antiga e remove a marca.
+
+    True se este processo removeu a marca (e deve contabilizar o ingresso);
+    False se deve ser tentado de novo ou se outro processo já o tratou.
+    """
+    doc = documento_legado(ingresso)
+    try:
+        await db.ingressos_emitidos.update_one(
+            {"_id": doc["_id"]}, {"$set": {k: v for k, v in doc.items() if k != "_id"}}, upsert=True
+        )
+    except DuplicateKeyError:
+        # a coleção antiga aceita um ingresso por participante no evento; o excedente
+        # não é espelhado (como na escrita dupla anterior)
+        logger.info("Ingresso %s não espelhado: já existe na coleção antiga", doc.get("_id"))
+    except Exception as exc:
+        logger.warning("Falha ao espelhar ingresso %s: %s", doc.get("_id"), exc)
+        return False
+    resultado = await db.participantes.update_one(
+        {"_id": participante_id,
+         "ingressos": {"$elemMatch": {"_id": ingresso.get("_id"), CAMPO_PENDENTE: True}}},
+        {"$unset": {f"ingressos.$.{CAMPO_PENDENTE}": ""}},
+    )
+    return bool(resultado.matched_count)
+
+
+async def contabilizar(db, evento_id: str, ingressos: List[Dict[str, Any]]) -> None:
+    """Ocupação das demais ilhas, métricas e histórico do snapshot para ingressos emitidos na bilheteria.
+
+    A ilha pedida na emissão já foi reservada (`reservar_vaga`) e não é
+    incrementada de novo. Falhas deixam os contadores para a reconciliação.
+    """
+    try:
+        permissoes = await permissoes_por_tipo(db, evento_id, await evento_por_id(db, evento_id))
+        ocupacao: Counter = Counter()
+        for ingresso in ingressos:
+            ocupacao.update(ilhas_afetadas(ingresso, permissoes) - {ingresso.get("ilha_id")})
+        por_delta: Dict[int, List[str]] = defaultdict(list)
+        for ilha_id, delta in ocupacao.items():
+            por_delta[delta].append(ilha_id)
+        for delta, ilhas in por_delta.items():
+            await registrar_ocupacao(db, evento_id, ilhas, delta)
+        await metricas_evento.registrar_emissoes(db, evento_id, ingressos, permissoes)
+    except Exception as exc:
+        logger.warning("Falha ao contabilizar %d ingressos do evento %s: %s", len(ingressos), evento_id, exc)
+    await registrar_alteracoes(db, evento_id, ingressos)
+
+
+async def drenar(db, limite: int = LOTE) -> int:
+    """Uma passada pela caixa de saída (até `limite` participantes); retorna quantos ingressos espelhou."""
+    por_evento: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    cursor = db.participantes.find({f"ingressos.{CAMPO_PENDENTE}": True}, {"ingressos": 1}).limit(limite)
+    async for participante in cursor:
+        for ingresso in participante.get("ingressos") or []:
+            if ingresso.get(CAMPO_PENDENTE) and await espelhar(db, participante["_id"], ingresso):
+                limpo = {k: v for k, v in ingresso.items() if k != CAMPO_PENDENTE}
+                por_evento[str(ingresso.get("evento_id"))].append(limpo)
+    for evento_id, ingressos in por_evento.items():
+        await contabilizar(db, evento_id, ingressos)
+    return sum(len(ingressos) for ingressos in por_evento.values())
+
+
+async def _executar(db) -> None:
+    while True:
+        try:
+            await drenar(db)
+        except Exception as exc:
+            logger.warning("Falha ao drenar o espelho de ingressos: %s", exc)
+        await asyncio.sleep(INTERVALO)
+
+
+def iniciar_espelho(db) -> None:
+    """Inicia a tarefa de espelhamento (uma por processo)."""
+    global _tarefa, _db
+    _db = db
+    if _tarefa is None or _tarefa.done():
+        _tarefa = asyncio.get_running_loop().create_task(_executar(db))
+
+
+async def encerrar_espelho() -> None:
+    """Para a tarefa e espelha o que estiver pendente."""
+    global _tarefa
+    if _tarefa is not None and not _tarefa.done():
+        _tarefa.cancel()
+        try:
+            await _tarefa
+        except (asyncio.CancelledError, Exception):
+            pass
+    _tarefa = None
+    if _db is not None:
+        try:
+            await drenar(_db)
+        except Exception as exc:
+            logger.warning("Falha ao drenar o espelho de ingressos no desligamento: %s", exc)
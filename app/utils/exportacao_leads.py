@@ -0,0 +1,110 @@
+"""Exportação dos leads de um evento em streaming.
+
+Os participantes vêm de um único cursor projetado (só as colunas exportadas)
+e viram blocos de bytes conforme o cursor avança:
+
+- "csv": texto UTF-8 (com BOM, para o Excel reconhecer a acentuação);
+- "csv.gz": o mesmo CSV comprimido com gzip incrementalmente;
+- "xlsx": workbook `write_only` do openpyxl, que guarda as linhas em arquivo
+  temporário; o .xlsx (zip) só existe ao final, e é enviado em blocos a
+  partir do disco. A serialização das linhas (em lotes de
+  `LINHAS_POR_BLOCO`), o `save` e a leitura do arquivo rodam em thread, para
+  não travar o event loop em exportações grandes.
+
+Em todos os formatos a memória usada não depende do número de leads.
+"""
+import asyncio
+import csv
+import io
+import tempfile
+import zlib
+from typing import Any, AsyncIterator, Dict, List
+
+from openpyxl import Workbook
+
+CABECALHO_LEADS = ["Nome", "Email", "Telefone", "Empresa", "Cargo"]
+CAMPOS_LEADS = ["nome", "email", "telefone", "empresa", "cargo"]
+PROJECAO_LEADS = {campo: 1 for campo in CAMPOS_LEADS}
+
+FORMATOS_LEADS: Dict[str, Dict[str, str]] = {
+    "xlsx": {"media_type": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+             "extensao": "xlsx"},
+    "csv": {"media_type": "text/csv", "extensao": "csv"},
+    "csv.gz": {"media_type": "application/gzip", "extensao": "csv.gz"},
+}
+
+LINHAS_POR_BLOCO = 1000
+BLOCO_ARQUIVO = 64 * 1024
+
+
+async def linhas_leads(db, evento_id: str) -> AsyncIterator[List[Any]]:
+    """Uma linha por participante com ingresso no evento, em uma única consulta."""
+    cursor = db.participantes.find({"ingressos.evento_id": evento_id}, PROJECAO_LEADS)
+    async for participante in cursor:
+        yield [participante.get(campo) or "" for campo in CAMPOS_LEADS]
+
+
+async def gerar_csv(linhas: AsyncIterator[List[Any]]) -> AsyncIterator[bytes]:
+    """CSV em blocos de `LINHAS_POR_BLOCO` linhas."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write("\ufeff")
+    writer.writerow(CABECALHO_LEADS)
+    pendentes = 0
+    async for linha in linhas:
+        writer.writerow(linha)
+        pendentes += 1
+        if pendentes >= LINHAS_POR_BLOCO:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pendentes = 0
+    yield buffer.getvalue().encode("utf-8")
+
+
+async def gerar_gzip(blocos: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Comprime um fluxo de blocos em formato gzip, sem acumular a saída."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for bloco in blocos:
+        comprimido = compressor.compress(bloco)
+        if comprimido:
+            yield comprimido
+    yield compressor.flush()
+
+
+def _anexar_linhas(ws, linhas: List[List[Any]]) -> None:
+    for linha in linhas:
+        ws.append(linha)
+
+
+async def gerar_xlsx(linhas: AsyncIterator[List[Any]]) -> AsyncIterator[bytes]:
+    """XLSX via workbook `write_only`, enviado em blocos a partir de um arquivo temporário."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Leads")
+    ws.append(CABECALHO_LEADS)
+    lote: List[List[Any]] = []
+    async for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= LINHAS_POR_BLOCO:
+            await asyncio.to_thread(_anexar_linhas, ws, lote)
+            lote = []
+    if lote:
+        await asyncio.to_thread(_anexar_linhas, ws, lote)
+    with tempfile.TemporaryFile() as arquivo:
+        await asyncio.to_thread(wb.save, arquivo)
+        arquivo.seek(0)
+        while True:
+            bloco = await asyncio.to_thread(arquivo.read, BLOCO_ARQUIVO)
+            if not bloco:
+                break
+            yield bloco
+
+
+def exportar_leads(db, evento_id: str, formato: str) -> AsyncIterator[bytes]:
+    """Gerador de bytes da exportação no formato pedido (uma chave de `FORMATOS_LEADS`)."""
+    linhas = linhas_leads(db, evento_id)
+    if formato == "xlsx":
+        return gerar_xlsx(linhas)
+    if formato == "csv.gz":
+        return gerar_gzip(gerar_csv(linhas))
+    return gerar_csv(linhas)
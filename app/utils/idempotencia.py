@@ -0,0 +1,171 @@
+"""Chaves de idempotência (`Idempotency-Key`) para emissão, reimpressão e inscrição pública.
+
+A mesa dá toque duplo e o celular repete a requisição quando o Wi-Fi do local
+cai; sem a chave, cada repetição percorre a emissão inteira (duplica o
+ingresso ou gasta uma ida ao banco até o 409 de CPF).
+
+Com a chave, a primeira requisição reserva `<escopo>:<chave>` na coleção
+`idempotencia` (insert com `_id` único, vale entre processos), executa e grava
+a resposta serializada. Repetições devolvem a resposta guardada, com o
+cabeçalho `Idempotent-Replayed: true`, sem executar de novo; a mesma chave com
+outro corpo é 422. Uma LRU em memória evita a ida ao banco nas repetições
+servidas pelo mesmo processo e uma trava por chave faz o toque duplo esperar a
+primeira resposta em vez de receber 409.
+
+Os documentos expiram pelo índice TTL em `criado_em`
+(`IDEMPOTENCIA_TTL_SEGUNDOS`). Falhas não são guardadas: a reserva é desfeita
+e a repetição executa de novo. Uma reserva sem resposta há mais de
+`IDEMPOTENCIA_RESERVA_SEGUNDOS` (processo que caiu no meio) pode ser retomada.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from bson import json_util
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+TTL = int(os.getenv("IDEMPOTENCIA_TTL_SEGUNDOS", "86400"))
+RESERVA = int(os.getenv("IDEMPOTENCIA_RESERVA_SEGUNDOS", "30"))
+LRU_MAX = int(os.getenv("IDEMPOTENCIA_LRU_MAX", "4096"))
+CHAVE_MAX = 255
+
+# _id -> (expira em, hash do corpo, status, resposta)
+_respostas: "OrderedDict[str, Tuple[float, str, int, Any]]" = OrderedDict()
+_travas: Dict[str, asyncio.Lock] = {}
+
+
+def _impressao(corpo: Any) -> str:
+    return hashlib.sha256(json_util.dumps(jsonable_encoder(corpo), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _serializar(resultado: Any, modelo=None) -> Any:
+    """Corpo JSON da resposta como o FastAPI o enviaria (pelo `response_model`, se houver)."""
+    if modelo is not None:
+        return modelo.model_validate(dict(resultado)).model_dump(mode="json", by_alias=True)
+    return jsonable_encoder(resultado)
+
+
+def _guardar(ident: str, impressao: str, status_code: int, resposta: Any) -> None:
+    _respostas[ident] = (time.monotonic() + TTL, impressao, status_code, resposta)
+    _respostas.move_to_end(ident)
+    while len(_respostas) > LRU_MAX:
+        _respostas.popitem(last=False)
+
+
+def _da_memoria(ident: str) -> Optional[Tuple[str, int, Any]]:
+    guardada = _respostas.get(ident)
+    if guardada is None:
+        return None
+    if guardada[0] <= time.monotonic():
+        _respostas.pop(ident, None)
+        return None
+    _respostas.move_to_end(ident)
+    return guardada[1:]
+
+
+async def _do_banco(db, ident: str) -> Optional[Dict[str, Any]]:
+    return await db.idempotencia.find_one({"_id": ident})
+
+
+def _repetir(impressao: str, guardada: Tuple[str, int, Any]) -> JSONResponse:
+    impressao_guardada, status_code, resposta = guardada
+    if impressao_guardada != impressao:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail="Idempotency-Key já usada com outro conteúdo"
+        )
+    return JSONResponse(resposta, status_code=status_code, headers={"Idempotent-Replayed": "true"})
+
+
+async def _reservar(db, ident: str, impressao: str):
+    """Reserva a chave; devolve a resposta guardada (tupla) se outra requisição já concluiu."""
+    agora = datetime.now(timezone.utc)
+    try:
+        await db.idempotencia.insert_one({"_id": ident, "hash": impressao, "estado": "em_andamento", "criado_em": agora})
+        return None
+    except DuplicateKeyError:
+        pass
+    doc = await _do_banco(db, ident)
+    if doc and doc.get("estado") == "concluida":
+        return doc["hash"], doc["status_code"], json.loads(doc["resposta"])
+    # reserva abandonada por um processo que caiu no meio da execução
+    retomada = await db.idempotencia.update_one(
+        {"_id": ident, "estado": "em_andamento", "criado_em": {"$lt": agora - timedelta(seconds=RESERVA)}},
+        {"$set": {"hash": impressao, "criado_em": agora}},
+    )
+    if retomada.matched_count:
+        return None
+    raise HTTPException(
+        status_code=status.HTTP_409_CONFLICT,
+        detail="Requisição com esta Idempotency-Key ainda em processamento"
+    )
+
+
+async def executar(
+    db,
+    escopo: str,
+    chave: Optional[str],
+    corpo: Any,
+    operacao: Callable[[], Awaitable[Any]],
+    status_code: int = status.HTTP_200_OK,
+    modelo=None,
+) -> Any:
+    """Executa `operacao` uma vez por `(escopo, chave)`; repetições devolvem a resposta guardada.
+
+    Sem chave, apenas executa. `corpo` identifica o conteúdo da requisição e
+    `modelo` é o `response_model` do endpoint, usado para serializar a resposta.
+    """
+    if not chave:
+        return await operacao()
+    if len(chave) > CHAVE_MAX:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Idempotency-Key muito longa")
+
+    ident = f"{escopo}:{chave}"
+    impressao = _impressao(corpo)
+    trava = _travas.setdefault(ident, asyncio.Lock())
+    try:
+        async with trava:
+            guardada = _da_memoria(ident)
+            if guardada is None:
+                guardada = await _reservar(db, ident, impressao)
+                if guardada is not None:
+                    _guardar(ident, *guardada)
+            if guardada is not None:
+                return _repetir(impressao, guardada)
+
+            try:
+                resultado = await operacao()
+            except BaseException:
+                await db.idempotencia.delete_one({"_id": ident})
+                raise
+            resposta = _serializar(resultado, modelo)
+            _guardar(ident, impressao, status_code, resposta)
+            try:
+                await db.idempotencia.update_one(
+                    {"_id": ident},
+                    # texto JSON: o layout pode ter chaves que o Mongo não aceita como campo
+                    {"$set": {"estado": "concluida", "status_code": status_code, "resposta": json.dumps(resposta)}},
+                )
+            except Exception as exc:
+                # a operação já aconteceu: a resposta segue, repetida ao menos por este processo
+                logger.warning("Falha ao guardar resposta da Idempotency-Key %s: %s", ident, exc)
+            return resultado
+    finally:
+        if not trava.locked():
+            _travas.pop(ident, None)
+
+
+def limpar() -> None:
+    _respostas.clear()
+    _travas.clear()
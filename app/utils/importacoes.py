@@ -0,0 +1,355 @@
+"""Importações de planilha em segundo plano.
+
+O upload só grava o arquivo e o documento da importação
+(`planilha_importacoes`, status "queued") e responde com o `import_id`; o
+processamento (`process_planilha`) acontece em um pool limitado de tarefas
+(`IMPORTACOES_TRABALHADORES`) no próprio processo. O andamento fica no mesmo
+documento (`progress`: processadas, total, linhas por segundo e estimativa de
+término) e é consultado por `GET /api/admin/importacoes/{id}`.
+
+Cada lote gravado deixa um `checkpoint` na importação (linha e contadores;
+os erros por linha ficam em `planilha_importacoes_erros`). Uma importação
+interrompida (reinício do processo) é retomada no startup a partir do último
+lote gravado; enquanto processa, a importação atualiza `atualizado_em`, e só é
+assumida por outro processo após `IMPORTACOES_LEASE_SEGUNDOS` sem atualização.
+
+Modos:
+- "importar": grava participantes e ingressos (upload do admin, aceite);
+- "validar": só valida (upload público); sem erros, a importação fica
+  "uploaded" aguardando o aceite do admin.
+
+O arquivo em disco só é mantido enquanto a importação aguarda o aceite: ao
+terminar (concluída ou com falha) ele é removido. Uma validação pública com
+falha não fica guardada: o registro é apagado quando o resultado é entregue
+ao remetente ou, se ninguém consultar, expira após
+`IMPORTACOES_VALIDACAO_FALHA_SEGUNDOS` (índice TTL em `expira_em`).
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from bson import ObjectId
+
+from app.utils.planilha import process_planilha
+
+logger = logging.getLogger(__name__)
+
+MODO_IMPORTAR = "importar"
+MODO_VALIDAR = "validar"
+
+STATUS_FILA = "queued"
+STATUS_PROCESSANDO = "processing"
+STATUS_AGUARDANDO_ACEITE = "uploaded"
+STATUS_ATIVOS = (STATUS_FILA, STATUS_PROCESSANDO)
+
+TRABALHADORES = int(os.getenv("IMPORTACOES_TRABALHADORES", "2"))
+LEASE_SEGUNDOS = float(os.getenv("IMPORTACOES_LEASE_SEGUNDOS", "300"))
+BLOCO_UPLOAD = 1024 * 1024
+VALIDACAO_FALHA_SEGUNDOS = float(os.getenv("IMPORTACOES_VALIDACAO_FALHA_SEGUNDOS", "3600"))
+
+
+def _diretorio() -> Path:
+    return Path(os.getenv("IMPORTACOES_DIR", "data/importacoes"))
+
+
+def status_final(report: Dict[str, Any]) -> str:
+    """Status de uma importação concluída a partir do relatório."""
+    if report.get('errors'):
+        if report.get('created_ingressos', 0) > 0 or report.get('created_participants', 0) > 0:
+            return 'partial'
+        return 'failed'
+    return 'completed'
+
+
+async def _gravar_arquivo(caminho: Path, arquivo) -> None:
+    """Copia o upload para o disco em blocos (sem carregar o arquivo inteiro)."""
+    if isinstance(arquivo, (bytes, bytearray)):
+        caminho.write_bytes(arquivo)
+        return
+    with open(caminho, 'wb') as fh:
+        while True:
+            bloco = await arquivo.read(BLOCO_UPLOAD)
+            if not bloco:
+                break
+            fh.write(bloco)
+
+
+async def criar_importacao(db, evento_id: str, filename: str, arquivo, modo: str = MODO_IMPORTAR) -> str:
+    """Grava o arquivo (bytes ou `UploadFile`) e a importação na fila; retorna o `import_id`."""
+    import_doc = {
+        'evento_id': evento_id,
+        'filename': filename,
+        'modo': modo,
+        'status': STATUS_FILA,
+        'relatorio': {},
+        'progress': {'processed': 0},
+        'created_at': datetime.now(timezone.utc),
+    }
+    res = await db.planilha_importacoes.insert_one(import_doc)
+    import_id = str(res.inserted_id)
+
+    diretorio = _diretorio()
+    diretorio.mkdir(parents=True, exist_ok=True)
+    caminho = diretorio / f"{import_id}_{os.path.basename(filename or 'planilha').replace(' ', '_')}"
+    await _gravar_arquivo(caminho, arquivo)
+    await db.planilha_importacoes.update_one({'_id': ObjectId(import_id)}, {'$set': {'file_path': str(caminho)}})
+
+    await fila_importacoes.enfileirar(db, import_id)
+    return import_id
+
+
+async def _assumir(db, import_id: str) -> Optional[Dict[str, Any]]:
+    """Marca a importação como em processamento se estiver na fila ou abandonada."""
+    agora = datetime.now(timezone.utc)
+    resultado = await db.planilha_importacoes.update_one(
+        {'_id': ObjectId(import_id), '$or': [
+            {'status': STATUS_FILA},
+            {'status': STATUS_PROCESSANDO, 'atualizado_em': {'$lt': agora - timedelta(seconds=LEASE_SEGUNDOS)}},
+        ]},
+        {'$set': {'status': STATUS_PROCESSANDO, 'atualizado_em': agora}},
+    )
+    if not resultado.matched_count:
+        return None
+    return await db.planilha_importacoes.find_one({'_id': ObjectId(import_id)})
+
+
+def _remover_arquivo(caminho: Optional[str]) -> None:
+    if not caminho:
+        return
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+    except OSError as exc:
+        logger.warning("Falha ao remover o arquivo da importação %s: %s", caminho, exc)
+
+
+async def _encerrar(db, doc: Dict[str, Any], campos: Dict[str, Any]) -> None:
+    """Grava o status final; fora do aguardo de aceite, remove o arquivo da importação."""
+    if campos['status'] == STATUS_AGUARDANDO_ACEITE:
+        await db.planilha_importacoes.update_one({'_id': doc['_id']}, {'$set': campos})
+        return
+    caminho = doc.get('file_path')
+    campos = {**campos, 'file_path': None}
+    if doc.get('modo') == MODO_VALIDAR:
+        # validação pública com falha: apagada na entrega do resultado ou pelo TTL
+        campos['expira_em'] = datetime.now(timezone.utc) + timedelta(seconds=VALIDACAO_FALHA_SEGUNDOS)
+    await db.planilha_importacoes.update_one({'_id': doc['_id']}, {'$set': campos})
+    _remover_arquivo(caminho)
+    if doc.get('modo') == MODO_VALIDAR:
+        # os erros já estão no relatório; a coleção só serve à retomada
+        try:
+            await db.planilha_importacoes_erros.delete_many({'import_id': str(doc['_id'])})
+        except Exception as exc:
+            logger.warning("Falha ao remover erros da importação %s: %s", doc['_id'], exc)
+
+
+async def _falhar(db, doc: Dict[str, Any], erro: str) -> None:
+    await _encerrar(db, doc, {'status': 'failed', 'relatorio': {'errors': [erro]},
+                              'finished_at': datetime.now(timezone.utc)})
+
+
+async def executar_importacao(db, import_id: str) -> Optional[Dict[str, Any]]:
+    """Processa uma importação da fila (ou a retoma do último checkpoint)."""
+    doc = await _assumir(db, import_id)
+    if doc is None:
+        return None
+    filtro = {'_id': ObjectId(import_id)}
+    inicio = doc.get('started_at')
+    if not inicio:
+        inicio = datetime.now(timezone.utc)
+        await db.planilha_importacoes.update_one(filtro, {'$set': {'started_at': inicio}})
+    if inicio.tzinfo is None:
+        inicio = inicio.replace(tzinfo=timezone.utc)
+
+    try:
+        arquivo = open(doc['file_path'], 'rb')
+    except Exception:
+        await _falhar(db, doc, 'Falha ao ler arquivo no servidor')
+        return None
+
+    validar = doc.get('modo') == MODO_VALIDAR
+    try:
+        with arquivo:
+            report = await process_planilha(arquivo, doc.get('filename') or '', doc['evento_id'], db, import_id=import_id,
+                                            validate_only=validar, checkpoint=doc.get('checkpoint'))
+    except ValueError as exc:
+        await _falhar(db, doc, str(exc))
+        return None
+    except Exception as exc:
+        # erro de gravação (ex.: BulkWriteError, timeout do Mongo): sem isso a
+        # importação ficaria "processing" até um reinício e o fim do lease
+        logger.exception("Falha ao processar a importação %s", import_id)
+        await _falhar(db, doc, f'Erro ao processar a planilha: {exc}')
+        return None
+
+    if validar:
+        status_val = 'failed' if report.get('errors') else STATUS_AGUARDANDO_ACEITE
+    else:
+        status_val = status_final(report)
+    fim = datetime.now(timezone.utc)
+    decorrido = (fim - inicio).total_seconds()
+    total = report.get('total', 0)
+    await _encerrar(db, doc, {
+        'status': status_val,
+        'relatorio': report,
+        'progress': {'processed': total, 'total': total, 'eta_segundos': 0,
+                     'linhas_por_segundo': round(total / decorrido, 1) if decorrido > 0 else 0.0},
+        'checkpoint': None,
+        'finished_at': fim,
+    })
+    return report
+
+
+async def aceitar_importacao(db, import_id: str) -> bool:
+    """Coloca uma importação validada ("uploaded") na fila para gravação."""
+    resultado = await db.planilha_importacoes.update_one(
+        {'_id': ObjectId(import_id), 'status': STATUS_AGUARDANDO_ACEITE},
+        {'$set': {'status': STATUS_FILA, 'modo': MODO_IMPORTAR, 'checkpoint': None, 'progress': {'processed': 0}}},
+    )
+    if not resultado.matched_count:
+        return False
+    await fila_importacoes.enfileirar(db, import_id)
+    return True
+
+
+async def entregar_validacao(db, doc: Dict[str, Any]) -> None:
+    """Apaga uma validação pública com falha depois de o resultado ser entregue ao remetente."""
+    if doc.get('modo') == MODO_VALIDAR and doc.get('status') == 'failed':
+        await db.planilha_importacoes.delete_one({'_id': doc['_id']})
+
+
+def situacao_importacao(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Resumo pollable de uma importação."""
+    progresso = doc.get('progress') or {}
+    concluida = doc.get('status') not in STATUS_ATIVOS
+    return {
+        'id': str(doc['_id']),
+        'evento_id': doc.get('evento_id'),
+        'filename': doc.get('filename'),
+        'modo': doc.get('modo', MODO_IMPORTAR),
+        'status': doc.get('status'),
+        'processed': progresso.get('processed', 0),
+        'total': progresso.get('total'),
+        'linhas_por_segundo': progresso.get('linhas_por_segundo', 0.0),
+        'eta_segundos': 0 if concluida else progresso.get('eta_segundos'),
+        'created_at': doc.get('created_at'),
+        'started_at': doc.get('started_at'),
+        'finished_at': doc.get('finished_at'),
+        'relatorio': doc.get('relatorio') if concluida else None,
+    }
+
+
+class FilaImportacoes:
+    """Fila em memória das importações, consumida por um número fixo de tarefas."""
+
+    def __init__(self, trabalhadores: int = TRABALHADORES):
+        self.trabalhadores = max(1, trabalhadores)
+        self._loop = None
+        self._fila: Optional[asyncio.Queue] = None
+        self._trabalhadores = []
+        # retomadas agendadas para depois do lease
+        self._tarefas = []
+        self.metricas: Dict[str, int] = {"enfileiradas": 0, "concluidas": 0, "falhas": 0}
+
+    def _garantir_tarefas(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # primeiro uso (ou novo event loop, como nos testes): recria a fila
+            self._loop = loop
+            self._fila = asyncio.Queue()
+            self._trabalhadores = []
+            self._tarefas = []
+        self._trabalhadores = [t for t in self._trabalhadores if not t.done()]
+        while len(self._trabalhadores) < self.trabalhadores:
+            self._trabalhadores.append(loop.create_task(self._executar()))
+
+    async def enfileirar(self, db, import_id: str) -> None:
+        self._garantir_tarefas()
+        self.metricas["enfileiradas"] += 1
+        await self._fila.put((db, import_id))
+
+    async def _executar(self) -> None:
+        while True:
+            db, import_id = await self._fila.get()
+            try:
+                await executar_importacao(db, import_id)
+                self.metricas["concluidas"] += 1
+            except asyncio.CancelledError:
+                # desligamento: a importação volta para a fila e é retomada no próximo startup
+                try:
+                    await db.planilha_importacoes.update_one(
+                        {'_id': ObjectId(import_id), 'status': STATUS_PROCESSANDO}, {'$set': {'status': STATUS_FILA}})
+                except Exception:
+                    pass
+                raise
+            except Exception as exc:
+                self.metricas["falhas"] += 1
+                logger.exception("Falha na importação %s: %s", import_id, exc)
+            finally:
+                self._fila.task_done()
+
+    async def aguardar(self) -> None:
+        """Aguarda o esvaziamento da fila (usado nos testes)."""
+        if self._fila is not None:
+            await self._fila.join()
+
+    async def retomar(self, db) -> int:
+        """Enfileira as importações pendentes ou interrompidas por um reinício.
+
+        Importações ainda "processing" (processo encerrado sem desligamento
+        normal) só são enfileiradas quando o lease vence.
+        """
+        retomadas = 0
+        agora = datetime.now(timezone.utc)
+        cursor = db.planilha_importacoes.find({'status': {'$in': list(STATUS_ATIVOS)}},
+                                              {'_id': 1, 'status': 1, 'atualizado_em': 1})
+        async for doc in cursor:
+            import_id = str(doc['_id'])
+            espera = 0.0
+            atualizado_em = doc.get('atualizado_em')
+            if doc.get('status') == STATUS_PROCESSANDO and isinstance(atualizado_em, datetime):
+                if atualizado_em.tzinfo is None:
+                    atualizado_em = atualizado_em.replace(tzinfo=timezone.utc)
+                espera = (atualizado_em + timedelta(seconds=LEASE_SEGUNDOS) - agora).total_seconds() + 1
+            if espera > 0:
+                self._garantir_tarefas()
+                self._tarefas.append(self._loop.create_task(self._enfileirar_depois(db, import_id, espera)))
+            else:
+                await self.enfileirar(db, import_id)
+            retomadas += 1
+        return retomadas
+
+    async def _enfileirar_depois(self, db, import_id: str, espera: float) -> None:
+        await asyncio.sleep(espera)
+        await self.enfileirar(db, import_id)
+
+    async def encerrar(self) -> None:
+        tarefas = self._trabalhadores + self._tarefas
+        for tarefa in tarefas:
+            tarefa.cancel()
+        for tarefa in tarefas:
+            try:
+                await tarefa
+            except (asyncio.CancelledError, Exception):
+                pass
+        self._trabalhadores = []
+        self._tarefas = []
+
+    def estado(self) -> Dict[str, Any]:
+        return {**self.metricas, "pendentes": self._fila.qsize() if self._fila is not None else 0,
+                "trabalhadores": self.trabalhadores}
+
+
+fila_importacoes = FilaImportacoes()
+
+
+async def retomar_importacoes(db) -> int:
+    return await fila_importacoes.retomar(db)
+
+
+async def encerrar_importacoes() -> None:
+    await fila_importacoes.encerrar()
@@ -0,0 +1,242 @@
+"""Índice em memória para validação de QR codes na portaria.
+
+Para cada evento mantém um dicionário `qrcode_hash -> RegistroIngresso` com o
+mínimo necessário para liberar a catraca (id, status, tipo e nome do
+participante), além do conjunto de ilhas permitidas por tipo. Com o índice
+carregado, `POST /api/portaria/validar` decide tipo e ilha sem ler o evento nem
+procurar o QR code; antes de liberar a catraca, `confirmar_status` relê apenas
+o status do ingresso pelo `_id` do participante, porque um cancelamento feito
+em outro worker só chegaria ao índice na ressincronização.
+
+O índice é carregado no primeiro uso do evento, atualizado pelas escritas de
+emissão/cancelamento deste processo e ressincronizado periodicamente em segundo
+plano (para refletir escritas de outros workers). Um hash ausente do índice não
+é negado: o chamador consulta o banco e registra o resultado.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, Any, FrozenSet, Iterable, Optional, Tuple
+
+from bson import ObjectId
+
+from app.utils import qr_assinado
+from app.utils.buffer_acessos import MODO_BUFFER, JANELA_PADRAO
+
+logger = logging.getLogger(__name__)
+
+RESYNC_SEGUNDOS = float(os.getenv("PORTARIA_INDICE_RESYNC_SEGUNDOS", "300"))
+
+
+class RegistroIngresso:
+    """Registro compacto de um ingresso no índice."""
+
+    __slots__ = ("ingresso_id", "status", "tipo_ingresso_id", "participante_id", "participante_nome")
+
+    def __init__(self, ingresso_id, status, tipo_ingresso_id, participante_id, participante_nome):
+        self.ingresso_id = ingresso_id
+        self.status = status
+        self.tipo_ingresso_id = tipo_ingresso_id
+        self.participante_id = participante_id
+        self.participante_nome = participante_nome
+
+
+class IndiceEvento:
+    """Índice de validação de um evento."""
+
+    def __init__(self, evento_id: str):
+        self.evento_id = evento_id
+        self.ingressos: Dict[str, RegistroIngresso] = {}
+        # tipo (por _id/id e por numero) -> (descricao, ilhas permitidas)
+        self.tipos: Dict[str, Tuple[str, FrozenSet[str]]] = {}
+        self.ilhas_nome: Dict[str, str] = {}
+        # durabilidade do log de acessos configurada no evento (ver app.utils.buffer_acessos)
+        self.log_modo = MODO_BUFFER
+        self.log_janela = JANELA_PADRAO
+        self.qr_segredo: Optional[str] = None
+        self.carregado_em = 0.0
+        self._resync: Optional[asyncio.Task] = None
+
+    def registrar(self, ingresso: Dict[str, Any], participante_nome: Optional[str], participante_id=None) -> None:
+        qrcode_hash = ingresso.get("qrcode_hash")
+        if not qrcode_hash:
+            return
+        self.ingressos[qrcode_hash] = RegistroIngresso(
+            str(ingresso.get("_id") or qrcode_hash),
+            ingresso.get("status"),
+            str(ingresso.get("tipo_ingresso_id")),
+            ingresso.get("participante_id") or (str(participante_id) if participante_id else None),
+            participante_nome,
+        )
+
+    def tipo(self, tipo_ingresso_id: str) -> Optional[Tuple[str, FrozenSet[str]]]:
+        return self.tipos.get(str(tipo_ingresso_id))
+
+    def verificar_qr(self, qrcode_hash: str) -> Optional[str]:
+        """Recusa, sem consultar o banco, QR assinados forjados ou de outro evento."""
+        return qr_assinado.verificar(qrcode_hash, self.evento_id, self.qr_segredo)
+
+    def decidir(self, registro: RegistroIngresso, ilha_id: str) -> Tuple[Optional[str], Optional[str]]:
+        """Aplica as regras de acesso a um ingresso indexado.
+
+        Retorna `(None, descricao_do_tipo)` quando o acesso é permitido ou
+        `(motivo, None)` quando negado. Se o tipo não estiver no índice retorna
+        `(None, None)` e o chamador deve recorrer ao banco.
+        """
+        tipo = self.tipo(registro.tipo_ingresso_id)
+        if tipo is None:
+            return None, None
+        if registro.status != "Ativo":
+            return "Ingresso cancelado ou inválido", None
+        descricao, permissoes = tipo
+        if str(ilha_id) not in permissoes:
+            ilha_nome = self.ilhas_nome.get(str(ilha_id), "Setor desconhecido")
+            return f"Acesso negado: ingresso não tem permissão para {ilha_nome}", None
+        return None, descricao
+
+    @property
+    def expirado(self) -> bool:
+        return time.monotonic() - self.carregado_em > RESYNC_SEGUNDOS
+
+
+_indices: Dict[str, IndiceEvento] = {}
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+async def carregar_evento(db, evento_id: str, indice: IndiceEvento) -> None:
+    """Preenche tipos (com permissões) e nomes de ilhas do índice com uma leitura do evento."""
+    projecao = {
+        "tipos_ingresso": 1, "ilhas": 1, "qr_segredo": 1,
+        "log_acessos_modo": 1, "log_acessos_janela_segundos": 1,
+    }
+    try:
+        evento = await db.eventos.find_one({"_id": ObjectId(evento_id)}, projecao)
+    except Exception:
+        evento = await db.eventos.find_one({"_id": evento_id}, projecao)
+    evento = evento or {}
+    indice.log_modo = evento.get("log_acessos_modo") or MODO_BUFFER
+    indice.log_janela = float(evento.get("log_acessos_janela_segundos") or JANELA_PADRAO)
+    indice.qr_segredo = evento.get("qr_segredo")
+
+    for t in evento.get("tipos_ingresso", []) or []:
+        registro = (t.get("descricao"), frozenset(str(p) for p in (t.get("permissoes") or [])))
+        for chave in (t.get("_id") or t.get("id"), t.get("numero")):
+            if chave is not None:
+                indice.tipos.setdefault(str(chave), registro)
+    try:
+        async for t in db.tipos_ingresso.find({"evento_id": evento_id}):
+            indice.tipos.setdefault(
+                str(t.get("_id")),
+                (t.get("descricao"), frozenset(str(p) for p in (t.get("permissoes") or []))),
+            )
+    except Exception:
+        pass
+
+    for il in evento.get("ilhas", []) or []:
+        indice.ilhas_nome[str(il.get("_id") or il.get("id"))] = il.get("nome_setor", "Setor desconhecido")
+
+
+async def _carregar(db, evento_id: str) -> IndiceEvento:
+    indice = IndiceEvento(evento_id)
+    await carregar_evento(db, evento_id, indice)
+    cursor = db.participantes.find({"ingressos.evento_id": evento_id}, {"nome": 1, "ingressos": 1})
+    async for p in cursor:
+        for ing in p.get("ingressos", []) or []:
+            if str(ing.get("evento_id")) == str(evento_id):
+                indice.registrar(ing, p.get("nome"), p.get("_id"))
+
+    indice.carregado_em = time.monotonic()
+    return indice
+
+
+async def _ressincronizar(db, evento_id: str) -> None:
+    try:
+        _indices[evento_id] = await _carregar(db, evento_id)
+    except Exception as exc:
+        logger.warning("Falha ao ressincronizar índice de validação do evento %s: %s", evento_id, exc)
+
+
+async def obter_indice(db, evento_id: str) -> Optional[IndiceEvento]:
+    """Retorna o índice do evento, carregando-o no primeiro uso.
+
+    Um índice expirado continua sendo servido enquanto a ressincronização roda
+    em segundo plano. Retorna None se o carregamento falhar.
+    """
+    indice = _indices.get(evento_id)
+    if indice is not None:
+        if indice.expirado and (indice._resync is None or indice._resync.done()):
+            indice._resync = asyncio.create_task(_ressincronizar(db, evento_id))
+        return indice
+
+    lock = _locks.setdefault(evento_id, asyncio.Lock())
+    async with lock:
+        indice = _indices.get(evento_id)
+        if indice is None:
+            try:
+                indice = await _carregar(db, evento_id)
+            except Exception as exc:
+                logger.warning("Falha ao carregar índice de validação do evento %s: %s", evento_id, exc)
+                return None
+            _indices[evento_id] = indice
+    return indice
+
+
+async def confirmar_status(db, indice: IndiceEvento, qrcodes: Iterable[str]) -> None:
+    """Relê do banco o status dos ingressos indexados e atualiza o índice.
+
+    Uma consulta por `_id` dos participantes cobre todos os QR codes. Um
+    ingresso que não existe mais fica com status None (negado). Se o banco
+    falhar, o status indexado é mantido e a falha é registrada.
+    """
+    registros = {qr: indice.ingressos[qr] for qr in qrcodes if qr in indice.ingressos}
+    if not registros:
+        return
+    ids, sem_id = set(), []
+    for qr, registro in registros.items():
+        if not registro.participante_id:
+            sem_id.append(qr)
+            continue
+        try:
+            ids.add(ObjectId(registro.participante_id))
+        except Exception:
+            ids.add(registro.participante_id)
+    clausulas = []
+    if ids:
+        clausulas.append({"_id": {"$in": list(ids)}})
+    if sem_id:
+        clausulas.append({"ingressos.qrcode_hash": {"$in": sem_id}})
+    filtro = clausulas[0] if len(clausulas) == 1 else {"$or": clausulas}
+    encontrados = set()
+    try:
+        async for p in db.participantes.find(filtro, {"ingressos.qrcode_hash": 1, "ingressos.status": 1}):
+            for ing in p.get("ingressos", []) or []:
+                registro = registros.get(ing.get("qrcode_hash"))
+                if registro is not None:
+                    registro.status = ing.get("status")
+                    encontrados.add(ing.get("qrcode_hash"))
+    except Exception as exc:
+        logger.warning("Falha ao confirmar status de ingressos do evento %s: %s", indice.evento_id, exc)
+        return
+    for qr, registro in registros.items():
+        if qr not in encontrados:
+            registro.status = None
+
+
+def registrar_ingresso(evento_id: str, ingresso: Dict[str, Any], participante_nome: Optional[str] = None) -> None:
+    """Inclui um ingresso recém-emitido no índice do evento (se carregado)."""
+    indice = _indices.get(str(evento_id))
+    if indice is not None:
+        indice.registrar(ingresso, participante_nome)
+
+
+def atualizar_status(evento_id: str, qrcode_hash: str, status: str) -> None:
+    """Atualiza o status de um ingresso no índice do evento (se carregado)."""
+    indice = _indices.get(str(evento_id))
+    if indice is not None and qrcode_hash in indice.ingressos:
+        indice.ingressos[qrcode_hash].status = status
+
+
+def invalidar_evento(evento_id: str) -> None:
+    """Descarta o índice do evento (ex.: após alterar tipos ou ilhas)."""
+    _indices.pop(str(evento_id), None)
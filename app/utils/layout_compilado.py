@@ -0,0 +1,288 @@
+"""Compilação de layouts de ingresso para uma forma intermediária imutável.
+
+Havia três interpretações independentes do layout, todas refeitas a cada
+ingresso a partir do dicionário cru: `embed_layout` (deepcopy + 14
+`str.replace` por elemento), `preencher_layout` da bilheteria (ida e volta por
+`json.dumps`/`json.loads`) e `_render_layout_to_image` (recompilando `groups`).
+Agora as três usam `compilar_layout`, que resolve uma única vez:
+
+- coordenadas absolutas dos elementos (grupos achatados, com os padrões do
+  grupo propagados);
+- caminho da fonte de cada texto;
+- os textos com placeholders já divididos em segmentos;
+- a geometria em pixels de cada elemento, por DPI.
+
+A chave do cache é o hash do layout sem os valores dos elementos: o template
+do evento e todos os layouts embutidos a partir dele compartilham a mesma
+compilação, e o trabalho por ingresso se resume a preencher os valores.
+"""
+import copy
+import hashlib
+import json
+import re
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from app.utils.render_assets import LRUContado, caminho_fonte
+
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+# atributos herdados do grupo quando ausentes no elemento
+_PADROES_GRUPO = ("align", "size_mm", "size", "margin_mm")
+
+_compilados = LRUContado(128)
+
+
+def mm_para_px(val_mm: float, dpi: int) -> int:
+    """Converte milímetros em pixels no DPI informado."""
+    return int(round(float(val_mm) * dpi / 25.4))
+
+
+def _numero(valor: Any) -> float:
+    try:
+        return float(valor or 0)
+    except Exception:
+        return 0.0
+
+
+@lru_cache(maxsize=4096)
+def segmentar(texto: str) -> Tuple[str, ...]:
+    """Divide o texto em literais (posições pares) e nomes de placeholder (ímpares)."""
+    return tuple(_PLACEHOLDER.split(texto))
+
+
+def preencher_texto(texto: Any, valores: Mapping[str, Any]) -> Any:
+    """Substitui `{nome}` pelos valores informados; placeholders desconhecidos ficam intactos."""
+    if not isinstance(texto, str):
+        return texto
+    partes = segmentar(texto)
+    if len(partes) == 1:
+        return texto
+    return "".join(
+        parte if i % 2 == 0 else str(valores[parte]) if parte in valores else "{" + parte + "}"
+        for i, parte in enumerate(partes)
+    )
+
+
+def placeholders(texto: Any) -> Tuple[str, ...]:
+    """Nomes dos placeholders presentes no texto."""
+    return segmentar(texto)[1::2] if isinstance(texto, str) else ()
+
+
+@dataclass(frozen=True)
+class GeometriaElemento:
+    """Posição de um elemento em pixels para um DPI."""
+    y_px: int
+    area_inicio_px: int
+    area_largura_px: int
+    largura_util_px: int
+    ancora_px: int
+    h_pos: str
+    tamanho_px: int
+    fonte_px: int
+
+
+@dataclass(frozen=True)
+class Geometria:
+    """Geometria de todo o layout para um DPI."""
+    dpi: int
+    largura_px: int
+    altura_px: int
+    borda_px: Optional[int]
+    elementos: Tuple[GeometriaElemento, ...]
+
+
+@dataclass(frozen=True)
+class ElementoCompilado:
+    tipo: Optional[str]
+    # atributos com coordenadas absolutas, sem `value`
+    atributos: Mapping[str, Any]
+    fonte: Optional[str]
+
+    @property
+    def variavel(self) -> Optional[bool]:
+        """Marca gravada por `embed_layout` (None em layouts não marcados)."""
+        return self.atributos.get("variavel")
+
+    def para_dict(self, valor: Any = None) -> Dict[str, Any]:
+        """Elemento como dicionário; `value` só é incluído quando há valor."""
+        el = {k: copy.deepcopy(v) if isinstance(v, (dict, list)) else v for k, v in self.atributos.items()}
+        if valor is not None:
+            el["value"] = valor
+        return el
+
+
+@dataclass(frozen=True)
+class LayoutCompilado:
+    chave: str
+    canvas: Mapping[str, Any]
+    section: Optional[Mapping[str, Any]]
+    # chaves de topo além de elements/groups (preservadas no layout embutido)
+    extras: Mapping[str, Any]
+    elementos: Tuple[ElementoCompilado, ...]
+    _geometrias: Dict[int, Geometria] = field(default_factory=dict, compare=False, repr=False)
+
+    def valores(self, layout: Dict[str, Any]) -> List[Any]:
+        """Valores dos elementos de `layout`, na ordem de `elementos`."""
+        return _valores(layout)
+
+    def geometria(self, dpi: int) -> Geometria:
+        geometria = self._geometrias.get(dpi)
+        if geometria is None:
+            geometria = _calcular_geometria(self, dpi)
+            self._geometrias[dpi] = geometria
+        return geometria
+
+
+def _elementos_resolvidos(layout: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Elementos de topo seguidos dos elementos dos grupos, em coordenadas absolutas."""
+    grupos = [g for g in (layout.get("groups") or []) if isinstance(g, dict)]
+    por_id = {g.get("id"): g for g in grupos if g.get("id")}
+
+    resolvidos = []
+    for el in layout.get("elements") or []:
+        el = dict(el)
+        grupo = por_id.get(el.get("groupId"))
+        if grupo is not None:
+            el["x"] = _numero(grupo.get("x", 0)) + _numero(el.get("x", 0))
+            el["y"] = _numero(grupo.get("y", 0)) + _numero(el.get("y", 0))
+        resolvidos.append(el)
+
+    for g in grupos:
+        gx = _numero(g.get("x", 0))
+        gy = _numero(g.get("y", 0))
+        for el in g.get("elements") or []:
+            el = dict(el)
+            el["x"] = gx + _numero(el.get("x", 0))
+            el["y"] = gy + _numero(el.get("y", 0))
+            for chave in _PADROES_GRUPO:
+                if chave in g and el.get(chave) is None:
+                    el[chave] = g.get(chave)
+            resolvidos.append(el)
+    return resolvidos
+
+
+def _valores(layout: Dict[str, Any]) -> List[Any]:
+    valores = [el.get("value") for el in layout.get("elements") or []]
+    for g in layout.get("groups") or []:
+        if isinstance(g, dict):
+            valores.extend(el.get("value") for el in g.get("elements") or [])
+    return valores
+
+
+def _sem_valores(layout: Dict[str, Any]) -> Dict[str, Any]:
+    forma = dict(layout)
+    forma["elements"] = [{k: v for k, v in el.items() if k != "value"} for el in layout.get("elements") or []]
+    if layout.get("groups"):
+        forma["groups"] = [
+            {**g, "elements": [{k: v for k, v in el.items() if k != "value"} for el in g.get("elements") or []]}
+            if isinstance(g, dict) else g
+            for g in layout["groups"]
+        ]
+    return forma
+
+
+def chave_layout(layout: Dict[str, Any]) -> str:
+    """Hash do layout ignorando os valores dos elementos."""
+    conteudo = json.dumps(_sem_valores(layout), sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+def _compilar(layout: Dict[str, Any], chave: str) -> LayoutCompilado:
+    elementos = []
+    for el in _elementos_resolvidos(layout):
+        tipo = el.get("type")
+        fonte = caminho_fonte(el.get("font", "Arial"), el.get("bold", False), el.get("italic", False)) \
+            if tipo == "text" else None
+        atributos = {k: copy.deepcopy(v) for k, v in el.items() if k != "value"}
+        elementos.append(ElementoCompilado(tipo=tipo, atributos=MappingProxyType(atributos), fonte=fonte))
+    extras = {k: copy.deepcopy(v) for k, v in layout.items() if k not in ("elements", "groups")}
+    return LayoutCompilado(
+        chave=chave,
+        canvas=MappingProxyType(dict(layout.get("canvas") or {})),
+        section=copy.deepcopy(layout.get("section")),
+        extras=MappingProxyType(extras),
+        elementos=tuple(elementos),
+    )
+
+
+def compilar_layout(layout: Dict[str, Any]) -> LayoutCompilado:
+    """Forma compilada do layout, reaproveitada entre layouts de mesma estrutura."""
+    chave = chave_layout(layout)
+    return _compilados.obter(chave, lambda: _compilar(layout, chave))
+
+
+def _calcular_geometria(compilado: LayoutCompilado, dpi: int) -> Geometria:
+    canvas = compilado.canvas
+    largura_mm = float(canvas.get("width", 80))
+    altura_mm = float(canvas.get("height", 120))
+    largura_px = max(1, mm_para_px(largura_mm, dpi))
+    altura_px = max(1, mm_para_px(altura_mm, dpi))
+
+    borda_px = None
+    padding_mm = float(canvas.get("padding_mm", 0))
+    if bool(canvas.get("border", False)) and padding_mm >= 0:
+        borda_px = mm_para_px(padding_mm, dpi)
+
+    section = compilado.section
+    geometrias = []
+    for elemento in compilado.elementos:
+        el = elemento.atributos
+        h_pos = el.get("horizontal_position") or el.get("align") or "center"
+
+        margem_esq_px = mm_para_px(float(el.get("margin_left", el.get("margin_mm", 0)) or 0), dpi)
+        margem_dir_px = mm_para_px(float(el.get("margin_right", el.get("margin_mm", 0)) or 0), dpi)
+
+        # área do setor (divisão vertical do editor) ou, no modelo antigo, x explícito
+        setor = el.get("sector")
+        if section and section.get("type") == "vertical" and setor in ("A", "B"):
+            pos_mm = float(section.get("pos_mm", largura_mm / 2) or largura_mm / 2)
+            if setor == "A":
+                area_inicio_mm, area_largura_mm = 0.0, pos_mm
+            else:
+                area_inicio_mm, area_largura_mm = pos_mm, largura_mm - pos_mm
+        else:
+            x_mm = float(el.get("x", 0) or 0)
+            area_inicio_mm = x_mm if h_pos in ("left",) else 0.0
+            area_largura_mm = largura_mm
+
+        area_inicio_px = mm_para_px(area_inicio_mm, dpi)
+        area_largura_px = mm_para_px(area_largura_mm, dpi)
+        largura_util_px = max(10, area_largura_px - margem_esq_px - margem_dir_px)
+
+        if h_pos == "left":
+            ancora_px = area_inicio_px + margem_esq_px
+        elif h_pos == "right":
+            ancora_px = area_inicio_px + area_largura_px - margem_dir_px
+        else:
+            ancora_px = area_inicio_px + area_largura_px // 2 + margem_esq_px - margem_dir_px
+
+        tamanho_px = 0
+        fonte_px = 0
+        if elemento.tipo == "text":
+            # tamanho em pontos convertido para pixels, para manter o tamanho físico
+            fonte_px = max(1, int(round(float(el.get("size", 12)) * dpi / 72.0)))
+        elif elemento.tipo in ("qrcode", "logo"):
+            tamanho_px = mm_para_px(float(el.get("size_mm", 30)), dpi)
+
+        geometrias.append(GeometriaElemento(
+            y_px=mm_para_px(float(el.get("y", 0)), dpi),
+            area_inicio_px=area_inicio_px,
+            area_largura_px=area_largura_px,
+            largura_util_px=largura_util_px,
+            ancora_px=ancora_px,
+            h_pos=h_pos,
+            tamanho_px=tamanho_px,
+            fonte_px=fonte_px,
+        ))
+    return Geometria(dpi=dpi, largura_px=largura_px, altura_px=altura_px, borda_px=borda_px,
+                     elementos=tuple(geometrias))
+
+
+def metricas_layouts() -> Dict[str, int]:
+    return _compilados.metricas()
+
+
+def limpar_layouts_compilados() -> None:
+    _compilados.limpar()
@@ -0,0 +1,232 @@
+"""Layouts de ingresso versionados, referenciados pelos ingressos.
+
+Cada ingresso guardava uma cópia completa do layout embutido
+(`ingressos.layout_ingresso`), e salvar o layout do evento reescrevia todos os
+ingressos, um `update_one` por vez. Agora:
+
+- cada versão do layout de um evento é imutável e fica na coleção
+  `layouts_ingresso` (`{"_id": <sha256>, "evento_id", "layout", "data_criacao"}`),
+  com `_id` derivado do conteúdo — salvar o mesmo layout duas vezes não cria
+  outra versão;
+- o evento guarda o template em edição (`layout_ingresso`) e a versão vigente
+  (`layout_versao`); salvar o layout é uma escrita no evento;
+- o ingresso guarda apenas os seus valores (`campos_layout`, ver
+  `app.utils.layouts.valores_placeholders`) e segue a versão vigente do evento;
+  quando precisa ficar congelado em um layout antigo, guarda também
+  `layout_versao`.
+
+Versões são imutáveis, então o cache em memória nunca precisa ser invalidado.
+Ingressos antigos com `layout_ingresso` embutido continuam sendo atendidos e
+são convertidos por `migrar_layouts_evento`.
+"""
+import hashlib
+import json
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from bson import ObjectId
+
+from app.utils import contexto_evento
+from app.utils.layouts import montar_layout, valores_evento, valores_placeholders
+from app.utils.render_assets import LRUContado
+
+logger = logging.getLogger(__name__)
+
+_versoes = LRUContado(256)
+
+
+def _filtro_evento(evento_id) -> Dict[str, Any]:
+    try:
+        return {"_id": ObjectId(evento_id)}
+    except Exception:
+        return {"_id": evento_id}
+
+
+def id_versao(evento_id: str, layout: Dict[str, Any]) -> str:
+    conteudo = json.dumps({"evento_id": str(evento_id), "layout": layout},
+                          sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha256(conteudo.encode("utf-8")).hexdigest()
+
+
+async def salvar_versao(db, evento_id: str, layout: Dict[str, Any]) -> str:
+    """Registra a versão (se ainda não existir) e retorna o seu id."""
+    versao = id_versao(evento_id, layout)
+    if await db.layouts_ingresso.find_one({"_id": versao}, {"_id": 1}) is None:
+        try:
+            await db.layouts_ingresso.insert_one({
+                "_id": versao,
+                "evento_id": str(evento_id),
+                "layout": layout,
+                "data_criacao": datetime.now(timezone.utc),
+            })
+        except Exception:
+            # gravação concorrente da mesma versão
+            pass
+    _versoes.obter(versao, lambda: layout)
+    return versao
+
+
+async def carregar_versao(db, versao: str) -> Optional[Dict[str, Any]]:
+    """Template da versão, via cache em memória."""
+    if versao in _versoes:
+        return _versoes.obter(versao, lambda: None)
+    doc = await db.layouts_ingresso.find_one({"_id": versao})
+    if doc is None:
+        return None
+    return _versoes.obter(versao, lambda: doc.get("layout"))
+
+
+async def publicar_layout(db, evento_id: str, layout: Dict[str, Any]) -> bool:
+    """Grava o template no evento e o torna a versão vigente; False se o evento não existe.
+
+    O template é gravado mesmo se o registro da versão falhar; nesse caso a
+    versão é criada na próxima renderização (ver `versao_atual`).
+    """
+    resultado = await db.eventos.update_one(_filtro_evento(evento_id), {"$set": {"layout_ingresso": layout}})
+    if not resultado.matched_count:
+        return False
+    try:
+        versao = await salvar_versao(db, evento_id, layout)
+        await db.eventos.update_one(_filtro_evento(evento_id), {"$set": {"layout_versao": versao}})
+    except Exception as e:
+        logger.warning("Falha ao registrar versão do layout do evento %s: %s", evento_id, e)
+    return True
+
+
+async def versao_atual(db, evento: Dict[str, Any]) -> Optional[str]:
+    """Versão vigente do evento; eventos anteriores ao versionamento ganham uma agora."""
+    layout = evento.get("layout_ingresso")
+    if not layout:
+        return None
+    versao = evento.get("layout_versao")
+    if versao and versao == id_versao(str(evento["_id"]), layout):
+        return versao
+    versao = await salvar_versao(db, str(evento["_id"]), layout)
+    await db.eventos.update_one({"_id": evento["_id"]}, {"$set": {"layout_versao": versao}})
+    contexto_evento.invalidar_evento(str(evento["_id"]))
+    evento["layout_versao"] = versao
+    return versao
+
+
+def campos_layout(participante: Dict[str, Any], tipo: Dict[str, Any], evento: Dict[str, Any],
+                  ingresso: Dict[str, Any]) -> Dict[str, str]:
+    """Valores do ingresso gravados no documento no lugar do layout embutido.
+
+    Os placeholders do evento (nome, data) ficam de fora: são lidos do evento
+    na renderização e acompanham as suas alterações.
+    """
+    do_evento = valores_evento(evento)
+    return {nome: valor for nome, valor in valores_placeholders(participante, tipo, evento, ingresso).items()
+            if nome not in do_evento}
+
+
+async def layout_do_ingresso(db, evento: Dict[str, Any], ingresso: Dict[str, Any],
+                             participante: Optional[Dict[str, Any]] = None,
+                             tipo: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """Layout pronto para renderização (sem placeholders) de um ingresso.
+
+    Ordem: cópia embutida legada -> versão congelada do ingresso -> versão
+    vigente do evento. Sem `campos_layout` (ingressos antigos), os valores são
+    derivados de participante/tipo.
+    """
+    if ingresso.get("layout_ingresso"):
+        # cópias embutidas já trazem os grupos achatados em `elements`
+        return {k: v for k, v in ingresso["layout_ingresso"].items() if k != "groups"}
+
+    versao = ingresso.get("layout_versao") or await versao_atual(db, evento)
+    template = await carregar_versao(db, versao) if versao else None
+    if template is None:
+        template = evento.get("layout_ingresso")
+    if not template:
+        return None
+
+    campos = ingresso.get("campos_layout")
+    if campos is None:
+        campos = campos_layout(participante or {}, tipo or {}, evento, ingresso)
+    return montar_layout(template, {**valores_evento(evento), **campos})
+
+
+# ==================== MIGRAÇÃO ====================
+
+def _forma(layout: Dict[str, Any]) -> Dict[str, Any]:
+    """Layout embutido comparável: sem `groups` (já achatados) e sem as marcas `variavel`."""
+    forma = {k: v for k, v in layout.items() if k not in ("elements", "groups")}
+    forma["elements"] = [{k: v for k, v in el.items() if k != "variavel"} for el in layout.get("elements") or []]
+    return forma
+
+
+def _para_template(layout: Dict[str, Any]) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """Converte um layout embutido em (template com slots `{_i}`, valores dos slots).
+
+    Só os elementos que `montar_layout` preenche (text, qrcode) viram slots; os
+    demais (logo, imagem...) ficam literais no template da versão.
+    """
+    template = _forma(layout)
+    campos: Dict[str, str] = {}
+    for i, el in enumerate(template["elements"]):
+        valor = el.get("value")
+        if el.get("type") in ("text", "qrcode") and isinstance(valor, str):
+            campos[f"_{i}"] = valor
+            el["value"] = f"{{_{i}}}"
+    return template, campos
+
+
+async def _converter_ingresso(db, evento: Dict[str, Any], ingresso: Dict[str, Any],
+                              participante: Dict[str, Any], tipo: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Campos que substituem o `layout_ingresso` embutido de um ingresso."""
+    embutido = ingresso["layout_ingresso"]
+    campos = campos_layout(participante, tipo or {}, evento, ingresso)
+    template_atual = evento.get("layout_ingresso")
+    if template_atual and _forma(montar_layout(template_atual, {**valores_evento(evento), **campos})) == _forma(embutido):
+        return {"campos_layout": campos}
+    # layout antigo: congela o ingresso numa versão própria (deduplicada por estrutura)
+    template, slots = _para_template(embutido)
+    versao = await salvar_versao(db, str(evento["_id"]), template)
+    return {"campos_layout": {**campos, **slots}, "layout_versao": versao}
+
+
+async def migrar_layouts_evento(db, evento_id: str) -> Dict[str, int]:
+    """Troca as cópias embutidas dos ingressos do evento por referências de versão."""
+    evento = await db.eventos.find_one(_filtro_evento(evento_id), {"logo_blob": 0})
+    if not evento:
+        return {"seguem_atual": 0, "congelados": 0}
+    await versao_atual(db, evento)
+
+    tipos: Dict[str, Any] = {}
+    seguem_atual = 0
+    congelados = 0
+    cursor = db.participantes.find({"ingressos": {"$elemMatch": {"evento_id": str(evento_id), "layout_ingresso": {"$exists": True}}}})
+    async for participante in cursor:
+        for ingresso in participante.get("ingressos", []):
+            if str(ingresso.get("evento_id")) != str(evento_id) or not ingresso.get("layout_ingresso"):
+                continue
+            tid = ingresso.get("tipo_ingresso_id")
+            if tid not in tipos:
+                try:
+                    tipos[tid] = await db.tipos_ingresso.find_one({"_id": ObjectId(tid)})
+                except Exception:
+                    tipos[tid] = await db.tipos_ingresso.find_one({"_id": tid})
+            novos = await _converter_ingresso(db, evento, ingresso, participante, tipos[tid])
+            await db.participantes.update_one(
+                {"_id": participante["_id"], "ingressos._id": ingresso.get("_id")},
+                {
+                    "$set": {f"ingressos.$.{campo}": valor for campo, valor in novos.items()},
+                    "$unset": {"ingressos.$.layout_ingresso": ""},
+                },
+            )
+            if "layout_versao" in novos:
+                congelados += 1
+            else:
+                seguem_atual += 1
+    return {"seguem_atual": seguem_atual, "congelados": congelados}
+
+
+async def migrar_layouts(db) -> Dict[str, int]:
+    """Migra todos os eventos."""
+    total = {"seguem_atual": 0, "congelados": 0}
+    async for evento in db.eventos.find({}, {"_id": 1}):
+        parcial = await migrar_layouts_evento(db, str(evento["_id"]))
+        for chave in total:
+            total[chave] += parcial[chave]
+    return total
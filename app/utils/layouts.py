@@ -1,161 +1,113 @@
+import copy
+from datetime import datetime
 from typing import Dict, Any
 
+from app.utils.layout_compilado import compilar_layout, placeholders, preencher_texto
 
-def embed_layout(layout_template: Dict[str, Any], participante: Dict[str, Any], tipo: Dict[str, Any], evento: Dict[str, Any], ingresso: Dict[str, Any]) -> Dict[str, Any]:
-    """Return a deep-copied layout with element values replaced by provided data.
+# placeholders that change from one ticket to the next; elements using them are
+# drawn per ticket, everything else can be precomposed once per event layout
+PLACEHOLDERS_INGRESSO = (
+    "{NOME}", "{participante_nome}", "{CPF}", "{EMAIL}", "{TELEFONE}", "{EMPRESA}",
+    "{NACIONALIDADE}", "{qrcode_hash}", "{TIPO_INGRESSO}",
+)
+PLACEHOLDERS_EVENTO = ("{EVENTO_NOME}", "{DATA_EVENTO}", "{DATA}", "{HORARIO}", "{DATA_HORA}")
+_NOMES_INGRESSO = frozenset(p.strip("{}") for p in PLACEHOLDERS_INGRESSO)
+_NOMES_CONHECIDOS = _NOMES_INGRESSO | frozenset(p.strip("{}") for p in PLACEHOLDERS_EVENTO)
 
-    Supports placeholder variants: {NOME}, {participante_nome}, {CPF}, {EMAIL}, {qrcode_hash},
-    {TIPO_INGRESSO}, {EVENTO_NOME}, {DATA_EVENTO}.
-    Coordinates are left untouched.
-    """
-    import copy
-    from datetime import datetime
 
-    if not layout_template:
-        return {"canvas": {"width": 80, "height": 120, "unit": "mm"}, "elements": []}
+def _nome_variavel(nome: str) -> bool:
+    # `{_0}`, `{_1}`... são valores próprios do ingresso (layouts migrados)
+    return nome in _NOMES_INGRESSO or nome.startswith("_")
 
-    layout = copy.deepcopy(layout_template)
-
-    # If layout defines groups, compile them into flattened elements for backward compatibility
-    def compile_groups(layout_obj: Dict[str, Any]) -> list:
-        """Compile `groups` into a flat list of elements with absolute coordinates.
-
-        Expected group format (non-strict):
-        {
-            "x": <mm>, "y": <mm>, "elements": [ {..element..}, ... ],
-            "direction": "horizontal"|"vertical" (optional), "spacing_mm": <mm> (optional)
-        }
-
-        This function is conservative: it only adjusts element coordinates by group's x/y
-        and preserves element attributes. If element already has absolute x/y it will be
-        offset by the group's origin.
-        """
-        out = []
-        groups = layout_obj.get("groups") or []
-        for g in groups:
-            gx = float(g.get("x", 0) or 0)
-            gy = float(g.get("y", 0) or 0)
-            elems = g.get("elements") or []
-            for el in elems:
-                # copy to avoid mutating original
-                el_copy = copy.deepcopy(el)
-                try:
-                    rel_x = float(el_copy.get("x", 0) or 0)
-                except Exception:
-                    rel_x = 0
-                try:
-                    rel_y = float(el_copy.get("y", 0) or 0)
-                except Exception:
-                    rel_y = 0
-
-                # set absolute coords
-                el_copy["x"] = gx + rel_x
-                el_copy["y"] = gy + rel_y
-
-                # propagate group-level align/size defaults if not present on element
-                for key in ("align", "size_mm", "size", "margin_mm"):
-                    if key in g and el_copy.get(key) is None:
-                        el_copy[key] = g.get(key)
-
-                out.append(el_copy)
-        return out
-
-    # derive replacement values (ensure all are strings)
+
+def elemento_variavel(el: Dict[str, Any]) -> bool:
+    """True if the (template) element depends on per-ticket data."""
+    etype = el.get("type")
+    if etype == "qrcode":
+        valor = el.get("value", "{qrcode_hash}")
+    elif etype == "text":
+        valor = el.get("value", "")
+    else:
+        return False
+    return not isinstance(valor, str) or any(_nome_variavel(nome) for nome in placeholders(valor))
+
+
+def valores_placeholders(participante: Dict[str, Any], tipo: Dict[str, Any], evento: Dict[str, Any], ingresso: Dict[str, Any]) -> Dict[str, str]:
+    """Map every supported placeholder name to its value (all strings)."""
     nome = str(participante.get("nome", "") if participante else "")
-    cpf = str(participante.get("cpf", "") if participante else "")
-    email = str(participante.get("email", "") if participante else "")
-    telefone = str(participante.get("telefone", "") if participante else "")
-    empresa = str(participante.get("empresa", "") if participante else "")
-    nacionalidade = str(participante.get("nacionalidade", "") if participante else "")
-    qrcode = str(ingresso.get("qrcode_hash", "") if ingresso else "")
-    tipo_desc = str(tipo.get("descricao", "") if tipo else "")
-    evento_nome = str(evento.get("nome", "") if evento else "")
     data_evento_str = ""
     data_str = ""
     horario_str = ""
-    data_hora_str = ""
     de = evento.get("data_evento") if evento else None
     if de:
         if isinstance(de, datetime):
             data_evento_str = de.strftime("%d/%m/%Y %H:%M")
             data_str = de.strftime("%d/%m/%Y")
             horario_str = de.strftime("%H:%M")
-            data_hora_str = de.strftime("%d/%m/%Y %H:%M")
         else:
             data_evento_str = str(de)
             data_str = str(de)
-            horario_str = ""
-            data_hora_str = str(de)
-
-    def replace_vals(s: str) -> str:
-        if not isinstance(s, str):
-            return s
-        out = s
-        out = out.replace("{NOME}", nome)
-        out = out.replace("{participante_nome}", nome)
-        out = out.replace("{CPF}", cpf)
-        out = out.replace("{EMAIL}", email)
-        out = out.replace("{TELEFONE}", telefone)
-        out = out.replace("{EMPRESA}", empresa)
-        out = out.replace("{NACIONALIDADE}", nacionalidade)
-        out = out.replace("{qrcode_hash}", qrcode)
-        out = out.replace("{TIPO_INGRESSO}", tipo_desc)
-        out = out.replace("{EVENTO_NOME}", evento_nome)
-        out = out.replace("{DATA_EVENTO}", data_evento_str)
-        out = out.replace("{DATA}", data_str)
-        out = out.replace("{HORARIO}", horario_str)
-        out = out.replace("{DATA_HORA}", data_hora_str)
-        return out
-
-    elements = layout.get("elements", [])
-    # merge compiled groups into elements for rendering/embedding
-    if layout.get("groups"):
-        try:
-            compiled = compile_groups(layout)
-            # Maintain original elements order first, then group elements
-            elements = elements + compiled
-            layout["elements"] = elements
-        except Exception:
-            # on any failure fall back to original elements
-            pass
-    # If elements reference groups by `groupId`, convert their coords to absolute using group's origin
-    groups_map = {}
-    try:
-        for g in layout.get("groups", []) or []:
-            gid = g.get("id")
-            if gid:
-                groups_map[gid] = g
-    except Exception:
-        groups_map = {}
-
-    if groups_map:
-        for el in elements:
-            gid = el.get("groupId")
-            if gid and gid in groups_map:
-                g = groups_map[gid]
-                try:
-                    gx = float(g.get("x", 0) or 0)
-                except Exception:
-                    gx = 0
-                try:
-                    gy = float(g.get("y", 0) or 0)
-                except Exception:
-                    gy = 0
-                try:
-                    rel_x = float(el.get("x", 0) or 0)
-                except Exception:
-                    rel_x = 0
-                try:
-                    rel_y = float(el.get("y", 0) or 0)
-                except Exception:
-                    rel_y = 0
-
-                el["x"] = gx + rel_x
-                el["y"] = gy + rel_y
-    for el in elements:
-        if el.get("type") == "text":
-            el["value"] = replace_vals(el.get("value", ""))
-        elif el.get("type") == "qrcode":
+    return {
+        "NOME": nome,
+        "participante_nome": nome,
+        "CPF": str(participante.get("cpf", "") if participante else ""),
+        "EMAIL": str(participante.get("email", "") if participante else ""),
+        "TELEFONE": str(participante.get("telefone", "") if participante else ""),
+        "EMPRESA": str(participante.get("empresa", "") if participante else ""),
+        "NACIONALIDADE": str(participante.get("nacionalidade", "") if participante else ""),
+        "qrcode_hash": str(ingresso.get("qrcode_hash", "") if ingresso else ""),
+        "TIPO_INGRESSO": str(tipo.get("descricao", "") if tipo else ""),
+        "EVENTO_NOME": str(evento.get("nome", "") if evento else ""),
+        "DATA_EVENTO": data_evento_str,
+        "DATA": data_str,
+        "HORARIO": horario_str,
+        "DATA_HORA": data_evento_str,
+    }
+
+
+def valores_evento(evento: Dict[str, Any]) -> Dict[str, str]:
+    """Values of the event-level placeholders only (name, date and time)."""
+    todos = valores_placeholders({}, {}, evento, {})
+    return {nome: valor for nome, valor in todos.items() if nome not in _NOMES_INGRESSO}
+
+
+def embed_layout(layout_template: Dict[str, Any], participante: Dict[str, Any], tipo: Dict[str, Any], evento: Dict[str, Any], ingresso: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a new layout with element values replaced by provided data.
+
+    Supports placeholder variants: {NOME}, {participante_nome}, {CPF}, {EMAIL}, {qrcode_hash},
+    {TIPO_INGRESSO}, {EVENTO_NOME}, {DATA_EVENTO}.
+    The template is compiled once (see `app.utils.layout_compilado`): groups are
+    flattened into `elements` with absolute coordinates, so the result carries no
+    `groups`. Each element is tagged with `variavel` (see `elemento_variavel`) so the
+    renderer can precompose the static ones.
+    """
+    return montar_layout(layout_template, valores_placeholders(participante, tipo, evento, ingresso))
+
+
+def montar_layout(layout_template: Dict[str, Any], valores: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill a template with already-resolved placeholder values (see `valores_placeholders`).
+
+    Known placeholders without a value become empty strings, as in `embed_layout`.
+    """
+    if not layout_template:
+        return {"canvas": {"width": 80, "height": 120, "unit": "mm"}, "elements": []}
+
+    compilado = compilar_layout(layout_template)
+    valores = {**{nome: "" for nome in _NOMES_CONHECIDOS}, **valores}
+
+    layout = copy.deepcopy(dict(compilado.extras))
+    elements = []
+    for elemento, valor in zip(compilado.elementos, compilado.valores(layout_template)):
+        if elemento.tipo == "text":
+            valor = "" if valor is None else valor
+        elif elemento.tipo == "qrcode":
             # qrcode elements may have value placeholders too
-            el["value"] = replace_vals(el.get("value", "{qrcode_hash}"))
+            valor = "{qrcode_hash}" if valor is None else valor
+        variavel = elemento_variavel({"type": elemento.tipo, "value": valor})
+        if elemento.tipo in ("text", "qrcode"):
+            valor = preencher_texto(valor, valores)
+        el = elemento.para_dict(valor)
+        el["variavel"] = variavel
+        elements.append(el)
+    layout["elements"] = elements
     return layout
@@ -0,0 +1,211 @@
+"""Métricas de ingressos por evento mantidas incrementalmente (coleção `evento_metricas`).
+
+Um documento por evento guarda os contadores que os painéis consultam:
+
+    {evento_id, total, impressos, ativos, cancelados, validacoes,
+     tipos: {<tipo_id>: {total, impressos, ativos, cancelados}},
+     ilhas: {<ilha_id>: {total, ativos, cancelados, validacoes}}}
+
+Emissão (bilheteria, inscrição, admin, planilha), impressão, cancelamento e
+validação na portaria aplicam `$inc` ao documento já existente. Um evento sem
+documento é calculado a partir dos ingressos embutidos em `participantes` (ou
+da coleção antiga `ingressos_emitidos`, se não houver nenhum) e dos acessos em
+`validacoes_acesso` na primeira leitura; `reconstruir_metricas`
+refaz o documento a partir da mesma fonte. As ilhas de um ingresso são as
+mesmas do livro-razão de capacidade (`ilhas_afetadas`).
+"""
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional, Set
+
+from bson import ObjectId
+
+from app.utils.capacidade import STATUS_CANCELADO, ilhas_afetadas, permissoes_por_tipo
+
+logger = logging.getLogger(__name__)
+
+STATUS_ATIVO = "Ativo"
+# chave dos ingressos sem tipo em `tipos`
+SEM_TIPO = "sem_tipo"
+
+
+def _campo_status(status: Optional[str]) -> Optional[str]:
+    if status == STATUS_ATIVO:
+        return "ativos"
+    if status == STATUS_CANCELADO:
+        return "cancelados"
+    return None
+
+
+def _somar(inc: Dict[str, int], caminho: str, delta: int) -> None:
+    inc[caminho] = inc.get(caminho, 0) + delta
+
+
+def _prefixo_tipo(ingresso: Dict[str, Any]) -> str:
+    tipo_id = ingresso.get("tipo_ingresso_id")
+    return f"tipos.{tipo_id if tipo_id not in (None, '') else SEM_TIPO}."
+
+
+def _somar_ingresso(inc: Dict[str, int], ingresso: Dict[str, Any], permissoes: Dict[str, Set[str]]) -> None:
+    """Contadores de um ingresso: total/status no evento, no tipo e nas ilhas; impressos no evento e no tipo."""
+    campo = _campo_status(ingresso.get("status"))
+    prefixos = ["", _prefixo_tipo(ingresso)] + [f"ilhas.{i}." for i in ilhas_afetadas(ingresso, permissoes)]
+    for prefixo in prefixos:
+        _somar(inc, prefixo + "total", 1)
+        if campo:
+            _somar(inc, prefixo + campo, 1)
+    if ingresso.get("impresso") is True:
+        _somar(inc, "impressos", 1)
+        _somar(inc, _prefixo_tipo(ingresso) + "impressos", 1)
+
+
+async def _aplicar(db, evento_id: str, inc: Dict[str, int]) -> None:
+    """`$inc` no documento do evento; sem documento, a primeira leitura o calcula."""
+    inc = {k: v for k, v in inc.items() if v}
+    if not inc:
+        return
+    try:
+        await db.evento_metricas.update_one(
+            {"evento_id": evento_id},
+            {"$inc": inc, "$set": {"atualizado_em": datetime.now(timezone.utc)}},
+        )
+    except Exception as exc:
+        # o contador fica para `reconstruir_metricas`
+        logger.warning("Falha ao atualizar métricas do evento %s: %s", evento_id, exc)
+
+
+async def _permissoes(db, evento_id: str, permissoes: Optional[Dict[str, Set[str]]]) -> Dict[str, Set[str]]:
+    if permissoes is not None:
+        return permissoes
+    try:
+        return await permissoes_por_tipo(db, evento_id)
+    except Exception:
+        return {}
+
+
+async def registrar_emissoes(db, evento_id: str, ingressos: Iterable[Dict[str, Any]],
+                             permissoes: Optional[Dict[str, Set[str]]] = None) -> None:
+    """Contabiliza ingressos emitidos (um único `$inc` para todos, ex.: um lote da planilha)."""
+    permissoes = await _permissoes(db, evento_id, permissoes)
+    inc: Dict[str, int] = {}
+    for ingresso in ingressos:
+        _somar_ingresso(inc, ingresso, permissoes)
+    await _aplicar(db, evento_id, inc)
+
+
+async def registrar_cancelamento(db, evento_id: str, ingresso: Dict[str, Any],
+                                 permissoes: Optional[Dict[str, Set[str]]] = None) -> None:
+    """Move um ingresso (antes ativo) de `ativos` para `cancelados` no evento, no tipo e nas ilhas."""
+    permissoes = await _permissoes(db, evento_id, permissoes)
+    inc: Dict[str, int] = {}
+    for prefixo in ["", _prefixo_tipo(ingresso)] + [f"ilhas.{i}." for i in ilhas_afetadas(ingresso, permissoes)]:
+        _somar(inc, prefixo + "ativos", -1)
+        _somar(inc, prefixo + "cancelados", 1)
+    await _aplicar(db, evento_id, inc)
+
+
+async def registrar_impressao(db, evento_id: str, ingresso: Dict[str, Any], impresso: bool = True) -> None:
+    """Aplica a mudança do flag `impresso` de um ingresso (só chamar quando o valor mudou)."""
+    delta = 1 if impresso else -1
+    await _aplicar(db, evento_id, {"impressos": delta, _prefixo_tipo(ingresso) + "impressos": delta})
+
+
+async def registrar_validacoes(db, docs: Iterable[Dict[str, Any]]) -> None:
+    """Contabiliza acessos aprovados gravados em `validacoes_acesso` (agrupados por evento)."""
+    por_evento: Dict[str, Dict[str, int]] = {}
+    for doc in docs:
+        if doc.get("status") != "OK":
+            continue
+        inc = por_evento.setdefault(str(doc.get("evento_id")), {})
+        _somar(inc, "validacoes", 1)
+        if doc.get("ilha_id"):
+            _somar(inc, f"ilhas.{doc['ilha_id']}.validacoes", 1)
+    for evento_id, inc in por_evento.items():
+        await _aplicar(db, evento_id, inc)
+
+
+def _vazio() -> Dict[str, Any]:
+    return {"total": 0, "impressos": 0, "ativos": 0, "cancelados": 0, "validacoes": 0, "tipos": {}, "ilhas": {}}
+
+
+def _aplicar_em(metricas: Dict[str, Any], inc: Dict[str, int]) -> None:
+    """Aplica incrementos com caminhos "a.b.c" a um dicionário em memória."""
+    for caminho, delta in inc.items():
+        *pais, campo = caminho.split(".")
+        alvo = metricas
+        for chave in pais:
+            alvo = alvo.setdefault(chave, {})
+        alvo[campo] = alvo.get(campo, 0) + delta
+
+
+async def calcular_metricas(db, evento_id: str) -> Dict[str, Any]:
+    """Calcula as métricas do evento a partir dos ingressos embutidos e do log de acessos."""
+    permissoes = await _permissoes(db, evento_id, None)
+    inc: Dict[str, int] = {}
+    cursor = db.participantes.find({"ingressos.evento_id": evento_id}, {"ingressos": 1})
+    async for participante in cursor:
+        for ingresso in participante.get("ingressos", []) or []:
+            if str(ingresso.get("evento_id")) == str(evento_id):
+                _somar_ingresso(inc, ingresso, permissoes)
+    legado = getattr(db, "ingressos_emitidos", None)
+    if not inc and legado is not None:
+        # evento anterior aos ingressos embutidos: só a coleção antiga
+        async for ingresso in legado.find({"evento_id": evento_id}):
+            _somar_ingresso(inc, ingresso, permissoes)
+
+    validacoes = getattr(db, "validacoes_acesso", None)
+    if validacoes is not None:
+        pipeline = [
+            {"$match": {"evento_id": evento_id, "status": "OK"}},
+            {"$group": {"_id": "$ilha_id", "total": {"$sum": 1}}},
+        ]
+        try:
+            for grupo in await validacoes.aggregate(pipeline).to_list(length=None):
+                _somar(inc, "validacoes", grupo.get("total", 0))
+                if grupo.get("_id"):
+                    _somar(inc, f"ilhas.{grupo['_id']}.validacoes", grupo.get("total", 0))
+        except Exception as exc:
+            logger.warning("Falha ao contar validações do evento %s: %s", evento_id, exc)
+
+    metricas = _vazio()
+    _aplicar_em(metricas, inc)
+    return metricas
+
+
+async def reconstruir_metricas(db, evento_id: str) -> Dict[str, Any]:
+    """Recalcula e grava o documento de métricas do evento."""
+    metricas = await calcular_metricas(db, evento_id)
+    await db.evento_metricas.update_one(
+        {"evento_id": evento_id},
+        {"$set": {**metricas, "atualizado_em": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    return metricas
+
+
+async def obter_metricas(db, evento_id: str) -> Dict[str, Any]:
+    """Documento de métricas do evento (calculado e gravado no primeiro acesso)."""
+    doc = await db.evento_metricas.find_one({"evento_id": evento_id})
+    if not doc:
+        return await reconstruir_metricas(db, evento_id)
+    return {**_vazio(), **doc}
+
+
+async def tipos_por_id(db, evento: Dict[str, Any], tipo_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """Tipos de ingresso das chaves de `tipos`: os embutidos no evento e os demais em uma consulta `$in`."""
+    tipos: Dict[str, Dict[str, Any]] = {}
+    for t in (evento or {}).get("tipos_ingresso", []) or []:
+        for chave in (t.get("_id") or t.get("id"), t.get("numero")):
+            if chave is not None:
+                tipos.setdefault(str(chave), t)
+    faltando = [t for t in tipo_ids if t not in tipos and t != SEM_TIPO]
+    if faltando:
+        ids: list = list(faltando)
+        for t in faltando:
+            try:
+                ids.append(ObjectId(t))
+            except Exception:
+                pass
+        async for tipo in db.tipos_ingresso.find({"_id": {"$in": ids}}):
+            tipos[str(tipo.get("_id"))] = tipo
+    return tipos
@@ -0,0 +1,83 @@
+"""Paginação por cursor (keyset) das listagens de participantes.
+
+As listagens ordenam por `(nome_busca, _id)`, coberto pelo índice
+`(ingressos.evento_id, nome_busca, _id)`, e devolvem `next_cursor`: um token
+opaco com a chave do último item da página. A página seguinte filtra
+`(nome_busca, _id) > cursor` e lê do índice só os `per_page` documentos, em
+qualquer profundidade, em vez de descartar `(page - 1) * per_page` com `skip`.
+
+`page`/`per_page` continuam aceitos (com `skip`) para as primeiras páginas. O
+total é aproximado: a contagem de cada filtro fica em cache por
+`PAGINACAO_CONTAGEM_TTL_SEGUNDOS`, em vez de um `count_documents` por página.
+"""
+import base64
+import json
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from bson import ObjectId, json_util
+from bson.errors import InvalidId
+
+ORDEM = [("nome_busca", 1), ("_id", 1)]
+
+CONTAGEM_TTL = float(os.getenv("PAGINACAO_CONTAGEM_TTL_SEGUNDOS", "60"))
+CONTAGENS_MAX = 1024
+
+_contagens: "OrderedDict[Tuple[int, str], Tuple[float, int]]" = OrderedDict()
+
+
+def codificar_cursor(doc: Dict[str, Any]) -> str:
+    """Cursor opaco (base64 url-safe) com a chave de ordenação de `doc`."""
+    chave = json.dumps([doc.get("nome_busca"), str(doc.get("_id"))], separators=(",", ":"))
+    return base64.urlsafe_b64encode(chave.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decodificar_cursor(cursor: str) -> Tuple[Optional[str], Any]:
+    """Chave `(nome_busca, _id)` de um cursor; ValueError se o cursor for inválido."""
+    try:
+        bruto = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        nome_busca, _id = json.loads(bruto.decode("utf-8"))
+    except Exception as exc:
+        raise ValueError("cursor inválido") from exc
+    if not isinstance(_id, str) or (nome_busca is not None and not isinstance(nome_busca, str)):
+        raise ValueError("cursor inválido")
+    try:
+        return nome_busca, ObjectId(_id)
+    except InvalidId:
+        return nome_busca, _id
+
+
+def filtro_apos(cursor: str) -> Dict[str, Any]:
+    """Filtro dos documentos posteriores ao cursor na ordem `ORDEM`."""
+    nome_busca, _id = decodificar_cursor(cursor)
+    if nome_busca is None:
+        # participantes ainda sem `nome_busca` (null) vêm antes de qualquer nome
+        return {"$or": [{"nome_busca": None, "_id": {"$gt": _id}}, {"nome_busca": {"$type": "string"}}]}
+    return {"$or": [{"nome_busca": {"$gt": nome_busca}}, {"nome_busca": nome_busca, "_id": {"$gt": _id}}]}
+
+
+def proximo_cursor(docs: list, per_page: int) -> Optional[str]:
+    """`next_cursor` de uma página: None quando ela não veio cheia (última página)."""
+    return codificar_cursor(docs[-1]) if docs and len(docs) >= per_page else None
+
+
+async def contar_participantes(db, query: Dict[str, Any]) -> int:
+    """`count_documents` do filtro, reaproveitado por `CONTAGEM_TTL` segundos."""
+    chave = (id(db), json_util.dumps(query, sort_keys=True))
+    agora = time.monotonic()
+    em_cache = _contagens.get(chave)
+    if em_cache is not None and em_cache[0] > agora:
+        _contagens.move_to_end(chave)
+        return em_cache[1]
+    total = await db.participantes.count_documents(query)
+    _contagens[chave] = (agora + CONTAGEM_TTL, total)
+    _contagens.move_to_end(chave)
+    while len(_contagens) > CONTAGENS_MAX:
+        _contagens.popitem(last=False)
+    return total
+
+
+def limpar_contagens() -> None:
+    _contagens.clear()
@@ -1,258 +1,733 @@
 import io
 import csv
-from typing import Dict, Any
+import hashlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, BinaryIO, Callable, Dict, Iterator, List, Optional, Tuple, Union
 from datetime import datetime, timezone
 from openpyxl import load_workbook
 from email_validator import validate_email, EmailNotValidError
 from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 
-from app.utils.validations import validate_cpf, normalize_participante_data
+from app.config.auth import generate_qrcode_hash
+from app.utils.validations import validate_cpf, validar_cpfs, normalize_participante_data
+from app.utils.busca_participantes import campos_busca
+from app.utils.capacidade import permissoes_por_tipo, ilhas_afetadas, registrar_ocupacao
+from app.utils.indice_validacao import registrar_ingresso
+from app.utils import roster_evento
+from app.utils.metricas_evento import registrar_emissoes
+from app.utils.snapshot_portaria import registrar_alteracoes
+from app.utils.assets import PROJECAO_SEM_LOGO
+from app.utils.layout_versoes import campos_layout
+from app.utils.qr_assinado import codigo_para_evento
 
+logger = logging.getLogger(__name__)
 
-async def process_planilha(file_bytes: bytes, filename: str, evento_id: str, db, import_id: str = None, validate_only: bool = False) -> Dict[str, Any]:
-    """Processa uma planilha (.xlsx ou .csv) e importa participantes/ingressos.
 
-    Retorna um relatório com estatísticas e lista de erros por linha.
-    """
-    errors = []
-    created_participants = 0
-    reused_participants = 0
-    created_ingressos = 0
-    total = 0
+# linhas validadas e gravadas por vez (uma consulta de CPFs e poucas escritas em lote por lote)
+TAMANHO_LOTE = 500
+# o progresso da importação é gravado a cada N linhas ou S segundos, o que vier primeiro
+PROGRESSO_A_CADA_LINHAS = 500
+PROGRESSO_A_CADA_SEGUNDOS = 2.0
 
-    # Carrega evento para obter campos obrigatorios
-    evento = await _fetch_evento(db, evento_id)
-    if not evento:
-        raise ValueError("Evento não encontrado para importação")
-    campos_obrigatorios = evento.get("campos_obrigatorios_planilha", ["Nome", "Email", "CPF"])
 
-    # Determinar tipo de arquivo
-    if filename.lower().endswith('.xlsx'):
-        wb = load_workbook(io.BytesIO(file_bytes), read_only=True)
-        ws = wb.active
-        rows = list(ws.iter_rows(values_only=True))
-        if not rows:
-            return {"total": 0, "created_participants": 0, "created_ingressos": 0, "errors": []}
-        header = [str(c).strip() if c is not None else '' for c in rows[0]]
-        data_rows = rows[1:]
-        def iter_rows():
-            for r in data_rows:
-                yield {h: (v if v is not None else '') for h, v in zip(header, r)}
-    else:
-        # assume csv
-        text = file_bytes.decode('utf-8')
-        reader = csv.DictReader(io.StringIO(text))
-        def iter_rows():
-            for r in reader:
-                yield r
+def _filtro_id(valor) -> Dict[str, Any]:
+    try:
+        return {'_id': ObjectId(valor)}
+    except Exception:
+        return {'_id': valor}
 
-    seen_cpfs = set()
 
-    line_no = 1
-    for row in iter_rows():
-        line_no += 1
-        
-        # Normalize header keys to lowercase without spaces for lookup
-        def g(key):
-            return row.get(key) or row.get(key.title()) or row.get(key.capitalize()) or row.get(key.upper()) or row.get(key.lower())
-
-        # Extract basic fields
-        nome = None
-        email = None
-        cpf_raw = None
-        tipo_num = None
-        # Try common header names
-        for k in row.keys():
-            kn = k.strip().lower()
-            if kn in ['nome', 'name']:
-                nome = row[k]
-            elif kn in ['email', 'e-mail']:
-                email = row[k]
-            elif kn in ['cpf']:
-                # Excel pode interpretar CPF como número
-                raw_value = row[k]
-                if raw_value is not None:
-                    cpf_raw = str(raw_value).strip()
-            elif kn in ['tipo ingresso', 'tipo_ingresso', 'tipo', 'tipoingresso']:
-                tipo_num = row[k]
-        
-        # Pula linhas completamente vazias (ignora fórmulas do Excel)
-        # Uma linha é considerada vazia se Nome, Email e CPF estão vazios ou são apenas espaços
-        is_empty_line = True
-        if nome and str(nome).strip():
-            is_empty_line = False
-        if email and str(email).strip():
-            is_empty_line = False
-        if cpf_raw and str(cpf_raw).strip() and not str(cpf_raw).startswith('='):
-            is_empty_line = False
-        
-        if is_empty_line:
-            continue  # Pula esta linha sem incrementar total ou gerar erros
-        
-        total += 1
-        # After each row processed, update progress if import_id provided
-        if import_id:
+def _ids_da_linha(import_id: Optional[str], line: int) -> Tuple[ObjectId, ObjectId]:
+    """`_id` do participante novo e do ingresso criados pela linha.
+
+    Numa importação (`import_id`) são derivados de (importação, linha): ao
+    retomar, o lote sem checkpoint é refeito com os mesmos `_id`s e o que já
+    foi gravado é reconhecido em vez de virar erro ou duplicata.
+    """
+    if not import_id:
+        return ObjectId(), ObjectId()
+    return tuple(ObjectId(hashlib.sha256(f"{import_id}:{line}:{tipo}".encode()).digest()[:12])
+                 for tipo in ('participante', 'ingresso'))
+
+
+def _extrair_campos(row: Dict[str, Any]) -> Tuple[Any, Any, Optional[str], Any]:
+    """Nome, email, CPF (texto) e número do tipo de ingresso da linha."""
+    nome = None
+    email = None
+    cpf_raw = None
+    tipo_num = None
+    # Try common header names
+    for k in row.keys():
+        kn = k.strip().lower()
+        if kn in ['nome', 'name']:
+            nome = row[k]
+        elif kn in ['email', 'e-mail']:
+            email = row[k]
+        elif kn in ['cpf']:
+            # Excel pode interpretar CPF como número
+            raw_value = row[k]
+            if raw_value is not None:
+                cpf_raw = str(raw_value).strip()
+        elif kn in ['tipo ingresso', 'tipo_ingresso', 'tipo', 'tipoingresso']:
+            tipo_num = row[k]
+    return nome, email, cpf_raw, tipo_num
+
+
+def _linha_vazia(nome, email, cpf_raw) -> bool:
+    # Uma linha é considerada vazia se Nome, Email e CPF estão vazios ou são apenas espaços
+    # (ignora fórmulas do Excel)
+    if nome and str(nome).strip():
+        return False
+    if email and str(email).strip():
+        return False
+    if cpf_raw and str(cpf_raw).strip() and not str(cpf_raw).startswith('='):
+        return False
+    return True
+
+
+class _Progresso:
+    """Grava o progresso da importação (`progress`) sem uma escrita por linha.
+
+    Além de linhas processadas/total, registra a taxa (linhas por segundo) e a
+    estimativa de término. Ao fim de cada lote gravado também salva o ponto de
+    retomada (`checkpoint`: última linha e contadores), usado por
+    `app.utils.importacoes` após um reinício. Os erros por linha do lote vão
+    para `planilha_importacoes_erros` (um documento por linha, por `import_id`),
+    antes do checkpoint, em vez de regravar a lista inteira a cada lote.
+    """
+
+    def __init__(self, db, import_id: Optional[str], total: Optional[int] = None, inicial: int = 0):
+        self.db = db
+        self.import_id = import_id
+        self.total = total
+        self._inicial = inicial
+        self._gravado = inicial
+        self._inicio = time.monotonic()
+        self._instante = self._inicio
+
+    def progresso(self, processed: int) -> Dict[str, Any]:
+        decorrido = time.monotonic() - self._inicio
+        feitos = processed - self._inicial
+        taxa = feitos / decorrido if decorrido > 0 and feitos > 0 else 0.0
+        total = max(self.total, processed) if self.total is not None else None
+        eta = (total - processed) / taxa if taxa and total is not None else None
+        return {
+            'processed': processed,
+            'total': total,
+            'linhas_por_segundo': round(taxa, 1),
+            'eta_segundos': round(eta) if eta is not None else None,
+        }
+
+    async def atualizar(self, processed: int, forcar: bool = False) -> None:
+        if not self.import_id or processed == self._gravado:
+            return
+        agora = time.monotonic()
+        if not forcar and processed - self._gravado < PROGRESSO_A_CADA_LINHAS \
+                and agora - self._instante < PROGRESSO_A_CADA_SEGUNDOS:
+            return
+        await self._gravar(processed, {})
+
+    async def lote_gravado(self, processed: int, checkpoint: Dict[str, Any], erros: List[Dict[str, Any]]) -> None:
+        if not self.import_id:
+            return
+        if erros:
             try:
-                await db.planilha_importacoes.update_one({'_id': ObjectId(import_id)}, {'$set': {'progress': {'processed': total}}})
-            except Exception:
-                # ignore DB/update issues (e.g., fake DB in tests)
-                pass
+                await self.db.planilha_importacoes_erros.insert_many(
+                    [{'import_id': self.import_id, **erro} for erro in erros], ordered=False
+                )
+            except Exception as exc:
+                # sem os erros gravados o checkpoint não avança: a retomada refaz o lote
+                logger.warning("Falha ao gravar erros da importação %s: %s", self.import_id, exc)
+                await self._gravar(processed, {})
+                return
+        await self._gravar(processed, {'checkpoint': checkpoint})
+
+    async def _gravar(self, processed: int, extra: Dict[str, Any]) -> None:
+        self._gravado = processed
+        self._instante = time.monotonic()
+        try:
+            await self.db.planilha_importacoes.update_one({'_id': ObjectId(self.import_id)}, {'$set': {
+                'progress': self.progresso(processed),
+                'atualizado_em': datetime.now(timezone.utc),
+                **extra,
+            }})
+        except Exception:
+            # ignore DB/update issues (e.g., fake DB in tests)
+            pass
 
-        row_errors = []
-        # Required fields
-        for req in campos_obrigatorios:
-            key = req.strip().lower()
-            if key == 'nome' and not nome:
-                row_errors.append('Nome obrigatório')
-            if key == 'email' and not email:
-                row_errors.append('Email obrigatório')
-            if key == 'cpf' and not cpf_raw:
-                row_errors.append('CPF obrigatório')
 
+class _TiposEvento:
+    """Tipos de ingresso do evento, carregados uma vez por importação."""
+
+    def __init__(self, db, evento_id: str):
+        self.db = db
+        self.evento_id = evento_id
+        self._por_numero: Optional[Dict[Any, Any]] = None
+        self._padrao = None
+        self._cache: Dict[Any, Any] = {}
+
+    async def carregar(self) -> None:
+        try:
+            cursor = self.db.tipos_ingresso.find({'evento_id': self.evento_id})
+        except AttributeError:
+            # coleções mínimas (testes) só têm find_one: consultas por número, memorizadas
+            return
+        self._por_numero = {}
+        async for tipo in cursor:
+            self._por_numero.setdefault(tipo.get('numero'), tipo)
+            if tipo.get('padrao') and self._padrao is None:
+                self._padrao = tipo
+
+    async def por_numero(self, numero: int):
+        if self._por_numero is not None:
+            return self._por_numero.get(numero)
+        if numero not in self._cache:
+            self._cache[numero] = await self.db.tipos_ingresso.find_one({'evento_id': self.evento_id, 'numero': numero})
+        return self._cache[numero]
+
+    async def padrao(self):
+        if self._por_numero is not None:
+            return self._padrao
+        if 'padrao' not in self._cache:
+            self._cache['padrao'] = await self.db.tipos_ingresso.find_one({'evento_id': self.evento_id, 'padrao': True})
+        return self._cache['padrao']
+
+
+async def _participantes_por_cpf(db, cpfs) -> Dict[str, Dict[str, Any]]:
+    """Participantes já cadastrados com os CPFs informados, em uma consulta `$in`."""
+    if not cpfs:
+        return {}
+    encontrados = {}
+    try:
+        cursor = db.participantes.find({'cpf': {'$in': list(cpfs)}},
+                                       {'cpf': 1, 'ingressos._id': 1, 'ingressos.evento_id': 1})
+    except AttributeError:
+        for cpf in cpfs:
+            doc = await db.participantes.find_one({'cpf': cpf})
+            if doc:
+                encontrados[cpf] = doc
+        return encontrados
+    async for doc in cursor:
+        encontrados.setdefault(doc.get('cpf'), doc)
+    return encontrados
+
+
+async def _participantes_por_id(db, ids) -> Dict[str, Dict[str, Any]]:
+    """Participantes já gravados com os `_id`s informados (criados por uma tentativa anterior do lote)."""
+    try:
+        cursor = db.participantes.find({'_id': {'$in': list(ids)}}, {'ingressos._id': 1, 'ingressos.evento_id': 1})
+    except AttributeError:
+        return {}
+    return {str(doc['_id']): doc async for doc in cursor}
+
+
+def _ingresso_gravado(participante: Dict[str, Any], ingresso_id) -> bool:
+    return any(str(ing.get('_id')) == str(ingresso_id) for ing in participante.get('ingressos') or []
+               if isinstance(ing, dict))
+
+
+def _inscrito_no_evento(participante: Dict[str, Any], evento_id: str) -> bool:
+    return any(str(ing.get('evento_id')) == evento_id for ing in participante.get('ingressos') or [] if isinstance(ing, dict))
+
+
+async def _inserir_participantes(db, docs) -> List[Any]:
+    """Insere os participantes novos; retorna o `_id` de cada um ou a exceção que o impediu."""
+    if not docs:
+        return []
+    try:
+        res = await db.participantes.insert_many(docs, ordered=False)
+        return list(res.inserted_ids)
+    except AttributeError:
+        pass
+    except BulkWriteError as e:
+        falhas = {erro['index']: e for erro in e.details.get('writeErrors', [])}
+        return [falhas.get(i, doc.get('_id')) for i, doc in enumerate(docs)]
+    ids = []
+    for doc in docs:
+        try:
+            res = await db.participantes.insert_one(doc)
+            ids.append(res.inserted_id)
+        except Exception as e:
+            ids.append(e)
+    return ids
+
+
+async def _inserir_ingressos_emitidos(db, docs) -> None:
+    """Grava os ingressos também na coleção antiga (compatibilidade); falhas são ignoradas."""
+    try:
+        await db.ingressos_emitidos.insert_many(docs, ordered=False)
+        return
+    except AttributeError:
+        pass
+    except Exception:
+        # Se falhar (ex: coleção não existe), continua
+        return
+    for doc in docs:
+        try:
+            res = await db.ingressos_emitidos.insert_one(doc)
+            doc['_id'] = res.inserted_id
+        except Exception:
+            pass
+
+
+async def _push_ingresso(db, participante_id: str, ingresso_doc: Dict[str, Any]) -> None:
+    try:
+        await db.participantes.update_one({"_id": ObjectId(participante_id)}, {"$push": {"ingressos": ingresso_doc}})
+    except AttributeError:
+        # FakeCollection in some tests lacks update_one: perform in-place append on the found document
+        try:
+            part = await db.participantes.find_one({"_id": ObjectId(participante_id)})
+        except Exception:
+            part = await db.participantes.find_one({"_id": participante_id})
+        if part is not None:
+            part.setdefault('ingressos', []).append(ingresso_doc)
+    except Exception:
+        # fallback se participante._id estiver em formato string or other DB differences
+        try:
+            await db.participantes.update_one({"_id": participante_id}, {"$push": {"ingressos": ingresso_doc}})
+        except AttributeError:
+            part = await db.participantes.find_one({"_id": participante_id})
+            if part is not None:
+                part.setdefault('ingressos', []).append(ingresso_doc)
+
+
+async def _push_ingressos(db, pares) -> None:
+    """`$push` dos ingressos nos participantes em um único `bulk_write` não ordenado."""
+    if not pares:
+        return
+    bulk_write = getattr(db.participantes, 'bulk_write', None)
+    if bulk_write is None:
+        for participante_id, ingresso_doc in pares:
+            await _push_ingresso(db, participante_id, ingresso_doc)
+        return
+    await bulk_write([
+        UpdateOne(_filtro_id(participante_id), {"$push": {"ingressos": ingresso_doc}})
+        for participante_id, ingresso_doc in pares
+    ], ordered=False)
+
+
+@dataclass
+class _Importacao:
+    """Estado de uma importação, acumulado lote a lote."""
+    db: Any
+    evento: Dict[str, Any]
+    evento_id: str
+    campos_obrigatorios: List[str]
+    tipos: _TiposEvento
+    validate_only: bool
+    permissoes: Any = None
+    errors: List[Dict[str, Any]] = field(default_factory=list)
+    created_participants: int = 0
+    reused_participants: int = 0
+    created_ingressos: int = 0
+    seen_cpfs: set = field(default_factory=set)
+    # ocupação das ilhas e ingressos do lote corrente, aplicados ao fim do lote
+    ocupacao_importada: Dict[str, int] = field(default_factory=dict)
+    ingressos_importados: List[Dict[str, Any]] = field(default_factory=list)
+    import_id: Optional[str] = None
+    # o primeiro lote de uma execução pode refazer um lote interrompido antes do checkpoint
+    conferir_gravados: bool = False
+
+
+_OBRIGATORIOS = {'nome': (0, 'Nome obrigatório'), 'email': (1, 'Email obrigatório'), 'cpf': (2, 'CPF obrigatório')}
+
+
+def _email_invalido(email) -> bool:
+    # Email validation (relaxed): must contain '@' and a domain with a dot
+    try:
+        parts = str(email).split('@')
+        return len(parts) != 2 or '.' not in parts[1]
+    except Exception:
+        return True
+
+
+async def _validar_lote(imp: _Importacao, lote) -> List[Dict[str, Any]]:
+    """Validações que não dependem do banco, coluna a coluna sobre o lote.
+
+    Os CPFs do lote são validados de uma vez (`validar_cpfs`) e cada número de
+    tipo distinto é resolvido uma única vez; os erros de cada linha saem na
+    mesma ordem da validação linha a linha.
+    """
+    obrigatorios = [_OBRIGATORIOS[k] for k in (req.strip().lower() for req in imp.campos_obrigatorios)
+                    if k in _OBRIGATORIOS]
+    cpfs_raw = [campos[2] for _, _, campos in lote]
+    cpfs = iter(validar_cpfs([str(c) for c in cpfs_raw if c]))
+
+    tipos: Dict[Any, Tuple[Any, Optional[str]]] = {}
+    for tipo_num in {campos[3] for _, _, campos in lote if campos[3]}:
+        try:
+            tipo_obj = await imp.tipos.por_numero(int(str(tipo_num).strip()))
+            tipos[tipo_num] = (tipo_obj, None if tipo_obj else 'Tipo de ingresso inválido para o evento')
+        except Exception:
+            tipos[tipo_num] = (None, 'Tipo de ingresso deve ser número inteiro')
+
+    linhas = []
+    for (line_no, row, campos), cpf_raw in zip(lote, cpfs_raw):
+        nome, email, _, tipo_num = campos
+        # Required fields
+        row_errors = [msg for indice, msg in obrigatorios if not campos[indice]]
         # CPF validation
         cpf_digits = None
         if cpf_raw:
-            try:
-                cpf_digits = validate_cpf(str(cpf_raw))
-            except ValueError as e:
-                row_errors.append(f'CPF inválido: {e}')
-        # Email validation (relaxed): must contain '@' and a domain with a dot
-        if email:
-            try:
-                email_s = str(email)
-                parts = email_s.split('@')
-                if len(parts) != 2 or '.' not in parts[1]:
-                    row_errors.append('Email inválido')
-            except Exception:
-                row_errors.append('Email inválido')
+            cpf_digits, erro = next(cpfs)
+            if erro:
+                row_errors.append(f'CPF inválido: {erro}')
+        if email and _email_invalido(email):
+            row_errors.append('Email inválido')
         # Tipo ingresso validation
         tipo_obj = None
         if tipo_num:
-            try:
-                numero = int(str(tipo_num).strip())
-                tipo_obj = await db.tipos_ingresso.find_one({'evento_id': evento_id, 'numero': numero})
-                if not tipo_obj:
-                    row_errors.append('Tipo de ingresso inválido para o evento')
-            except Exception:
-                row_errors.append('Tipo de ingresso deve ser número inteiro')
-
+            tipo_obj, erro = tipos[tipo_num]
+            if erro:
+                row_errors.append(erro)
         # Dup CPF in sheet
         if cpf_digits:
-            if cpf_digits in seen_cpfs:
+            if cpf_digits in imp.seen_cpfs:
                 row_errors.append('CPF duplicado na planilha')
             else:
-                seen_cpfs.add(cpf_digits)
-
-        # Dup CPF in DB: check participantes then ingressos
-        if cpf_digits and not row_errors:
-            existing_part = await db.participantes.find_one({'cpf': cpf_digits})
-            if existing_part:
-                # Verifica se participante já tem ingresso para este evento (procura em ingressos embutidos)
-                part_has_ingresso = await db.participantes.find_one({'_id': existing_part.get('_id'), 'ingressos.evento_id': evento_id})
-                if part_has_ingresso:
-                    row_errors.append('CPF já inscrito neste evento')
-
-        if row_errors:
-            errors.append({'line': line_no, 'errors': row_errors, 'row': row})
+                imp.seen_cpfs.add(cpf_digits)
+        linhas.append({'line': line_no, 'row': row, 'nome': nome, 'email': email, 'cpf': cpf_digits,
+                       'tipo': tipo_obj, 'errors': row_errors})
+    return linhas
+
+
+async def _processar_lote(imp: _Importacao, lote) -> None:
+    """Valida o lote em memória, resolve os CPFs de uma vez e grava participantes/ingressos em lote."""
+    linhas = await _validar_lote(imp, lote)
+
+    # Dup CPF in DB: uma consulta para todos os CPFs válidos do lote
+    existentes = await _participantes_por_cpf(imp.db, {l['cpf'] for l in linhas if l['cpf'] and not l['errors']})
+    for linha in linhas:
+        linha['participante_oid'], linha['ingresso_oid'] = _ids_da_linha(imp.import_id, linha['line'])
+    proprios = {}
+    if imp.conferir_gravados and not imp.validate_only:
+        imp.conferir_gravados = False
+        proprios = await _participantes_por_id(imp.db, [l['participante_oid'] for l in linhas if not l['errors']])
+    for linha in linhas:
+        linha['gravado'] = False
+        proprio = proprios.get(str(linha['participante_oid'])) if not linha['errors'] else None
+        existente = proprio or (existentes.get(linha['cpf']) if linha['cpf'] and not linha['errors'] else None)
+        if existente and _ingresso_gravado(existente, linha['ingresso_oid']):
+            # gravada pela tentativa interrompida: conta como importada, sem nova escrita
+            linha['gravado'] = True
+        # Verifica se participante já tem ingresso para este evento (procura em ingressos embutidos)
+        elif existente and _inscrito_no_evento(existente, imp.evento_id):
+            linha['errors'].append('CPF já inscrito neste evento')
+        linha['participante'] = existente
+        linha['participante_proprio'] = proprio is not None
+
+    validas = [l for l in linhas if not l['errors']]
+    if imp.validate_only:
+        # In validation-only mode we don't create participants/ingressos; counts remain zero
+        imp.errors.extend({'line': l['line'], 'errors': l['errors'], 'row': l['row']} for l in linhas if l['errors'])
+        return
+
+    # Participantes novos em um único insert_many
+    novas = [l for l in validas if not l['participante']]
+    docs = []
+    for linha in novas:
+        row = linha['row']
+        # Extrair telefone e empresa do row, podem vir como Long do Excel
+        telefone_raw = row.get('Telefone', '') or row.get('telefone', '')
+        empresa_raw = row.get('Empresa', '') or row.get('empresa', '')
+        part_doc = {
+            'nome': linha['nome'] or '',
+            'email': linha['email'] or '',
+            'cpf': linha['cpf'] or '',
+            'telefone': telefone_raw,
+            'empresa': empresa_raw
+        }
+        # Normalizar dados antes de inserir (converte Long->str, ''->None, etc)
+        part_doc = normalize_participante_data(part_doc)
+        part_doc.update(campos_busca(part_doc.get('nome')))
+        if imp.import_id:
+            part_doc['_id'] = linha['participante_oid']
+        docs.append(part_doc)
+    for linha, inserido in zip(novas, await _inserir_participantes(imp.db, docs)):
+        if isinstance(inserido, Exception):
+            duplicado = isinstance(inserido, BulkWriteError) or 'duplicate' in str(inserido).lower()
+            linha['errors'].append('Email já cadastrado' if duplicado else 'Erro ao gravar participante')
             continue
-
-        # Passed validations -> if not in validate-only mode, create participant if needed and ingresso
-        if not validate_only:
-            if cpf_digits:
-                existing_part = await db.participantes.find_one({'cpf': cpf_digits})
+        linha['participante_id'] = str(inserido)
+        imp.created_participants += 1
+    for linha in validas:
+        if linha['participante']:
+            linha['participante_id'] = str(linha['participante'].get('_id'))
+            if linha['participante_proprio']:
+                imp.created_participants += 1
             else:
-                existing_part = None
+                imp.reused_participants += 1
 
-            if existing_part:
-                participante_id = str(existing_part.get('_id'))
-                reused_participants += 1
-            else:
-                # Extrair telefone e empresa do row, podem vir como Long do Excel
-                telefone_raw = row.get('Telefone', '') or row.get('telefone', '')
-                empresa_raw = row.get('Empresa', '') or row.get('empresa', '')
-                
-                part_doc = {
-                    'nome': nome or '',
-                    'email': email or '',
-                    'cpf': cpf_digits or '',
-                    'telefone': telefone_raw,
-                    'empresa': empresa_raw
-                }
-                # Normalizar dados antes de inserir (converte Long->str, ''->None, etc)
-                part_doc = normalize_participante_data(part_doc)
-                
-                res = await db.participantes.insert_one(part_doc)
-                participante_id = str(res.inserted_id)
-                created_participants += 1
-
-            # tipo to use
-            if tipo_obj:
-                tipo_id = str(tipo_obj.get('_id') or tipo_obj.get('id') or tipo_obj.get('numero'))
-            else:
-                # find padrao
-                tipo_obj = await db.tipos_ingresso.find_one({'evento_id': evento_id, 'padrao': True})
-                tipo_id = str(tipo_obj.get('_id')) if tipo_obj else None
-
-            ingresso_doc = {
-                'evento_id': evento_id,
-                'tipo_ingresso_id': tipo_id,
-                'participante_id': participante_id,
-                'participante_cpf': cpf_digits,
-                'status': 'Ativo',
-                'qrcode_hash': f'auto-{datetime.now(timezone.utc).timestamp()}',
-                'data_emissao': datetime.now(timezone.utc),
-                'impresso': False
-            }
-            # embed layout into ingresso
-            layout_source = evento.get("layout_ingresso")
-            try:
-                from app.utils.layouts import embed_layout
-                embedded = embed_layout(layout_source, {'nome': nome or '', 'cpf': cpf_digits or '', 'email': email or ''}, tipo_obj or {}, evento, ingresso_doc)
-                ingresso_doc['layout_ingresso'] = embedded
-            except Exception:
-                pass
-            # Primeiro insere na coleção antiga para compatibilidade e obter _id
-            try:
-                res = await db.ingressos_emitidos.insert_one(ingresso_doc)
-                ingresso_doc["_id"] = res.inserted_id
-            except Exception:
-                # Se falhar (ex: coleção não existe), continua sem _id
-                pass
-
-            # Normalizar ingresso_doc antes de embedar (converter ObjectId->str, etc)
-            ingresso_doc = normalize_participante_data(ingresso_doc)
+    imp.errors.extend({'line': l['line'], 'errors': l['errors'], 'row': l['row']} for l in linhas if l['errors'])
 
-            # Em seguida push no participante (ingressos embutidos)
-            try:
-                await db.participantes.update_one({"_id": ObjectId(participante_id)}, {"$push": {"ingressos": ingresso_doc}})
-            except AttributeError:
-                # FakeCollection in some tests lacks update_one: perform in-place append on the found document
-                try:
-                    part = await db.participantes.find_one({"_id": ObjectId(participante_id)})
-                except Exception:
-                    part = await db.participantes.find_one({"_id": participante_id})
-                if part is not None:
-                    part.setdefault('ingressos', []).append(ingresso_doc)
-            except Exception:
-                # fallback se participante._id estiver em formato string or other DB differences
-                try:
-                    await db.participantes.update_one({"_id": participante_id}, {"$push": {"ingressos": ingresso_doc}})
-                except AttributeError:
-                    part = await db.participantes.find_one({"_id": participante_id})
-                    if part is not None:
-                        part.setdefault('ingressos', []).append(ingresso_doc)
-
-            created_ingressos += 1
+    ingressos = []
+    for linha in validas:
+        if linha['errors']:
+            continue
+        if linha['gravado']:
+            imp.created_ingressos += 1
+            continue
+        tipo_obj = linha['tipo']
+        # tipo to use
+        if tipo_obj:
+            tipo_id = str(tipo_obj.get('_id') or tipo_obj.get('id') or tipo_obj.get('numero'))
         else:
-            # In validation-only mode we don't create participants/ingressos; counts remain zero
+            # find padrao
+            tipo_obj = await imp.tipos.padrao()
+            tipo_id = str(tipo_obj.get('_id')) if tipo_obj else None
+
+        ingresso_doc = {
+            '_id': linha['ingresso_oid'],
+            'evento_id': imp.evento_id,
+            'tipo_ingresso_id': tipo_id,
+            'participante_id': linha['participante_id'],
+            'participante_cpf': linha['cpf'],
+            'status': 'Ativo',
+            'qrcode_hash': codigo_para_evento(imp.evento, str(linha['ingresso_oid']),
+                                              (tipo_obj or {}).get('numero')) or generate_qrcode_hash(),
+            'data_emissao': datetime.now(timezone.utc),
+            'impresso': False
+        }
+        # valores do ingresso; o layout vem da versão vigente do evento
+        ingresso_doc['campos_layout'] = campos_layout(
+            {'nome': linha['nome'] or '', 'cpf': linha['cpf'] or '', 'email': linha['email'] or ''},
+            tipo_obj or {}, imp.evento, ingresso_doc
+        )
+        ingressos.append((linha, ingresso_doc))
+
+    # Primeiro insere na coleção antiga para compatibilidade
+    await _inserir_ingressos_emitidos(imp.db, [doc for _, doc in ingressos])
+
+    # Normalizar ingresso_doc antes de embedar (converter ObjectId->str, etc)
+    ingressos = [(linha, normalize_participante_data(ingresso_doc)) for linha, ingresso_doc in ingressos]
+    # Em seguida push nos participantes (ingressos embutidos)
+    await _push_ingressos(imp.db, [(linha['participante_id'], ingresso_doc) for linha, ingresso_doc in ingressos])
+
+    # estado em memória e contadores só depois da gravação
+    for linha, ingresso_doc in ingressos:
+        imp.created_ingressos += 1
+        registrar_ingresso(imp.evento_id, ingresso_doc, linha['nome'])
+        roster_evento.registrar_ingresso(imp.evento_id, ingresso_doc, linha['nome'], linha['cpf'])
+        imp.ingressos_importados.append(ingresso_doc)
+        for ilha_id in ilhas_afetadas(ingresso_doc, imp.permissoes):
+            imp.ocupacao_importada[ilha_id] = imp.ocupacao_importada.get(ilha_id, 0) + 1
+
+    # ocupação das ilhas e uma versão nova do snapshot offline por lote gravado
+    for ilha_id, n in imp.ocupacao_importada.items():
+        try:
+            await registrar_ocupacao(imp.db, imp.evento_id, [ilha_id], n)
+        except Exception:
             pass
+    imp.ocupacao_importada.clear()
+    await registrar_emissoes(imp.db, imp.evento_id, imp.ingressos_importados, imp.permissoes)
+    await registrar_alteracoes(imp.db, imp.evento_id, imp.ingressos_importados)
+    imp.ingressos_importados.clear()
+
+
+# ==================== LEITURA ====================
+
+# bytes lidos por vez ao contar linhas de um CSV
+_BLOCO_LEITURA = 1024 * 1024
+
+
+class LeituraPlanilha:
+    """Linhas de uma planilha como dicionários (cabeçalho -> valor), lidas sob demanda."""
+
+    def __init__(self, linhas: Iterator[Dict[str, Any]], total_estimado: Optional[int], vazia: bool = False,
+                 fechar: Optional[Callable[[], None]] = None):
+        self._linhas = linhas
+        self.total_estimado = total_estimado
+        self.vazia = vazia
+        self._fechar = fechar
+
+    def linhas(self) -> Iterator[Dict[str, Any]]:
+        return self._linhas
+
+    def fechar(self) -> None:
+        if self._fechar is not None:
+            self._fechar()
+            self._fechar = None
+
+
+def _contar_linhas(fh: BinaryIO) -> int:
+    """Conta as quebras de linha em blocos e volta ao início do arquivo."""
+    inicio = fh.tell()
+    linhas = 0
+    ultimo = b''
+    while True:
+        bloco = fh.read(_BLOCO_LEITURA)
+        if not bloco:
+            break
+        linhas += bloco.count(b'\n')
+        ultimo = bloco[-1:]
+    if ultimo and ultimo != b'\n':
+        linhas += 1
+    fh.seek(inicio)
+    return linhas
+
+
+def ler_planilha(arquivo: Union[bytes, BinaryIO], filename: str) -> LeituraPlanilha:
+    """Abre a planilha (.xlsx ou .csv) para leitura em streaming.
+
+    XLSX usa o modo somente leitura do openpyxl (linhas lidas do zip sob
+    demanda); CSV é decodificado incrementalmente com `io.TextIOWrapper`.
+    """
+    fh = io.BytesIO(arquivo) if isinstance(arquivo, (bytes, bytearray)) else arquivo
+
+    # Determinar tipo de arquivo
+    if filename.lower().endswith('.xlsx'):
+        wb = load_workbook(fh, read_only=True)
+        ws = wb.active
+        rows = ws.iter_rows(values_only=True)
+        primeira = next(rows, None)
+        if primeira is None:
+            wb.close()
+            return LeituraPlanilha(iter(()), 0, vazia=True)
+        header = [str(c).strip() if c is not None else '' for c in primeira]
+        max_row = ws.max_row
+        def iter_rows():
+            for r in rows:
+                yield {h: (v if v is not None else '') for h, v in zip(header, r)}
+        return LeituraPlanilha(iter_rows(), max_row - 1 if max_row else None, fechar=wb.close)
+
+    # assume csv
+    total_estimado = max(0, _contar_linhas(fh) - 1) if fh.seekable() else None
+    texto = io.TextIOWrapper(fh, encoding='utf-8', newline='')
+    reader = csv.DictReader(texto)
+    # o wrapper não fecha o arquivo do chamador
+    return LeituraPlanilha(iter(reader), total_estimado, fechar=texto.detach)
+
+
+async def process_planilha(file_bytes: Union[bytes, BinaryIO], filename: str, evento_id: str, db, import_id: str = None, validate_only: bool = False,
+                           checkpoint: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Processa uma planilha (.xlsx ou .csv) e importa participantes/ingressos.
+
+    `file_bytes` pode ser o conteúdo em bytes ou um arquivo binário aberto (ex.:
+    o spool de um `UploadFile`); a planilha é lida linha a linha, sem carregar
+    o arquivo inteiro em memória.
+
+    As linhas são processadas em lotes de `TAMANHO_LOTE`: validação em memória,
+    uma consulta `$in` pelos CPFs do lote, `insert_many` dos participantes
+    novos e um `bulk_write` com os ingressos. Com `import_id`, cada lote
+    gravado deixa um `checkpoint` na importação; passando-o de volta em
+    `checkpoint`, o processamento continua após a última linha gravada. O
+    lote interrompido antes do checkpoint é refeito: participantes e ingressos
+    novos têm `_id` derivado de (importação, linha), e as linhas já gravadas
+    contam como importadas em vez de virar erro.
+
+    Retorna um relatório com estatísticas e lista de erros por linha.
+    """
+    # Carrega evento para obter campos obrigatorios
+    evento = await _fetch_evento(db, evento_id)
+    if not evento:
+        raise ValueError("Evento não encontrado para importação")
+
+    leitura = ler_planilha(file_bytes, filename)
+    try:
+        return await _importar_linhas(db, evento, evento_id, leitura, import_id, validate_only, checkpoint)
+    finally:
+        leitura.fechar()
+
+
+async def _erros_gravados(db, import_id: str, ate_linha: int) -> List[Dict[str, Any]]:
+    """Erros por linha já gravados para a importação, até a linha do checkpoint.
+
+    Erros de linhas posteriores (lote interrompido antes do checkpoint, ou uma
+    execução anterior sem retomada) são descartados: essas linhas serão
+    processadas de novo.
+    """
+    try:
+        await db.planilha_importacoes_erros.delete_many({'import_id': import_id, 'line': {'$gt': ate_linha}})
+        if not ate_linha:
+            return []
+        docs = await db.planilha_importacoes_erros.find({'import_id': import_id}).sort('line', 1).to_list(length=None)
+    except Exception as exc:
+        logger.warning("Falha ao ler erros gravados da importação %s: %s", import_id, exc)
+        return []
+    return [{'line': d['line'], 'errors': d['errors'], 'row': d['row']} for d in docs]
+
+
+async def _importar_linhas(db, evento, evento_id: str, leitura: LeituraPlanilha, import_id: Optional[str],
+                           validate_only: bool, checkpoint: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    campos_obrigatorios = evento.get("campos_obrigatorios_planilha", ["Nome", "Email", "CPF"])
+    if leitura.vazia:
+        return {"total": 0, "created_participants": 0, "created_ingressos": 0, "errors": []}
+
+    tipos = _TiposEvento(db, evento_id)
+    await tipos.carregar()
+    imp = _Importacao(
+        db=db,
+        evento=evento,
+        evento_id=evento_id,
+        campos_obrigatorios=campos_obrigatorios,
+        tipos=tipos,
+        validate_only=validate_only,
+        permissoes=None if validate_only else await permissoes_por_tipo(db, evento_id, evento),
+        import_id=import_id,
+        conferir_gravados=bool(import_id),
+    )
+
+    total = 0
+    ultima_gravada = 0
+    if checkpoint:
+        # retomada: contadores até a última linha gravada
+        ultima_gravada = checkpoint.get('linha', 0)
+        total = checkpoint.get('total', 0)
+        imp.created_participants = checkpoint.get('created_participants', 0)
+        imp.reused_participants = checkpoint.get('reused_participants', 0)
+        imp.created_ingressos = checkpoint.get('created_ingressos', 0)
+    if import_id:
+        imp.errors = await _erros_gravados(db, import_id, ultima_gravada)
+    progresso = _Progresso(db, import_id, total=leitura.total_estimado, inicial=total)
+
+    async def gravar_lote(lote):
+        antes = len(imp.errors)
+        await _processar_lote(imp, lote)
+        await progresso.lote_gravado(total, {
+            'linha': lote[-1][0],
+            'total': total,
+            'created_participants': imp.created_participants,
+            'reused_participants': imp.reused_participants,
+            'created_ingressos': imp.created_ingressos,
+        }, imp.errors[antes:])
+
+    lote = []
+    line_no = 1
+    for row in leitura.linhas():
+        line_no += 1
+        campos = _extrair_campos(row)
+        if _linha_vazia(*campos[:3]):
+            continue  # Pula esta linha sem incrementar total ou gerar erros
+        if line_no <= ultima_gravada:
+            # linha já gravada: só o CPF, para a checagem de duplicados na planilha
+            try:
+                if campos[2]:
+                    imp.seen_cpfs.add(validate_cpf(str(campos[2])))
+            except ValueError:
+                pass
+            continue
+
+        total += 1
+        lote.append((line_no, row, campos))
+        await progresso.atualizar(total)
+        if len(lote) >= TAMANHO_LOTE:
+            await gravar_lote(lote)
+            lote = []
+    if lote:
+        await gravar_lote(lote)
+    progresso.total = total
+    await progresso.atualizar(total, forcar=True)
 
     report = {
         'total': total,
-        'created_participants': created_participants,
-        'reused_participants': reused_participants,
-        'created_ingressos': created_ingressos,
-        'errors': errors
+        'created_participants': imp.created_participants,
+        'reused_participants': imp.reused_participants,
+        'created_ingressos': imp.created_ingressos,
+        'errors': imp.errors
     }
 
     return report
@@ -341,7 +816,7 @@ async def _fetch_evento(db, evento_id: str):
 
     evento = None
     if object_id:
-        evento = await db.eventos.find_one({"_id": object_id})
+        evento = await db.eventos.find_one({"_id": object_id}, PROJECAO_SEM_LOGO)
     if not evento:
-        evento = await db.eventos.find_one({"_id": evento_id})
+        evento = await db.eventos.find_one({"_id": evento_id}, PROJECAO_SEM_LOGO)
     return evento
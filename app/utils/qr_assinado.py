@@ -0,0 +1,111 @@
+"""QR codes assinados (HMAC) verificáveis sem consulta ao banco.
+
+Formato opcional, habilitado por evento (`qr_assinado: true`). O código é
+`Q1-` seguido do base32 (sem padding) de:
+
+    evento_id (12 bytes) | ingresso_id (12 bytes) | número do tipo (2 bytes)
+    | emissão em epoch (4 bytes) | HMAC-SHA256 truncado (8 bytes)
+
+O HMAC é calculado com o segredo do evento (`qr_segredo`). O alfabeto base32
+(A-Z, 2-7) e o prefixo cabem no modo alfanumérico do QR, o que mantém o
+código em uma versão baixa (64 caracteres -> versão 3-L).
+
+Os hashes aleatórios antigos continuam válidos: qualquer código sem o prefixo
+segue o fluxo normal de validação.
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+import struct
+import time
+from typing import Optional, Dict, Any
+
+from bson import ObjectId
+
+PREFIXO = "Q1-"
+_TAMANHO_HMAC = 8
+_FORMATO = ">12s12sHI"
+_TAMANHO_DADOS = struct.calcsize(_FORMATO)
+
+
+def gerar_segredo() -> str:
+    """Segredo por evento usado para assinar os QR codes."""
+    return secrets.token_hex(32)
+
+
+def _assinar(segredo: str, dados: bytes) -> bytes:
+    return hmac.new(segredo.encode("utf-8"), dados, hashlib.sha256).digest()[:_TAMANHO_HMAC]
+
+
+def _numero_tipo(tipo_numero) -> int:
+    try:
+        return max(0, min(int(tipo_numero), 0xFFFF))
+    except (TypeError, ValueError):
+        return 0
+
+
+def gerar_qrcode_assinado(segredo: str, evento_id: str, ingresso_id: str, tipo_numero=None,
+                          emitido_em: Optional[int] = None) -> str:
+    """Gera o código assinado de um ingresso."""
+    dados = struct.pack(
+        _FORMATO,
+        ObjectId(evento_id).binary,
+        ObjectId(ingresso_id).binary,
+        _numero_tipo(tipo_numero),
+        int(emitido_em if emitido_em is not None else time.time()) & 0xFFFFFFFF,
+    )
+    bruto = dados + _assinar(segredo, dados)
+    return PREFIXO + base64.b32encode(bruto).decode("ascii").rstrip("=")
+
+
+def codigo_para_evento(evento: Optional[Dict[str, Any]], ingresso_id: str, tipo_numero=None) -> Optional[str]:
+    """Código assinado para o ingresso se o evento usa `qr_assinado`; None caso contrário."""
+    if evento and evento.get("qr_assinado") and evento.get("qr_segredo"):
+        return gerar_qrcode_assinado(evento["qr_segredo"], str(evento["_id"]), ingresso_id, tipo_numero)
+    return None
+
+
+def eh_assinado(codigo: str) -> bool:
+    return isinstance(codigo, str) and codigo.startswith(PREFIXO)
+
+
+def decodificar(codigo: str) -> Optional[Dict[str, Any]]:
+    """Decodifica um código assinado sem verificar a assinatura; None se malformado."""
+    if not eh_assinado(codigo):
+        return None
+    corpo = codigo[len(PREFIXO):].upper()
+    try:
+        bruto = base64.b32decode(corpo + "=" * (-len(corpo) % 8))
+    except Exception:
+        return None
+    if len(bruto) != _TAMANHO_DADOS + _TAMANHO_HMAC:
+        return None
+    dados, assinatura = bruto[:_TAMANHO_DADOS], bruto[_TAMANHO_DADOS:]
+    evento, ingresso, tipo_numero, emitido_em = struct.unpack(_FORMATO, dados)
+    return {
+        "evento_id": str(ObjectId(evento)),
+        "ingresso_id": str(ObjectId(ingresso)),
+        "tipo_numero": tipo_numero,
+        "emitido_em": emitido_em,
+        "_dados": dados,
+        "_assinatura": assinatura,
+    }
+
+
+def verificar(codigo: str, evento_id: str, segredo: Optional[str]) -> Optional[str]:
+    """Verifica um código assinado apenas com CPU.
+
+    Retorna None quando o código não é assinado (formato legado) ou é válido
+    para o evento; caso contrário retorna o motivo da recusa.
+    """
+    if not eh_assinado(codigo):
+        return None
+    info = decodificar(codigo)
+    if info is None:
+        return "QR Code inválido"
+    if info["evento_id"] != str(evento_id):
+        return "Ingresso não pertence a este evento"
+    if not segredo or not hmac.compare_digest(_assinar(segredo, info["_dados"]), info["_assinatura"]):
+        return "QR Code inválido"
+    return None
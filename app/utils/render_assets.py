@@ -0,0 +1,232 @@
+"""Caches de recursos usados pelo renderizador de ingressos.
+
+Na impressão em lote o custo de `_render_layout_to_image` era dominado por
+trabalho repetido a cada ingresso: `ImageFont.truetype` lido do disco para
+cada texto, o logo do evento decodificado e redimensionado (LANCZOS) para cada
+elemento de logo e o QR gerado em tamanho cheio por `qrcode.make` para depois
+ser redimensionado. Este módulo mantém:
+
+- fontes por (caminho, tamanho em px);
+- o logo já decodificado e ajustado ao quadrado do elemento, por
+  (hash do logo, tamanho em px);
+- QR codes gerados diretamente no tamanho final (cada módulo um bloco de
+  `tamanho // módulos` px, centralizado no quadrado), por (texto, tamanho em px);
+- a camada base de cada layout (borda e elementos que não dependem do
+  ingresso e vêm antes do primeiro elemento variável, para manter a ordem
+  de sobreposição), por (hash do conteúdo estático, DPI, logo).
+
+Cada cache é um LRU com contadores de acertos e faltas. No pool de
+renderização cada processo mantém seus próprios caches.
+"""
+import base64
+import hashlib
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional
+
+import qrcode
+from PIL import Image, ImageFont
+
+DIRETORIO_FONTES = "/usr/share/fonts/truetype/dejavu"
+FONTE_PADRAO = f"{DIRETORIO_FONTES}/DejaVuSans.ttf"
+
+_FAMILIAS = {
+    "serif": ("DejaVuSerif", "Bold", "Italic", "BoldItalic"),
+    "mono": ("DejaVuSansMono", "Bold", "Oblique", "BoldOblique"),
+    "sans": ("DejaVuSans", "Bold", "Oblique", "BoldOblique"),
+}
+
+
+class LRUContado:
+    """LRU simples com contadores de acertos e faltas."""
+
+    def __init__(self, maximo: int):
+        self.maximo = maximo
+        self._itens: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self.acertos = 0
+        self.faltas = 0
+
+    def __contains__(self, chave: Hashable) -> bool:
+        return chave in self._itens
+
+    def obter(self, chave: Hashable, criar: Callable[[], Any]) -> Any:
+        if chave in self._itens:
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return self._itens[chave]
+        self.faltas += 1
+        valor = criar()
+        self._itens[chave] = valor
+        while len(self._itens) > self.maximo:
+            self._itens.popitem(last=False)
+        return valor
+
+    def limpar(self) -> None:
+        self._itens.clear()
+        self.acertos = 0
+        self.faltas = 0
+
+    def metricas(self) -> Dict[str, int]:
+        return {"itens": len(self._itens), "acertos": self.acertos, "faltas": self.faltas}
+
+
+_fontes = LRUContado(64)
+_logos = LRUContado(32)
+_qrcodes = LRUContado(256)
+# ~4 MB por camada a 300 DPI (80x120 mm)
+_camadas = LRUContado(8)
+
+
+# ==================== FONTES ====================
+
+def caminho_fonte(familia: Optional[str], negrito: bool = False, italico: bool = False) -> str:
+    """Mapeia a família do editor para o arquivo DejaVu equivalente."""
+    if familia in ("Times", "Times New Roman", "Serif"):
+        base, b, i, bi = _FAMILIAS["serif"]
+    elif familia in ("Courier", "Courier New", "Mono", "Monospace"):
+        base, b, i, bi = _FAMILIAS["mono"]
+    else:
+        base, b, i, bi = _FAMILIAS["sans"]
+    sufixo = bi if (negrito and italico) else b if negrito else i if italico else ""
+    return f"{DIRETORIO_FONTES}/{base}{'-' + sufixo if sufixo else ''}.ttf"
+
+
+def _carregar_fonte(caminho: str, tamanho_px: int) -> ImageFont.ImageFont:
+    for candidato in (caminho, FONTE_PADRAO):
+        try:
+            return ImageFont.truetype(candidato, tamanho_px)
+        except Exception:
+            continue
+    return ImageFont.load_default()
+
+
+def fonte(caminho: str, tamanho_px: int) -> ImageFont.ImageFont:
+    """Fonte carregada uma vez por (caminho, tamanho)."""
+    return _fontes.obter((caminho, tamanho_px), lambda: _carregar_fonte(caminho, tamanho_px))
+
+
+# ==================== LOGO ====================
+
+def chave_logo(logo_blob: Optional[Dict[str, Any]], logo_path: Optional[str]) -> Optional[str]:
+    if logo_blob and isinstance(logo_blob, dict):
+        if logo_blob.get("sha256"):
+            return f"sha256:{logo_blob['sha256']}"
+        if logo_blob.get("bytes") is not None:
+            return "sha256:" + hashlib.sha256(logo_blob["bytes"]).hexdigest()
+        if logo_blob.get("data"):
+            return "b64:" + hashlib.sha256(str(logo_blob["data"]).encode("utf-8")).hexdigest()
+    if logo_path:
+        arquivo = Path("app/static/uploads") / logo_path
+        try:
+            return f"path:{logo_path}:{arquivo.stat().st_mtime_ns}"
+        except OSError:
+            return None
+    return None
+
+
+def _abrir_logo(logo_blob: Optional[Dict[str, Any]], logo_path: Optional[str]) -> Optional[Image.Image]:
+    if logo_blob and isinstance(logo_blob, dict):
+        try:
+            # asset store gives raw bytes; legacy embedded blobs are base64
+            dados = logo_blob.get("bytes")
+            if dados is None:
+                dados = base64.b64decode(logo_blob.get("data", ""))
+            return Image.open(BytesIO(dados)).convert("RGBA")
+        except Exception:
+            pass
+    if logo_path:
+        arquivo = Path("app/static/uploads") / logo_path
+        try:
+            if arquivo.exists():
+                return Image.open(arquivo).convert("RGBA")
+        except Exception:
+            pass
+    return None
+
+
+def _ajustar_logo(logo: Image.Image, tamanho_px: int) -> Image.Image:
+    """Reduz mantendo a proporção e centraliza sobre um quadrado branco."""
+    logo = logo.copy()
+    logo.thumbnail((tamanho_px, tamanho_px), Image.Resampling.LANCZOS)
+    fundo = Image.new("RGB", (tamanho_px, tamanho_px), color="white")
+    deslocamento = ((tamanho_px - logo.width) // 2, (tamanho_px - logo.height) // 2)
+    if logo.mode == "RGBA":
+        fundo.paste(logo, deslocamento, logo)
+    else:
+        fundo.paste(logo, deslocamento)
+    return fundo
+
+
+def logo_ajustado(logo_blob: Optional[Dict[str, Any]], logo_path: Optional[str],
+                  tamanho_px: int) -> Optional[Image.Image]:
+    """Logo pronto para colar (tamanho_px x tamanho_px), ou None se indisponível.
+
+    A imagem retornada é compartilhada entre renderizações: não deve ser
+    alterada, apenas colada.
+    """
+    chave = chave_logo(logo_blob, logo_path)
+    if chave is None:
+        return None
+
+    def criar():
+        original = _abrir_logo(logo_blob, logo_path)
+        return _ajustar_logo(original, tamanho_px) if original is not None else None
+
+    return _logos.obter((chave, tamanho_px), criar)
+
+
+# ==================== QR CODE ====================
+
+def _gerar_qrcode(texto: str, tamanho_px: int) -> Image.Image:
+    qr = qrcode.QRCode(border=4)
+    qr.add_data(texto)
+    qr.make(fit=True)
+    matriz = qr.get_matrix()
+    modulos = len(matriz)
+    base = Image.new("1", (modulos, modulos), 1)
+    base.putdata([0 if ponto else 1 for linha in matriz for ponto in linha])
+    box = tamanho_px // modulos
+    if box == 0:
+        # menor que um px por módulo: não há como manter módulos inteiros
+        return base.resize((tamanho_px, tamanho_px), Image.Resampling.NEAREST)
+    # ampliação por fator inteiro: todos os módulos com box x box px
+    blocos = base.resize((modulos * box, modulos * box), Image.Resampling.NEAREST)
+    if blocos.width == tamanho_px:
+        return blocos
+    quadro = Image.new("1", (tamanho_px, tamanho_px), 1)
+    deslocamento = (tamanho_px - blocos.width) // 2
+    quadro.paste(blocos, (deslocamento, deslocamento))
+    return quadro
+
+
+def qrcode_imagem(texto: str, tamanho_px: int) -> Image.Image:
+    """QR code em tamanho_px x tamanho_px com módulos de largura uniforme (imagem compartilhada).
+
+    Cada módulo ocupa `tamanho_px // módulos` px; a sobra vira margem branca
+    ao redor, somada à zona de silêncio do próprio QR.
+    """
+    return _qrcodes.obter((texto, tamanho_px), lambda: _gerar_qrcode(texto, tamanho_px))
+
+
+# ==================== CAMADA BASE ====================
+
+def camada_base(chave: Hashable, criar: Callable[[], Image.Image]) -> Image.Image:
+    """Camada estática do layout (imagem compartilhada: copiar antes de desenhar)."""
+    return _camadas.obter(chave, criar)
+
+
+# ==================== MÉTRICAS ====================
+
+def metricas_render_assets() -> Dict[str, Dict[str, int]]:
+    return {
+        "fontes": _fontes.metricas(),
+        "logos": _logos.metricas(),
+        "qrcodes": _qrcodes.metricas(),
+        "camadas": _camadas.metricas(),
+    }
+
+
+def limpar_render_assets() -> None:
+    for cache in (_fontes, _logos, _qrcodes, _camadas):
+        cache.limpar()
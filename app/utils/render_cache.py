@@ -0,0 +1,171 @@
+"""Cache persistente de ingressos renderizados, endereçado por conteúdo.
+
+A chave de uma imagem é o SHA-256 de tudo que determina os pixels: o layout
+já embutido, a referência do logo (hash do asset ou caminho do arquivo), DPI,
+formato, qualidade e rotação. O mesmo ingresso com o mesmo layout reaproveita
+o arquivo; qualquer alteração gera outra chave, e a entrada antiga é removida
+naturalmente pela política LRU.
+
+Os arquivos ficam em `RENDER_CACHE_DIR/<evento_id>/<chave>.<ext>` (fora de
+`app/static`, pois contêm QR codes válidos). O tamanho total é limitado por
+`RENDER_CACHE_MAX_MB`; ao exceder, as entradas menos usadas são apagadas. O
+namespace por evento permite descartar tudo de um evento de uma vez.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+EXTENSOES = {"JPEG": "jpg", "PNG": "png"}
+
+
+def chave_render(layout: Dict[str, Any], logo_ref: Optional[str], dpi: int, formato: str = "JPEG",
+                 qualidade: int = 85, rotacionar: bool = False) -> str:
+    """Hash de conteúdo que identifica uma imagem renderizada."""
+    material = json.dumps(
+        {
+            "layout": layout,
+            "logo": logo_ref,
+            "dpi": dpi,
+            "formato": formato,
+            "qualidade": qualidade,
+            "rotacionar": bool(rotacionar),
+        },
+        sort_keys=True,
+        default=str,
+        separators=(",", ":"),
+    )
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def referencia_logo(evento: Optional[Dict[str, Any]]) -> Optional[str]:
+    """Identifica o logo do evento sem carregar o conteúdo."""
+    if not evento:
+        return None
+    asset = evento.get("logo_asset")
+    if asset and asset.get("sha256"):
+        return f"sha256:{asset['sha256']}"
+    if evento.get("logo_path"):
+        return f"path:{evento['logo_path']}"
+    return None
+
+
+class RenderCache:
+    """Armazenamento em disco com LRU limitado por bytes."""
+
+    def __init__(self, diretorio: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.diretorio = Path(diretorio or os.getenv("RENDER_CACHE_DIR", "data/render_cache"))
+        if max_bytes is None:
+            max_bytes = int(float(os.getenv("RENDER_CACHE_MAX_MB", "512")) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self._entradas: "OrderedDict[Tuple[str, str], Tuple[Path, int]]" = OrderedDict()
+        self._total = 0
+        self._carregado = False
+        self.acertos = 0
+        self.falhas = 0
+
+    def _caminho(self, evento_id: str, chave: str, formato: str) -> Path:
+        return self.diretorio / str(evento_id) / f"{chave}.{EXTENSOES.get(formato, 'bin')}"
+
+    def _carregar_indice(self) -> None:
+        """Reconstrói o índice LRU a partir do disco (ordem pelo último acesso)."""
+        self._carregado = True
+        if not self.diretorio.exists():
+            return
+        arquivos = []
+        for caminho in self.diretorio.glob("*/*.*"):
+            try:
+                st = caminho.stat()
+            except OSError:
+                continue
+            arquivos.append((st.st_mtime, caminho, st.st_size))
+        for _, caminho, tamanho in sorted(arquivos, key=lambda a: a[0]):
+            self._entradas[(caminho.parent.name, caminho.stem)] = (caminho, tamanho)
+            self._total += tamanho
+        self._despejar()
+
+    def obter(self, evento_id: str, chave: str, formato: str = "JPEG") -> Optional[bytes]:
+        if not self._carregado:
+            self._carregar_indice()
+        caminho = self._caminho(evento_id, chave, formato)
+        try:
+            conteudo = caminho.read_bytes()
+        except OSError:
+            self._esquecer((str(evento_id), chave))
+            self.falhas += 1
+            return None
+        tamanho = len(conteudo)
+        anterior = self._entradas.pop((str(evento_id), chave), None)
+        self._total += tamanho - (anterior[1] if anterior else 0)
+        self._entradas[(str(evento_id), chave)] = (caminho, tamanho)
+        try:
+            os.utime(caminho)
+        except OSError:
+            pass
+        self.acertos += 1
+        return conteudo
+
+    def guardar(self, evento_id: str, chave: str, conteudo: bytes, formato: str = "JPEG") -> None:
+        if not self._carregado:
+            self._carregar_indice()
+        if len(conteudo) > self.max_bytes:
+            return
+        caminho = self._caminho(evento_id, chave, formato)
+        try:
+            caminho.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=caminho.parent, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(conteudo)
+            os.replace(tmp, caminho)
+        except OSError:
+            return
+        self._esquecer((str(evento_id), chave))
+        self._entradas[(str(evento_id), chave)] = (caminho, len(conteudo))
+        self._total += len(conteudo)
+        self._despejar()
+
+    def invalidar_evento(self, evento_id: str) -> None:
+        for chave in [k for k in self._entradas if k[0] == str(evento_id)]:
+            self._esquecer(chave)
+        shutil.rmtree(self.diretorio / str(evento_id), ignore_errors=True)
+
+    def _esquecer(self, chave: Tuple[str, str]) -> None:
+        entrada = self._entradas.pop(chave, None)
+        if entrada is not None:
+            self._total -= entrada[1]
+
+    def _despejar(self) -> None:
+        while self._total > self.max_bytes and self._entradas:
+            _, (caminho, tamanho) = self._entradas.popitem(last=False)
+            self._total -= tamanho
+            try:
+                caminho.unlink()
+            except OSError:
+                pass
+
+    def metricas(self) -> Dict[str, Any]:
+        return {
+            "entradas": len(self._entradas),
+            "bytes": self._total,
+            "max_bytes": self.max_bytes,
+            "acertos": self.acertos,
+            "falhas": self.falhas,
+        }
+
+
+_cache: Optional[RenderCache] = None
+
+
+def obter_cache() -> RenderCache:
+    global _cache
+    if _cache is None:
+        _cache = RenderCache()
+    return _cache
+
+
+def invalidar_evento(evento_id: str) -> None:
+    obter_cache().invalidar_evento(evento_id)
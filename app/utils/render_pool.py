@@ -0,0 +1,163 @@
+"""Renderização de ingressos fora do event loop.
+
+`_render_layout_to_image` (Pillow a 300 DPI: QR, LANCZOS, texto e
+codificação JPEG/PNG) é puramente CPU; executado dentro do handler, um único
+pedido de impressão travava todas as outras requisições do worker, inclusive a
+validação na portaria. As rotas de renderização chamam `renderizar`, que envia
+o trabalho para um `ProcessPoolExecutor` e aguarda o resultado sem bloquear o
+loop.
+
+Os parâmetros do trabalho são serializáveis (layout já embutido, caminho do
+logo e o logo carregado do armazenamento de assets). O número de trabalhos em
+andamento ou na fila é limitado por `RENDER_FILA_MAX`; acima disso a rota
+responde 503. Cada trabalho tem o prazo `RENDER_TIMEOUT_SEGUNDOS` (504).
+
+Com `RENDER_PROCESSOS=0` a renderização acontece na própria thread (usado nos
+testes, que substituem `_render_layout_to_image` por stubs).
+"""
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException, status
+
+
+def _processos_padrao() -> int:
+    return min(4, os.cpu_count() or 1)
+
+
+class RenderPool:
+    """Pool de processos com fila limitada e prazo por trabalho."""
+
+    def __init__(self, processos: Optional[int] = None, fila_max: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        if processos is None:
+            processos = int(os.getenv("RENDER_PROCESSOS", str(_processos_padrao())))
+        self.processos = max(0, processos)
+        self.fila_max = fila_max if fila_max is not None else int(os.getenv("RENDER_FILA_MAX", "32"))
+        self.timeout = timeout if timeout is not None else float(os.getenv("RENDER_TIMEOUT_SEGUNDOS", "30"))
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._em_andamento = 0
+        self.recusados = 0
+        self.expirados = 0
+
+    def _obter_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.processos)
+        return self._executor
+
+    def _liberar(self, _future=None) -> None:
+        self._em_andamento -= 1
+
+    async def executar(self, **trabalho) -> bytes:
+        if self.processos == 0:
+            return renderizar_em_bytes(**trabalho)
+
+        if self._em_andamento >= self.fila_max:
+            self.recusados += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Fila de renderização cheia, tente novamente",
+                headers={"Retry-After": "1"},
+            )
+
+        loop = asyncio.get_running_loop()
+        try:
+            future = loop.run_in_executor(self._obter_executor(), _renderizar_trabalho, trabalho)
+        except BrokenProcessPool:
+            self._executor = None
+            future = loop.run_in_executor(self._obter_executor(), _renderizar_trabalho, trabalho)
+
+        # a vaga só é devolvida quando o processo termina, mesmo após o prazo
+        self._em_andamento += 1
+        future.add_done_callback(self._liberar)
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            self.expirados += 1
+            raise HTTPException(
+                status_code=status.HTTP_504_GATEWAY_TIMEOUT,
+                detail="Tempo de renderização excedido",
+            )
+        except BrokenProcessPool:
+            self._executor = None
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Renderizador indisponível, tente novamente",
+            )
+
+    def encerrar(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def metricas(self) -> Dict[str, Any]:
+        return {
+            "processos": self.processos,
+            "em_andamento": self._em_andamento,
+            "fila_max": self.fila_max,
+            "recusados": self.recusados,
+            "expirados": self.expirados,
+        }
+
+
+def renderizar_em_bytes(layout: Dict[str, Any], dpi: int = 300, logo_path: Optional[str] = None,
+                        logo_blob: Optional[Dict[str, Any]] = None, formato: str = "JPEG",
+                        qualidade: int = 85, rotacionar: bool = False) -> bytes:
+    """Renderiza o layout e devolve a imagem codificada."""
+    # import tardio: no processo filho o módulo é carregado uma vez por worker,
+    # e na thread atual permite que testes substituam a função
+    from app.routers import evento_api
+
+    img = evento_api._render_layout_to_image(layout, dpi, logo_path=logo_path, logo_blob=logo_blob)
+    if rotacionar:
+        img = img.rotate(90, expand=True)
+
+    bio = BytesIO()
+    if formato == "PNG":
+        try:
+            img.save(bio, format="PNG", dpi=(dpi, dpi))
+        except Exception:
+            bio = BytesIO()
+            img.save(bio, format="PNG")
+    else:
+        img.save(bio, format="JPEG", quality=qualidade)
+    return bio.getvalue()
+
+
+def _renderizar_trabalho(trabalho: Dict[str, Any]) -> bytes:
+    return renderizar_em_bytes(**trabalho)
+
+
+_pool: Optional[RenderPool] = None
+
+
+def _obter_pool() -> RenderPool:
+    global _pool
+    if _pool is None:
+        _pool = RenderPool()
+    return _pool
+
+
+async def renderizar(layout: Dict[str, Any], dpi: int = 300, logo_path: Optional[str] = None,
+                     logo_blob: Optional[Dict[str, Any]] = None, formato: str = "JPEG",
+                     qualidade: int = 85, rotacionar: bool = False) -> bytes:
+    """Renderiza no pool de processos e devolve os bytes da imagem."""
+    return await _obter_pool().executar(
+        layout=layout, dpi=dpi, logo_path=logo_path, logo_blob=logo_blob,
+        formato=formato, qualidade=qualidade, rotacionar=rotacionar,
+    )
+
+
+def encerrar_render_pool() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.encerrar()
+        _pool = None
+
+
+def metricas_render_pool() -> Dict[str, Any]:
+    return _obter_pool().metricas()
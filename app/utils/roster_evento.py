@@ -0,0 +1,302 @@
+"""Cadastro em memória dos participantes de um evento para a busca da bilheteria.
+
+No credenciamento várias mesas consultam `busca-smart` a cada tecla para o
+mesmo evento. Com `ROSTER_HABILITADO=1`, cada processo mantém, por evento, um
+roster colunar (listas paralelas, uma posição por participante):
+
+- `ids`, `nomes` (nome sem acentos, ver `busca_participantes.normalizar_nome`)
+  e `cpfs`, com dicionários `_id -> linha` e `cpf -> linha`;
+- por ingresso: `ingresso_ids`, `ingresso_linhas` (linha do participante) e
+  `impressos` (um byte por ingresso), com `qrcode_hash -> ingresso`.
+
+A busca por nome percorre um único texto com os nomes separados por "\\n"
+(`str.find` em C), com a mesma regra da busca no banco: cada termo é prefixo
+de alguma palavra do nome. O roster devolve apenas os `_id` em ordem de
+relevância; o chamador lê os documentos com uma consulta `_id $in`.
+
+O roster é carregado no primeiro uso, atualizado pelas escritas deste
+processo (emissão, edição de participante, impressão) e recarregado em
+segundo plano a cada `ROSTER_RESYNC_SEGUNDOS`, para refletir outros workers.
+Os rosters somam no máximo `ROSTER_MEMORIA_MB` (estimativa); os eventos usados
+há mais tempo são descartados primeiro. Sem roster (desabilitado, evento acima
+do limite, falha de carga) ou sem resultado, o chamador consulta o banco.
+"""
+import asyncio
+import logging
+import os
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from app.utils.busca_participantes import OUTROS, normalizar_nome, relevancia
+
+logger = logging.getLogger(__name__)
+
+ROSTER_HABILITADO = os.getenv("ROSTER_HABILITADO", "0") == "1"
+MEMORIA_MAXIMA = int(float(os.getenv("ROSTER_MEMORIA_MB", "256")) * 1024 * 1024)
+RESYNC_SEGUNDOS = float(os.getenv("ROSTER_RESYNC_SEGUNDOS", "60"))
+
+# custo fixo estimado (listas, dicionários, array) por participante e por ingresso
+_BYTES_LINHA = 160
+_BYTES_INGRESSO = 120
+
+PROJECAO_ROSTER = {
+    "nome": 1, "cpf": 1,
+    "ingressos._id": 1, "ingressos.evento_id": 1, "ingressos.qrcode_hash": 1, "ingressos.impresso": 1,
+}
+
+
+class RosterEvento:
+    """Participantes com ingresso em um evento, em colunas."""
+
+    def __init__(self, evento_id: str):
+        self.evento_id = evento_id
+        self.ids: List[str] = []
+        self.nomes: List[str] = []
+        self.cpfs: List[Optional[str]] = []
+        self.linha_por_id: Dict[str, int] = {}
+        self.linha_por_cpf: Dict[str, int] = {}
+        self.ingresso_ids: List[str] = []
+        self.ingresso_linhas = array("l")
+        self.impressos = bytearray()
+        self.ingresso_por_qr: Dict[str, int] = {}
+        self.ingresso_por_id: Dict[str, int] = {}
+        self.bytes_estimados = 0
+        self.carregado_em = 0.0
+        self._texto: Optional[str] = None
+        self._inicios = array("l")
+        self._resync: Optional[asyncio.Task] = None
+
+    # ---------- escrita ----------
+
+    def registrar_participante(self, participante_id, nome: Any, cpf: Any = None) -> int:
+        """Inclui ou atualiza um participante; retorna sua linha."""
+        pid = str(participante_id)
+        linha = self.linha_por_id.get(pid)
+        nome_busca = normalizar_nome(nome)
+        cpf = str(cpf) if cpf else None
+        if linha is None:
+            linha = len(self.ids)
+            self.ids.append(pid)
+            self.nomes.append(nome_busca)
+            self.cpfs.append(cpf)
+            self.linha_por_id[pid] = linha
+            self.bytes_estimados += _BYTES_LINHA + sys.getsizeof(pid) + sys.getsizeof(nome_busca)
+            self._texto = None
+        else:
+            if nome is not None and self.nomes[linha] != nome_busca:
+                self.nomes[linha] = nome_busca
+                self._texto = None
+            if cpf is None:
+                return linha
+            anterior = self.cpfs[linha]
+            if anterior and self.linha_por_cpf.get(anterior) == linha:
+                del self.linha_por_cpf[anterior]
+            self.cpfs[linha] = cpf
+        if cpf:
+            self.linha_por_cpf[cpf] = linha
+            self.bytes_estimados += sys.getsizeof(cpf)
+        return linha
+
+    def registrar_ingresso(self, linha: int, ingresso: Dict[str, Any]) -> None:
+        qrcode_hash = ingresso.get("qrcode_hash")
+        ingresso_id = str(ingresso.get("_id") or qrcode_hash)
+        posicao = self.ingresso_por_id.get(ingresso_id)
+        if posicao is None:
+            posicao = len(self.ingresso_ids)
+            self.ingresso_ids.append(ingresso_id)
+            self.ingresso_linhas.append(linha)
+            self.impressos.append(0)
+            self.ingresso_por_id[ingresso_id] = posicao
+            self.bytes_estimados += _BYTES_INGRESSO + sys.getsizeof(ingresso_id) + sys.getsizeof(qrcode_hash or "")
+        self.impressos[posicao] = 1 if ingresso.get("impresso") else 0
+        if qrcode_hash:
+            self.ingresso_por_qr[qrcode_hash] = posicao
+
+    def marcar_impresso(self, ingresso_id, impresso: bool) -> None:
+        posicao = self.ingresso_por_id.get(str(ingresso_id))
+        if posicao is not None:
+            self.impressos[posicao] = 1 if impresso else 0
+
+    # ---------- leitura ----------
+
+    def _garantir_texto(self) -> str:
+        if self._texto is None:
+            inicios = array("l")
+            posicao = 1
+            for nome in self.nomes:
+                inicios.append(posicao)
+                posicao += len(nome) + 1
+            self._inicios = inicios
+            self._texto = "\n" + "\n".join(self.nomes) + "\n"
+        return self._texto
+
+    def _linhas_com_palavra(self, termo: str) -> set:
+        """Linhas com alguma palavra começando por `termo`."""
+        texto = self._garantir_texto()
+        linhas = set()
+        for separador in ("\n", " "):
+            agulha = separador + termo
+            posicao = texto.find(agulha)
+            while posicao != -1:
+                linhas.add(bisect_right(self._inicios, posicao + 1) - 1)
+                posicao = texto.find(agulha, posicao + 1)
+        return linhas
+
+    def buscar_nome(self, termo: str, limite: int = 20) -> List[str]:
+        """`_id` dos participantes cujo nome casa com `termo`, por relevância e nome."""
+        normalizado = normalizar_nome(termo)
+        if not normalizado:
+            return []
+        termos = normalizado.split()
+        # a palavra mais longa costuma ser a mais seletiva
+        candidatas = self._linhas_com_palavra(max(termos, key=len))
+        pontuadas = []
+        for linha in candidatas:
+            nivel = relevancia(self.nomes[linha], normalizado)
+            if nivel < OUTROS:
+                pontuadas.append((nivel, self.nomes[linha], linha))
+        pontuadas.sort()
+        return [self.ids[linha] for _, _, linha in pontuadas[:limite]]
+
+    def buscar_cpf(self, cpf: str) -> Optional[str]:
+        linha = self.linha_por_cpf.get(cpf)
+        return self.ids[linha] if linha is not None else None
+
+    def buscar_qr(self, qrcode_hash: str) -> Optional[str]:
+        posicao = self.ingresso_por_qr.get(qrcode_hash)
+        return self.ids[self.ingresso_linhas[posicao]] if posicao is not None else None
+
+    def impresso(self, qrcode_hash: str) -> Optional[bool]:
+        posicao = self.ingresso_por_qr.get(qrcode_hash)
+        return bool(self.impressos[posicao]) if posicao is not None else None
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def expirado(self) -> bool:
+        return time.monotonic() - self.carregado_em > RESYNC_SEGUNDOS
+
+
+_rosters: "OrderedDict[str, RosterEvento]" = OrderedDict()
+_locks: Dict[str, asyncio.Lock] = {}
+
+
+def _registrar(roster: RosterEvento, participante: Dict[str, Any]) -> None:
+    ingressos = [
+        ing for ing in participante.get("ingressos", []) or []
+        if str(ing.get("evento_id")) == str(roster.evento_id)
+    ]
+    if not ingressos:
+        return
+    linha = roster.registrar_participante(participante.get("_id"), participante.get("nome"), participante.get("cpf"))
+    for ing in ingressos:
+        roster.registrar_ingresso(linha, ing)
+
+
+async def _carregar(db, evento_id: str) -> RosterEvento:
+    roster = RosterEvento(evento_id)
+    cursor = db.participantes.find({"ingressos.evento_id": evento_id}, PROJECAO_ROSTER)
+    async for participante in cursor:
+        _registrar(roster, participante)
+        if roster.bytes_estimados > MEMORIA_MAXIMA:
+            raise MemoryError(f"roster acima de {MEMORIA_MAXIMA} bytes")
+    roster.carregado_em = time.monotonic()
+    return roster
+
+
+def _guardar(roster: RosterEvento) -> None:
+    """Guarda o roster como o mais recente e descarta os menos usados acima do limite."""
+    _rosters[roster.evento_id] = roster
+    _rosters.move_to_end(roster.evento_id)
+    total = sum(r.bytes_estimados for r in _rosters.values())
+    while total > MEMORIA_MAXIMA and len(_rosters) > 1:
+        _, antigo = _rosters.popitem(last=False)
+        total -= antigo.bytes_estimados
+
+
+async def _ressincronizar(db, evento_id: str) -> None:
+    try:
+        roster = await _carregar(db, evento_id)
+    except Exception as exc:
+        logger.warning("Falha ao recarregar roster do evento %s: %s", evento_id, exc)
+        _rosters.pop(evento_id, None)
+        return
+    if evento_id in _rosters:
+        _guardar(roster)
+
+
+async def obter_roster(db, evento_id: str) -> Optional[RosterEvento]:
+    """Roster do evento, carregado no primeiro uso; None se desabilitado ou indisponível.
+
+    Um roster expirado continua sendo servido enquanto a recarga roda em
+    segundo plano.
+    """
+    if not ROSTER_HABILITADO:
+        return None
+    evento_id = str(evento_id)
+    roster = _rosters.get(evento_id)
+    if roster is not None:
+        _rosters.move_to_end(evento_id)
+        if roster.expirado and (roster._resync is None or roster._resync.done()):
+            roster._resync = asyncio.create_task(_ressincronizar(db, evento_id))
+        return roster
+
+    lock = _locks.setdefault(evento_id, asyncio.Lock())
+    async with lock:
+        roster = _rosters.get(evento_id)
+        if roster is None:
+            try:
+                roster = await _carregar(db, evento_id)
+            except Exception as exc:
+                logger.warning("Roster do evento %s indisponível: %s", evento_id, exc)
+                return None
+            _guardar(roster)
+    return roster
+
+
+def registrar_ingresso(evento_id: str, ingresso: Dict[str, Any], participante_nome: Any = None,
+                       participante_cpf: Any = None, participante_id=None) -> None:
+    """Inclui um ingresso recém-emitido (e seu participante) no roster do evento, se carregado."""
+    roster = _rosters.get(str(evento_id))
+    participante_id = ingresso.get("participante_id") or participante_id
+    if roster is None or not participante_id:
+        return
+    linha = roster.registrar_participante(participante_id, participante_nome, participante_cpf)
+    roster.registrar_ingresso(linha, ingresso)
+
+
+def atualizar_participante(participante_id, nome: Any = None, cpf: Any = None) -> None:
+    """Aplica a edição de um participante em todos os rosters carregados que o contêm."""
+    pid = str(participante_id)
+    for roster in _rosters.values():
+        if pid in roster.linha_por_id:
+            roster.registrar_participante(pid, nome, cpf)
+
+
+def marcar_impresso(evento_id: str, ingresso_id, impresso: bool) -> None:
+    roster = _rosters.get(str(evento_id))
+    if roster is not None:
+        roster.marcar_impresso(ingresso_id, impresso)
+
+
+def invalidar_evento(evento_id: str) -> None:
+    """Descarta o roster do evento (ex.: após excluir participantes)."""
+    _rosters.pop(str(evento_id), None)
+
+
+def limpar() -> None:
+    _rosters.clear()
+
+
+def metricas_roster() -> Dict[str, Any]:
+    return {
+        "eventos": len(_rosters),
+        "participantes": sum(len(r) for r in _rosters.values()),
+        "bytes_estimados": sum(r.bytes_estimados for r in _rosters.values()),
+        "limite_bytes": MEMORIA_MAXIMA,
+    }
@@ -0,0 +1,219 @@
+"""Snapshot offline da portaria e sincronização incremental por versão.
+
+Cada evento mantém em `eventos.versao_ingressos` um contador monotônico,
+incrementado a cada emissão ou cancelamento de ingresso. Toda alteração também
+é anotada na coleção `ingressos_alteracoes` com a versão correspondente, de
+modo que um coletor que já possui o snapshot na versão N busca apenas as
+alterações com `versao > N`. O delta só avança até a última versão contígua
+do histórico; uma lacuna que não se fecha em `SNAPSHOT_LACUNA_SEGUNDOS` leva o
+coletor a baixar o snapshot completo.
+
+Os ingressos são identificados no snapshot por `hash_offline(qrcode_hash)`
+(SHA-256 truncado), para que o pacote não exponha QR codes válidos; o coletor
+aplica a mesma função ao código lido. O pacote é assinado com HMAC-SHA256
+usando o token de portaria do evento, que o coletor já possui.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Any, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+STATUS_ATIVO = "Ativo"
+TAMANHO_HASH_OFFLINE = 16
+# idade a partir da qual uma versão sem registro é tratada como perdida
+LACUNA_SEGUNDOS = float(os.getenv("SNAPSHOT_LACUNA_SEGUNDOS", "30"))
+
+
+def hash_offline(qrcode_hash: str) -> str:
+    """Hash truncado usado para identificar o ingresso no snapshot."""
+    return hashlib.sha256(str(qrcode_hash).encode("utf-8")).hexdigest()[:TAMANHO_HASH_OFFLINE]
+
+
+def _evento_filtro(evento_id: str) -> Dict[str, Any]:
+    try:
+        return {"_id": ObjectId(evento_id)}
+    except Exception:
+        return {"_id": evento_id}
+
+
+def _alteracoes_collection(db):
+    return getattr(db, "ingressos_alteracoes", None)
+
+
+async def _incrementar_versao(db, evento_id: str, n: int) -> int:
+    """Reserva `n` versões do evento e retorna a última."""
+    filtro = _evento_filtro(evento_id)
+    update = {"$inc": {"versao_ingressos": n}}
+    find_one_and_update = getattr(db.eventos, "find_one_and_update", None)
+    if find_one_and_update is not None:
+        evento = await find_one_and_update(
+            filtro, update, projection={"versao_ingressos": 1}, return_document=ReturnDocument.AFTER
+        )
+    else:
+        await db.eventos.update_one(filtro, update)
+        evento = await db.eventos.find_one(filtro)
+    return int((evento or {}).get("versao_ingressos", 0))
+
+
+async def registrar_alteracoes(db, evento_id: str, ingressos: List[Dict[str, Any]]) -> Optional[int]:
+    """Incrementa a versão do evento e anota as alterações de ingressos.
+
+    Deve ser chamada após a emissão (status "Ativo") ou o cancelamento de
+    ingressos; um único `$inc` cobre o lote inteiro. Falhas não interrompem a
+    operação principal: o snapshot completo continua correto.
+    """
+    ingressos = [i for i in ingressos if i.get("qrcode_hash")]
+    if not ingressos:
+        return None
+    try:
+        ultima = await _incrementar_versao(db, evento_id, len(ingressos))
+    except Exception as exc:
+        logger.warning("Falha ao reservar versão de ingressos do evento %s: %s", evento_id, exc)
+        return None
+    col = _alteracoes_collection(db)
+    if col is None:
+        return ultima
+    primeira = ultima - len(ingressos) + 1
+    agora = datetime.now(timezone.utc)
+    docs = [
+        {
+            "evento_id": evento_id,
+            "versao": primeira + i,
+            "hash": hash_offline(ing["qrcode_hash"]),
+            "tipo_ingresso_id": str(ing.get("tipo_ingresso_id")),
+            "status": ing.get("status") or STATUS_ATIVO,
+            "data": agora,
+        }
+        for i, ing in enumerate(ingressos)
+    ]
+    # as versões já foram reservadas: uma nova tentativa evita a lacuna; se ela
+    # persistir, `montar_delta` responde com o snapshot completo (410)
+    for tentativa in range(2):
+        try:
+            await col.insert_many([dict(d) for d in docs], ordered=False)
+            return ultima
+        except BulkWriteError as exc:
+            falhas = [e for e in exc.details.get("writeErrors", []) if e.get("code") != 11000]
+            if not falhas:
+                return ultima
+            docs = [docs[e["index"]] for e in falhas]
+            erro = exc
+        except Exception as exc:
+            erro = exc
+    logger.warning("Lacuna nas versões %s-%s do evento %s: %s", primeira, ultima, evento_id, erro)
+    return None
+
+
+def _mapa_tipos(evento: Dict[str, Any]) -> Dict[str, Any]:
+    """Mapa `tipo_ingresso_id -> numero` (ou o próprio id quando não há número)."""
+    mapa = {}
+    for t in evento.get("tipos_ingresso", []) or []:
+        chave = t.get("numero") if t.get("numero") is not None else str(t.get("_id") or t.get("id"))
+        for ref in (t.get("_id") or t.get("id"), t.get("numero")):
+            if ref is not None:
+                mapa[str(ref)] = chave
+    return mapa
+
+
+def _matriz_permissoes(evento: Dict[str, Any]) -> Dict[str, Any]:
+    tipos = {}
+    for t in evento.get("tipos_ingresso", []) or []:
+        chave = t.get("numero") if t.get("numero") is not None else str(t.get("_id") or t.get("id"))
+        tipos[str(chave)] = {
+            "descricao": t.get("descricao"),
+            "ilhas": [str(p) for p in (t.get("permissoes") or [])],
+        }
+    ilhas = {
+        str(il.get("_id") or il.get("id")): il.get("nome_setor")
+        for il in evento.get("ilhas", []) or []
+    }
+    return {"tipos": tipos, "ilhas": ilhas}
+
+
+async def montar_snapshot(db, evento: Dict[str, Any]) -> Dict[str, Any]:
+    """Snapshot completo: ingressos ativos e matriz tipo→ilhas do evento."""
+    evento_id = str(evento["_id"])
+    # versão lida antes da varredura: alterações concorrentes podem reaparecer no delta (idempotente)
+    versao = int(evento.get("versao_ingressos", 0))
+    tipos = _mapa_tipos(evento)
+    ingressos = []
+    cursor = db.participantes.find({"ingressos.evento_id": evento_id}, {"ingressos": 1})
+    async for p in cursor:
+        for ing in p.get("ingressos", []) or []:
+            if str(ing.get("evento_id")) != evento_id or ing.get("status") != STATUS_ATIVO:
+                continue
+            if not ing.get("qrcode_hash"):
+                continue
+            tipo = str(ing.get("tipo_ingresso_id"))
+            ingressos.append([hash_offline(ing["qrcode_hash"]), tipos.get(tipo, tipo)])
+    return {
+        "evento_id": evento_id,
+        "versao": versao,
+        "gerado_em": datetime.now(timezone.utc).isoformat(),
+        "formato_hash": f"sha256:{TAMANHO_HASH_OFFLINE}",
+        **_matriz_permissoes(evento),
+        "ingressos": ingressos,
+    }
+
+
+async def montar_delta(db, evento: Dict[str, Any], desde: int) -> Optional[Dict[str, Any]]:
+    """Alterações com versão maior que `desde`; None se o histórico não estiver disponível."""
+    col = _alteracoes_collection(db)
+    if col is None:
+        return None
+    evento_id = str(evento["_id"])
+    tipos = _mapa_tipos(evento)
+    alteracoes = []
+    # a versão devolvida é a última contígua presente no histórico, não o contador
+    # do evento: versões reservadas (`$inc`) cujo registro ainda não foi gravado
+    # não podem ser puladas pelo coletor
+    ultima = desde
+    cursor = col.find({"evento_id": evento_id, "versao": {"$gt": desde}}).sort("versao", 1)
+    async for alt in cursor:
+        if alt["versao"] <= ultima:
+            continue
+        if alt["versao"] != ultima + 1:
+            if _lacuna_abandonada(alt):
+                return None
+            break
+        ultima = alt["versao"]
+        tipo = alt.get("tipo_ingresso_id")
+        alteracoes.append({
+            "versao": alt["versao"],
+            "hash": alt["hash"],
+            "tipo": tipos.get(tipo, tipo),
+            "status": alt.get("status"),
+        })
+    return {
+        "evento_id": evento_id,
+        "desde": desde,
+        "versao": ultima,
+        "alteracoes": alteracoes,
+    }
+
+
+def _lacuna_abandonada(alteracao: Dict[str, Any]) -> bool:
+    """Lacuna antes de `alteracao` que não será mais preenchida (gravação falhou)."""
+    data = alteracao.get("data")
+    if not isinstance(data, datetime):
+        return False
+    if data.tzinfo is None:
+        data = data.replace(tzinfo=timezone.utc)
+    return datetime.now(timezone.utc) - data > timedelta(seconds=LACUNA_SEGUNDOS)
+
+
+def empacotar(payload: Dict[str, Any], chave: str) -> Dict[str, Any]:
+    """Serializa, comprime (gzip) e assina (HMAC-SHA256 sobre o JSON) o payload."""
+    corpo = json.dumps(payload, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+    assinatura = hmac.new(str(chave).encode("utf-8"), corpo, hashlib.sha256).hexdigest()
+    return {"conteudo": gzip.compress(corpo), "assinatura": assinatura}
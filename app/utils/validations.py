@@ -1,10 +1,16 @@
+import logging
 import re
 import unicodedata
 from fastapi import HTTPException, status
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 from bson.int64 import Int64
+from collections import defaultdict
 from datetime import datetime, timezone
-from typing import Dict, Any, Optional
+from operator import mul
+from typing import Dict, Any, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 
 def normalize_participante_data(data: Dict[str, Any]) -> Dict[str, Any]:
@@ -47,8 +53,9 @@ def normalize_participante_data(data: Dict[str, Any]) -> Dict[str, Any]:
                 item
                 for item in value
             ]
-        # Processar dicts aninhados (como layout_ingresso)
-        elif isinstance(value, dict):
+        # Processar dicts aninhados (como layout_ingresso); `campos_layout` já é
+        # um mapa de strings e não recebe os campos opcionais de participante
+        elif isinstance(value, dict) and key != 'campos_layout':
             normalized[key] = normalize_participante_data(value)
         else:
             normalized[key] = value
@@ -87,6 +94,63 @@ def validate_cpf(cpf: str) -> str:
     return s
 
 
+_CPF_NAO_DIGITO = re.compile(r"\D")
+_CPF_PESOS_1 = (10, 9, 8, 7, 6, 5, 4, 3, 2)
+_CPF_PESOS_2 = (11, 10, 9, 8, 7, 6, 5, 4, 3, 2)
+# os dígitos são somados pelo código ASCII; desconta '0' (48) vezes a soma dos pesos
+_CPF_AJUSTE_1 = 48 * sum(_CPF_PESOS_1)
+_CPF_AJUSTE_2 = 48 * sum(_CPF_PESOS_2)
+
+
+def cpf_participante(cpf_raw: Any) -> Optional[str]:
+    """CPF gravado em `participante_cpf` do ingresso: só os dígitos, ou None sem CPF.
+
+    Nunca grava "" nem o CPF formatado: ambos são strings e entrariam no índice
+    único (ingressos.evento_id, ingressos.participante_cpf) como outra chave.
+    """
+    digitos = _CPF_NAO_DIGITO.sub("", str(cpf_raw or ""))
+    return digitos or None
+
+
+def validar_cpfs(valores: Iterable[Any]) -> List[Tuple[Optional[str], Optional[str]]]:
+    """Valida uma coluna de CPFs de uma vez.
+
+    Equivale a chamar `validate_cpf` em cada valor, sem exceções por item:
+    retorna, na mesma ordem, `(cpf_normalizado, None)` ou `(None, mensagem)`
+    com a mesma mensagem do `ValueError` de `validate_cpf`.
+    """
+    resultados = []
+    append = resultados.append
+    sub = _CPF_NAO_DIGITO.sub
+    for valor in valores:
+        s = valor if isinstance(valor, str) else str(valor or "")
+        if not (len(s) == 11 and s.isascii() and s.isdigit()):
+            s = sub("", s)
+            if not s.isascii():
+                # dígitos não ASCII (raro): caminho item a item
+                try:
+                    append((validate_cpf(s), None))
+                except ValueError as e:
+                    append((None, str(e)))
+                continue
+        if len(s) != 11:
+            append((None, "CPF must have 11 digits"))
+            continue
+        if s == s[0] * 11:
+            append((None, "Invalid CPF"))
+            continue
+        b = s.encode("ascii")
+        r1 = (sum(map(mul, b, _CPF_PESOS_1)) - _CPF_AJUSTE_1) % 11
+        r2 = (sum(map(mul, b, _CPF_PESOS_2)) - _CPF_AJUSTE_2) % 11
+        # o segundo dígito é calculado sobre o décimo informado: se ele diferir
+        # do primeiro verificador o CPF já é inválido
+        if b[9] - 48 != (0 if r1 < 2 else 11 - r1) or b[10] - 48 != (0 if r2 < 2 else 11 - r2):
+            append((None, "CPF checksum invalid"))
+            continue
+        append((s, None))
+    return resultados
+
+
 def normalize_event_name(name: str) -> str:
     """Normaliza o nome do evento para usar na URL de inscrição.
 
@@ -138,3 +202,99 @@ async def ensure_cpf_unique(db, evento_id: str, participante_id: str = None, cpf
             raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail='CPF já inscrito neste evento')
 
     return cpf_digits
+
+
+async def gravar_ingresso_embutido(db, participante_oid, evento_id: str, ingresso: Dict[str, Any]) -> None:
+    """Grava o ingresso no participante com um único `$push` condicional.
+
+    Com CPF, o filtro `ingressos.evento_id $ne` recusa um segundo ingresso do
+    participante no evento e o índice único (ingressos.evento_id,
+    ingressos.participante_cpf) recusa o mesmo CPF em outro participante.
+    Levanta HTTPException 409 nesses casos e 404 se o participante não existe;
+    efeitos colaterais da emissão só devem ser aplicados depois do retorno.
+    """
+    cpf = ingresso.get("participante_cpf")
+    filtro = {"_id": participante_oid}
+    if cpf:
+        filtro["ingressos.evento_id"] = {"$ne": evento_id}
+    try:
+        result = await db.participantes.update_one(filtro, {"$push": {"ingressos": ingresso}})
+    except DuplicateKeyError:
+        result = None
+    if result is not None and result.matched_count:
+        return
+    if not cpf:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Participante não encontrado")
+    raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"CPF {cpf} já possui ingresso para este evento")
+
+
+async def atualizar_participante(db, participante_oid, update_data: Dict[str, Any]) -> None:
+    """Grava `update_data` no participante; com CPF, regrava também o `participante_cpf` dos ingressos embutidos.
+
+    O índice único (ingressos.evento_id, ingressos.participante_cpf) aplica o
+    filtro parcial ao documento inteiro: ingressos com CPF antigo ou nulo num
+    participante que passou a ter CPF seriam indexados com a chave errada.
+    Levanta HTTPException 409 quando o CPF ou o email colidem com outro participante.
+    """
+    filtro = {"_id": participante_oid}
+    try:
+        if "cpf" in update_data:
+            # `$[]` exige o array: só participantes com ingressos passam por aqui
+            result = await db.participantes.update_one(
+                {**filtro, "ingressos.evento_id": {"$exists": True}},
+                {"$set": {**update_data, "ingressos.$[].participante_cpf": cpf_participante(update_data["cpf"])}},
+            )
+            if result.matched_count:
+                return
+        await db.participantes.update_one(filtro, {"$set": update_data})
+    except DuplicateKeyError:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT,
+                            detail='CPF já inscrito em um evento deste participante ou email já cadastrado')
+
+
+async def cpfs_duplicados(db) -> List[Dict[str, Any]]:
+    """Pares (evento, CPF) com ingresso em mais de um participante.
+
+    São os documentos que impedem a criação do índice único
+    (ingressos.evento_id, ingressos.participante_cpf); o índice não compara
+    ingressos do mesmo participante, então só participantes distintos contam.
+    """
+    grupos: Dict[Tuple[Any, str], set] = defaultdict(set)
+    cursor = db.participantes.find({"ingressos.participante_cpf": {"$type": "string"}},
+                                   {"ingressos.evento_id": 1, "ingressos.participante_cpf": 1})
+    async for doc in cursor:
+        for ingresso in doc.get("ingressos") or []:
+            cpf = ingresso.get("participante_cpf")
+            if isinstance(cpf, str):
+                grupos[(ingresso.get("evento_id"), cpf)].add(str(doc["_id"]))
+    return [
+        {"evento_id": evento_id, "cpf": cpf, "participantes": sorted(ids)}
+        for (evento_id, cpf), ids in grupos.items() if len(ids) > 1
+    ]
+
+
+async def preencher_cpf_ingressos(db) -> int:
+    """Regrava `participante_cpf` dos ingressos embutidos a partir do CPF do participante.
+
+    Ingressos antigos com o CPF ausente, vazio ou formatado ficam fora do
+    índice único (ou colidem em ""); retorna quantos ingressos foram corrigidos.
+    """
+    corrigidos = 0
+    async for doc in db.participantes.find({"ingressos": {"$exists": True}},
+                                           {"cpf": 1, "ingressos._id": 1, "ingressos.participante_cpf": 1}):
+        cpf = cpf_participante(doc.get("cpf"))
+        for ingresso in doc.get("ingressos") or []:
+            if ingresso.get("participante_cpf") == cpf:
+                continue
+            try:
+                result = await db.participantes.update_one(
+                    {"_id": doc["_id"], "ingressos._id": ingresso.get("_id")},
+                    {"$set": {"ingressos.$.participante_cpf": cpf}},
+                )
+            except DuplicateKeyError:
+                # com o índice já criado, outro participante tem o CPF no evento
+                logger.error("CPF %s do participante %s já tem ingresso no evento %s em outro participante",
+                             cpf, doc["_id"], ingresso.get("evento_id"))
+                continue
+            corrigidos += result.modified_count
+    return corrigidos
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Pico de memória (RSS) da leitura de planilhas: arquivo inteiro x streaming.
+
+Gera um CSV e um XLSX sintéticos e mede, cada variante em um processo
+separado, o pico de RSS acima do processo já com os módulos carregados:
+
+- materializado: o upload inteiro em memória (`await file.read()`), CSV
+  decodificado de uma vez e XLSX via `list(ws.iter_rows(...))`;
+- streaming: `ler_planilha` sobre o arquivo aberto, consumido em lotes de
+  `TAMANHO_LOTE` linhas (como `process_planilha`).
+
+Uso:
+
+    $ python scripts/benchmark_planilha.py                 # 200000 linhas CSV, 50000 XLSX
+    $ python scripts/benchmark_planilha.py 100000 20000
+"""
+
+import csv
+import io
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+
+
+def _rss_pico_mb() -> float:
+    # ru_maxrss em KiB no Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _gerar(diretorio: str, linhas_csv: int, linhas_xlsx: int):
+    from openpyxl import Workbook
+
+    cabecalho = ['Nome', 'Email', 'CPF', 'Telefone', 'Empresa', 'Tipo Ingresso']
+
+    def linha(i):
+        return [f'Participante {i}', f'p{i}@empresa.com.br', f'{i:011d}', '+5511999999999', 'Empresa X', 1]
+
+    caminho_csv = os.path.join(diretorio, 'lista.csv')
+    with open(caminho_csv, 'w', newline='', encoding='utf-8') as fh:
+        w = csv.writer(fh)
+        w.writerow(cabecalho)
+        for i in range(linhas_csv):
+            w.writerow(linha(i))
+
+    caminho_xlsx = os.path.join(diretorio, 'lista.xlsx')
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(cabecalho)
+    for i in range(linhas_xlsx):
+        ws.append(linha(i))
+    wb.save(caminho_xlsx)
+    return caminho_csv, caminho_xlsx
+
+
+def _medir(variante: str, caminho: str) -> None:
+    """Executado no processo filho: imprime 'linhas base_mb pico_mb'."""
+    from openpyxl import load_workbook
+    from app.utils.planilha import TAMANHO_LOTE, ler_planilha
+
+    base = _rss_pico_mb()
+    linhas = 0
+    if variante == 'materializado':
+        with open(caminho, 'rb') as fh:
+            conteudo = fh.read()
+        if caminho.endswith('.xlsx'):
+            ws = load_workbook(io.BytesIO(conteudo), read_only=True).active
+            rows = list(ws.iter_rows(values_only=True))
+            header = [str(c) for c in rows[0]]
+            dados = [dict(zip(header, r)) for r in rows[1:]]
+        else:
+            dados = list(csv.DictReader(io.StringIO(conteudo.decode('utf-8'))))
+        linhas = len(dados)
+    else:
+        with open(caminho, 'rb') as fh:
+            leitura = ler_planilha(fh, os.path.basename(caminho))
+            lote = []
+            for row in leitura.linhas():
+                lote.append(row)
+                if len(lote) >= TAMANHO_LOTE:
+                    linhas += len(lote)
+                    lote = []
+            linhas += len(lote)
+            leitura.fechar()
+    print(linhas, round(base, 1), round(_rss_pico_mb(), 1))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--medir':
+        _medir(sys.argv[2], sys.argv[3])
+        return
+
+    linhas_csv = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    linhas_xlsx = int(sys.argv[2]) if len(sys.argv) > 2 else 50000
+    raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as diretorio:
+        arquivos = _gerar(diretorio, linhas_csv, linhas_xlsx)
+        print(f"{'arquivo':<12}{'tamanho':>10}{'variante':>16}{'linhas':>10}{'pico RSS':>12}{'acima da base':>16}")
+        for caminho in arquivos:
+            tamanho = os.path.getsize(caminho) / (1024 * 1024)
+            for variante in ('materializado', 'streaming'):
+                saida = subprocess.run(
+                    [sys.executable, os.path.abspath(__file__), '--medir', variante, caminho],
+                    cwd=raiz, capture_output=True, text=True, check=True,
+                    env={**os.environ, 'PYTHONPATH': raiz},
+                ).stdout.split()
+                linhas, base, pico = int(saida[0]), float(saida[1]), float(saida[2])
+                print(f"{os.path.basename(caminho):<12}{tamanho:>8.1f}MB{variante:>16}{linhas:>10}"
+                      f"{pico:>10.1f}MB{pico - base:>14.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -31,6 +31,13 @@ def main():
     except Exception as e:
         print("Falha ao criar índices de ingressos_emitidos:", e)
 
+    print("Criando índice do livro-razão de capacidade (ilha_capacidade)...")
+    try:
+        db.ilha_capacidade.create_index([("evento_id", 1), ("ilha_id", 1)], unique=True)
+        print("Índice de ilha_capacidade criado")
+    except Exception as e:
+        print("Falha ao criar índice de ilha_capacidade:", e)
+
     print("Concluído")
 
 if __name__ == '__main__':
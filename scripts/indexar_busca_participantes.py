@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""Preenche `nome_busca`/`nome_termos` dos participantes cadastrados antes da busca por prefixo.
+
+Uso:
+
+    $ python scripts/indexar_busca_participantes.py
+"""
+
+import asyncio
+
+from app.config.database import connect_to_mongo, close_mongo_connection, get_database
+from app.utils.busca_participantes import indexar_participantes
+
+
+async def _run():
+    await connect_to_mongo()
+    try:
+        total = await indexar_participantes(get_database())
+        print(f"{total} participantes indexados para busca")
+    finally:
+        await close_mongo_connection()
+
+
+def main():
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""Troca os layouts embutidos nos ingressos por referências de versão.
+
+Ingressos cujo layout embutido corresponde ao layout atual do evento passam a
+guardar apenas `campos_layout`; os demais ficam congelados em uma versão
+própria (`layout_versao`). Pode ser executado mais de uma vez.
+
+Uso:
+
+    $ python scripts/migrar_layouts.py
+"""
+
+import asyncio
+
+from app.config.database import connect_to_mongo, close_mongo_connection, get_database
+from app.utils.layout_versoes import migrar_layouts
+
+
+async def _run():
+    await connect_to_mongo()
+    try:
+        db = get_database()
+        total = await migrar_layouts(db)
+        print(f"Ingressos no layout atual: {total['seguem_atual']}")
+        print(f"Ingressos congelados em versão antiga: {total['congelados']}")
+    finally:
+        await close_mongo_connection()
+
+
+def main():
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+"""Move `eventos.logo_blob` (base64 embutido) para o armazenamento de assets.
+
+Cada logo é gravado em `assets`/`assets_chunks` pelo SHA-256 do conteúdo e o
+evento passa a guardar apenas `logo_asset`. Pode ser executado mais de uma vez.
+
+Uso:
+
+    $ python scripts/migrar_logos.py
+"""
+
+import asyncio
+
+from app.config.database import connect_to_mongo, close_mongo_connection, get_database
+from app.utils.assets import migrar_logos
+
+
+async def _run():
+    await connect_to_mongo()
+    try:
+        db = get_database()
+        migrados = await migrar_logos(db)
+        print(f"Logos migrados: {migrados}")
+    finally:
+        await close_mongo_connection()
+
+
+def main():
+    asyncio.run(_run())
+
+
+if __name__ == "__main__":
+    main()
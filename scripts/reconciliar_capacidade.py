@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""Reconstrói os contadores de `ilha_capacidade` a partir dos ingressos embutidos.
+
+Uso:
+
+    $ python scripts/reconciliar_capacidade.py            # todos os eventos
+    $ python scripts/reconciliar_capacidade.py <evento_id>
+"""
+
+import asyncio
+import sys
+
+from app.config.database import connect_to_mongo, close_mongo_connection, get_database
+from app.utils.capacidade import reconciliar_capacidade
+
+
+async def _run(evento_ids):
+    await connect_to_mongo()
+    try:
+        db = get_database()
+        if not evento_ids:
+            evento_ids = [str(e["_id"]) async for e in db.eventos.find({}, {"_id": 1})]
+        for evento_id in evento_ids:
+            contagem = await reconciliar_capacidade(db, evento_id)
+            print(f"{evento_id}: {contagem}")
+    finally:
+        await close_mongo_connection()
+
+
+def main():
+    asyncio.run(_run(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
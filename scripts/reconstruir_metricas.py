@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""Reconstrói os documentos de `evento_metricas` a partir dos ingressos embutidos.
+
+Uso:
+
+    $ python scripts/reconstruir_metricas.py            # todos os eventos
+    $ python scripts/reconstruir_metricas.py <evento_id>
+"""
+
+import asyncio
+import sys
+
+from app.config.database import connect_to_mongo, close_mongo_connection, get_database
+from app.utils.metricas_evento import reconstruir_metricas
+
+
+async def _run(evento_ids):
+    await connect_to_mongo()
+    try:
+        db = get_database()
+        if not evento_ids:
+            evento_ids = [str(e["_id"]) async for e in db.eventos.find({}, {"_id": 1})]
+        for evento_id in evento_ids:
+            metricas = await reconstruir_metricas(db, evento_id)
+            print(f"{evento_id}: total={metricas['total']} ativos={metricas['ativos']} "
+                  f"cancelados={metricas['cancelados']} impressos={metricas['impressos']} "
+                  f"validacoes={metricas['validacoes']}")
+    finally:
+        await close_mongo_connection()
+
+
+def main():
+    asyncio.run(_run(sys.argv[1:]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+"""Prepara os ingressos embutidos para o índice único (ingressos.evento_id, ingressos.participante_cpf).
+
+Regrava `participante_cpf` de cada ingresso a partir do CPF do participante
+(só dígitos, ou nulo sem CPF) e lista os pares (evento, CPF) com ingresso em
+mais de um participante, que precisam ser resolvidos antes de criar o índice.
+
+Uso:
+
+    $ python scripts/verificar_cpf_ingressos.py              # só lista os duplicados
+    $ python scripts/verificar_cpf_ingressos.py --corrigir   # regrava o CPF e lista
+"""
+
+import asyncio
+import sys
+
+from app.config.database import connect_to_mongo, close_mongo_connection, get_database
+from app.utils.validations import cpfs_duplicados, preencher_cpf_ingressos
+
+
+async def _run(corrigir):
+    await connect_to_mongo()
+    try:
+        db = get_database()
+        if corrigir:
+            print(f"Ingressos com CPF regravado: {await preencher_cpf_ingressos(db)}")
+        duplicados = await cpfs_duplicados(db)
+        for dup in duplicados:
+            print(f"{dup['evento_id']} {dup['cpf']}: {', '.join(dup['participantes'])}")
+        print(f"Duplicados: {len(duplicados)}")
+        return 1 if duplicados else 0
+    finally:
+        await close_mongo_connection()
+
+
+def main():
+    sys.exit(asyncio.run(_run("--corrigir" in sys.argv[1:])))
+
+
+if __name__ == "__main__":
+    main()
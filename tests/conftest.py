@@ -2,16 +2,25 @@
 Configuração compartilhada para testes.
 Define fixtures reutilizáveis em todos os testes.
 """
+import os
+import re
+import tempfile
 import pytest
 import asyncio
 from typing import AsyncGenerator, Dict, Any
 from datetime import datetime, timezone
 from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from fastapi.testclient import TestClient
 from unittest.mock import AsyncMock, MagicMock
 from types import SimpleNamespace
 from app.utils.tokens import generate_token
 
+# renderização na própria thread: os testes substituem `_render_layout_to_image`
+os.environ.setdefault("RENDER_PROCESSOS", "0")
+# cache de renderização fora da árvore do projeto
+os.environ.setdefault("RENDER_CACHE_DIR", tempfile.mkdtemp(prefix="render_cache_"))
+
 
 @pytest.fixture(scope="session")
 def event_loop():
@@ -21,12 +30,70 @@ def event_loop():
     loop.close()
 
 
+_AUSENTE = object()
+
+
+def _tipo_bson(valor):
+    """Ordem de comparação entre tipos do MongoDB (null < números < texto < ... < ObjectId < datas)."""
+    if valor is None or valor is _AUSENTE:
+        return 0
+    if isinstance(valor, bool):
+        return 8
+    if isinstance(valor, (int, float)):
+        return 1
+    if isinstance(valor, str):
+        return 2
+    if isinstance(valor, dict):
+        return 3
+    if isinstance(valor, list):
+        return 4
+    if isinstance(valor, bytes):
+        return 5
+    if isinstance(valor, ObjectId):
+        return 7
+    if isinstance(valor, datetime):
+        return 9
+    return 10
+
+
+def _chave_ordem(valor):
+    tipo = _tipo_bson(valor)
+    if tipo == 0:
+        return (0, 0)
+    if isinstance(valor, datetime) and valor.tzinfo is None:
+        valor = valor.replace(tzinfo=timezone.utc)
+    return (tipo, valor)
+
+
+_TIPOS_TEXTO = {"null": 0, "double": 1, "int": 1, "long": 1, "number": 1, "string": 2, "object": 3,
+                "array": 4, "binData": 5, "objectId": 7, "bool": 8, "date": 9}
+
+
 class FakeCollection:
-    """Mock de collection do MongoDB para testes."""
+    """Mock de collection do MongoDB para testes.
+
+    Cobre o subconjunto de operadores usado pela aplicação: consultas com
+    notação de ponto (um valor escalar casa com qualquer elemento de um array),
+    `$or`/`$and`/`$ne`/`$in`/`$nin`/`$regex`/`$lt`/`$lte`/`$gt`/`$gte`/
+    `$exists`/`$type`/`$elemMatch`; atualizações com `$set`/`$setOnInsert`/
+    `$inc`/`$unset`/`$push`/`$pull` (inclusive o posicional `campo.$.sub`);
+    `_id` e índices `unicos` (ou de `create_index(..., unique=True)`) únicos
+    (DuplicateKeyError / BulkWriteError), `insert_many`,
+    `update_many`, `delete_many` e `bulk_write`.
+    """
     
-    def __init__(self, docs=None):
+    def __init__(self, docs=None, unicos=None):
         self.docs = docs or []
         self._counter = 1000
+        # campos de índices únicos, ex.: [("asset_id", "n")]
+        self._unicos = [list(campos) for campos in unicos or []]
+
+    async def create_index(self, chaves, unique=False, **kwargs):
+        """Registra índices únicos (campos simples), verificados nas inserções."""
+        campos = [chaves] if isinstance(chaves, str) else [c for c, _ in chaves]
+        if unique:
+            self._unicos.append(campos)
+        return "_".join(campos)
     
     async def find_one(self, query=None, sort=None):
         """Busca um documento que corresponda ao query."""
@@ -35,38 +102,73 @@ class FakeCollection:
             if self._match(doc, query):
                 return doc
         return None
+
+    def _novo_id(self, doc):
+        if "_id" not in doc:
+            doc["_id"] = ObjectId()
+        elif isinstance(doc["_id"], str) and ObjectId.is_valid(doc["_id"]):
+            doc["_id"] = ObjectId(doc["_id"])
+        if any(self._equals(d.get("_id"), doc["_id"]) for d in self.docs):
+            raise DuplicateKeyError(f"E11000 duplicate key error: _id {doc['_id']!r}")
+        for campos in self._unicos:
+            chave = [doc.get(c) for c in campos]
+            if any(all(self._equals(d.get(c), v) for c, v in zip(campos, chave)) for d in self.docs):
+                raise DuplicateKeyError(f"E11000 duplicate key error: {campos} {chave!r}")
     
-    async def insert_one(self, doc):
-        """Insere um novo documento."""
+    def _inserir(self, doc):
         new_doc = dict(doc)
-        if "_id" not in new_doc:
-            new_doc["_id"] = ObjectId()
-        else:
-            if isinstance(new_doc["_id"], str):
-                new_doc["_id"] = ObjectId(new_doc["_id"])
+        self._novo_id(new_doc)
+        doc.setdefault("_id", new_doc["_id"])
         self.docs.append(new_doc)
-        return SimpleNamespace(inserted_id=new_doc["_id"])
+        return new_doc["_id"]
+
+    async def insert_one(self, doc):
+        """Insere um novo documento."""
+        return SimpleNamespace(inserted_id=self._inserir(doc))
+
+    async def insert_many(self, docs, ordered=True):
+        """Insere vários documentos; como o pymongo, define `_id` nos próprios dicts."""
+        ids, erros = [], []
+        for i, doc in enumerate(docs):
+            try:
+                ids.append(self._inserir(doc))
+            except DuplicateKeyError as exc:
+                erros.append({"index": i, "code": 11000, "errmsg": str(exc)})
+                if ordered:
+                    break
+        if erros:
+            raise BulkWriteError({"writeErrors": erros, "nInserted": len(ids)})
+        return SimpleNamespace(inserted_ids=ids)
     
     async def update_one(self, query, update, upsert=False):
         """Atualiza um documento."""
         for doc in self.docs:
             if self._match(doc, query):
-                if "$set" in update:
-                    doc.update(update["$set"])
-                if "$inc" in update:
-                    for key, value in update["$inc"].items():
-                        doc[key] = doc.get(key, 0) + value
-                return SimpleNamespace(matched_count=1, modified_count=1)
-        
-        if upsert and "$set" in update:
-            new_doc = dict(query)
-            new_doc.update(update["$set"])
-            if "_id" not in new_doc:
-                new_doc["_id"] = ObjectId()
-            self.docs.append(new_doc)
-            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=new_doc["_id"])
-        
-        return SimpleNamespace(matched_count=0, modified_count=0)
+                self._aplicar(doc, query, update)
+                return SimpleNamespace(matched_count=1, modified_count=1, upserted_id=None)
+        if upsert:
+            return self._upsert(query, update)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query, update, upsert=False):
+        """Atualiza todos os documentos que correspondem ao query."""
+        n = 0
+        for doc in self.docs:
+            if self._match(doc, query):
+                self._aplicar(doc, query, update)
+                n += 1
+        if not n and upsert:
+            return self._upsert(query, update)
+        return SimpleNamespace(matched_count=n, modified_count=n, upserted_id=None)
+
+    def _upsert(self, query, update):
+        new_doc = {k: v for k, v in query.items() if not k.startswith("$") and not isinstance(v, dict)}
+        for caminho, valor in update.get("$setOnInsert", {}).items():
+            self._definir(new_doc, caminho, valor)
+        self._aplicar(new_doc, query, update)
+        self._novo_id(new_doc)
+        self.docs.append(new_doc)
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=new_doc["_id"])
     
     async def delete_one(self, query):
         """Remove um documento."""
@@ -75,6 +177,33 @@ class FakeCollection:
                 self.docs.pop(i)
                 return SimpleNamespace(deleted_count=1)
         return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, query):
+        """Remove todos os documentos que correspondem ao query."""
+        antes = len(self.docs)
+        self.docs[:] = [d for d in self.docs if not self._match(d, query)]
+        return SimpleNamespace(deleted_count=antes - len(self.docs))
+
+    async def bulk_write(self, operacoes, ordered=True):
+        """Executa UpdateOne/UpdateMany/InsertOne/DeleteOne do pymongo, na ordem."""
+        lote = _LoteFake()
+        for op in operacoes:
+            op._add_to_bulk(lote)
+        modificados = inseridos = removidos = 0
+        for tipo, args in lote.operacoes:
+            if tipo == "insert":
+                self._inserir(args[0])
+                inseridos += 1
+            elif tipo == "update":
+                filtro, update, multi, upsert = args
+                metodo = self.update_many if multi else self.update_one
+                modificados += (await metodo(filtro, update, upsert)).modified_count
+            elif tipo == "delete":
+                filtro, limite = args
+                metodo = self.delete_one if limite == 1 else self.delete_many
+                removidos += (await metodo(filtro)).deleted_count
+        return SimpleNamespace(modified_count=modificados, matched_count=modificados,
+                               inserted_count=inseridos, deleted_count=removidos)
     
     async def count_documents(self, query=None):
         """Conta documentos que correspondem ao query."""
@@ -86,10 +215,10 @@ class FakeCollection:
         return count
     
     def find(self, query=None, sort=None):
-        """Retorna cursor para busca."""
+        """Retorna cursor para busca (a projeção é ignorada)."""
         query = query or {}
         matching_docs = [doc for doc in self.docs if self._match(doc, query)]
-        return FakeCursor(matching_docs, sort)
+        return FakeCursor(matching_docs)
 
     def aggregate(self, pipeline):
         """Implementa subset of aggregation for tests: $match + $group sum/cond."""
@@ -116,6 +245,28 @@ class FakeCollection:
             async def to_list(self, length=None):
                 return self.docs
         return AggResult(result)
+
+    # --- consultas -------------------------------------------------------
+
+    @staticmethod
+    def _extrair(d, k):
+        """Valor do caminho com notação de ponto; em arrays, a lista dos valores dos elementos."""
+        if "." in k:
+            top, rest = k.split('.', 1)
+            sub = d.get(top)
+            if isinstance(sub, dict):
+                return FakeCollection._extrair(sub, rest)
+            if isinstance(sub, list):
+                vals = []
+                for item in sub:
+                    if isinstance(item, dict):
+                        v = FakeCollection._extrair(item, rest)
+                        if v is _AUSENTE or v is None:
+                            continue
+                        vals.extend(v) if isinstance(v, list) else vals.append(v)
+                return vals
+            return _AUSENTE
+        return d.get(k, _AUSENTE)
     
     def _match(self, doc, query):
         """Verifica se documento corresponde ao query."""
@@ -124,85 +275,76 @@ class FakeCollection:
                 if not any(self._match(doc, sub) for sub in value):
                     return False
                 continue
-            
             if key == "$and":
                 if not all(self._match(doc, sub) for sub in value):
                     return False
                 continue
-            
-            # support dot notation
-            def extract(d, k):
-                if "." in k:
-                    top, rest = k.split('.', 1)
-                    sub = d.get(top)
-                    if isinstance(sub, dict):
-                        return extract(sub, rest)
-                    if isinstance(sub, list):
-                        # return list of values for each element
-                        vals = []
-                        for item in sub:
-                            if isinstance(item, dict):
-                                v = extract(item, rest)
-                                if v is not None:
-                                    vals.append(v)
-                        return vals
-                    return None
-                return d.get(k)
-            doc_value = extract(doc, key)
-            
-            # if the document value is a list and the query is a simple scalar,
-            # consider it a match if any element equals the scalar (mimics Mongo $elemMatch behavior).
-            if isinstance(doc_value, list) and not isinstance(value, dict):
-                if any(self._equals(v, value) for v in doc_value):
-                    continue  # treat as match and move to next query key
-                else:
+            doc_value = self._extrair(doc, key)
+            if isinstance(value, dict) and any(k.startswith("$") for k in value):
+                if not self._operadores(doc, key, doc_value, value):
                     return False
-            
-            if isinstance(value, dict):
-                if "$ne" in value:
-                    if self._equals(doc_value, value["$ne"]):
-                        return False
-                    continue
-                if "$in" in value:
-                    # doc_value might be list
-                    if isinstance(doc_value, list):
-                        if not any(any(self._equals(v, w) for w in value["$in"]) for v in doc_value):
-                            return False
-                    else:
-                        if not any(self._equals(doc_value, v) for v in value["$in"]):
-                            return False
-                    continue
-                if "$regex" in value:
-                    import re
-                    pattern = value["$regex"]
-                    flags = value.get("$options", "")
-                    regex_flags = 0
-                    if "i" in flags:
-                        regex_flags |= re.IGNORECASE
-                    if not re.search(pattern, str(doc_value), regex_flags):
-                        return False
-                    continue
-                # comparison operators (used for date filtering)
-                if "$lt" in value:
-                    if not (doc_value < value["$lt"]):
-                        return False
-                    continue
-                if "$lte" in value:
-                    if not (doc_value <= value["$lte"]):
-                        return False
-                    continue
-                if "$gt" in value:
-                    if not (doc_value > value["$gt"]):
-                        return False
-                    continue
-                if "$gte" in value:
-                    if not (doc_value >= value["$gte"]):
-                        return False
-                    continue
-            
-            if not self._equals(doc_value, value):
+            elif not self._casa_valor(doc_value, value):
                 return False
-        
+        return True
+
+    def _casa_valor(self, doc_value, value):
+        """Igualdade; um escalar casa com qualquer elemento de um array e null casa com ausente."""
+        if doc_value is _AUSENTE:
+            return value is None
+        if isinstance(doc_value, list) and not isinstance(value, list):
+            return any(self._equals(v, value) for v in doc_value)
+        return self._equals(doc_value, value)
+
+    def _candidatos(self, doc_value):
+        if doc_value is _AUSENTE:
+            return []
+        return doc_value if isinstance(doc_value, list) else [doc_value]
+
+    def _compara(self, doc_value, operador, alvo):
+        for v in self._candidatos(doc_value):
+            if _tipo_bson(v) != _tipo_bson(alvo):
+                continue
+            a, b = _chave_ordem(v), _chave_ordem(alvo)
+            if ((operador == "$lt" and a < b) or (operador == "$lte" and a <= b)
+                    or (operador == "$gt" and a > b) or (operador == "$gte" and a >= b)):
+                return True
+        return False
+
+    def _operadores(self, doc, key, doc_value, ops):
+        for op, alvo in ops.items():
+            if op == "$options":
+                continue
+            if op == "$ne":
+                if self._casa_valor(doc_value, alvo):
+                    return False
+            elif op == "$in":
+                if not any(self._casa_valor(doc_value, w) for w in alvo):
+                    return False
+            elif op == "$nin":
+                if any(self._casa_valor(doc_value, w) for w in alvo):
+                    return False
+            elif op == "$regex":
+                flags = re.IGNORECASE if "i" in ops.get("$options", "") else 0
+                if not any(isinstance(v, str) and re.search(alvo, v, flags) for v in self._candidatos(doc_value)):
+                    return False
+            elif op in ("$lt", "$lte", "$gt", "$gte"):
+                if not self._compara(doc_value, op, alvo):
+                    return False
+            elif op == "$exists":
+                if (doc_value is not _AUSENTE and doc_value != []) != bool(alvo):
+                    return False
+            elif op == "$type":
+                tipo = _TIPOS_TEXTO.get(alvo, alvo)
+                if not any(_tipo_bson(v) == tipo for v in self._candidatos(doc_value)):
+                    return False
+            elif op == "$elemMatch":
+                lista = self._extrair(doc, key)
+                if not isinstance(lista, list) or not any(
+                    isinstance(item, dict) and self._match(item, alvo) for item in lista
+                ):
+                    return False
+            else:
+                raise NotImplementedError(f"FakeCollection: operador {op} não suportado")
         return True
     
     def _equals(self, left, right):
@@ -213,13 +355,96 @@ class FakeCollection:
             right = str(right)
         return left == right
 
+    # --- atualizações ----------------------------------------------------
+
+    def _elemento_posicional(self, doc, query, lista):
+        """Primeiro elemento de `doc[lista]` casado pelas condições do query sobre o array."""
+        criterios = {}
+        for k, v in query.items():
+            if k.startswith(lista + "."):
+                criterios[k[len(lista) + 1:]] = v
+            elif k == lista and isinstance(v, dict) and "$elemMatch" in v:
+                criterios.update(v["$elemMatch"])
+        for item in doc.get(lista) or []:
+            if isinstance(item, dict) and self._match(item, criterios):
+                return item
+        return None
+
+    def _alvo(self, doc, query, caminho):
+        """(dict, chave) onde `caminho` se aplica, resolvendo `lista.$.campo`; None se não houver."""
+        if ".$." in caminho:
+            lista, resto = caminho.split(".$.", 1)
+            doc = self._elemento_posicional(doc, query, lista)
+            if doc is None:
+                return None
+            caminho = resto
+        *pais, chave = caminho.split(".")
+        for parte in pais:
+            doc = doc.setdefault(parte, {})
+        return doc, chave
+
+    def _alvos(self, doc, query, caminho):
+        """Como `_alvo`, expandindo `lista.$[].campo` para todos os elementos."""
+        if ".$[]." in caminho:
+            lista, resto = caminho.split(".$[].", 1)
+            return [alvo for item in doc.get(lista) or [] if isinstance(item, dict)
+                    for alvo in self._alvos(item, {}, resto)]
+        alvo = self._alvo(doc, query, caminho)
+        return [] if alvo is None else [alvo]
+
+    def _definir(self, doc, caminho, valor):
+        alvo = self._alvo(doc, {}, caminho)
+        if alvo is not None:
+            alvo[0][alvo[1]] = valor
+
+    def _aplicar(self, doc, query, update):
+        for caminho, valor in update.get("$set", {}).items():
+            for dono, chave in self._alvos(doc, query, caminho):
+                dono[chave] = valor
+        for caminho, valor in update.get("$inc", {}).items():
+            for dono, chave in self._alvos(doc, query, caminho):
+                dono[chave] = dono.get(chave, 0) + valor
+        for caminho in update.get("$unset", {}):
+            for dono, chave in self._alvos(doc, query, caminho):
+                dono.pop(chave, None)
+        for caminho, valor in update.get("$push", {}).items():
+            itens = valor["$each"] if isinstance(valor, dict) and "$each" in valor else [valor]
+            for dono, chave in self._alvos(doc, query, caminho):
+                dono.setdefault(chave, []).extend(itens)
+        for caminho, cond in update.get("$pull", {}).items():
+            for dono, chave in self._alvos(doc, query, caminho):
+                if isinstance(dono.get(chave), list):
+                    dono[chave] = [
+                        item for item in dono[chave]
+                        if not (self._match(item, cond) if isinstance(cond, dict) and isinstance(item, dict)
+                                else self._equals(item, cond))
+                    ]
+
+
+class _LoteFake:
+    """Recebe as operações do pymongo (`op._add_to_bulk`) para o `bulk_write` do fake."""
+
+    def __init__(self):
+        self.operacoes = []
+
+    def add_insert(self, document):
+        self.operacoes.append(("insert", (document,)))
+
+    def add_update(self, selector, update, multi=False, upsert=False, **kwargs):
+        self.operacoes.append(("update", (selector, update, multi, upsert)))
+
+    def add_replace(self, selector, replacement, upsert=False, **kwargs):
+        raise NotImplementedError("FakeCollection: ReplaceOne não suportado")
+
+    def add_delete(self, selector, limit, **kwargs):
+        self.operacoes.append(("delete", (selector, limit)))
+
 
 class FakeCursor:
     """Mock de cursor do MongoDB."""
     
     def __init__(self, docs, sort=None):
         self.docs = docs
-        self._sort = sort
         self._skip = 0
         self._limit = None
     
@@ -231,23 +456,30 @@ class FakeCursor:
         self._limit = n
         return self
     
-    def sort(self, *args):
-        # Implementação simplificada de sort
+    def sort(self, chave, direcao=1):
+        """Ordena como o MongoDB: `sort("campo", 1)` ou `sort([("a", 1), ("b", -1)])`."""
+        campos = chave if isinstance(chave, list) else [(chave, direcao)]
+        for campo, sentido in reversed(campos):
+            self.docs = sorted(
+                self.docs,
+                key=lambda d: _chave_ordem(FakeCollection._extrair(d, campo)),
+                reverse=sentido == -1,
+            )
         return self
     
-    async def to_list(self, length=None):
-        """Converte cursor para lista."""
+    def _janela(self):
         docs = self.docs[self._skip:]
         if self._limit:
             docs = docs[:self._limit]
         return docs
+
+    async def to_list(self, length=None):
+        """Converte cursor para lista."""
+        return self._janela()
     
     def __aiter__(self):
         """Suporte para iteração assíncrona."""
-        if self._limit:
-            self._iter_docs = iter(self.docs[self._skip:self._skip + self._limit])
-        else:
-            self._iter_docs = iter(self.docs[self._skip:])
+        self._iter_docs = iter(self._janela())
         return self
     
     async def __anext__(self):
@@ -271,6 +503,8 @@ class FakeDB:
         self.admins = FakeCollection(admins or [])
         self.lead_interacoes = FakeCollection(leads or [])
         self.planilhas_upload = FakeCollection(planilhas or [])
+        self.ilha_capacidade = FakeCollection()
+        self.evento_metricas = FakeCollection()
 
 
 @pytest.fixture
@@ -356,6 +590,24 @@ def sample_ingresso(sample_evento, sample_tipo_ingresso, sample_participante):
     }
 
 
+@pytest.fixture(autouse=True)
+def limpar_contexto_evento():
+    """Evita que snapshots de evento em cache vazem entre testes."""
+    from app.utils import contexto_evento
+    contexto_evento.limpar_cache()
+    yield
+    contexto_evento.limpar_cache()
+
+
+@pytest.fixture(autouse=True)
+def limpar_contagens_paginacao():
+    """Evita que contagens em cache da paginação vazem entre testes."""
+    from app.utils import paginacao
+    paginacao.limpar_contagens()
+    yield
+    paginacao.limpar_contagens()
+
+
 @pytest.fixture
 def mock_get_database(fake_db, monkeypatch):
     """Mock da função get_database."""
@@ -0,0 +1,91 @@
+"""
+Testes do armazenamento de logos endereçado por conteúdo e da migração de `logo_blob`.
+"""
+import asyncio
+import base64
+import hashlib
+import pytest
+
+from app.utils import assets
+from tests.conftest import FakeCollection
+
+
+@pytest.fixture
+def db_assets(fake_db, monkeypatch):
+    fake_db.assets = FakeCollection()
+    fake_db.assets_chunks = FakeCollection(unicos=[("asset_id", "n")])
+    fake_db.eventos = FakeCollection(fake_db.eventos.docs)
+    monkeypatch.setattr(assets, "TAMANHO_CHUNK", 1024)
+    assets._sem_logo_legado.limpar()
+    yield fake_db
+    assets._sem_logo_legado.limpar()
+
+
+class TestAssets:
+
+    @pytest.mark.asyncio
+    async def test_salvar_e_carregar_em_chunks_com_deduplicacao(self, db_assets):
+        conteudo = bytes(range(256)) * 10
+        ref = await assets.salvar_asset(db_assets, conteudo, "image/png", "logo.png")
+        ref2 = await assets.salvar_asset(db_assets, conteudo, "image/png", "outro.png")
+
+        assert ref["sha256"] == hashlib.sha256(conteudo).hexdigest() == ref2["sha256"]
+        assert len(db_assets.assets.docs) == 1
+        assert len(db_assets.assets_chunks.docs) == 3
+        assert await assets.carregar_asset(db_assets, ref["sha256"]) == conteudo
+
+    @pytest.mark.asyncio
+    async def test_migracao_move_logo_blob_para_referencia(self, db_assets, sample_evento):
+        conteudo = b"\x89PNG" + b"x" * 3000
+        sample_evento["logo_blob"] = {
+            "data": base64.b64encode(conteudo).decode(),
+            "content_type": "image/png",
+            "filename": "logo.png",
+        }
+        db_assets.eventos.docs.append(sample_evento)
+        outro = {"_id": "sem-logo", "nome": "Sem logo"}
+        db_assets.eventos.docs.append(outro)
+
+        # antes da migração o logo legado continua disponível para renderização
+        projetado = {k: v for k, v in sample_evento.items() if k != "logo_blob"}
+        legado = await assets.carregar_logo(db_assets, projetado)
+        assert legado["data"] == sample_evento["logo_blob"]["data"]
+
+        assert await assets.migrar_logos(db_assets) == 1
+        assert "logo_blob" not in sample_evento
+        assert sample_evento["logo_asset"]["sha256"] == hashlib.sha256(conteudo).hexdigest()
+
+        logo = await assets.carregar_logo(db_assets, sample_evento)
+        assert logo["bytes"] == conteudo
+        assert logo["content_type"] == "image/png"
+        assert await assets.migrar_logos(db_assets) == 0
+
+    @pytest.mark.asyncio
+    async def test_gravacao_concorrente_ou_interrompida_reaproveita_chunks(self, db_assets):
+        conteudo = bytes(range(256)) * 10
+        sha256 = hashlib.sha256(conteudo).hexdigest()
+        # gravação anterior interrompida depois do primeiro pedaço
+        await assets.salvar_asset(db_assets, conteudo[:1024])
+        db_assets.assets_chunks.docs[0]["asset_id"] = sha256
+        db_assets.assets.docs.clear()
+
+        await asyncio.gather(assets.salvar_asset(db_assets, conteudo), assets.salvar_asset(db_assets, conteudo))
+
+        assert len(db_assets.assets.docs) == 1
+        assert sorted(c["n"] for c in db_assets.assets_chunks.docs if c["asset_id"] == sha256) == [0, 1, 2]
+        assert await assets.carregar_asset(db_assets, sha256) == conteudo
+
+    @pytest.mark.asyncio
+    async def test_evento_sem_logo_legado_consulta_uma_vez(self, db_assets, sample_evento, monkeypatch):
+        db_assets.eventos.docs.append(sample_evento)
+        consultas = []
+        find_one = db_assets.eventos.find_one
+
+        async def contar(query=None, sort=None):
+            consultas.append(query)
+            return await find_one(query, sort)
+
+        monkeypatch.setattr(db_assets.eventos, "find_one", contar)
+        for _ in range(3):
+            assert await assets.carregar_logo(db_assets, sample_evento) is None
+        assert len(consultas) == 1
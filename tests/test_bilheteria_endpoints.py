@@ -9,6 +9,7 @@ from fastapi import HTTPException
 from fastapi.responses import RedirectResponse
 
 from app.routers import bilheteria
+from app.utils import espelho_ingressos
 from tests.conftest import FakeDB
 
 
@@ -413,6 +414,9 @@ class TestEmissaoBilheteria:
         assert result["participante_nome"] == "João Silva"
         assert result["tipo_ingresso"] == "VIP All Access"
         assert "qrcode_hash" in result
+        # a coleção antiga é espelhada em segundo plano
+        assert len(fake_db.ingressos_emitidos.docs) == 0
+        await espelho_ingressos.drenar(fake_db)
         assert len(fake_db.ingressos_emitidos.docs) == 1
         # não foi enviada ilha, portanto não deve aparecer no resultado
         assert result.get("ilha_id") is None
@@ -441,6 +445,7 @@ class TestEmissaoBilheteria:
         )
         assert result.get("ilha_id") == str(sample_ilha["_id"])
         # ingressos_emitidos collection deve conter registro com ilha_id
+        await espelho_ingressos.drenar(fake_db)
         assert fake_db.ingressos_emitidos.docs[0].get("ilha_id") == str(sample_ilha["_id"])
     
     @pytest.mark.asyncio
@@ -510,6 +515,7 @@ class TestEmissaoBilheteria:
         )
         
         assert result is not None
+        await espelho_ingressos.drenar(fake_db)
         assert len(fake_db.ingressos_emitidos.docs) == 2
 
     @pytest.mark.asyncio
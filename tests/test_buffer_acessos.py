@@ -0,0 +1,149 @@
+"""
+Testes do buffer de escrita do log de acessos (`validacoes_acesso`).
+"""
+import asyncio
+import pytest
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.utils.buffer_acessos import BufferAcessos, registrar_acessos, MODO_SYNC
+
+
+class _Colecao:
+    def __init__(self, falhar=False):
+        self.docs = []
+        self.chamadas = 0
+        self.falhar = falhar
+
+    async def insert_one(self, doc):
+        self.chamadas += 1
+        self.docs.append(doc)
+
+    async def insert_many(self, docs, ordered=True):
+        self.chamadas += 1
+        if self.falhar:
+            raise RuntimeError("banco indisponível")
+        self.docs.extend(docs)
+
+
+class _ColecaoUnica(_Colecao):
+    """`_id` único, como o Mongo; `aplicar_e_expirar` grava e depois falha (timeout)."""
+
+    def __init__(self):
+        super().__init__()
+        self.aplicar_e_expirar = False
+        self.rejeitar = set()
+
+    async def insert_many(self, docs, ordered=True):
+        self.chamadas += 1
+        erros = []
+        for i, doc in enumerate(docs):
+            doc.setdefault("_id", ObjectId())
+            if doc["ingresso_id"] in self.rejeitar:
+                erros.append({"index": i, "code": 121, "errmsg": "validação"})
+            elif any(d["_id"] == doc["_id"] for d in self.docs):
+                erros.append({"index": i, "code": 11000, "errmsg": "E11000"})
+            else:
+                self.docs.append(doc)
+        if self.aplicar_e_expirar:
+            self.aplicar_e_expirar = False
+            raise RuntimeError("timeout")
+        if erros:
+            raise BulkWriteError({"writeErrors": erros})
+
+
+class _DB:
+    def __init__(self, falhar=False):
+        self.validacoes_acesso = _Colecao(falhar)
+
+
+def _acesso(i):
+    return {"ingresso_id": str(i), "evento_id": "ev1", "status": "OK"}
+
+
+class TestBufferAcessos:
+
+    @pytest.mark.asyncio
+    async def test_descarrega_ao_atingir_lote(self):
+        db = _DB()
+        buffer = BufferAcessos(tamanho_maximo=100, tamanho_lote=3)
+        await buffer.registrar(db, [_acesso(i) for i in range(3)], janela=60)
+        await asyncio.sleep(0.05)
+        assert len(db.validacoes_acesso.docs) == 3
+        assert db.validacoes_acesso.chamadas == 1
+        await buffer.encerrar()
+
+    @pytest.mark.asyncio
+    async def test_descarrega_ao_vencer_janela(self):
+        db = _DB()
+        buffer = BufferAcessos(tamanho_maximo=100, tamanho_lote=50)
+        await buffer.registrar(db, [_acesso(1)], janela=0.05)
+        assert db.validacoes_acesso.docs == []
+        await asyncio.sleep(0.2)
+        assert len(db.validacoes_acesso.docs) == 1
+        await buffer.encerrar()
+
+    @pytest.mark.asyncio
+    async def test_encerrar_grava_pendentes(self):
+        db = _DB()
+        buffer = BufferAcessos(tamanho_maximo=100, tamanho_lote=50)
+        await buffer.registrar(db, [_acesso(i) for i in range(5)], janela=60)
+        await buffer.encerrar()
+        assert len(db.validacoes_acesso.docs) == 5
+        assert buffer.estado()["pendentes"] == 0
+
+    @pytest.mark.asyncio
+    async def test_backpressure_e_descarte_com_banco_indisponivel(self):
+        db = _DB(falhar=True)
+        buffer = BufferAcessos(tamanho_maximo=2, tamanho_lote=50)
+        aceitos = await buffer.registrar(db, [_acesso(i) for i in range(3)], janela=60)
+        estado = buffer.estado()
+        assert aceitos == 2
+        assert estado["backpressure"] == 1
+        assert estado["descartados"] == 1
+        assert estado["pendentes"] == 2
+        assert estado["falhas"] >= 1
+
+        # banco volta: pendentes são gravados
+        db.validacoes_acesso.falhar = False
+        await buffer.encerrar()
+        assert len(db.validacoes_acesso.docs) == 2
+
+    @pytest.mark.asyncio
+    async def test_modo_sync_grava_imediatamente(self):
+        db = _DB()
+        await registrar_acessos(db, [_acesso(1)], MODO_SYNC)
+        assert len(db.validacoes_acesso.docs) == 1
+
+    @pytest.mark.asyncio
+    async def test_repeticao_apos_timeout_nao_trava_na_chave_duplicada(self):
+        db = _DB()
+        db.validacoes_acesso = _ColecaoUnica()
+        db.validacoes_acesso.aplicar_e_expirar = True
+        buffer = BufferAcessos(tamanho_maximo=100, tamanho_lote=50)
+        await buffer.registrar(db, [_acesso(i) for i in range(3)], janela=60)
+        await buffer.descarregar()
+        assert buffer.estado()["pendentes"] == 3
+
+        # a nova tentativa recebe E11000 para todos: já estão gravados
+        await buffer.descarregar()
+        assert buffer.estado()["pendentes"] == 0
+        assert buffer.estado()["gravados"] == 3
+        assert len(db.validacoes_acesso.docs) == 3
+        await buffer.encerrar()
+
+    @pytest.mark.asyncio
+    async def test_gravacao_parcial_devolve_so_os_rejeitados(self):
+        db = _DB()
+        db.validacoes_acesso = _ColecaoUnica()
+        db.validacoes_acesso.rejeitar = {"1"}
+        buffer = BufferAcessos(tamanho_maximo=100, tamanho_lote=50)
+        await buffer.registrar(db, [_acesso(i) for i in range(3)], janela=60)
+        await buffer.descarregar()
+        assert [d["ingresso_id"] for d in db.validacoes_acesso.docs] == ["0", "2"]
+        assert buffer.estado()["pendentes"] == 1
+        assert buffer.estado()["gravados"] == 2
+
+        db.validacoes_acesso.rejeitar = set()
+        await buffer.encerrar()
+        assert len(db.validacoes_acesso.docs) == 3
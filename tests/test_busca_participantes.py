@@ -0,0 +1,77 @@
+"""
+Testes da busca de participantes por prefixo sem acentos (`nome_busca`/`nome_termos`).
+"""
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+from app.routers import bilheteria
+from app.utils.busca_participantes import (
+    buscar_por_nome, campos_busca, filtro_nome, normalizar_nome
+)
+from tests.conftest import FakeCollection
+
+
+EVENTO = "evt1"
+
+
+def _participante(nome, evento_id=EVENTO, indexado=True):
+    doc = {"_id": ObjectId(), "nome": nome, "email": f"{ObjectId()}@x.com", "cpf": "52998224725",
+           "ingressos": [{"_id": str(ObjectId()), "evento_id": evento_id, "tipo_ingresso_id": "t1",
+                          "status": "Ativo", "qrcode_hash": str(ObjectId()),
+                          "data_emissao": datetime.now(timezone.utc)}]}
+    if indexado:
+        doc.update(campos_busca(nome))
+    return doc
+
+
+@pytest.fixture
+def db_busca(fake_db):
+    fake_db.participantes = FakeCollection([
+        _participante("Ana João"),
+        _participante("João da Silva"),
+        _participante("Joao"),
+        _participante("Maria Silva"),
+        _participante("José Pereira", indexado=False),
+        _participante("João Outro Evento", evento_id="evt2"),
+    ])
+    return fake_db
+
+
+def test_normalizar_nome_remove_acentos_e_pontuacao():
+    assert normalizar_nome("  João  da Silva-Éboli ") == "joao da silva eboli"
+    assert campos_busca("Ana Ana Çé") == {"nome_busca": "ana ana ce", "nome_termos": ["ana", "ce"]}
+    assert filtro_nome("  ") == {}
+
+
+@pytest.mark.asyncio
+async def test_busca_sem_acento_ordena_por_relevancia(db_busca):
+    resultado = await buscar_por_nome(db_busca, {"ingressos.evento_id": EVENTO}, "JOÃO")
+    assert [p["nome"] for p in resultado] == ["Joao", "João da Silva", "Ana João"]
+
+
+@pytest.mark.asyncio
+async def test_busca_por_prefixo_de_palavras(db_busca):
+    resultado = await buscar_por_nome(db_busca, {"ingressos.evento_id": EVENTO}, "sil")
+    assert [p["nome"] for p in resultado] == ["João da Silva", "Maria Silva"]
+    resultado = await buscar_por_nome(db_busca, {"ingressos.evento_id": EVENTO}, "silva jo")
+    assert [p["nome"] for p in resultado] == ["João da Silva"]
+
+
+@pytest.mark.asyncio
+async def test_busca_encontra_participantes_ainda_nao_indexados(db_busca):
+    resultado = await buscar_por_nome(db_busca, {"ingressos.evento_id": EVENTO}, "jose")
+    assert [p["nome"] for p in resultado] == ["José Pereira"]
+
+
+@pytest.mark.asyncio
+async def test_busca_escapa_caracteres_de_regex(db_busca):
+    assert await buscar_por_nome(db_busca, {"ingressos.evento_id": EVENTO}, ".*") == []
+
+
+@pytest.mark.asyncio
+async def test_busca_smart_bilheteria_usa_prefixo(db_busca, monkeypatch):
+    monkeypatch.setattr(bilheteria, "get_database", lambda: db_busca)
+    resultado = await bilheteria.busca_smart_participantes(q="joao", evento_id=EVENTO)
+    assert [p.nome for p in resultado] == ["Joao", "João da Silva", "Ana João"]
@@ -1,5 +1,4 @@
 import asyncio
-import hashlib
 from datetime import datetime, timezone, timedelta
 from bson import ObjectId
 from email.utils import format_datetime
@@ -67,12 +66,11 @@ def test_if_none_match_returns_304(monkeypatch):
     evento = make_event(str(ev_id))
     fake_db = FakeDB(eventos=[evento], participantes=[{'_id': part_id, 'nome': 'Joao'}], ingressos=[ingresso], tipos=[{'_id': tipo_id, 'descricao': 'VIP'}])
 
-    # compute expected etag
-    etag_src = ingresso['qrcode_hash'] + str(ingresso['data_emissao'])
-    etag = hashlib.sha1(etag_src.encode()).hexdigest()
+    # the ETag is the render cache key returned by a first render
+    evento_api.get_database = lambda: fake_db
+    etag = asyncio.run(evento_api.render_ingresso_jpg(str(ev_id), str(ingresso['_id']))).headers['etag']
 
     # call with If-None-Match header
-    evento_api.get_database = lambda: fake_db
     resp = asyncio.run(evento_api.render_ingresso_jpg(str(ev_id), str(ingresso['_id']), request=FakeRequest({'if-none-match': etag})))
     assert getattr(resp, 'status_code', None) == 304
 
@@ -0,0 +1,97 @@
+"""
+Testes do livro-razão de capacidade por ilha (`ilha_capacidade`).
+Cobre reserva condicional, semeadura a partir dos ingressos, cancelamento e reconciliação.
+"""
+import pytest
+from datetime import datetime, timezone
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.routers import bilheteria
+from app.utils import capacidade
+
+
+def _ingresso(evento_id, ilha_id, status="Ativo"):
+    return {
+        "_id": str(ObjectId()),
+        "evento_id": evento_id,
+        "ilha_id": ilha_id,
+        "tipo_ingresso_id": "x",
+        "qrcode_hash": str(ObjectId()),
+        "status": status,
+        "data_emissao": datetime.now(timezone.utc),
+    }
+
+
+class TestCapacidadeIlha:
+
+    @pytest.mark.asyncio
+    async def test_reserva_respeita_capacidade(self, fake_db):
+        evento_id = str(ObjectId())
+        assert await capacidade.reservar_vaga(fake_db, evento_id, "ilha1", 2)
+        assert await capacidade.reservar_vaga(fake_db, evento_id, "ilha1", 2)
+        assert not await capacidade.reservar_vaga(fake_db, evento_id, "ilha1", 2)
+        assert await capacidade.ocupacao_ilha(fake_db, evento_id, "ilha1") == 2
+
+    @pytest.mark.asyncio
+    async def test_semeia_a_partir_dos_ingressos_ativos(self, fake_db):
+        evento_id = str(ObjectId())
+        fake_db.participantes.docs.append({
+            "_id": ObjectId(),
+            "ingressos": [_ingresso(evento_id, "ilha1"), _ingresso(evento_id, "ilha1", status="Cancelado")],
+        })
+        assert await capacidade.ocupacao_ilha(fake_db, evento_id, "ilha1") == 1
+        assert await capacidade.reservar_vaga(fake_db, evento_id, "ilha1", 2)
+        assert not await capacidade.reservar_vaga(fake_db, evento_id, "ilha1", 2)
+
+    @pytest.mark.asyncio
+    async def test_cancelar_ingresso_libera_vaga(self, fake_db, mock_get_database, sample_evento):
+        evento_id = str(sample_evento["_id"])
+        ing = _ingresso(evento_id, "ilha1")
+        participante = {"_id": ObjectId(), "nome": "Fulano", "ingressos": [ing]}
+        fake_db.eventos.docs.append(sample_evento)
+        fake_db.participantes.docs.append(participante)
+        assert await capacidade.ocupacao_ilha(fake_db, evento_id, "ilha1") == 1
+
+        result = await bilheteria.cancelar_ingresso(ing["_id"], evento_id=evento_id)
+        assert result["status"] == "Cancelado"
+        assert participante["ingressos"][0]["status"] == "Cancelado"
+        assert fake_db.ilha_capacidade.docs[0]["ocupados"] == 0
+
+        # cancelar novamente não libera a vaga duas vezes
+        await bilheteria.cancelar_ingresso(ing["_id"], evento_id=evento_id)
+        assert fake_db.ilha_capacidade.docs[0]["ocupados"] == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelar_ingresso_inexistente(self, fake_db, mock_get_database, sample_evento):
+        with pytest.raises(HTTPException) as exc_info:
+            await bilheteria.cancelar_ingresso("nao-existe", evento_id=str(sample_evento["_id"]))
+        assert exc_info.value.status_code == 404
+
+    @pytest.mark.asyncio
+    async def test_reconciliar_corrige_contadores(self, fake_db):
+        evento_id = str(ObjectId())
+        fake_db.participantes.docs.append({
+            "_id": ObjectId(),
+            "ingressos": [_ingresso(evento_id, "ilha1"), _ingresso(evento_id, "ilha1")],
+        })
+        fake_db.ilha_capacidade.docs.extend([
+            {"_id": ObjectId(), "evento_id": evento_id, "ilha_id": "ilha1", "ocupados": 7},
+            {"_id": ObjectId(), "evento_id": evento_id, "ilha_id": "ilha2", "ocupados": 3},
+        ])
+        contagem = await capacidade.reconciliar_capacidade(fake_db, evento_id)
+        assert contagem == {"ilha1": 2}
+        ocupados = {d["ilha_id"]: d["ocupados"] for d in fake_db.ilha_capacidade.docs}
+        assert ocupados == {"ilha1": 2, "ilha2": 0}
+
+    @pytest.mark.asyncio
+    async def test_falha_ao_registrar_emissao_fica_no_log(self, fake_db, caplog):
+        evento_id = str(ObjectId())
+
+        async def falha(query, update, upsert=False):
+            raise RuntimeError("banco indisponível")
+
+        fake_db.ilha_capacidade.update_many = falha
+        await capacidade.registrar_emissao(fake_db, evento_id, _ingresso(evento_id, "ilha1"), {})
+        assert f"Falha ao contabilizar ingresso do evento {evento_id}" in caplog.text
+        assert "banco indisponível" in caplog.text
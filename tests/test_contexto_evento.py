@@ -0,0 +1,74 @@
+"""
+Testes do cache de contexto de evento (token → snapshot do evento).
+"""
+import pytest
+
+from app.config import auth
+from app.routers import bilheteria
+from app.utils import contexto_evento
+from app.utils.contexto_evento import CacheContextoEvento
+
+
+class ContadorFindOne:
+    def __init__(self, collection):
+        self.chamadas = 0
+        self._find_one = collection.find_one
+
+    async def __call__(self, *args, **kwargs):
+        self.chamadas += 1
+        return await self._find_one(*args, **kwargs)
+
+
+class TestContextoEvento:
+
+    @pytest.mark.asyncio
+    async def test_token_resolvido_e_reaproveitado_pelo_handler(self, fake_db, mock_get_database, monkeypatch,
+                                                                sample_evento):
+        sample_evento["logo_blob"] = {"data": "x" * 1000}
+        fake_db.eventos.docs.append(sample_evento)
+        contador = ContadorFindOne(fake_db.eventos)
+        monkeypatch.setattr(fake_db.eventos, "find_one", contador)
+        monkeypatch.setattr(bilheteria, "get_database", lambda: fake_db)
+
+        evento_id = await auth.verify_token_bilheteria(sample_evento["token_bilheteria"])
+        await auth.verify_token_bilheteria(sample_evento["token_bilheteria"])
+        evento = await bilheteria.get_evento_campos_obrigatorios(evento_id=evento_id)
+
+        assert evento_id == str(sample_evento["_id"])
+        assert evento is not None
+        assert contador.chamadas == 1
+
+        snapshot = await contexto_evento.evento_por_id(fake_db, evento_id)
+        assert "logo_blob" not in snapshot
+        # alterações no snapshot retornado não afetam o cache
+        snapshot["layout_ingresso"]["elements"].append({"type": "text"})
+        novo = await contexto_evento.evento_por_token(fake_db, "token_portaria", sample_evento["token_portaria"])
+        assert novo["layout_ingresso"]["elements"] == []
+
+    @pytest.mark.asyncio
+    async def test_invalidacao_descarta_tokens_e_id(self, fake_db, sample_evento):
+        fake_db.eventos.docs.append(sample_evento)
+        evento_id = str(sample_evento["_id"])
+        await contexto_evento.evento_por_qualquer_token(fake_db, sample_evento["token_portaria"])
+
+        sample_evento["nome"] = "Renomeado"
+        assert (await contexto_evento.evento_por_id(fake_db, evento_id))["nome"] == "Tech Conference 2024"
+
+        contexto_evento.invalidar_evento(evento_id)
+        assert (await contexto_evento.evento_por_token(fake_db, "token_bilheteria",
+                                                       sample_evento["token_bilheteria"]))["nome"] == "Renomeado"
+
+    def test_lru_limitado_e_ttl(self, monkeypatch):
+        agora = [1000.0]
+        monkeypatch.setattr(contexto_evento.time, "monotonic", lambda: agora[0])
+        cache = CacheContextoEvento(maximo=4, ttl=10)
+
+        cache.guardar({"_id": "a", "token_bilheteria": "TA", "token_portaria": "PA"})
+        cache.guardar({"_id": "b", "token_bilheteria": "TB", "token_portaria": "PB"})
+        assert len(cache) == 4
+        # o evento "a" é o menos usado recentemente e sai primeiro
+        assert cache.obter(("_id", "a")) is None
+        assert cache.obter(("token_bilheteria", "TB"))["_id"] == "b"
+
+        agora[0] += 11
+        assert cache.obter(("token_portaria", "PB")) is None
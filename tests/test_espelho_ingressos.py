@@ -0,0 +1,149 @@
+"""
+Testes da emissão em uma única escrita e da caixa de saída (espelho em `ingressos_emitidos` e contadores).
+"""
+import asyncio
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.routers import bilheteria
+from app.routers.bilheteria import EmissaoRequest
+from app.utils import espelho_ingressos
+from app.utils.snapshot_portaria import hash_offline
+from tests.conftest import FakeCollection
+
+COLECOES = ("eventos", "tipos_ingresso", "participantes", "ingressos_emitidos", "ilha_capacidade",
+            "evento_metricas", "ingressos_alteracoes")
+
+
+class ContaEscritas(FakeCollection):
+    """Anota (coleção, operação) de cada escrita numa lista compartilhada entre coleções."""
+
+    def __init__(self, nome, escritas, docs=None):
+        super().__init__(docs)
+        self.nome = nome
+        self.escritas = escritas
+        self.resultados = []
+
+    async def update_one(self, query, update, upsert=False):
+        self.escritas.append((self.nome, "update_one"))
+        resultado = await super().update_one(query, update, upsert)
+        self.resultados.append(resultado)
+        return resultado
+
+    async def update_many(self, query, update, upsert=False):
+        self.escritas.append((self.nome, "update_many"))
+        return await super().update_many(query, update, upsert)
+
+    async def insert_one(self, doc):
+        self.escritas.append((self.nome, "insert_one"))
+        return await super().insert_one(doc)
+
+    async def insert_many(self, docs, ordered=True):
+        self.escritas.append((self.nome, "insert_many"))
+        return await super().insert_many(docs, ordered)
+
+    async def bulk_write(self, operacoes, ordered=True):
+        self.escritas.append((self.nome, "bulk_write"))
+        return await super().bulk_write(operacoes, ordered)
+
+
+@pytest.fixture
+def emissao_db(fake_db, mock_get_database, sample_evento, sample_tipo_ingresso, sample_participante, sample_ilha):
+    fake_db.escritas = []
+    for nome in COLECOES:
+        setattr(fake_db, nome, ContaEscritas(nome, fake_db.escritas))
+    fake_db.eventos.docs.append(sample_evento)
+    fake_db.tipos_ingresso.docs.append(sample_tipo_ingresso)
+    fake_db.participantes.docs.append(sample_participante)
+    # contador já semeado da ilha liberada pelo tipo
+    fake_db.ilha_capacidade.docs.append({"_id": ObjectId(), "evento_id": str(sample_evento["_id"]),
+                                         "ilha_id": str(sample_ilha["_id"]), "ocupados": 0})
+    fake_db.evento_metricas.docs.append({"_id": ObjectId(), "evento_id": str(sample_evento["_id"]), "total": 0})
+    return fake_db
+
+
+def _emissao(sample_tipo_ingresso, sample_participante):
+    return EmissaoRequest(tipo_ingresso_id=str(sample_tipo_ingresso["_id"]),
+                          participante_id=str(sample_participante["_id"]))
+
+
+@pytest.mark.asyncio
+async def test_emissao_grava_uma_vez_e_a_caixa_de_saida_aplica_o_resto(emissao_db, sample_evento,
+                                                                       sample_tipo_ingresso, sample_participante):
+    result = await bilheteria.emitir_ingresso(_emissao(sample_tipo_ingresso, sample_participante),
+                                              evento_id=str(sample_evento["_id"]))
+
+    # uma única escrita no caminho da emissão, somando todas as coleções
+    assert emissao_db.escritas == [("participantes", "update_one")]
+    embutido = sample_participante["ingressos"][0]
+    assert embutido[espelho_ingressos.CAMPO_PENDENTE] is True
+    assert espelho_ingressos.CAMPO_PENDENTE not in result["ingresso"]
+
+    emissao_db.escritas.clear()
+    assert await espelho_ingressos.drenar(emissao_db) == 1
+    assert sorted(emissao_db.escritas) == sorted([
+        ("ingressos_emitidos", "update_one"),    # espelho (upsert)
+        ("participantes", "update_one"),         # remoção da marca
+        ("ilha_capacidade", "update_many"),      # ilha liberada pelo tipo
+        ("evento_metricas", "update_one"),
+        ("eventos", "update_one"),               # versão do snapshot offline
+        ("ingressos_alteracoes", "insert_many"),
+    ])
+    legado = emissao_db.ingressos_emitidos.docs[0]
+    assert legado["_id"] == ObjectId(embutido["_id"])
+    assert legado["qrcode_hash"] == result["qrcode_hash"]
+    assert espelho_ingressos.CAMPO_PENDENTE not in legado
+    assert espelho_ingressos.CAMPO_PENDENTE not in embutido
+    assert emissao_db.ilha_capacidade.docs[0]["ocupados"] == 1
+    assert [a["hash"] for a in emissao_db.ingressos_alteracoes.docs] == [hash_offline(result["qrcode_hash"])]
+    assert emissao_db.evento_metricas.docs[0]["total"] == 1
+
+    # nada pendente: a passada seguinte não reescreve
+    emissao_db.escritas.clear()
+    assert await espelho_ingressos.drenar(emissao_db) == 0
+    assert emissao_db.escritas == []
+
+
+@pytest.mark.asyncio
+async def test_segunda_emissao_do_cpf_no_evento_e_conflito(emissao_db, sample_evento, sample_tipo_ingresso,
+                                                           sample_participante):
+    emissao = _emissao(sample_tipo_ingresso, sample_participante)
+    await bilheteria.emitir_ingresso(emissao, evento_id=str(sample_evento["_id"]))
+
+    # o filtro `ingressos.evento_id $ne` não casa: nenhum documento atualizado, 409
+    with pytest.raises(HTTPException) as exc:
+        await bilheteria.emitir_ingresso(emissao, evento_id=str(sample_evento["_id"]))
+    assert exc.value.status_code == 409
+    assert emissao_db.participantes.resultados[-1].matched_count == 0
+    assert len(sample_participante["ingressos"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_passadas_concorrentes_contabilizam_uma_vez(emissao_db, sample_evento, sample_tipo_ingresso,
+                                                          sample_participante):
+    await bilheteria.emitir_ingresso(_emissao(sample_tipo_ingresso, sample_participante),
+                                     evento_id=str(sample_evento["_id"]))
+
+    # dois processos drenando ao mesmo tempo: só quem remove a marca contabiliza
+    assert sorted(await asyncio.gather(espelho_ingressos.drenar(emissao_db),
+                                       espelho_ingressos.drenar(emissao_db))) == [0, 1]
+    assert emissao_db.ilha_capacidade.docs[0]["ocupados"] == 1
+    assert len(emissao_db.ingressos_alteracoes.docs) == 1
+    assert len(emissao_db.ingressos_emitidos.docs) == 1
+
+
+@pytest.mark.asyncio
+async def test_espelho_mantem_pendente_quando_a_colecao_antiga_falha(emissao_db, sample_evento,
+                                                                     sample_tipo_ingresso, sample_participante):
+    await bilheteria.emitir_ingresso(_emissao(sample_tipo_ingresso, sample_participante),
+                                     evento_id=str(sample_evento["_id"]))
+
+    async def indisponivel(query, update, upsert=False):
+        raise RuntimeError("timeout")
+
+    emissao_db.ingressos_emitidos.update_one = indisponivel
+    assert await espelho_ingressos.drenar(emissao_db) == 0
+    assert sample_participante["ingressos"][0][espelho_ingressos.CAMPO_PENDENTE] is True
+    assert emissao_db.ilha_capacidade.docs[0]["ocupados"] == 0
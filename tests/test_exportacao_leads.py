@@ -0,0 +1,101 @@
+"""
+Testes da exportação de leads em streaming (XLSX, CSV e CSV gzip).
+"""
+import csv
+import gzip
+import io
+import threading
+
+import pytest
+from bson import ObjectId
+from openpyxl import load_workbook
+
+from tests.conftest import FakeCollection
+from app.utils import exportacao_leads
+
+
+class ContaFind(FakeCollection):
+    def __init__(self, docs=None):
+        super().__init__(docs)
+        self.finds = []
+        self.find_ones = 0
+
+    def find(self, query=None, sort=None):
+        self.finds.append((query, sort))
+        return super().find(query)
+
+    async def find_one(self, query=None, sort=None):
+        self.find_ones += 1
+        return await super().find_one(query, sort)
+
+
+@pytest.fixture
+def db_leads(fake_db):
+    evento_id = str(ObjectId())
+    fake_db.participantes = ContaFind([
+        {"_id": ObjectId(), "nome": "Ana Único", "email": "ana@ex.com", "telefone": "11999",
+         "empresa": "ACME", "cpf": "1", "ingressos": [{"evento_id": evento_id}, {"evento_id": evento_id}]},
+        {"_id": ObjectId(), "nome": "Bruno", "email": "bruno@ex.com", "telefone": None,
+         "ingressos": [{"evento_id": evento_id}]},
+        {"_id": ObjectId(), "nome": "Outro Evento", "email": "x@ex.com", "ingressos": [{"evento_id": "outro"}]},
+    ])
+    fake_db.evento_id = evento_id
+    return fake_db
+
+
+async def _bytes(gerador):
+    return b"".join([bloco async for bloco in gerador])
+
+
+ESPERADO = [
+    ["Nome", "Email", "Telefone", "Empresa", "Cargo"],
+    ["Ana Único", "ana@ex.com", "11999", "ACME", ""],
+    ["Bruno", "bruno@ex.com", "", "", ""],
+]
+
+
+class TestExportacaoLeads:
+
+    @pytest.mark.asyncio
+    async def test_csv_em_uma_consulta_projetada(self, db_leads, monkeypatch):
+        monkeypatch.setattr(exportacao_leads, "LINHAS_POR_BLOCO", 1)
+        blocos = [b async for b in exportacao_leads.exportar_leads(db_leads, db_leads.evento_id, "csv")]
+        # um bloco por linha além do cabeçalho: o conteúdo sai conforme o cursor avança
+        assert len(blocos) >= 3
+        texto = b"".join(blocos).decode("utf-8-sig")
+        assert list(csv.reader(io.StringIO(texto))) == ESPERADO
+
+        participantes = db_leads.participantes
+        assert len(participantes.finds) == 1
+        assert participantes.finds[0][1] == exportacao_leads.PROJECAO_LEADS
+        assert participantes.find_ones == 0
+
+    @pytest.mark.asyncio
+    async def test_csv_gzip(self, db_leads):
+        conteudo = await _bytes(exportacao_leads.exportar_leads(db_leads, db_leads.evento_id, "csv.gz"))
+        texto = gzip.decompress(conteudo).decode("utf-8-sig")
+        assert list(csv.reader(io.StringIO(texto))) == ESPERADO
+
+    @pytest.mark.asyncio
+    async def test_xlsx_write_only(self, db_leads):
+        conteudo = await _bytes(exportacao_leads.exportar_leads(db_leads, db_leads.evento_id, "xlsx"))
+        ws = load_workbook(io.BytesIO(conteudo))["Leads"]
+        linhas = [[c if c is not None else "" for c in r] for r in ws.iter_rows(values_only=True)]
+        assert linhas == ESPERADO
+
+    @pytest.mark.asyncio
+    async def test_xlsx_serializa_em_lotes_fora_do_event_loop(self, db_leads, monkeypatch):
+        monkeypatch.setattr(exportacao_leads, "LINHAS_POR_BLOCO", 1)
+        anexar = exportacao_leads._anexar_linhas
+        threads = []
+
+        def registrar(ws, linhas):
+            threads.append(threading.get_ident())
+            anexar(ws, linhas)
+
+        monkeypatch.setattr(exportacao_leads, "_anexar_linhas", registrar)
+        conteudo = await _bytes(exportacao_leads.exportar_leads(db_leads, db_leads.evento_id, "xlsx"))
+        assert len(threads) == 2
+        assert threading.get_ident() not in threads
+        ws = load_workbook(io.BytesIO(conteudo))["Leads"]
+        assert [[c if c is not None else "" for c in r] for r in ws.iter_rows(values_only=True)] == ESPERADO
@@ -0,0 +1,99 @@
+"""
+Testes das chaves de idempotência (`Idempotency-Key`) da emissão, reimpressão e inscrição.
+"""
+import asyncio
+import json
+
+import pytest
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+
+from app.routers import bilheteria
+from app.routers.bilheteria import EmissaoRequest
+from app.utils import idempotencia
+from tests.conftest import FakeCollection
+
+
+@pytest.fixture
+def idem_db(fake_db, mock_get_database, sample_evento, sample_tipo_ingresso, sample_participante):
+    idempotencia.limpar()
+    fake_db.eventos.docs.append(sample_evento)
+    fake_db.tipos_ingresso.docs.append(sample_tipo_ingresso)
+    fake_db.participantes.docs.append(sample_participante)
+    fake_db.idempotencia = FakeCollection()
+    yield fake_db
+    idempotencia.limpar()
+
+
+def _emissao(sample_tipo_ingresso, sample_participante):
+    return EmissaoRequest(tipo_ingresso_id=str(sample_tipo_ingresso["_id"]),
+                          participante_id=str(sample_participante["_id"]))
+
+
+@pytest.mark.asyncio
+async def test_repeticao_devolve_a_primeira_emissao(idem_db, sample_evento, sample_tipo_ingresso,
+                                                   sample_participante):
+    emissao = _emissao(sample_tipo_ingresso, sample_participante)
+    evento_id = str(sample_evento["_id"])
+    primeira = await bilheteria.emitir_ingresso(emissao, evento_id=evento_id, idempotency_key="k1")
+    repetida = await bilheteria.emitir_ingresso(emissao, evento_id=evento_id, idempotency_key="k1")
+
+    assert isinstance(repetida, JSONResponse)
+    assert repetida.status_code == 201
+    assert repetida.headers["Idempotent-Replayed"] == "true"
+    corpo = json.loads(repetida.body)
+    assert corpo["ingresso"]["qrcode_hash"] == primeira["qrcode_hash"]
+    assert len(sample_participante["ingressos"]) == 1
+
+    # outro processo (sem a LRU) repete a partir da coleção
+    idempotencia.limpar()
+    do_banco = await bilheteria.emitir_ingresso(emissao, evento_id=evento_id, idempotency_key="k1")
+    assert json.loads(do_banco.body) == corpo
+    assert len(sample_participante["ingressos"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_toque_duplo_concorrente_executa_uma_vez(idem_db, sample_evento, sample_tipo_ingresso,
+                                                      sample_participante):
+    emissao = _emissao(sample_tipo_ingresso, sample_participante)
+    evento_id = str(sample_evento["_id"])
+    resultados = await asyncio.gather(
+        bilheteria.emitir_ingresso(emissao, evento_id=evento_id, idempotency_key="k2"),
+        bilheteria.emitir_ingresso(emissao, evento_id=evento_id, idempotency_key="k2"),
+    )
+    assert sum(isinstance(r, JSONResponse) for r in resultados) == 1
+    assert len(sample_participante["ingressos"]) == 1
+
+
+@pytest.mark.asyncio
+async def test_mesma_chave_com_outro_corpo(idem_db, sample_evento, sample_tipo_ingresso, sample_participante):
+    evento_id = str(sample_evento["_id"])
+    await bilheteria.emitir_ingresso(_emissao(sample_tipo_ingresso, sample_participante),
+                                     evento_id=evento_id, idempotency_key="k3")
+    outra = EmissaoRequest(tipo_ingresso_id=str(sample_tipo_ingresso["_id"]), participante_id="0" * 24)
+    with pytest.raises(HTTPException) as exc:
+        await bilheteria.emitir_ingresso(outra, evento_id=evento_id, idempotency_key="k3")
+    assert exc.value.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_falha_nao_e_guardada(idem_db, sample_evento, sample_tipo_ingresso):
+    emissao = EmissaoRequest(tipo_ingresso_id=str(sample_tipo_ingresso["_id"]), participante_id="0" * 24)
+    for _ in range(2):
+        with pytest.raises(HTTPException) as exc:
+            await bilheteria.emitir_ingresso(emissao, evento_id=str(sample_evento["_id"]), idempotency_key="k4")
+        assert exc.value.status_code == 404
+    assert idem_db.idempotencia.docs == []
+
+
+@pytest.mark.asyncio
+async def test_sem_chave_executa_sempre(idem_db):
+    chamadas = []
+
+    async def operacao():
+        chamadas.append(1)
+        return {"ok": True}
+
+    await idempotencia.executar(idem_db, "teste", None, {}, operacao)
+    await idempotencia.executar(idem_db, "teste", None, {}, operacao)
+    assert len(chamadas) == 2
@@ -0,0 +1,181 @@
+"""
+Testes das importações de planilha em segundo plano (fila, progresso e retomada).
+"""
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from bson import ObjectId
+
+from app.utils import importacoes
+from tests.test_planilha_lotes import CPFS_VALIDOS, LoteCollection, _csv
+
+
+@pytest.fixture
+def db_importacoes(fake_db, monkeypatch, tmp_path):
+    monkeypatch.setenv("IMPORTACOES_DIR", str(tmp_path))
+    evento_id = ObjectId()
+    fake_db.eventos = LoteCollection([{"_id": evento_id, "nome": "Congresso"}])
+    fake_db.tipos_ingresso = LoteCollection([
+        {"_id": ObjectId(), "evento_id": str(evento_id), "numero": 1, "padrao": True, "descricao": "Geral"},
+    ])
+    fake_db.participantes = LoteCollection()
+    fake_db.ingressos_emitidos = LoteCollection()
+    fake_db.planilha_importacoes = LoteCollection()
+    fake_db.planilha_importacoes_erros = LoteCollection()
+    fake_db.evento_id = str(evento_id)
+    return fake_db
+
+
+def _linhas(n):
+    return [f"Pessoa {i},p{i}@ex.com,{cpf}," for i, cpf in enumerate(CPFS_VALIDOS[:n])]
+
+
+class TestImportacoes:
+
+    @pytest.mark.asyncio
+    async def test_upload_enfileira_e_trabalhador_processa(self, db_importacoes):
+        import_id = await importacoes.criar_importacao(db_importacoes, db_importacoes.evento_id, "lista.csv",
+                                                       _csv(_linhas(4)))
+        doc = db_importacoes.planilha_importacoes.docs[0]
+        # a resposta não espera o processamento
+        assert str(doc["_id"]) == import_id
+        assert doc["status"] == importacoes.STATUS_FILA
+
+        await importacoes.fila_importacoes.aguardar()
+
+        situacao = importacoes.situacao_importacao(doc)
+        assert situacao["status"] == "completed"
+        assert (situacao["processed"], situacao["total"], situacao["eta_segundos"]) == (4, 4, 0)
+        assert situacao["relatorio"]["created_ingressos"] == 4
+        assert doc["started_at"] and doc["finished_at"]
+        assert len(db_importacoes.participantes.docs) == 4
+        await importacoes.encerrar_importacoes()
+
+    @pytest.mark.asyncio
+    async def test_upload_copiado_em_blocos_para_o_disco(self, db_importacoes, monkeypatch):
+        from io import BytesIO
+        from fastapi import UploadFile
+        monkeypatch.setattr(importacoes, "BLOCO_UPLOAD", 16)
+        conteudo = _csv(_linhas(3))
+        upload = UploadFile(file=BytesIO(conteudo), filename="lista grande.csv")
+        await importacoes.criar_importacao(db_importacoes, db_importacoes.evento_id, upload.filename, upload)
+        doc = db_importacoes.planilha_importacoes.docs[0]
+        caminho = doc["file_path"]
+        assert caminho.endswith("_lista_grande.csv")
+        with open(caminho, "rb") as fh:
+            assert fh.read() == conteudo
+
+        await importacoes.fila_importacoes.aguardar()
+        assert doc["relatorio"]["created_ingressos"] == 3
+        # importação concluída: o arquivo não fica em disco
+        assert doc["file_path"] is None
+        assert not os.path.exists(caminho)
+        await importacoes.encerrar_importacoes()
+
+    @pytest.mark.asyncio
+    async def test_importacao_interrompida_retoma_do_ultimo_lote(self, db_importacoes, tmp_path):
+        arquivo = tmp_path / "lista.csv"
+        arquivo.write_bytes(_csv(_linhas(5)))
+        # as linhas 2 e 3 já foram gravadas antes da queda do processo
+        for cpf in CPFS_VALIDOS[:2]:
+            db_importacoes.participantes.docs.append({"_id": ObjectId(), "cpf": cpf, "ingressos": [
+                {"evento_id": db_importacoes.evento_id}]})
+        db_importacoes.planilha_importacoes.docs.append({
+            "_id": ObjectId(), "evento_id": db_importacoes.evento_id, "filename": "lista.csv",
+            "file_path": str(arquivo), "modo": importacoes.MODO_IMPORTAR,
+            "status": importacoes.STATUS_PROCESSANDO,
+            "atualizado_em": datetime.now(timezone.utc) - timedelta(seconds=importacoes.LEASE_SEGUNDOS + 5),
+            "checkpoint": {"linha": 3, "total": 2, "created_participants": 2, "reused_participants": 0,
+                           "created_ingressos": 2},
+        })
+        import_id = str(db_importacoes.planilha_importacoes.docs[0]["_id"])
+
+        report = await importacoes.executar_importacao(db_importacoes, import_id)
+
+        assert report["total"] == 5
+        assert report["created_ingressos"] == 5
+        assert report["errors"] == []
+        # só as três linhas restantes foram gravadas agora
+        assert len(db_importacoes.participantes.docs) == 5
+        assert db_importacoes.planilha_importacoes.docs[0]["status"] == "completed"
+
+    @pytest.mark.asyncio
+    async def test_importacao_com_lease_ativo_nao_e_assumida(self, db_importacoes, tmp_path):
+        arquivo = tmp_path / "lista.csv"
+        arquivo.write_bytes(_csv(_linhas(1)))
+        db_importacoes.planilha_importacoes.docs.append({
+            "_id": ObjectId(), "evento_id": db_importacoes.evento_id, "filename": "lista.csv",
+            "file_path": str(arquivo), "status": importacoes.STATUS_PROCESSANDO,
+            "atualizado_em": datetime.now(timezone.utc),
+        })
+        import_id = str(db_importacoes.planilha_importacoes.docs[0]["_id"])
+        assert await importacoes.executar_importacao(db_importacoes, import_id) is None
+        assert db_importacoes.participantes.docs == []
+
+    @pytest.mark.asyncio
+    async def test_upload_publico_valida_e_aguarda_aceite(self, db_importacoes):
+        import_id = await importacoes.criar_importacao(db_importacoes, db_importacoes.evento_id, "lista.csv",
+                                                       _csv(_linhas(2)), modo=importacoes.MODO_VALIDAR)
+        await importacoes.fila_importacoes.aguardar()
+        doc = db_importacoes.planilha_importacoes.docs[0]
+        assert doc["status"] == importacoes.STATUS_AGUARDANDO_ACEITE
+        assert db_importacoes.participantes.docs == []
+
+        assert await importacoes.aceitar_importacao(db_importacoes, import_id)
+        assert not await importacoes.aceitar_importacao(db_importacoes, import_id)
+        await importacoes.fila_importacoes.aguardar()
+        assert doc["status"] == "completed"
+        assert len(db_importacoes.participantes.docs) == 2
+        await importacoes.encerrar_importacoes()
+
+    @pytest.mark.asyncio
+    async def test_erro_de_gravacao_encerra_a_importacao_como_falha(self, db_importacoes, monkeypatch):
+        from pymongo.errors import BulkWriteError
+
+        async def falha(*args, **kwargs):
+            raise BulkWriteError({"writeErrors": [{"index": 0, "code": 11000}]})
+
+        monkeypatch.setattr(importacoes, "process_planilha", falha)
+        await importacoes.criar_importacao(db_importacoes, db_importacoes.evento_id, "lista.csv", _csv(_linhas(1)))
+        await importacoes.fila_importacoes.aguardar()
+
+        situacao = importacoes.situacao_importacao(db_importacoes.planilha_importacoes.docs[0])
+        assert situacao["status"] == "failed"
+        assert situacao["finished_at"]
+        assert situacao["relatorio"]["errors"][0].startswith("Erro ao processar a planilha")
+        await importacoes.encerrar_importacoes()
+
+    @pytest.mark.asyncio
+    async def test_validacao_publica_com_falha_nao_fica_guardada(self, db_importacoes, mock_get_database):
+        from app.routers import planilha as planilha_router
+        db_importacoes.planilha_upload_links = LoteCollection([{"token": "t1", "evento_id": db_importacoes.evento_id}])
+        import_id = await importacoes.criar_importacao(db_importacoes, db_importacoes.evento_id, "lista.csv",
+                                                       _csv(["Sem Email,,111.111.111-11,"]),
+                                                       modo=importacoes.MODO_VALIDAR)
+        doc = db_importacoes.planilha_importacoes.docs[0]
+        caminho = doc["file_path"]
+        await importacoes.fila_importacoes.aguardar()
+
+        assert doc["status"] == "failed"
+        assert doc["expira_em"] > datetime.now(timezone.utc)
+        assert not os.path.exists(caminho)
+        assert db_importacoes.planilha_importacoes_erros.docs == []
+
+        # o remetente recebe o relatório uma vez; depois o registro não existe mais
+        situacao = await planilha_router.public_upload_situacao("t1", import_id)
+        assert situacao["status"] == "failed"
+        assert situacao["relatorio"]["errors"]
+        assert db_importacoes.planilha_importacoes.docs == []
+        await importacoes.encerrar_importacoes()
+
+    @pytest.mark.asyncio
+    async def test_validacao_aguardando_aceite_mantem_o_arquivo(self, db_importacoes):
+        await importacoes.criar_importacao(db_importacoes, db_importacoes.evento_id, "lista.csv",
+                                           _csv(_linhas(1)), modo=importacoes.MODO_VALIDAR)
+        doc = db_importacoes.planilha_importacoes.docs[0]
+        await importacoes.fila_importacoes.aguardar()
+        assert doc["status"] == importacoes.STATUS_AGUARDANDO_ACEITE
+        assert os.path.exists(doc["file_path"])
+        assert "expira_em" not in doc
+        await importacoes.encerrar_importacoes()
@@ -0,0 +1,186 @@
+"""
+Testes do CPF gravado nos ingressos embutidos e do índice único (ingressos.evento_id, ingressos.participante_cpf).
+"""
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from pymongo.errors import DuplicateKeyError, OperationFailure
+
+import app.config.database as database
+from app.config.indexes import create_indexes
+from app.routers import bilheteria
+from app.routers.bilheteria import EmissaoRequest
+from app.utils.validations import cpf_participante, cpfs_duplicados, preencher_cpf_ingressos
+from tests.conftest import FakeCollection
+
+
+def _participante(cpf, *ingressos):
+    return {"_id": ObjectId(), "nome": "P", "cpf": cpf, "ingressos": list(ingressos)}
+
+
+def test_cpf_participante_so_digitos_ou_none():
+    assert cpf_participante("529.982.247-25") == "52998224725"
+    assert cpf_participante("") is None
+    assert cpf_participante(None) is None
+
+
+@pytest.mark.asyncio
+async def test_emissao_grava_o_cpf_normalizado(fake_db, mock_get_database, sample_evento, sample_tipo_ingresso,
+                                               sample_participante):
+    sample_participante["cpf"] = "529.982.247-25"
+    fake_db.eventos.docs.append(sample_evento)
+    fake_db.tipos_ingresso.docs.append(sample_tipo_ingresso)
+    fake_db.participantes.docs.append(sample_participante)
+
+    await bilheteria.emitir_ingresso(EmissaoRequest(tipo_ingresso_id=str(sample_tipo_ingresso["_id"]),
+                                                    participante_id=str(sample_participante["_id"])),
+                                     evento_id=str(sample_evento["_id"]))
+    assert sample_participante["ingressos"][0]["participante_cpf"] == "52998224725"
+
+
+@pytest.mark.asyncio
+async def test_preenche_cpf_e_lista_duplicados():
+    participantes = FakeCollection([
+        _participante("52998224725", {"_id": "a", "evento_id": "e1", "participante_cpf": None}),
+        _participante("529.982.247-25", {"_id": "b", "evento_id": "e1", "participante_cpf": "529.982.247-25"}),
+        _participante("", {"_id": "c", "evento_id": "e1", "participante_cpf": ""},
+                      {"_id": "d", "evento_id": "e2", "participante_cpf": ""}),
+        _participante("11144477735", {"_id": "e", "evento_id": "e1", "participante_cpf": "11144477735"}),
+    ])
+    db = type("DB", (), {"participantes": participantes})()
+
+    # antes: o CPF nulo e o formatado escapam da comparação
+    assert await cpfs_duplicados(db) == []
+
+    assert await preencher_cpf_ingressos(db) == 4
+    assert [i["participante_cpf"] for p in participantes.docs for i in p["ingressos"]] == [
+        "52998224725", "52998224725", None, None, "11144477735"]
+    assert await preencher_cpf_ingressos(db) == 0
+
+    duplicados = await cpfs_duplicados(db)
+    assert duplicados == [{"evento_id": "e1", "cpf": "52998224725",
+                           "participantes": sorted(str(p["_id"]) for p in participantes.docs[:2])}]
+
+
+class _BancoIndices:
+    """Banco com uma coleção fake por atributo; o índice de CPF falha como no servidor com duplicados."""
+
+    def __init__(self, participantes):
+        self.participantes = participantes
+
+    def __getattr__(self, nome):
+        colecao = FakeCollection()
+        setattr(self, nome, colecao)
+        return colecao
+
+
+@pytest.mark.asyncio
+async def test_falha_do_indice_de_cpf_impede_a_inicializacao(monkeypatch, caplog):
+    participantes = FakeCollection([
+        _participante("52998224725", {"_id": "a", "evento_id": "e1", "participante_cpf": "52998224725"}),
+        _participante("52998224725", {"_id": "b", "evento_id": "e1", "participante_cpf": "52998224725"}),
+    ])
+    criar = participantes.create_index
+
+    async def create_index(chaves, unique=False, **kwargs):
+        if chaves == [("ingressos.evento_id", 1), ("ingressos.participante_cpf", 1)]:
+            raise OperationFailure("E11000 duplicate key error", code=11000)
+        return await criar(chaves, unique=unique, **kwargs)
+
+    participantes.create_index = create_index
+    monkeypatch.setattr(database, "get_database", lambda: _BancoIndices(participantes))
+
+    with pytest.raises(RuntimeError):
+        await create_indexes()
+    assert "CPF 52998224725 com ingresso em mais de um participante no evento e1" in caplog.text
+
+
+@pytest.mark.asyncio
+async def test_cpf_incluido_depois_regrava_os_ingressos(fake_db, mock_get_database, sample_evento,
+                                                        sample_tipo_ingresso, sample_participante):
+    # ingresso emitido antes de o participante ter CPF: chave nula no índice
+    sample_participante["cpf"] = None
+    fake_db.eventos.docs.append(sample_evento)
+    fake_db.tipos_ingresso.docs.append(sample_tipo_ingresso)
+    fake_db.participantes.docs.append(sample_participante)
+    emissao = EmissaoRequest(tipo_ingresso_id=str(sample_tipo_ingresso["_id"]),
+                             participante_id=str(sample_participante["_id"]))
+    await bilheteria.emitir_ingresso(emissao, evento_id=str(sample_evento["_id"]))
+    assert sample_participante["ingressos"][0]["participante_cpf"] is None
+
+    await bilheteria.update_participante(str(sample_participante["_id"]),
+                                         bilheteria.ParticipanteUpdate(cpf="529.982.247-25"),
+                                         evento_id=str(sample_evento["_id"]))
+
+    # o documento passa a entrar no índice: nenhum ingresso fica com CPF nulo ou antigo
+    assert sample_participante["cpf"] == "52998224725"
+    assert [i["participante_cpf"] for i in sample_participante["ingressos"]] == ["52998224725"]
+    assert await preencher_cpf_ingressos(fake_db) == 0
+
+
+@pytest.mark.asyncio
+async def test_alteracao_de_cpf_sem_ingressos(fake_db, mock_get_database, sample_evento, sample_participante):
+    fake_db.participantes.docs.append(sample_participante)
+    await bilheteria.update_participante(str(sample_participante["_id"]),
+                                         bilheteria.ParticipanteUpdate(cpf="111.444.777-35"),
+                                         evento_id=str(sample_evento["_id"]))
+    assert sample_participante["cpf"] == "11144477735"
+    assert "ingressos" not in sample_participante
+
+
+@pytest.fixture
+def emissao_concorrente(fake_db, mock_get_database, sample_evento, sample_tipo_ingresso, sample_participante,
+                        monkeypatch):
+    """Outro participante grava o mesmo CPF no evento entre a checagem e o $push."""
+    from app.routers import admin, evento_web
+    fake_db.eventos.docs.append(sample_evento)
+    fake_db.tipos_ingresso.docs.append(sample_tipo_ingresso)
+    fake_db.participantes.docs.append(sample_participante)
+
+    async def colide(query, update, upsert=False):
+        raise DuplicateKeyError("E11000 duplicate key error")
+
+    fake_db.participantes.update_one = colide
+    efeitos = []
+
+    async def registrar(db, evento_id, ingressos):
+        efeitos.append(evento_id)
+
+    for modulo in (admin, evento_web):
+        monkeypatch.setattr(modulo, "registrar_emissao", registrar)
+        monkeypatch.setattr(modulo, "registrar_alteracoes", registrar)
+    fake_db.efeitos = efeitos
+    return fake_db
+
+
+@pytest.mark.asyncio
+async def test_admin_recusa_cpf_duplicado_sem_efeitos(emissao_concorrente, sample_evento, sample_tipo_ingresso,
+                                                       sample_participante):
+    from app.routers import admin
+    with pytest.raises(HTTPException) as exc:
+        await admin.admin_emitir(admin.EmissaoAdminRequest(evento_id=str(sample_evento["_id"]),
+                                                           tipo_ingresso_id=str(sample_tipo_ingresso["_id"]),
+                                                           participante_id=str(sample_participante["_id"])))
+    assert exc.value.status_code == 409
+    assert emissao_concorrente.ingressos_emitidos.docs == []
+    assert emissao_concorrente.efeitos == []
+
+
+@pytest.mark.asyncio
+async def test_web_recusa_cpf_duplicado_sem_efeitos(emissao_concorrente, sample_evento, sample_tipo_ingresso,
+                                                     sample_participante, monkeypatch):
+    from app.routers import evento_web
+
+    async def sessao(request):
+        return sample_evento, "token"
+
+    monkeypatch.setattr(evento_web, "_get_evento_from_cookie", sessao)
+    resp = await evento_web.evento_participante_novo_save(
+        object(), nome=sample_participante["nome"], email=sample_participante["email"],
+        cpf=sample_participante["cpf"], telefone="", empresa="", nacionalidade="",
+        tipo_ingresso_id=str(sample_tipo_ingresso["_id"]),
+    )
+    assert resp.status_code == 409
+    assert "já possui ingresso" in resp.body.decode()
+    assert emissao_concorrente.ingressos_emitidos.docs == []
+    assert emissao_concorrente.efeitos == []
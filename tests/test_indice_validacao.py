@@ -0,0 +1,142 @@
+"""
+Testes do índice em memória usado por `POST /api/portaria/validar`.
+"""
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.routers import portaria
+from app.routers.portaria import ValidacaoRequest
+from app.utils import indice_validacao
+from app.utils.buffer_acessos import descarregar_acessos
+
+
+@pytest.fixture
+def evento_com_ingresso(fake_db, sample_evento, sample_ilha, sample_tipo_ingresso, sample_participante, sample_ingresso):
+    sample_evento["tipos_ingresso"] = [sample_tipo_ingresso]
+    sample_evento["ilhas"] = [sample_ilha]
+    ingresso = dict(sample_ingresso, _id=str(sample_ingresso["_id"]))
+    sample_participante["ingressos"] = [ingresso]
+    fake_db.eventos.docs.append(sample_evento)
+    fake_db.participantes.docs.append(sample_participante)
+    yield str(sample_evento["_id"])
+    indice_validacao.invalidar_evento(str(sample_evento["_id"]))
+
+
+def _sem_leituras(fake_db):
+    async def proibido(*args, **kwargs):
+        raise AssertionError("validação com índice carregado não deve ler o banco")
+    fake_db.participantes.find_one = proibido
+    fake_db.eventos.find_one = proibido
+    fake_db.tipos_ingresso.find_one = proibido
+
+
+class TestIndiceValidacao:
+
+    @pytest.mark.asyncio
+    async def test_validacao_le_apenas_o_status(self, fake_db, mock_get_database, evento_com_ingresso, sample_ilha,
+                                                 sample_participante):
+        await indice_validacao.obter_indice(fake_db, evento_com_ingresso)
+        _sem_leituras(fake_db)
+        consultas = []
+        find = fake_db.participantes.find
+
+        def find_registrado(query=None, *args):
+            consultas.append(query)
+            return find(query)
+        fake_db.participantes.find = find_registrado
+
+        result = await portaria.validar_acesso(
+            ValidacaoRequest(qrcode_hash="qr_hash_abc123", ilha_id=str(sample_ilha["_id"])),
+            evento_id=evento_com_ingresso
+        )
+        assert result.status == "OK"
+        assert result.participante_nome == "João Silva"
+        assert result.tipo_ingresso == "VIP All Access"
+        # uma única leitura, pelo _id do participante
+        assert consultas == [{"_id": {"$in": [sample_participante["_id"]]}}]
+        await descarregar_acessos()
+        assert len(fake_db.validacoes_acesso.docs) == 1
+
+    @pytest.mark.asyncio
+    async def test_cancelamento_em_outro_worker_nega_acesso(self, fake_db, mock_get_database, evento_com_ingresso,
+                                                           sample_ilha, sample_participante):
+        indice = await indice_validacao.obter_indice(fake_db, evento_com_ingresso)
+        # cancelado no banco por outro processo: o índice deste ainda diz "Ativo"
+        sample_participante["ingressos"][0]["status"] = "Cancelado"
+        assert indice.ingressos["qr_hash_abc123"].status == "Ativo"
+
+        with pytest.raises(HTTPException) as exc_info:
+            await portaria.validar_acesso(
+                ValidacaoRequest(qrcode_hash="qr_hash_abc123", ilha_id=str(sample_ilha["_id"])),
+                evento_id=evento_com_ingresso
+            )
+        assert exc_info.value.status_code == 403
+        assert indice.ingressos["qr_hash_abc123"].status == "Cancelado"
+
+    @pytest.mark.asyncio
+    async def test_ilha_sem_permissao_negada_pelo_indice(self, fake_db, mock_get_database, evento_com_ingresso):
+        await indice_validacao.obter_indice(fake_db, evento_com_ingresso)
+        _sem_leituras(fake_db)
+
+        with pytest.raises(HTTPException) as exc_info:
+            await portaria.validar_acesso(
+                ValidacaoRequest(qrcode_hash="qr_hash_abc123", ilha_id=str(ObjectId())),
+                evento_id=evento_com_ingresso
+            )
+        assert exc_info.value.status_code == 403
+        assert "Setor desconhecido" in exc_info.value.detail
+
+    @pytest.mark.asyncio
+    async def test_cancelamento_atualiza_indice(self, fake_db, mock_get_database, evento_com_ingresso, sample_ilha):
+        await indice_validacao.obter_indice(fake_db, evento_com_ingresso)
+        indice_validacao.atualizar_status(evento_com_ingresso, "qr_hash_abc123", "Cancelado")
+        _sem_leituras(fake_db)
+
+        with pytest.raises(HTTPException) as exc_info:
+            await portaria.validar_acesso(
+                ValidacaoRequest(qrcode_hash="qr_hash_abc123", ilha_id=str(sample_ilha["_id"])),
+                evento_id=evento_com_ingresso
+            )
+        assert exc_info.value.status_code == 403
+        assert "cancelado" in exc_info.value.detail.lower()
+
+    @pytest.mark.asyncio
+    async def test_hash_ausente_consulta_banco_e_indexa(self, fake_db, mock_get_database, evento_com_ingresso,
+                                                       sample_ilha, sample_tipo_ingresso):
+        indice = await indice_validacao.obter_indice(fake_db, evento_com_ingresso)
+        # ingresso emitido por outro processo depois da carga do índice
+        fake_db.participantes.docs.append({
+            "_id": ObjectId(),
+            "nome": "Maria Souza",
+            "ingressos": [{
+                "_id": str(ObjectId()),
+                "evento_id": evento_com_ingresso,
+                "tipo_ingresso_id": str(sample_tipo_ingresso["_id"]),
+                "qrcode_hash": "novo_hash",
+                "status": "Ativo",
+            }],
+        })
+        assert "novo_hash" not in indice.ingressos
+
+        result = await portaria.validar_acesso(
+            ValidacaoRequest(qrcode_hash="novo_hash", ilha_id=str(sample_ilha["_id"])),
+            evento_id=evento_com_ingresso
+        )
+        assert result.status == "OK"
+        assert "novo_hash" in indice.ingressos
+
+    @pytest.mark.asyncio
+    async def test_lote_confere_status_de_cancelamento_em_outro_worker(self, fake_db, mock_get_database,
+                                                                      evento_com_ingresso, sample_ilha,
+                                                                      sample_participante):
+        from app.routers.portaria import ValidacaoLoteRequest, ValidacaoLoteItem
+        await indice_validacao.obter_indice(fake_db, evento_com_ingresso)
+        sample_participante["ingressos"][0]["status"] = "Cancelado"
+
+        resposta = await portaria.validar_acesso_lote(
+            ValidacaoLoteRequest(leituras=[ValidacaoLoteItem(qrcode_hash="qr_hash_abc123", ilha_id=str(sample_ilha["_id"]))]),
+            evento_id=evento_com_ingresso
+        )
+        assert resposta["aprovados"] == 0
+        assert "cancelado" in resposta["resultados"][0].mensagem.lower()
@@ -0,0 +1,60 @@
+"""
+Testes da compilação de layouts compartilhada por embed_layout, preencher_layout e o renderizador.
+"""
+import pytest
+
+from app.routers.bilheteria import preencher_layout
+from app.utils import layout_compilado
+from app.utils.layouts import embed_layout
+
+TEMPLATE = {
+    "canvas": {"width": 80, "height": 120, "unit": "mm"},
+    "elements": [
+        {"type": "text", "value": "{NOME} - {CPF}", "x": 5, "y": 10, "size": 12, "bold": True},
+        {"type": "qrcode", "x": 5, "y": 40, "size_mm": 30},
+    ],
+    "groups": [
+        {"id": "g1", "x": 10, "y": 80, "align": "left", "elements": [
+            {"type": "text", "value": "{EVENTO_NOME}", "x": 2, "y": 3},
+        ]},
+    ],
+}
+
+
+@pytest.fixture(autouse=True)
+def compilados_limpos():
+    layout_compilado.limpar_layouts_compilados()
+    yield
+    layout_compilado.limpar_layouts_compilados()
+
+
+class TestLayoutCompilado:
+
+    def test_embed_preenche_valores_e_achata_grupos(self):
+        layout = embed_layout(TEMPLATE, {"nome": "{CPF}", "cpf": "123"}, {}, {"nome": "Congresso"},
+                              {"qrcode_hash": "h1"})
+        valores = [el.get("value") for el in layout["elements"]]
+        # substituição em uma passada: um valor com aparência de placeholder não é reprocessado
+        assert valores == ["{CPF} - 123", "h1", "Congresso"]
+        assert "groups" not in layout
+        agrupado = layout["elements"][2]
+        assert (agrupado["x"], agrupado["y"], agrupado["align"]) == (12.0, 83.0, "left")
+        assert [el["variavel"] for el in layout["elements"]] == [True, True, False]
+        # o template não é alterado
+        assert TEMPLATE["elements"][0]["value"] == "{NOME} - {CPF}"
+
+    def test_layouts_embutidos_compartilham_a_compilacao(self):
+        a = embed_layout(TEMPLATE, {"nome": "Ana"}, {}, {}, {"qrcode_hash": "h1"})
+        b = embed_layout(TEMPLATE, {"nome": "Bruno"}, {}, {}, {"qrcode_hash": "h2"})
+        assert layout_compilado.compilar_layout(a) is layout_compilado.compilar_layout(b)
+        compilado = layout_compilado.compilar_layout(a)
+        assert compilado.elementos[0].fonte.endswith("DejaVuSans-Bold.ttf")
+        assert compilado.geometria(300) is compilado.geometria(300)
+        assert compilado.geometria(300).elementos[1].tamanho_px == 354
+        # template + um layout embutido (os dois de mesma estrutura)
+        assert layout_compilado.metricas_layouts()["faltas"] == 2
+
+    def test_preencher_layout_aceita_valores_com_aspas(self):
+        layout = preencher_layout(TEMPLATE, {"NOME": 'Ana "Aninha"', "qrcode_hash": "h1"})
+        assert layout["elements"][0]["value"] == 'Ana "Aninha" - {CPF}'
+        assert preencher_layout(None, {}) is None
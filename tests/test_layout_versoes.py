@@ -0,0 +1,155 @@
+"""
+Testes dos layouts de ingresso versionados (referência em vez de cópia embutida).
+"""
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+from tests.conftest import FakeCollection
+from app.utils import layout_versoes
+from app.utils.layouts import embed_layout
+
+TEMPLATE = {
+    "canvas": {"width": 80, "height": 120, "unit": "mm"},
+    "elements": [
+        {"type": "text", "value": "{EVENTO_NOME}", "x": 5, "y": 5},
+        {"type": "text", "value": "{NOME}", "x": 5, "y": 10},
+        {"type": "qrcode", "x": 5, "y": 40, "size_mm": 30},
+    ],
+}
+
+NOVO_TEMPLATE = {
+    **TEMPLATE,
+    "elements": TEMPLATE["elements"] + [{"type": "text", "value": "{TIPO_INGRESSO}", "x": 5, "y": 80}],
+}
+
+
+@pytest.fixture
+def db_layouts(fake_db):
+    layout_versoes._versoes.limpar()
+    evento_id = ObjectId()
+    fake_db.eventos = FakeCollection([{"_id": evento_id, "nome": "Congresso", "layout_ingresso": TEMPLATE}])
+    fake_db.layouts_ingresso = FakeCollection()
+    fake_db.participantes = FakeCollection()
+    fake_db.tipos_ingresso = FakeCollection()
+    fake_db.evento_id = str(evento_id)
+    yield fake_db
+    layout_versoes._versoes.limpar()
+
+
+def _ingresso(evento_id, qrcode_hash, **extra):
+    return {"_id": str(ObjectId()), "evento_id": evento_id, "tipo_ingresso_id": str(ObjectId()),
+            "qrcode_hash": qrcode_hash, "data_emissao": datetime.now(timezone.utc), **extra}
+
+
+def _valores(layout):
+    return [el.get("value") for el in layout["elements"]]
+
+
+class TestLayoutVersoes:
+
+    @pytest.mark.asyncio
+    async def test_publicar_grava_so_o_evento_e_deduplica_versoes(self, db_layouts):
+        evento_id = db_layouts.evento_id
+        db_layouts.participantes.docs.append({"_id": ObjectId(), "nome": "Ana", "ingressos": [
+            _ingresso(evento_id, "h1", campos_layout={"NOME": "Ana"}),
+        ]})
+
+        assert await layout_versoes.publicar_layout(db_layouts, evento_id, NOVO_TEMPLATE)
+        assert await layout_versoes.publicar_layout(db_layouts, evento_id, NOVO_TEMPLATE)
+        assert not await layout_versoes.publicar_layout(db_layouts, str(ObjectId()), NOVO_TEMPLATE)
+
+        evento = db_layouts.eventos.docs[0]
+        assert evento["layout_ingresso"] == NOVO_TEMPLATE
+        assert evento["layout_versao"] == layout_versoes.id_versao(evento_id, NOVO_TEMPLATE)
+        assert len(db_layouts.layouts_ingresso.docs) == 1
+        # o ingresso não é reescrito
+        assert set(db_layouts.participantes.docs[0]["ingressos"][0]) == {
+            "_id", "evento_id", "tipo_ingresso_id", "qrcode_hash", "data_emissao", "campos_layout"}
+
+    @pytest.mark.asyncio
+    async def test_ingresso_segue_versao_vigente_e_congelado_mantem_a_sua(self, db_layouts):
+        evento_id = db_layouts.evento_id
+        evento = db_layouts.eventos.docs[0]
+        versao_antiga = await layout_versoes.versao_atual(db_layouts, evento)
+        seguindo = _ingresso(evento_id, "h1", campos_layout={"NOME": "Ana", "qrcode_hash": "h1"})
+        congelado = _ingresso(evento_id, "h2", campos_layout={"NOME": "Bruno", "qrcode_hash": "h2"},
+                              layout_versao=versao_antiga)
+
+        await layout_versoes.publicar_layout(db_layouts, evento_id, NOVO_TEMPLATE)
+        evento = await db_layouts.eventos.find_one({"_id": ObjectId(evento_id)})
+
+        atual = await layout_versoes.layout_do_ingresso(db_layouts, evento, seguindo)
+        antigo = await layout_versoes.layout_do_ingresso(db_layouts, evento, congelado)
+        assert _valores(atual) == ["Congresso", "Ana", "h1", ""]
+        assert _valores(antigo) == ["Congresso", "Bruno", "h2"]
+        # mesmo resultado que a antiga cópia embutida
+        assert atual == embed_layout(NOVO_TEMPLATE, {"nome": "Ana"}, {}, evento, {"qrcode_hash": "h1"})
+
+    @pytest.mark.asyncio
+    async def test_layout_embutido_legado_ainda_atendido(self, db_layouts):
+        evento = db_layouts.eventos.docs[0]
+        embutido = embed_layout(TEMPLATE, {"nome": "Ana"}, {}, evento, {"qrcode_hash": "h1"})
+        ingresso = _ingresso(db_layouts.evento_id, "h1", layout_ingresso={**embutido, "groups": []})
+        assert await layout_versoes.layout_do_ingresso(db_layouts, evento, ingresso) == embutido
+
+    @pytest.mark.asyncio
+    async def test_migracao_troca_copias_por_referencias(self, db_layouts):
+        evento_id = db_layouts.evento_id
+        evento = db_layouts.eventos.docs[0]
+        antigo = {**TEMPLATE, "elements": TEMPLATE["elements"][1:]}
+        ingressos = []
+        for nome, layout in (("Ana", TEMPLATE), ("Bruno", antigo), ("Carla", antigo)):
+            participante = {"_id": ObjectId(), "nome": nome}
+            ingresso = _ingresso(evento_id, f"h-{nome}")
+            ingresso["layout_ingresso"] = embed_layout(layout, participante, {}, evento, ingresso)
+            participante["ingressos"] = [ingresso]
+            db_layouts.participantes.docs.append(participante)
+            ingressos.append((participante, dict(ingresso)))
+
+        resultado = await layout_versoes.migrar_layouts_evento(db_layouts, evento_id)
+        assert resultado == {"seguem_atual": 1, "congelados": 2}
+        # versão vigente + uma única versão congelada para os dois ingressos antigos
+        assert len(db_layouts.layouts_ingresso.docs) == 2
+
+        evento = db_layouts.eventos.docs[0]
+        for participante, original in ingressos:
+            migrado = participante["ingressos"][0]
+            assert "layout_ingresso" not in migrado
+            layout = await layout_versoes.layout_do_ingresso(db_layouts, evento, migrado)
+            assert _valores(layout) == _valores(original["layout_ingresso"])
+
+        # segunda execução não encontra mais cópias embutidas
+        assert await layout_versoes.migrar_layouts_evento(db_layouts, evento_id) == {
+            "seguem_atual": 0, "congelados": 0}
+
+    @pytest.mark.asyncio
+    async def test_migracao_nao_transforma_logo_em_slot(self, db_layouts):
+        evento_id = db_layouts.evento_id
+        evento = db_layouts.eventos.docs[0]
+        antigo = {**TEMPLATE, "elements": TEMPLATE["elements"][1:] + [
+            {"type": "logo", "value": "logo.png", "x": 40, "y": 5, "size_mm": 20},
+        ]}
+        participante = {"_id": ObjectId(), "nome": "Ana"}
+        ingresso = _ingresso(evento_id, "h-logo")
+        ingresso["layout_ingresso"] = embed_layout(antigo, participante, {}, evento, ingresso)
+        participante["ingressos"] = [ingresso]
+        db_layouts.participantes.docs.append(participante)
+
+        assert await layout_versoes.migrar_layouts_evento(db_layouts, evento_id) == {
+            "seguem_atual": 0, "congelados": 1}
+
+        migrado = participante["ingressos"][0]
+        versao = next(d for d in db_layouts.layouts_ingresso.docs if d["_id"] == migrado["layout_versao"])
+        logo = versao["layout"]["elements"][-1]
+        assert logo["value"] == "logo.png"
+        assert "_2" not in migrado["campos_layout"]
+        assert {k for k in migrado["campos_layout"] if k.startswith("_")} == {"_0", "_1"}
+
+    def test_normalizacao_do_ingresso_preserva_campos_layout(self):
+        from app.utils.validations import normalize_participante_data
+        campos = {"NOME": "Ana", "TELEFONE": "", "EMPRESA": ""}
+        ingresso = normalize_participante_data(_ingresso("e1", "h-norm", campos_layout=dict(campos)))
+        # nada de campos opcionais de participante (None) dentro do mapa de strings
+        assert ingresso["campos_layout"] == campos
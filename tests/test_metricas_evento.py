@@ -0,0 +1,123 @@
+"""
+Testes das métricas de ingressos por evento (`evento_metricas`) mantidas com `$inc`.
+"""
+import json
+
+import pytest
+from bson import ObjectId
+
+from app.routers import admin, evento_web
+from app.utils import metricas_evento
+from tests.conftest import FakeCollection
+
+
+class ContaFind(FakeCollection):
+    def __init__(self, docs=None):
+        super().__init__(docs)
+        self.finds = 0
+
+    def find(self, query=None, sort=None):
+        self.finds += 1
+        return super().find(query)
+
+
+@pytest.fixture
+def db_metricas(fake_db):
+    evento_id = ObjectId()
+    vip, pista = ObjectId(), ObjectId()
+    fake_db.eventos.docs.append({
+        "_id": evento_id, "nome": "Show",
+        "ilhas": [{"_id": "palco", "nome_setor": "Palco", "capacidade_maxima": 10}],
+        "tipos_ingresso": [
+            {"_id": vip, "descricao": "VIP", "valor": 100, "permissoes": ["palco"]},
+            {"_id": pista, "descricao": "Pista", "valor": 50, "permissoes": []},
+        ],
+    })
+    fake_db.participantes = ContaFind([
+        {"_id": ObjectId(), "nome": "Ana", "ingressos": [
+            {"_id": "i1", "evento_id": str(evento_id), "tipo_ingresso_id": str(vip), "status": "Ativo", "impresso": True},
+        ]},
+        {"_id": ObjectId(), "nome": "Bia", "ingressos": [
+            {"_id": "i2", "evento_id": str(evento_id), "tipo_ingresso_id": str(pista), "status": "Ativo"},
+            {"_id": "i3", "evento_id": str(evento_id), "tipo_ingresso_id": str(pista), "status": "Cancelado"},
+        ]},
+    ])
+    fake_db.evento_metricas = FakeCollection()
+    fake_db.evento = fake_db.eventos.docs[0]
+    fake_db.evento_id, fake_db.vip, fake_db.pista = str(evento_id), str(vip), str(pista)
+    return fake_db
+
+
+def _sem_data(doc):
+    return {k: v for k, v in doc.items() if k not in ("_id", "evento_id", "atualizado_em")}
+
+
+class TestMetricasEvento:
+
+    @pytest.mark.asyncio
+    async def test_primeira_leitura_calcula_e_grava(self, db_metricas):
+        metricas = await metricas_evento.obter_metricas(db_metricas, db_metricas.evento_id)
+        assert (metricas["total"], metricas["ativos"], metricas["cancelados"], metricas["impressos"]) == (3, 2, 1, 1)
+        assert metricas["tipos"][db_metricas.pista] == {"total": 2, "ativos": 1, "cancelados": 1}
+        assert metricas["ilhas"]["palco"] == {"total": 1, "ativos": 1}
+        assert len(db_metricas.evento_metricas.docs) == 1
+
+        # leituras seguintes: só o documento, sem percorrer os participantes
+        finds = db_metricas.participantes.finds
+        await metricas_evento.obter_metricas(db_metricas, db_metricas.evento_id)
+        assert db_metricas.participantes.finds == finds
+
+    @pytest.mark.asyncio
+    async def test_incrementos_acompanham_a_reconstrucao(self, db_metricas):
+        evento_id = db_metricas.evento_id
+        await metricas_evento.obter_metricas(db_metricas, evento_id)
+
+        novo = {"_id": "i4", "evento_id": evento_id, "tipo_ingresso_id": db_metricas.vip, "status": "Ativo",
+                "impresso": False}
+        db_metricas.participantes.docs[1]["ingressos"].append(novo)
+        await metricas_evento.registrar_emissoes(db_metricas, evento_id, [novo])
+
+        novo["impresso"] = True
+        await metricas_evento.registrar_impressao(db_metricas, evento_id, novo, True)
+
+        cancelado = db_metricas.participantes.docs[0]["ingressos"][0]
+        cancelado["status"] = "Cancelado"
+        await metricas_evento.registrar_cancelamento(db_metricas, evento_id, cancelado)
+
+        db_metricas.validacoes_acesso = FakeCollection([
+            {"evento_id": evento_id, "ilha_id": "palco", "status": "OK"},
+        ])
+        await metricas_evento.registrar_validacoes(db_metricas, db_metricas.validacoes_acesso.docs)
+
+        incremental = _sem_data(db_metricas.evento_metricas.docs[0])
+        recalculado = await metricas_evento.calcular_metricas(db_metricas, evento_id)
+        # contadores zerados pelos incrementos não aparecem no cálculo do zero
+        def _limpo(d):
+            return {k: _limpo(v) if isinstance(v, dict) else v for k, v in d.items() if v != 0}
+        assert _limpo(incremental) == _limpo(recalculado)
+        assert incremental["validacoes"] == 1 and incremental["ilhas"]["palco"]["validacoes"] == 1
+
+    @pytest.mark.asyncio
+    async def test_painel_e_relatorio_leem_o_documento(self, db_metricas, monkeypatch):
+        import app.config.database as database
+        monkeypatch.setattr(admin, "get_database", lambda: db_metricas)
+        monkeypatch.setattr(database, "get_database", lambda: db_metricas)
+
+        async def sessao(request):
+            return db_metricas.evento, db_metricas.evento_id
+        monkeypatch.setattr(evento_web, "_get_evento_from_cookie", sessao)
+
+        relatorio = await admin.relatorio_vendas(db_metricas.evento_id)
+        assert relatorio["total_ingressos"] == 3
+        vip = next(t for t in relatorio["tipos"] if t["tipo"] == "VIP")
+        assert (vip["quantidade"], vip["ativos"], vip["receita_total"]) == (1, 1, 100)
+
+        stats = json.loads((await evento_web.evento_api_ingressos_stats(None)).body)
+        assert stats == {"total": 3, "impressos": 1}
+
+        corpo = json.loads((await evento_web.evento_api_ingresso_metrics(None)).body)
+        pista = next(m for m in corpo["tipo_metrics"] if m["tipo_nome"] == "Pista")
+        assert (pista["total"], pista["printed"], pista["cancelados"]) == (2, 0, 1)
+        assert corpo["ilha_metrics"][0]["vendidos"] == 1
+        # uma única passagem pelos participantes (a que criou o documento)
+        assert db_metricas.participantes.finds == 1
@@ -0,0 +1,83 @@
+"""
+Testes da paginação por cursor (keyset) das listagens de participantes.
+"""
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.routers import bilheteria
+from app.utils import paginacao
+from app.utils.busca_participantes import campos_busca
+from tests.conftest import FakeCollection, FakeCursor
+
+EVENTO = "evt1"
+NOMES = ["Zé", "Ana", "Bruno", "ana", "Álvaro", "Carla", "Bia", "Ana"]
+
+
+class ContaContagens(FakeCollection):
+    """FakeCollection que conta `count_documents` e devolve cópias, como documentos vindos do banco."""
+
+    def __init__(self, docs=None):
+        super().__init__(docs)
+        self.contagens = 0
+
+    def find(self, query=None, sort=None):
+        return FakeCursor([dict(d) for d in self.docs if self._match(d, query or {})])
+
+    async def count_documents(self, query=None):
+        self.contagens += 1
+        return await super().count_documents(query)
+
+
+@pytest.fixture
+def db_paginacao(fake_db, monkeypatch):
+    docs = []
+    for nome in NOMES:
+        docs.append({"_id": ObjectId(), "nome": nome, "email": f"{ObjectId()}@x.com", "cpf": "52998224725",
+                     **campos_busca(nome),
+                     "ingressos": [{"_id": str(ObjectId()), "evento_id": EVENTO, "tipo_ingresso_id": "t1",
+                                    "status": "Ativo", "qrcode_hash": str(ObjectId()),
+                                    "data_emissao": datetime.now(timezone.utc)}]})
+    fake_db.participantes = ContaContagens(docs)
+    monkeypatch.setattr(bilheteria, "get_database", lambda: fake_db)
+    return fake_db
+
+
+def test_cursor_opaco_ida_e_volta():
+    oid = ObjectId()
+    cursor = paginacao.codificar_cursor({"nome_busca": "joao da silva", "_id": oid})
+    assert "joao" not in cursor
+    assert paginacao.decodificar_cursor(cursor) == ("joao da silva", oid)
+    with pytest.raises(ValueError):
+        paginacao.decodificar_cursor("nao-e-um-cursor")
+
+
+@pytest.mark.asyncio
+async def test_listagem_percorre_todas_as_paginas_por_cursor(db_paginacao):
+    pagina = await bilheteria.listar_participantes(per_page=3, evento_id=EVENTO)
+    vistos = [p.id for p in pagina.participantes]
+    while pagina.next_cursor:
+        pagina = await bilheteria.listar_participantes(per_page=3, cursor=pagina.next_cursor, evento_id=EVENTO)
+        vistos.extend(p.id for p in pagina.participantes)
+
+    esperado = sorted(db_paginacao.participantes.docs, key=lambda d: (d["nome_busca"], d["_id"]))
+    assert vistos == [str(d["_id"]) for d in esperado]
+    assert pagina.total_count == len(NOMES)
+    # uma única contagem para todas as páginas
+    assert db_paginacao.participantes.contagens == 1
+
+
+@pytest.mark.asyncio
+async def test_page_continua_funcionando(db_paginacao):
+    pagina = await bilheteria.listar_participantes(page=2, per_page=3, evento_id=EVENTO)
+    assert [p.nome for p in pagina.participantes] == ["Ana", "Bia", "Bruno"]
+    assert pagina.total_pages == 3
+
+
+@pytest.mark.asyncio
+async def test_cursor_invalido(db_paginacao):
+    with pytest.raises(HTTPException) as exc:
+        await bilheteria.listar_participantes(cursor="lixo", evento_id=EVENTO)
+    assert exc.value.status_code == 400
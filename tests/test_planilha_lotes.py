@@ -0,0 +1,260 @@
+"""
+Testes da importação de planilha em lotes (consultas agrupadas e escritas em lote).
+"""
+from collections import Counter
+
+import pytest
+from bson import ObjectId
+
+from tests.conftest import FakeCollection
+from app.utils import planilha
+from app.utils.planilha import process_planilha
+
+
+def _cpf(base: int) -> str:
+    """CPF válido a partir de 9 dígitos."""
+    digitos = [int(c) for c in f"{base:09d}"]
+    for tamanho in (9, 10):
+        soma = sum(d * (tamanho + 1 - i) for i, d in enumerate(digitos[:tamanho]))
+        digitos.append(0 if soma % 11 < 2 else 11 - soma % 11)
+    return "".join(map(str, digitos))
+
+
+CPFS_VALIDOS = [_cpf(123456780 + i) for i in range(10)]
+
+
+class LoteCollection(FakeCollection):
+    """FakeCollection com contagem de chamadas por operação."""
+
+    def __init__(self, docs=None, chamadas=None):
+        super().__init__(docs)
+        self.chamadas = chamadas if chamadas is not None else Counter()
+
+    async def find_one(self, query=None, sort=None):
+        self.chamadas["find_one"] += 1
+        return await super().find_one(query, sort)
+
+    def find(self, query=None, sort=None):
+        self.chamadas["find"] += 1
+        if "cpf" in (query or {}):
+            self.chamadas["find_cpfs"] += 1
+        return super().find(query)
+
+    async def insert_one(self, doc):
+        self.chamadas["insert_one"] += 1
+        return await super().insert_one(doc)
+
+    async def insert_many(self, docs, ordered=True):
+        self.chamadas["insert_many"] += 1
+        return await super().insert_many(docs, ordered)
+
+    async def update_one(self, query, update, upsert=False):
+        self.chamadas["update_one"] += 1
+        return await super().update_one(query, update, upsert)
+
+    async def bulk_write(self, operacoes, ordered=True):
+        self.chamadas["bulk_write"] += 1
+        return await super().bulk_write(operacoes, ordered)
+
+
+@pytest.fixture
+def db_planilha(fake_db):
+    chamadas = Counter()
+    evento_id = ObjectId()
+    fake_db.eventos = LoteCollection([{"_id": evento_id, "nome": "Congresso"}], chamadas)
+    fake_db.tipos_ingresso = LoteCollection([
+        {"_id": ObjectId(), "evento_id": str(evento_id), "numero": 1, "padrao": True, "descricao": "Geral"},
+        {"_id": ObjectId(), "evento_id": str(evento_id), "numero": 2, "descricao": "VIP"},
+    ], chamadas)
+    fake_db.participantes = LoteCollection([
+        {"_id": ObjectId(), "nome": "Já Inscrito", "cpf": CPFS_VALIDOS[0],
+         "ingressos": [{"evento_id": str(evento_id)}]},
+        {"_id": ObjectId(), "nome": "Outro Evento", "cpf": CPFS_VALIDOS[1], "ingressos": []},
+    ], chamadas)
+    fake_db.ingressos_emitidos = LoteCollection([], chamadas)
+    fake_db.planilha_importacoes = LoteCollection([{"_id": ObjectId(), "status": "processing"}])
+    fake_db.planilha_importacoes_erros = LoteCollection()
+    fake_db.chamadas = chamadas
+    fake_db.evento_id = str(evento_id)
+    return fake_db
+
+
+def _csv(linhas):
+    return ("Nome,Email,CPF,Tipo Ingresso\n" + "".join(f"{l}\n" for l in linhas)).encode("utf-8")
+
+
+class TestPlanilhaLotes:
+
+    @pytest.mark.asyncio
+    async def test_importacao_em_lotes_com_poucas_idas_ao_banco(self, db_planilha, monkeypatch):
+        monkeypatch.setattr(planilha, "TAMANHO_LOTE", 4)
+        linhas = [f"Pessoa {i},p{i}@ex.com,{cpf},{2 if i % 2 else ''}" for i, cpf in enumerate(CPFS_VALIDOS)]
+        linhas.insert(3, "Invalido,inv@ex.com,111.111.111-11,1")
+        linhas.append(f"Repetido,rep@ex.com,{CPFS_VALIDOS[5]},9")
+        import_id = str(db_planilha.planilha_importacoes.docs[0]["_id"])
+
+        report = await process_planilha(_csv(linhas), "p.csv", db_planilha.evento_id, db_planilha, import_id=import_id)
+
+        assert report["total"] == 12
+        assert report["created_participants"] == 8
+        assert report["reused_participants"] == 1
+        assert report["created_ingressos"] == 9
+        # formato e ordem do relatório por linha preservados
+        assert [(e["line"], e["errors"]) for e in report["errors"]] == [
+            (2, ["CPF já inscrito neste evento"]),
+            (5, ["CPF inválido: Invalid CPF"]),
+            (13, ["Tipo de ingresso inválido para o evento", "CPF duplicado na planilha"]),
+        ]
+        assert report["errors"][1]["row"]["Nome"] == "Invalido"
+
+        chamadas = db_planilha.chamadas
+        # 3 lotes: uma consulta de CPFs, um insert_many por coleção e um bulk_write por lote
+        assert chamadas["find_cpfs"] == 3
+        assert chamadas["insert_many"] == 2 * 3
+        assert chamadas["bulk_write"] == 3
+        assert chamadas["insert_one"] == 0
+        # progresso gravado uma vez por lote, junto com o checkpoint
+        assert db_planilha.planilha_importacoes.chamadas["update_one"] == 3
+        assert db_planilha.planilha_importacoes.docs[0]["progress"]["processed"] == 12
+        # checkpoint só com linha e contadores; os erros vão para a coleção, um insert por lote com erros
+        importacao = db_planilha.planilha_importacoes.docs[0]
+        assert "errors" not in importacao["checkpoint"]
+        assert importacao["checkpoint"]["linha"] == 13
+        erros = db_planilha.planilha_importacoes_erros
+        assert erros.chamadas["insert_many"] == 2
+        assert [(e["import_id"], e["line"]) for e in erros.docs] == [(import_id, 2), (import_id, 5), (import_id, 13)]
+
+        reutilizado = db_planilha.participantes.docs[1]
+        assert len(reutilizado["ingressos"]) == 1
+        hashes = {ing["qrcode_hash"] for p in db_planilha.participantes.docs for ing in p.get("ingressos", [])
+                  if "qrcode_hash" in ing}
+        assert len(hashes) == 9
+        vip = db_planilha.tipos_ingresso.docs[1]
+        tipos = Counter(ing["tipo_ingresso_id"] for ing in db_planilha.ingressos_emitidos.docs)
+        assert tipos[str(vip["_id"])] == 5
+
+    @pytest.mark.asyncio
+    async def test_validate_only_nao_grava(self, db_planilha):
+        linhas = [f"Pessoa {i},p{i}@ex.com,{cpf}," for i, cpf in enumerate(CPFS_VALIDOS[:3])]
+        report = await process_planilha(_csv(linhas), "p.csv", db_planilha.evento_id, db_planilha, validate_only=True)
+        assert report["created_ingressos"] == 0
+        assert [e["line"] for e in report["errors"]] == [2]
+        assert db_planilha.chamadas["insert_many"] == db_planilha.chamadas["bulk_write"] == 0
+
+    @pytest.mark.asyncio
+    async def test_evento_com_qr_assinado_recebe_codigos_assinados(self, db_planilha):
+        from app.utils import qr_assinado
+        evento = db_planilha.eventos.docs[0]
+        evento.update({"qr_assinado": True, "qr_segredo": qr_assinado.gerar_segredo()})
+        linhas = [f"Pessoa {i},p{i}@ex.com,{cpf},2" for i, cpf in enumerate(CPFS_VALIDOS[2:4])]
+
+        report = await process_planilha(_csv(linhas), "p.csv", db_planilha.evento_id, db_planilha)
+
+        assert report["created_ingressos"] == 2
+        for ingresso in db_planilha.ingressos_emitidos.docs:
+            codigo = ingresso["qrcode_hash"]
+            assert qr_assinado.verificar(codigo, db_planilha.evento_id, evento["qr_segredo"]) is None
+            info = qr_assinado.decodificar(codigo)
+            assert info["ingresso_id"] == str(ingresso["_id"])
+            assert info["tipo_numero"] == 2
+
+    @pytest.mark.asyncio
+    async def test_leitura_em_streaming_de_arquivo_aberto(self, db_planilha, tmp_path):
+        from openpyxl import Workbook
+        caminho = tmp_path / "lista.xlsx"
+        wb = Workbook()
+        wb.active.append(["Nome", "Email", "CPF"])
+        for i, cpf in enumerate(CPFS_VALIDOS[2:5]):
+            wb.active.append([f"Pessoa {i}", f"p{i}@ex.com", int(cpf)])
+        wb.save(caminho)
+
+        with open(caminho, "rb") as fh:
+            leitura = planilha.ler_planilha(fh, "lista.xlsx")
+            assert leitura.total_estimado == 3
+            primeira = next(leitura.linhas())
+            assert primeira["Nome"] == "Pessoa 0"
+            leitura.fechar()
+            assert not fh.closed
+
+        csv_path = tmp_path / "lista.csv"
+        csv_path.write_bytes(_csv([f"Pessoa {i},p{i}@ex.com,{cpf}," for i, cpf in enumerate(CPFS_VALIDOS[2:5])]))
+        with open(csv_path, "rb") as fh:
+            report = await process_planilha(fh, "lista.csv", db_planilha.evento_id, db_planilha)
+            assert not fh.closed
+        assert report["created_ingressos"] == 3
+
+    def test_validar_cpfs_equivale_a_validate_cpf(self):
+        from app.utils.validations import validar_cpfs, validate_cpf
+        valores = CPFS_VALIDOS[:3] + [
+            "529.982.247-25", " 529 982 247 25 ", "111.111.111-11", "52998224724", "52998224735",
+            "5299822472", "529982247250", "52998224725.0", "abc", "",
+        ]
+        esperado = []
+        for valor in valores:
+            try:
+                esperado.append((validate_cpf(valor), None))
+            except ValueError as e:
+                esperado.append((None, str(e)))
+        assert validar_cpfs(valores) == esperado
+
+    @pytest.mark.asyncio
+    async def test_retomada_le_erros_gravados_ate_o_checkpoint(self, db_planilha, monkeypatch):
+        monkeypatch.setattr(planilha, "TAMANHO_LOTE", 2)
+        import_id = str(db_planilha.planilha_importacoes.docs[0]["_id"])
+        linhas = [f"Pessoa {i},p{i}@ex.com,{cpf}," for i, cpf in enumerate(CPFS_VALIDOS[2:5], start=2)]
+        linhas.insert(1, "Invalido,inv@ex.com,111.111.111-11,")
+        # linhas 2 e 3 gravadas antes da queda; o erro da linha 5 é de um lote sem checkpoint
+        db_planilha.planilha_importacoes_erros.docs.extend([
+            {"_id": ObjectId(), "import_id": import_id, "line": 3, "errors": ["CPF inválido: Invalid CPF"],
+             "row": {"Nome": "Invalido"}},
+            {"_id": ObjectId(), "import_id": import_id, "line": 5, "errors": ["perdido"], "row": {}},
+        ])
+        checkpoint = {"linha": 3, "total": 2, "created_participants": 1, "reused_participants": 0,
+                      "created_ingressos": 1}
+
+        report = await process_planilha(_csv(linhas), "p.csv", db_planilha.evento_id, db_planilha,
+                                        import_id=import_id, checkpoint=checkpoint)
+
+        assert report["total"] == 4
+        assert report["created_ingressos"] == 3
+        assert [(e["line"], e["errors"]) for e in report["errors"]] == [(3, ["CPF inválido: Invalid CPF"])]
+        assert [e["line"] for e in db_planilha.planilha_importacoes_erros.docs] == [3]
+
+    @pytest.mark.asyncio
+    async def test_lote_refeito_sem_checkpoint_reconhece_o_que_ja_foi_gravado(self, db_planilha):
+        # sem CPF obrigatório: a linha sem CPF depende só do `_id` do participante
+        db_planilha.eventos.docs[0]["campos_obrigatorios_planilha"] = ["Nome", "Email"]
+        import_id = str(db_planilha.planilha_importacoes.docs[0]["_id"])
+        linhas = [f"Nova,nova@ex.com,{CPFS_VALIDOS[2]},", f"Outro Evento,outro@ex.com,{CPFS_VALIDOS[1]},",
+                  "Sem CPF,semcpf@ex.com,,"]
+        primeira = await process_planilha(_csv(linhas), "p.csv", db_planilha.evento_id, db_planilha,
+                                          import_id=import_id)
+        participantes = len(db_planilha.participantes.docs)
+        legados = len(db_planilha.ingressos_emitidos.docs)
+
+        # queda depois das escritas e antes do checkpoint: o lote é refeito do início
+        refeita = await process_planilha(_csv(linhas), "p.csv", db_planilha.evento_id, db_planilha,
+                                         import_id=import_id)
+
+        assert refeita["errors"] == primeira["errors"] == []
+        assert (refeita["created_participants"], refeita["reused_participants"], refeita["created_ingressos"]) == (
+            primeira["created_participants"], primeira["reused_participants"], primeira["created_ingressos"]) == (
+            2, 1, 3)
+        assert len(db_planilha.participantes.docs) == participantes
+        assert len(db_planilha.ingressos_emitidos.docs) == legados == 3
+        for doc in db_planilha.participantes.docs[1:]:
+            assert len([i for i in doc.get("ingressos", []) if i["evento_id"] == db_planilha.evento_id]) == 1
+
+    @pytest.mark.asyncio
+    async def test_ingressos_so_entram_no_indice_depois_do_push(self, db_planilha, monkeypatch):
+        registrados = []
+        monkeypatch.setattr(planilha, "registrar_ingresso", lambda *args: registrados.append(args))
+
+        async def falha(operacoes, ordered=True):
+            raise RuntimeError("timeout")
+
+        db_planilha.participantes.bulk_write = falha
+        with pytest.raises(RuntimeError):
+            await process_planilha(_csv([f"Nova,nova@ex.com,{CPFS_VALIDOS[2]},"]), "p.csv",
+                                   db_planilha.evento_id, db_planilha)
+        assert registrados == []
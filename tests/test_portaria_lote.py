@@ -0,0 +1,81 @@
+"""
+Testes de `POST /api/portaria/validar/lote`.
+"""
+import pytest
+from datetime import datetime, timezone
+from bson import ObjectId
+
+from app.routers import portaria
+from app.routers.portaria import ValidacaoLoteRequest, ValidacaoLoteItem
+from app.utils import indice_validacao
+from app.utils.buffer_acessos import descarregar_acessos
+
+
+@pytest.fixture
+def evento_lote(fake_db, sample_evento, sample_ilha, sample_tipo_ingresso):
+    sample_evento["tipos_ingresso"] = [sample_tipo_ingresso]
+    sample_evento["ilhas"] = [sample_ilha]
+    fake_db.eventos.docs.append(sample_evento)
+    evento_id = str(sample_evento["_id"])
+    for i, status in enumerate(["Ativo", "Ativo", "Cancelado"]):
+        fake_db.participantes.docs.append({
+            "_id": ObjectId(),
+            "nome": f"Participante {i}",
+            "ingressos": [{
+                "_id": str(ObjectId()),
+                "evento_id": evento_id,
+                "tipo_ingresso_id": str(sample_tipo_ingresso["_id"]),
+                "qrcode_hash": f"hash{i}",
+                "status": status,
+            }],
+        })
+    fake_db.participantes.docs.append({
+        "_id": ObjectId(),
+        "nome": "Outro Evento",
+        "ingressos": [{"_id": str(ObjectId()), "evento_id": str(ObjectId()), "qrcode_hash": "alheio", "status": "Ativo"}],
+    })
+    yield evento_id
+    indice_validacao.invalidar_evento(evento_id)
+
+
+class TestValidacaoLote:
+
+    @pytest.mark.asyncio
+    async def test_resultados_em_ordem(self, fake_db, mock_get_database, evento_lote, sample_ilha):
+        ilha = str(sample_ilha["_id"])
+        lidos_em = datetime(2024, 6, 15, 9, 30, tzinfo=timezone.utc)
+        lote = ValidacaoLoteRequest(leituras=[
+            ValidacaoLoteItem(qrcode_hash="hash0", ilha_id=ilha, scanned_at=lidos_em),
+            ValidacaoLoteItem(qrcode_hash="inexistente", ilha_id=ilha),
+            ValidacaoLoteItem(qrcode_hash="hash2", ilha_id=ilha),
+            ValidacaoLoteItem(qrcode_hash="alheio", ilha_id=ilha),
+            ValidacaoLoteItem(qrcode_hash="hash1", ilha_id=str(ObjectId())),
+            ValidacaoLoteItem(qrcode_hash="hash1", ilha_id=ilha),
+        ])
+
+        result = await portaria.validar_acesso_lote(lote, evento_id=evento_lote)
+
+        assert [r.status for r in result["resultados"]] == ["OK", "NEGADO", "NEGADO", "NEGADO", "NEGADO", "OK"]
+        assert result["resultados"][1].mensagem == "QR Code inválido"
+        assert "cancelado" in result["resultados"][2].mensagem.lower()
+        assert result["resultados"][3].mensagem == "Ingresso não pertence a este evento"
+        assert result["resultados"][0].participante_nome == "Participante 0"
+        assert result["aprovados"] == 2 and result["negados"] == 4
+        await descarregar_acessos()
+        assert len(fake_db.validacoes_acesso.docs) == 2
+        assert fake_db.validacoes_acesso.docs[0]["data_validacao"] == lidos_em
+
+    @pytest.mark.asyncio
+    async def test_leitura_duplicada_no_lote(self, fake_db, mock_get_database, evento_lote, sample_ilha):
+        ilha = str(sample_ilha["_id"])
+        lote = ValidacaoLoteRequest(leituras=[
+            ValidacaoLoteItem(qrcode_hash="hash0", ilha_id=ilha),
+            ValidacaoLoteItem(qrcode_hash="hash0", ilha_id=ilha),
+        ])
+
+        result = await portaria.validar_acesso_lote(lote, evento_id=evento_lote)
+
+        assert [r.status for r in result["resultados"]] == ["OK", "NEGADO"]
+        assert result["resultados"][1].mensagem == "Leitura duplicada no lote"
+        await descarregar_acessos()
+        assert len(fake_db.validacoes_acesso.docs) == 1
@@ -0,0 +1,69 @@
+"""
+Testes dos QR codes assinados com HMAC por evento.
+"""
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.config.auth import generate_qrcode_hash
+from app.routers import portaria
+from app.routers.portaria import ValidacaoRequest
+from app.utils import qr_assinado, indice_validacao
+
+
+SEGREDO = qr_assinado.gerar_segredo()
+
+
+class TestQrAssinado:
+
+    def test_codigo_curto_e_verificavel(self):
+        evento_id, ingresso_id = str(ObjectId()), str(ObjectId())
+        codigo = qr_assinado.gerar_qrcode_assinado(SEGREDO, evento_id, ingresso_id, 3)
+
+        assert len(codigo) == 64
+        assert codigo == codigo.upper()
+        info = qr_assinado.decodificar(codigo)
+        assert (info["evento_id"], info["ingresso_id"], info["tipo_numero"]) == (evento_id, ingresso_id, 3)
+        assert qr_assinado.verificar(codigo, evento_id, SEGREDO) is None
+
+    def test_recusa_codigo_adulterado_ou_de_outro_evento(self):
+        evento_id = str(ObjectId())
+        codigo = qr_assinado.gerar_qrcode_assinado(SEGREDO, evento_id, str(ObjectId()), 1)
+        adulterado = codigo[:-2] + ("AA" if codigo[-2:] != "AA" else "BB")
+
+        assert qr_assinado.verificar(adulterado, evento_id, SEGREDO) == "QR Code inválido"
+        assert qr_assinado.verificar(codigo, evento_id, qr_assinado.gerar_segredo()) == "QR Code inválido"
+        assert qr_assinado.verificar(codigo, str(ObjectId()), SEGREDO) == "Ingresso não pertence a este evento"
+        assert qr_assinado.verificar("Q1-LIXO", evento_id, SEGREDO) == "QR Code inválido"
+
+    def test_hash_legado_nao_e_afetado(self):
+        assert qr_assinado.verificar(generate_qrcode_hash(), str(ObjectId()), SEGREDO) is None
+
+    def test_codigo_para_evento_respeita_configuracao(self):
+        evento = {"_id": ObjectId(), "qr_assinado": True, "qr_segredo": SEGREDO}
+        ingresso_id = str(ObjectId())
+        assert qr_assinado.codigo_para_evento(evento, ingresso_id, 2).startswith(qr_assinado.PREFIXO)
+        assert qr_assinado.codigo_para_evento({**evento, "qr_assinado": False}, ingresso_id, 2) is None
+
+    @pytest.mark.asyncio
+    async def test_validar_recusa_forjado_sem_consultar_banco(self, fake_db, mock_get_database, sample_evento, sample_ilha):
+        sample_evento["qr_segredo"] = SEGREDO
+        fake_db.eventos.docs.append(sample_evento)
+        evento_id = str(sample_evento["_id"])
+        await indice_validacao.obter_indice(fake_db, evento_id)
+
+        async def proibido(*args, **kwargs):
+            raise AssertionError("código forjado não deve chegar ao banco")
+        fake_db.participantes.find_one = proibido
+
+        forjado = qr_assinado.gerar_qrcode_assinado(qr_assinado.gerar_segredo(), evento_id, str(ObjectId()), 1)
+        try:
+            with pytest.raises(HTTPException) as exc_info:
+                await portaria.validar_acesso(
+                    ValidacaoRequest(qrcode_hash=forjado, ilha_id=str(sample_ilha["_id"])),
+                    evento_id=evento_id
+                )
+            assert exc_info.value.status_code == 403
+            assert exc_info.value.detail == "QR Code inválido"
+        finally:
+            indice_validacao.invalidar_evento(evento_id)
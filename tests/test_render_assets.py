@@ -0,0 +1,135 @@
+"""
+Testes dos caches de fontes, logo e QR code do renderizador.
+"""
+import hashlib
+from io import BytesIO
+
+import pytest
+import qrcode
+from PIL import Image, ImageChops
+
+from app.routers import evento_api
+from app.routers.evento_api import _render_layout_to_image
+from app.utils import render_assets
+
+
+@pytest.fixture(autouse=True)
+def caches_limpos(monkeypatch):
+    # a camada base é renderizada via módulo; garante o renderizador real
+    monkeypatch.setattr(evento_api, "_render_layout_to_image", _render_layout_to_image)
+    render_assets.limpar_render_assets()
+    yield
+    render_assets.limpar_render_assets()
+
+
+def _png(cor="red", tamanho=(80, 40)):
+    bio = BytesIO()
+    Image.new("RGB", tamanho, color=cor).save(bio, format="PNG")
+    return bio.getvalue()
+
+
+class TestRenderAssets:
+
+    def test_fonte_carregada_uma_vez_por_caminho_e_tamanho(self):
+        caminho = render_assets.caminho_fonte("Arial", negrito=True)
+        assert caminho.endswith("DejaVuSans-Bold.ttf")
+        f1 = render_assets.fonte(caminho, 20)
+        f2 = render_assets.fonte(caminho, 20)
+        render_assets.fonte(caminho, 21)
+        assert f1 is f2
+        assert render_assets.metricas_render_assets()["fontes"] == {"itens": 2, "acertos": 1, "faltas": 2}
+
+    def test_logo_ajustado_reaproveitado_por_hash_e_tamanho(self):
+        conteudo = _png()
+        blob = {"bytes": conteudo, "sha256": hashlib.sha256(conteudo).hexdigest()}
+        logo = render_assets.logo_ajustado(blob, None, 60)
+        assert logo.size == (60, 60)
+        # mesmo conteúdo vindo de outra carga: mesmo hash, sem nova decodificação
+        assert render_assets.logo_ajustado({"bytes": conteudo}, None, 60) is logo
+        assert render_assets.logo_ajustado(blob, None, 30).size == (30, 30)
+        # proporção preservada: faixas brancas acima e abaixo
+        assert logo.getpixel((30, 2)) == (255, 255, 255)
+        assert logo.getpixel((30, 30)) == (255, 0, 0)
+        assert render_assets.metricas_render_assets()["logos"]["acertos"] == 1
+
+    def test_qrcode_gerado_no_tamanho_final_com_modulos_uniformes(self):
+        texto = "ABC123-ingresso"
+        qr = render_assets.qrcode_imagem(texto, 250)
+        assert qr.size == (250, 250)
+        matriz = qrcode.QRCode(border=4)
+        matriz.add_data(texto)
+        matriz.make(fit=True)
+        modulos = len(matriz.get_matrix())
+        box = 250 // modulos
+        # mesmo QR com box_size inteiro, centralizado na sobra
+        referencia = qrcode.make(texto, box_size=box).get_image().convert("L")
+        assert referencia.size == (modulos * box, modulos * box)
+        quadro = Image.new("L", (250, 250), 255)
+        quadro.paste(referencia, ((250 - referencia.width) // 2,) * 2)
+        assert ImageChops.difference(qr.convert("L"), quadro).getbbox() is None
+        assert render_assets.qrcode_imagem(texto, 250) is qr
+
+    def test_renderizacao_em_lote_usa_caches(self):
+        layout = {
+            "canvas": {"width": 60, "height": 90, "unit": "mm"},
+            "elements": [
+                {"type": "logo", "x": 5, "y": 5, "size_mm": 20},
+                {"type": "text", "value": "Fulano", "x": 5, "y": 30, "size": 12},
+                {"type": "qrcode", "value": "hash-1", "x": 5, "y": 40, "size_mm": 30},
+            ],
+        }
+        conteudo = _png()
+        for _ in range(3):
+            _render_layout_to_image(layout, 150, logo_blob={"bytes": conteudo})
+        metricas = render_assets.metricas_render_assets()
+        assert metricas["fontes"]["faltas"] == 1
+        assert metricas["logos"] == {"itens": 1, "acertos": 2, "faltas": 1}
+        assert metricas["qrcodes"]["acertos"] == 2
+
+    def test_camada_estatica_precomposta_uma_vez_por_layout(self):
+        from app.utils.layouts import embed_layout
+        template = {
+            "canvas": {"width": 60, "height": 90, "unit": "mm", "border": True},
+            "elements": [
+                {"type": "logo", "x": 5, "y": 5, "size_mm": 20},
+                {"type": "text", "value": "{EVENTO_NOME}", "x": 5, "y": 28, "size": 12},
+                {"type": "text", "value": "{NOME}", "x": 5, "y": 36, "size": 12},
+                {"type": "qrcode", "x": 5, "y": 45, "size_mm": 30},
+            ],
+        }
+        evento = {"nome": "Congresso"}
+        logo = {"bytes": _png()}
+        for nome, qr in (("Ana", "h1"), ("Bruno", "h2")):
+            layout = embed_layout(template, {"nome": nome}, {}, evento, {"qrcode_hash": qr})
+            assert [el["variavel"] for el in layout["elements"]] == [False, False, True, True]
+            sem_marca = {**layout, "elements": [
+                {k: v for k, v in el.items() if k != "variavel"} for el in layout["elements"]
+            ]}
+            composta = _render_layout_to_image(layout, 150, logo_blob=logo)
+            direta = _render_layout_to_image(sem_marca, 150, logo_blob=logo)
+            assert ImageChops.difference(composta, direta).getbbox() is None
+        assert render_assets.metricas_render_assets()["camadas"] == {"itens": 1, "acertos": 1, "faltas": 1}
+
+    def test_estatico_sobre_variavel_mantem_a_ordem_de_desenho(self):
+        from app.utils.layouts import embed_layout
+        # o logo (estático) cobre o nome (variável), que cobre o fundo do texto estático
+        template = {
+            "canvas": {"width": 60, "height": 90, "unit": "mm"},
+            "elements": [
+                {"type": "text", "value": "{EVENTO_NOME}", "x": 5, "y": 5, "size": 12},
+                {"type": "text", "value": "{NOME}", "x": 5, "y": 10, "size": 40},
+                {"type": "logo", "x": 5, "y": 8, "size_mm": 20},
+            ],
+        }
+        logo = {"bytes": _png(tamanho=(40, 40))}
+        for nome in ("WWWW", "MMMM"):
+            layout = embed_layout(template, {"nome": nome}, {}, {"nome": "Congresso"}, {})
+            assert [el["variavel"] for el in layout["elements"]] == [False, True, False]
+            sem_marca = {**layout, "elements": [
+                {k: v for k, v in el.items() if k != "variavel"} for el in layout["elements"]
+            ]}
+            composta = _render_layout_to_image(layout, 150, logo_blob=logo)
+            direta = _render_layout_to_image(sem_marca, 150, logo_blob=logo)
+            assert ImageChops.difference(composta, direta).getbbox() is None
+        # só o texto inicial vai para a camada base
+        assert render_assets.metricas_render_assets()["camadas"] == {"itens": 1, "acertos": 1, "faltas": 1}
@@ -0,0 +1,132 @@
+"""
+Testes do cache de ingressos renderizados.
+"""
+import pytest
+from datetime import datetime, timezone
+from bson import ObjectId
+from PIL import Image
+
+from app.routers import evento_api
+from app.utils import contexto_evento, render_cache
+from app.utils.render_cache import RenderCache, chave_render
+from tests.conftest import FakeCollection
+
+
+class FakeRequest:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+@pytest.fixture
+def cache_isolado(tmp_path, monkeypatch):
+    cache = RenderCache(diretorio=str(tmp_path), max_bytes=10_000)
+    monkeypatch.setattr(render_cache, "_cache", cache)
+    return cache
+
+
+class TestRenderCache:
+
+    def test_lru_limitado_por_bytes_e_namespace_por_evento(self, tmp_path):
+        cache = RenderCache(diretorio=str(tmp_path), max_bytes=250)
+        cache.guardar("ev1", "a", b"x" * 100)
+        cache.guardar("ev1", "b", b"y" * 100)
+        assert cache.obter("ev1", "a") == b"x" * 100  # "a" passa a ser o mais recente
+        cache.guardar("ev2", "c", b"z" * 100)
+
+        assert cache.obter("ev1", "b") is None
+        assert cache.obter("ev1", "a") is not None
+        assert cache.metricas()["bytes"] == 200
+
+        cache.invalidar_evento("ev1")
+        assert cache.obter("ev1", "a") is None
+        assert cache.obter("ev2", "c") == b"z" * 100
+
+        # o índice é reconstruído a partir do disco em um novo processo
+        assert RenderCache(diretorio=str(tmp_path), max_bytes=250).obter("ev2", "c") == b"z" * 100
+
+    def test_chave_muda_com_layout_logo_e_parametros(self):
+        layout = {"canvas": {"width": 80}, "elements": [{"type": "text", "value": "Fulano"}]}
+        base = chave_render(layout, "sha256:abc", 300)
+        assert base == chave_render(dict(layout), "sha256:abc", 300)
+        assert base != chave_render(layout, "sha256:def", 300)
+        assert base != chave_render(layout, "sha256:abc", 200)
+        assert base != chave_render(layout, "sha256:abc", 300, formato="PNG")
+
+    @pytest.mark.asyncio
+    async def test_render_jpg_servido_do_cache(self, fake_db, sample_evento, monkeypatch, cache_isolado):
+        evento_id = str(sample_evento["_id"])
+        ingresso_id = str(ObjectId())
+        fake_db.eventos.docs.append(sample_evento)
+        fake_db.participantes.docs.append({
+            "_id": ObjectId(),
+            "nome": "Fulano",
+            "ingressos": [{
+                "_id": ingresso_id,
+                "evento_id": evento_id,
+                "qrcode_hash": "abc",
+                "data_emissao": datetime.now(timezone.utc),
+                "layout_ingresso": {"canvas": {"width": 40, "height": 20, "unit": "mm"}, "elements": []},
+            }],
+        })
+        monkeypatch.setattr(evento_api, "get_database", lambda: fake_db)
+        chamadas = []
+
+        def fake_render(layout, dpi, logo_path=None, logo_blob=None):
+            chamadas.append(dpi)
+            return Image.new("RGB", (20, 10))
+        monkeypatch.setattr(evento_api, "_render_layout_to_image", fake_render)
+
+        primeira = await evento_api.render_ingresso_jpg(evento_id, ingresso_id, dpi=100)
+        segunda = await evento_api.render_ingresso_jpg(evento_id, ingresso_id, dpi=100)
+        corpo1 = b"".join([c async for c in primeira.body_iterator])
+        corpo2 = b"".join([c async for c in segunda.body_iterator])
+
+        assert chamadas == [100]
+        assert corpo1 == corpo2
+        assert cache_isolado.metricas()["acertos"] == 1
+
+        # ETag válido responde 304 sem renderizar nem reler o evento (contexto em cache)
+        async def proibido(*args, **kwargs):
+            raise AssertionError("evento não deve ser lido")
+        monkeypatch.setattr(fake_db.eventos, "find_one", proibido)
+        resp = await evento_api.render_ingresso_jpg(
+            evento_id, ingresso_id, dpi=100, request=FakeRequest({"If-None-Match": primeira.headers["etag"]})
+        )
+        assert resp.status_code == 304
+
+    @pytest.mark.asyncio
+    async def test_etag_muda_com_logo_e_layout(self, fake_db, sample_evento, monkeypatch, cache_isolado):
+        evento_id = str(sample_evento["_id"])
+        ingresso_id = str(ObjectId())
+        sample_evento["layout_ingresso"] = {"canvas": {"width": 40, "height": 20, "unit": "mm"},
+                                            "elements": [{"type": "text", "value": "{NOME}", "x": 1, "y": 1}]}
+        fake_db.eventos.docs.append(sample_evento)
+        fake_db.layouts_ingresso = FakeCollection()
+        fake_db.participantes.docs.append({
+            "_id": ObjectId(),
+            "nome": "Fulano",
+            "ingressos": [{"_id": ingresso_id, "evento_id": evento_id, "qrcode_hash": "abc",
+                           "data_emissao": datetime.now(timezone.utc), "campos_layout": {"NOME": "Fulano"}}],
+        })
+        monkeypatch.setattr(evento_api, "get_database", lambda: fake_db)
+        monkeypatch.setattr(evento_api, "_render_layout_to_image", lambda *a, **k: Image.new("RGB", (20, 10)))
+
+        async def etag(headers=None):
+            resp = await evento_api.render_ingresso_jpg(evento_id, ingresso_id, dpi=100,
+                                                        request=FakeRequest(headers or {}))
+            return resp.status_code, resp.headers["etag"]
+
+        _, original = await etag()
+        assert await etag({"If-None-Match": original}) == (304, original)
+
+        # logo trocado: o ETag antigo não vale mais
+        sample_evento["logo_asset"] = {"sha256": "novo"}
+        contexto_evento.invalidar_evento(evento_id)
+        status, com_logo = await etag({"If-None-Match": original})
+        assert status == 200 and com_logo != original
+
+        # layout do evento alterado
+        sample_evento["layout_ingresso"]["elements"][0]["x"] = 5
+        contexto_evento.invalidar_evento(evento_id)
+        status, com_layout = await etag({"If-None-Match": com_logo})
+        assert status == 200 and com_layout not in (original, com_logo)
@@ -0,0 +1,46 @@
+"""
+Testes do pool de renderização de ingressos.
+"""
+import pytest
+from io import BytesIO
+from fastapi import HTTPException
+from PIL import Image
+
+from app.utils.render_pool import RenderPool
+
+LAYOUT = {
+    "canvas": {"width": 40, "height": 20, "unit": "mm"},
+    "elements": [{"type": "text", "value": "Fulano", "x": 2, "y": 2, "size": 10}],
+}
+
+
+class TestRenderPool:
+
+    @pytest.mark.asyncio
+    async def test_renderiza_em_processo_separado(self):
+        pool = RenderPool(processos=1, fila_max=4, timeout=60)
+        try:
+            conteudo = await pool.executar(layout=LAYOUT, dpi=100, formato="PNG", rotacionar=True)
+        finally:
+            pool.encerrar()
+        img = Image.open(BytesIO(conteudo))
+        assert img.format == "PNG"
+        # rotação aplicada no worker: altura > largura
+        assert img.size[1] > img.size[0]
+        assert pool.metricas()["em_andamento"] == 0
+
+    @pytest.mark.asyncio
+    async def test_modo_em_thread_usa_renderizador_substituido(self, monkeypatch):
+        from app.routers import evento_api
+        monkeypatch.setattr(evento_api, "_render_layout_to_image",
+                            lambda layout, dpi, logo_path=None, logo_blob=None: Image.new("RGB", (30, 10)))
+        conteudo = await RenderPool(processos=0).executar(layout=LAYOUT, dpi=100)
+        assert Image.open(BytesIO(conteudo)).size == (30, 10)
+
+    @pytest.mark.asyncio
+    async def test_fila_cheia_responde_503(self):
+        pool = RenderPool(processos=1, fila_max=0)
+        with pytest.raises(HTTPException) as exc_info:
+            await pool.executar(layout=LAYOUT, dpi=100)
+        assert exc_info.value.status_code == 503
+        assert pool.metricas()["recusados"] == 1
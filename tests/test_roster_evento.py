@@ -0,0 +1,109 @@
+"""
+Testes do roster em memória dos participantes por evento (busca da bilheteria).
+"""
+from datetime import datetime, timezone
+
+import pytest
+from bson import ObjectId
+
+from app.routers import bilheteria
+from app.utils import roster_evento
+from tests.conftest import FakeCollection
+
+EVENTO = "evt1"
+
+
+class ContaFind(FakeCollection):
+    def __init__(self, docs=None):
+        super().__init__(docs)
+        self.consultas = []
+
+    def find(self, query=None, sort=None):
+        self.consultas.append(query)
+        return super().find(query)
+
+
+def _participante(nome, cpf, qr, evento_id=EVENTO, impresso=False):
+    return {"_id": ObjectId(), "nome": nome, "cpf": cpf, "email": f"{qr}@x.com",
+            "ingressos": [{"_id": f"ing-{qr}", "evento_id": evento_id, "tipo_ingresso_id": "t1",
+                           "status": "Ativo", "qrcode_hash": qr, "impresso": impresso,
+                           "data_emissao": datetime.now(timezone.utc)}]}
+
+
+@pytest.fixture
+def roster_db(fake_db, monkeypatch):
+    monkeypatch.setattr(roster_evento, "ROSTER_HABILITADO", True)
+    roster_evento.limpar()
+    fake_db.participantes = ContaFind([
+        _participante("Ana João", "11144477735", "qr1"),
+        _participante("João da Silva", "52998224725", "qr2", impresso=True),
+        _participante("Joao", "39053344705", "qr3"),
+        _participante("João Outro Evento", "15350946056", "qr4", evento_id="evt2"),
+    ])
+    yield fake_db
+    roster_evento.limpar()
+
+
+def _nomes(db, ids):
+    por_id = {str(p["_id"]): p["nome"] for p in db.participantes.docs}
+    return [por_id[i] for i in ids]
+
+
+@pytest.mark.asyncio
+async def test_roster_busca_nome_cpf_e_qr(roster_db):
+    roster = await roster_evento.obter_roster(roster_db, EVENTO)
+    assert len(roster) == 3
+    assert _nomes(roster_db, roster.buscar_nome("JOÃO")) == ["Joao", "João da Silva", "Ana João"]
+    assert _nomes(roster_db, roster.buscar_nome("sil jo")) == ["João da Silva"]
+    assert roster.buscar_nome("oao") == []
+    assert _nomes(roster_db, [roster.buscar_cpf("52998224725")]) == ["João da Silva"]
+    assert _nomes(roster_db, [roster.buscar_qr("qr1")]) == ["Ana João"]
+    assert roster.buscar_qr("qr4") is None
+    assert roster.impresso("qr2") is True and roster.impresso("qr3") is False
+
+
+@pytest.mark.asyncio
+async def test_roster_atualizado_incrementalmente(roster_db):
+    roster = await roster_evento.obter_roster(roster_db, EVENTO)
+    novo = ObjectId()
+    roster_evento.registrar_ingresso(
+        EVENTO, {"_id": "ing-qr9", "participante_id": str(novo), "qrcode_hash": "qr9"}, "Zoé Lima", "44444444444"
+    )
+    assert roster.buscar_nome("zoe") == [str(novo)]
+    assert roster.buscar_cpf("44444444444") == str(novo)
+
+    roster_evento.atualizar_participante(novo, nome="Zoé Pereira")
+    assert roster.buscar_nome("lima") == []
+    assert roster.buscar_nome("pereira") == [str(novo)]
+
+    roster_evento.marcar_impresso(EVENTO, "ing-qr9", True)
+    assert roster.impresso("qr9") is True
+
+
+@pytest.mark.asyncio
+async def test_roster_descarta_evento_menos_usado_acima_do_limite(roster_db, monkeypatch):
+    primeiro = await roster_evento.obter_roster(roster_db, EVENTO)
+    monkeypatch.setattr(roster_evento, "MEMORIA_MAXIMA", primeiro.bytes_estimados + 1)
+    await roster_evento.obter_roster(roster_db, "evt2")
+    assert roster_evento.metricas_roster()["eventos"] == 1
+    assert EVENTO not in roster_evento._rosters
+
+
+@pytest.mark.asyncio
+async def test_roster_desabilitado(roster_db, monkeypatch):
+    monkeypatch.setattr(roster_evento, "ROSTER_HABILITADO", False)
+    assert await roster_evento.obter_roster(roster_db, EVENTO) is None
+
+
+@pytest.mark.asyncio
+async def test_busca_smart_usa_roster(roster_db, monkeypatch):
+    monkeypatch.setattr(bilheteria, "get_database", lambda: roster_db)
+    await roster_evento.obter_roster(roster_db, EVENTO)
+    roster_db.participantes.consultas.clear()
+
+    resultado = await bilheteria.busca_smart_participantes(q="joao", evento_id=EVENTO)
+    assert [p.nome for p in resultado] == ["Joao", "João da Silva", "Ana João"]
+    resultado = await bilheteria.busca_smart_participantes(q="529.982.247-25", evento_id=EVENTO)
+    assert [p.nome for p in resultado] == ["João da Silva"]
+    # só a leitura dos documentos encontrados, por _id
+    assert all(list(q) == ["_id"] for q in roster_db.participantes.consultas)
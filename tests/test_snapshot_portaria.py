@@ -0,0 +1,136 @@
+"""
+Testes do snapshot offline da portaria e do delta por versão.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.routers import portaria
+from app.utils.snapshot_portaria import registrar_alteracoes, hash_offline
+from tests.conftest import FakeCollection
+
+
+def _request(headers=None):
+    raw = [(k.lower().encode(), v.encode()) for k, v in (headers or {}).items()]
+    return Request({"type": "http", "method": "GET", "path": "/", "headers": raw})
+
+
+def _abrir(response, token):
+    corpo = gzip.decompress(response.body)
+    esperado = hmac.new(token.encode(), corpo, hashlib.sha256).hexdigest()
+    assert response.headers["X-Snapshot-Assinatura"] == esperado
+    return json.loads(corpo)
+
+
+@pytest.fixture
+def evento_snapshot(fake_db, sample_evento, sample_ilha, sample_tipo_ingresso):
+    sample_tipo_ingresso["numero"] = 1
+    sample_evento["tipos_ingresso"] = [sample_tipo_ingresso]
+    sample_evento["ilhas"] = [sample_ilha]
+    fake_db.eventos.docs.append(sample_evento)
+    evento_id = str(sample_evento["_id"])
+    fake_db.participantes.docs.append({
+        "_id": ObjectId(),
+        "nome": "Fulano",
+        "ingressos": [
+            {"evento_id": evento_id, "tipo_ingresso_id": str(sample_tipo_ingresso["_id"]), "qrcode_hash": "ativo", "status": "Ativo"},
+            {"evento_id": evento_id, "tipo_ingresso_id": str(sample_tipo_ingresso["_id"]), "qrcode_hash": "cancelado", "status": "Cancelado"},
+        ],
+    })
+    return evento_id
+
+
+class TestSnapshotPortaria:
+
+    @pytest.mark.asyncio
+    async def test_snapshot_assinado_com_ingressos_ativos(self, fake_db, mock_get_database, sample_evento,
+                                                         sample_ilha, evento_snapshot):
+        response = await portaria.snapshot_offline(_request(), evento_id=evento_snapshot)
+        payload = _abrir(response, sample_evento["token_portaria"])
+
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert payload["versao"] == 0
+        assert payload["ingressos"] == [[hash_offline("ativo"), 1]]
+        assert payload["tipos"]["1"]["ilhas"] == [str(sample_ilha["_id"])]
+
+        # mesma versão: 304 sem remontar o pacote
+        nao_modificado = await portaria.snapshot_offline(
+            _request({"If-None-Match": response.headers["ETag"]}), evento_id=evento_snapshot
+        )
+        assert nao_modificado.status_code == 304
+
+    @pytest.mark.asyncio
+    async def test_delta_retorna_apenas_alteracoes_posteriores(self, fake_db, mock_get_database, sample_evento,
+                                                              sample_tipo_ingresso, evento_snapshot):
+        fake_db.ingressos_alteracoes = FakeCollection()
+        tipo_id = str(sample_tipo_ingresso["_id"])
+
+        v1 = await registrar_alteracoes(fake_db, evento_snapshot, [{"qrcode_hash": "a", "tipo_ingresso_id": tipo_id, "status": "Ativo"}])
+        v3 = await registrar_alteracoes(fake_db, evento_snapshot, [
+            {"qrcode_hash": "b", "tipo_ingresso_id": tipo_id, "status": "Ativo"},
+            {"qrcode_hash": "a", "tipo_ingresso_id": tipo_id, "status": "Cancelado"},
+        ])
+        assert (v1, v3) == (1, 3)
+
+        response = await portaria.snapshot_offline_delta(since=v1, evento_id=evento_snapshot)
+        payload = _abrir(response, sample_evento["token_portaria"])
+
+        assert payload["versao"] == 3
+        assert [(a["versao"], a["hash"], a["status"]) for a in payload["alteracoes"]] == [
+            (2, hash_offline("b"), "Ativo"),
+            (3, hash_offline("a"), "Cancelado"),
+        ]
+        assert all(a["tipo"] == 1 for a in payload["alteracoes"])
+
+    @pytest.mark.asyncio
+    async def test_delta_sem_historico(self, fake_db, mock_get_database, evento_snapshot):
+        with pytest.raises(HTTPException) as exc_info:
+            await portaria.snapshot_offline_delta(since=0, evento_id=evento_snapshot)
+        assert exc_info.value.status_code == 410
+
+    @pytest.mark.asyncio
+    async def test_delta_entre_reserva_e_gravacao_nao_pula_versao(self, fake_db, mock_get_database, sample_evento,
+                                                                 sample_tipo_ingresso, evento_snapshot):
+        col = fake_db.ingressos_alteracoes = FakeCollection()
+        tipo_id = str(sample_tipo_ingresso["_id"])
+        await registrar_alteracoes(fake_db, evento_snapshot, [{"qrcode_hash": "a", "tipo_ingresso_id": tipo_id}])
+
+        # delta servido depois do $inc da versão 2 e antes do insert do seu registro
+        lidos = []
+        inserir = col.insert_many
+
+        async def insert_intercalado(docs, ordered=True):
+            resposta = await portaria.snapshot_offline_delta(since=1, evento_id=evento_snapshot)
+            lidos.append(_abrir(resposta, sample_evento["token_portaria"]))
+            return await inserir(docs, ordered)
+
+        col.insert_many = insert_intercalado
+        assert await registrar_alteracoes(fake_db, evento_snapshot, [{"qrcode_hash": "b", "tipo_ingresso_id": tipo_id}]) == 2
+
+        assert lidos[0]["versao"] == 1 and lidos[0]["alteracoes"] == []
+        depois = _abrir(await portaria.snapshot_offline_delta(since=lidos[0]["versao"], evento_id=evento_snapshot),
+                        sample_evento["token_portaria"])
+        assert depois["versao"] == 2
+        assert [a["hash"] for a in depois["alteracoes"]] == [hash_offline("b")]
+
+    @pytest.mark.asyncio
+    async def test_lacuna_antiga_exige_snapshot_completo(self, fake_db, mock_get_database, evento_snapshot):
+        from datetime import datetime, timedelta, timezone
+        agora = datetime.now(timezone.utc)
+        fake_db.ingressos_alteracoes = FakeCollection([
+            {"evento_id": evento_snapshot, "versao": 1, "hash": "h1", "status": "Ativo", "data": agora},
+            {"evento_id": evento_snapshot, "versao": 3, "hash": "h3", "status": "Ativo", "data": agora},
+        ])
+        # lacuna recente: o delta para antes dela
+        payload = await portaria.snapshot_offline_delta(since=0, evento_id=evento_snapshot)
+        assert json.loads(gzip.decompress(payload.body))["versao"] == 1
+
+        fake_db.ingressos_alteracoes.docs[1]["data"] = agora - timedelta(minutes=5)
+        with pytest.raises(HTTPException) as exc_info:
+            await portaria.snapshot_offline_delta(since=1, evento_id=evento_snapshot)
+        assert exc_info.value.status_code == 410